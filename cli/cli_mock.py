@@ -33,6 +33,7 @@ class cli_unittest(unittest.TestCase):
         super(cli_unittest, self).setUp()
         self.god = mock.mock_god(debug=CLI_UT_DEBUG, ut=self)
         self.god.stub_class_method(rpc.afe_comm, 'run')
+        self.god.stub_class_method(rpc.afe_comm, 'run_batch')
         self.god.stub_function(sys, 'exit')
 
         def stub_authorization_headers(*args, **kwargs):
@@ -86,8 +87,16 @@ class cli_unittest(unittest.TestCase):
 
     def mock_rpcs(self, rpcs):
         """rpcs is a list of tuples, each representing one RPC:
-        (op, **dargs, success, expected)"""
-        for (op, dargs, success, expected) in rpcs:
+        (op, **dargs, success, expected)
+        or a batch of RPCs made in a single request:
+        ('batch', [(op, **dargs, success, expected), ...])
+        or a batch request that raises the exception error:
+        ('batch', [(op, **dargs, success, expected), ...], error)"""
+        for rpc_call in rpcs:
+            if rpc_call[0] == 'batch':
+                self._mock_batch_rpcs(*rpc_call[1:])
+                continue
+            (op, dargs, success, expected) = rpc_call
             comm = rpc.afe_comm.run
             if success:
                 comm.expect_call(op, **dargs).and_return(expected)
@@ -95,6 +104,21 @@ class cli_unittest(unittest.TestCase):
                 comm.expect_call(op, **dargs).and_raises(proxy.JSONRPCException(expected))
 
 
+    def _mock_batch_rpcs(self, rpcs, error=None):
+        calls = []
+        results = []
+        for (op, dargs, success, expected) in rpcs:
+            calls.append((op, dargs))
+            if success:
+                results.append(expected)
+            else:
+                results.append(proxy.JSONRPCException(expected))
+        if error:
+            rpc.afe_comm.run_batch.expect_call(calls).and_raises(error)
+        else:
+            rpc.afe_comm.run_batch.expect_call(calls).and_return(results)
+
+
 
     def run_cmd(self, argv, rpcs=[], exit_code=None,
                 out_words_ok=[], out_words_no=[],
@@ -344,19 +344,14 @@ class host_mod(host):
 
 
     def execute(self):
-        successes = []
+        data_list = []
         for host in self.hosts:
-            try:
-                res = self.execute_rpc('modify_host', item=host,
-                                       id=host, **self.data)
-                # TODO: Make the AFE return True or False,
-                # especially for lock
-                successes.append(host)
-            except topic_common.CliError, full_error:
-                # Already logged by execute_rpc()
-                pass
-
-        return successes
+            data = dict(self.data)
+            data['id'] = host
+            data_list.append(data)
+        # TODO: Make the AFE return True or False,
+        # especially for lock
+        return self.execute_rpc_batch('modify_host', self.hosts, data_list)
 
 
     def output(self, hosts):
@@ -425,21 +420,6 @@ class host_create(host):
         return (options, leftover)
 
 
-    def _execute_add_one_host(self, host):
-        # Always add the hosts as locked to avoid the host
-        # being picked up by the scheduler before it's ACL'ed
-        self.data['locked'] = True
-        self.execute_rpc('add_host', hostname=host,
-                         status="Ready", **self.data)
-
-        # Now add the platform label
-        labels = self.labels[:]
-        if self.platform:
-            labels.append(self.platform)
-        if len (labels):
-            self.execute_rpc('host_add_labels', id=host, labels=labels)
-
-
     def execute(self):
         # We need to check if these labels & ACLs exist,
         # and create them if not.
@@ -465,19 +445,42 @@ class host_create(host):
                 self.execute_rpc('acl_group_add_hosts', id=acl, hosts=success)
 
             if not self.locked:
-                for host in success:
-                    self.execute_rpc('modify_host', id=host, locked=False)
+                self.execute_rpc('modify_hosts',
+                                 host_filter_data={'hostname__in': success},
+                                 update_data={'locked': False})
         return success
 
 
     def site_create_hosts_hook(self):
-        success = []
+        # Always add the hosts as locked to avoid the host
+        # being picked up by the scheduler before it's ACL'ed
+        self.data['locked'] = True
+        data_list = []
         for host in self.hosts:
+            data = dict(self.data)
+            data.update(hostname=host, status='Ready')
+            data_list.append(data)
+        success = self.execute_rpc_batch('add_host', self.hosts, data_list)
+
+        # Now add the platform label
+        labels = self.labels[:]
+        if self.platform:
+            labels.append(self.platform)
+        if success and labels:
             try:
-                self._execute_add_one_host(host)
-                success.append(host)
+                self.execute_rpc('hosts_add_labels', hosts=success,
+                                 labels=labels)
             except topic_common.CliError:
-                pass
+                # Label the hosts one by one to find the ones that failed
+                labeled = []
+                for host in success:
+                    try:
+                        self.execute_rpc('host_add_labels', item=host,
+                                         id=host, labels=labels)
+                        labeled.append(host)
+                    except topic_common.CliError:
+                        pass
+                success = labeled
 
         return success
 
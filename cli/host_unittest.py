@@ -10,7 +10,8 @@ try:
     import autotest.common as common
 except ImportError:
     import common
-from autotest_lib.cli import cli_mock, host
+from autotest_lib.cli import cli_mock, host, topic_common
+from autotest_lib.frontend.afe.json_rpc import proxy
 
 
 class host_ut(cli_mock.cli_unittest):
@@ -1221,62 +1222,101 @@ class host_mod_unittest(cli_mock.cli_unittest):
     def test_execute_lock_one_host(self):
         self.run_cmd(argv=['atest', 'host', 'mod',
                            '--lock', 'host0', '--ignore_site_file'],
-                     rpcs=[('modify_host', {'id': 'host0', 'locked': True},
-                            True, None)],
+                     rpcs=[('batch',
+                            [('modify_host', {'id': 'host0', 'locked': True},
+                              True, None)])],
                      out_words_ok=['Locked', 'host0'])
 
 
     def test_execute_unlock_two_hosts(self):
         self.run_cmd(argv=['atest', 'host', 'mod',
                            '-u', 'host0,host1', '--ignore_site_file'],
-                     rpcs=[('modify_host', {'id': 'host1', 'locked': False},
-                            True, None),
-                           ('modify_host', {'id': 'host0', 'locked': False},
-                            True, None)],
+                     rpcs=[('batch',
+                            [('modify_host', {'id': 'host1', 'locked': False},
+                              True, None),
+                             ('modify_host', {'id': 'host0', 'locked': False},
+                              True, None)])],
                      out_words_ok=['Unlocked', 'host0', 'host1'])
 
 
     def test_execute_lock_unknown_hosts(self):
         self.run_cmd(argv=['atest', 'host', 'mod',
                            '-l', 'host0,host1', 'host2', '--ignore_site_file'],
-                     rpcs=[('modify_host', {'id': 'host2', 'locked': True},
-                            True, None),
-                           ('modify_host', {'id': 'host1', 'locked': True},
-                            False, 'DoesNotExist: Host matching '
-                            'query does not exist.'),
-                           ('modify_host', {'id': 'host0', 'locked': True},
-                            True, None)],
+                     rpcs=[('batch',
+                            [('modify_host', {'id': 'host2', 'locked': True},
+                              True, None),
+                             ('modify_host', {'id': 'host1', 'locked': True},
+                              False, 'DoesNotExist: Host matching '
+                              'query does not exist.'),
+                             ('modify_host', {'id': 'host0', 'locked': True},
+                              True, None)])],
                      out_words_ok=['Locked', 'host0', 'host2'],
                      err_words_ok=['Host', 'matching', 'query', 'host1'])
 
 
+    def test_execute_lock_second_batch_fails(self):
+        self.god.stub_with(topic_common.atest, 'MAX_BATCH_SIZE', 1)
+        self.run_cmd(argv=['atest', 'host', 'mod',
+                           '-l', 'host0,host1', '--ignore_site_file'],
+                     rpcs=[('batch',
+                            [('modify_host', {'id': 'host1', 'locked': True},
+                              True, None)]),
+                           ('batch',
+                            [('modify_host', {'id': 'host0', 'locked': True},
+                              True, None)],
+                            proxy.JSONRPCException('Bad batch response'))],
+                     out_words_ok=['Locked', 'host1'],
+                     out_words_no=['host0'],
+                     err_words_ok=['Bad batch response', 'host0'])
+
+
+    def test_execute_lock_without_batches(self):
+        self.god.stub_with(topic_common.atest, 'MAX_BATCH_SIZE', 1)
+        self.run_cmd(argv=['atest', 'host', 'mod',
+                           '-l', 'host0,host1', '--ignore_site_file'],
+                     rpcs=[('batch',
+                            [('modify_host', {'id': 'host1', 'locked': True},
+                              True, None)],
+                            proxy.BatchNotSupportedError('Batch request '
+                                                         'failed')),
+                           ('modify_host', {'id': 'host1', 'locked': True},
+                            True, None),
+                           ('modify_host', {'id': 'host0', 'locked': True},
+                            False, 'DoesNotExist: Host matching '
+                            'query does not exist.')],
+                     out_words_ok=['Locked', 'host1'],
+                     err_words_ok=['Host', 'matching', 'query', 'host0'],
+                     err_words_no=['Batch request'])
+
+
     def test_execute_protection_hosts(self):
         mfile = cli_mock.create_file('host0\nhost1,host2\nhost3 host4')
         self.run_cmd(argv=['atest', 'host', 'mod', '--protection',
                            'Do not repair',
                            'host5' ,'--mlist', mfile.name, 'host1', 'host6',
                            '--ignore_site_file'],
-                     rpcs=[('modify_host', {'id': 'host6',
-                                            'protection': 'Do not repair'},
-                            True, None),
-                           ('modify_host', {'id': 'host5',
-                                            'protection': 'Do not repair'},
-                            True, None),
-                           ('modify_host', {'id': 'host4',
-                                            'protection': 'Do not repair'},
-                            True, None),
-                           ('modify_host', {'id': 'host3',
-                                            'protection': 'Do not repair'},
-                            True, None),
-                           ('modify_host', {'id': 'host2',
-                                            'protection': 'Do not repair'},
-                            True, None),
-                           ('modify_host', {'id': 'host1',
-                                            'protection': 'Do not repair'},
-                            True, None),
-                           ('modify_host', {'id': 'host0',
-                                            'protection': 'Do not repair'},
-                            True, None)],
+                     rpcs=[('batch',
+                            [('modify_host', {'id': 'host6',
+                                              'protection': 'Do not repair'},
+                              True, None),
+                             ('modify_host', {'id': 'host5',
+                                              'protection': 'Do not repair'},
+                              True, None),
+                             ('modify_host', {'id': 'host4',
+                                              'protection': 'Do not repair'},
+                              True, None),
+                             ('modify_host', {'id': 'host3',
+                                              'protection': 'Do not repair'},
+                              True, None),
+                             ('modify_host', {'id': 'host2',
+                                              'protection': 'Do not repair'},
+                              True, None),
+                             ('modify_host', {'id': 'host1',
+                                              'protection': 'Do not repair'},
+                              True, None),
+                             ('modify_host', {'id': 'host0',
+                                              'protection': 'Do not repair'},
+                              True, None)])],
                      out_words_ok=['Do not repair', 'host0', 'host1', 'host2',
                                    'host3', 'host4', 'host5', 'host6'])
         mfile.clean()
@@ -1299,19 +1339,17 @@ class host_create_unittest(cli_mock.cli_unittest):
                             True, []),
                            ('add_acl_group', {'name': 'acl0'},
                             True, 5),
-                           ('add_host', {'hostname': 'host1',
-                                         'status': 'Ready',
-                                         'locked': True},
-                            True, 42),
-                           ('host_add_labels', {'id': 'host1',
-                                                'labels': ['label0']},
-                            True, None),
-                           ('add_host', {'hostname': 'host0',
-                                         'status': 'Ready',
-                                         'locked': True},
-                            True, 42),
-                           ('host_add_labels', {'id': 'host0',
-                                                'labels': ['label0']},
+                           ('batch',
+                            [('add_host', {'hostname': 'host1',
+                                           'status': 'Ready',
+                                           'locked': True},
+                              True, 42),
+                             ('add_host', {'hostname': 'host0',
+                                           'status': 'Ready',
+                                           'locked': True},
+                              True, 42)]),
+                           ('hosts_add_labels', {'hosts': ['host1', 'host0'],
+                                                 'labels': ['label0']},
                             True, None),
                            ('acl_group_add_hosts',
                             {'id': 'acl0', 'hosts': ['host1', 'host0']},
@@ -1334,26 +1372,25 @@ class host_create_unittest(cli_mock.cli_unittest):
                             True, []),
                            ('add_acl_group', {'name': 'acl0'},
                             True, 5),
-                           ('add_host', {'hostname': 'host1',
-                                         'status': 'Ready',
-                                         'locked': True},
-                            True, 42),
-                           ('host_add_labels', {'id': 'host1',
-                                                'labels': ['label0']},
-                            True, None),
-                           ('add_host', {'hostname': 'host0',
-                                         'status': 'Ready',
-                                         'locked': True},
-                            True, 42),
-                           ('host_add_labels', {'id': 'host0',
-                                                'labels': ['label0']},
+                           ('batch',
+                            [('add_host', {'hostname': 'host1',
+                                           'status': 'Ready',
+                                           'locked': True},
+                              True, 42),
+                             ('add_host', {'hostname': 'host0',
+                                           'status': 'Ready',
+                                           'locked': True},
+                              True, 42)]),
+                           ('hosts_add_labels', {'hosts': ['host1', 'host0'],
+                                                 'labels': ['label0']},
                             True, None),
                            ('acl_group_add_hosts',
                             {'id': 'acl0', 'hosts': ['host1', 'host0']},
                             True, None),
-                           ('modify_host', {'id': 'host1', 'locked': False},
-                            True, None),
-                           ('modify_host', {'id': 'host0', 'locked': False},
+                           ('modify_hosts',
+                            {'host_filter_data': {'hostname__in':
+                                                  ['host1', 'host0']},
+                             'update_data': {'locked': False}},
                             True, None)],
                      out_words_ok=['host0', 'host1'])
 
@@ -1388,30 +1425,106 @@ class host_create_unittest(cli_mock.cli_unittest):
                             True, []),
                            ('add_acl_group', {'name': 'acl0'},
                             True, 5),
-                           ('add_host', {'hostname': 'host1',
-                                         'status': 'Ready',
-                                         'locked': True},
-                            True, 42),
-                           ('host_add_labels', {'id': 'host1',
-                                                'labels': ['label0', 'label,1',
-                                                           'label,2']},
+                           ('batch',
+                            [('add_host', {'hostname': 'host1',
+                                           'status': 'Ready',
+                                           'locked': True},
+                              True, 42),
+                             ('add_host', {'hostname': 'host0',
+                                           'status': 'Ready',
+                                           'locked': True},
+                              True, 42)]),
+                           ('hosts_add_labels', {'hosts': ['host1', 'host0'],
+                                                 'labels': ['label0', 'label,1',
+                                                            'label,2']},
                             True, None),
-                           ('add_host', {'hostname': 'host0',
-                                         'status': 'Ready',
-                                         'locked': True},
-                            True, 42),
+                           ('acl_group_add_hosts',
+                            {'id': 'acl0', 'hosts': ['host1', 'host0']},
+                            True, None),
+                           ('modify_hosts',
+                            {'host_filter_data': {'hostname__in':
+                                                  ['host1', 'host0']},
+                             'update_data': {'locked': False}},
+                            True, None)],
+                     out_words_ok=['host0', 'host1'])
+
+
+    def test_execute_create_label_batch_fails(self):
+        self.run_cmd(argv=['atest', 'host', 'create', '-b', 'label0',
+                           '--acls', 'acl0', 'host0', 'host1',
+                           '--ignore_site_file'],
+                     rpcs=[('get_labels', {'name': 'label0'},
+                            True,
+                            [{u'id': 4,
+                              u'platform': 0,
+                              u'name': u'label0',
+                              u'invalid': False,
+                              u'kernel_config': u''}]),
+                           ('get_acl_groups', {'name': 'acl0'},
+                            True, []),
+                           ('add_acl_group', {'name': 'acl0'},
+                            True, 5),
+                           ('batch',
+                            [('add_host', {'hostname': 'host1',
+                                           'status': 'Ready',
+                                           'locked': True},
+                              True, 42),
+                             ('add_host', {'hostname': 'host0',
+                                           'status': 'Ready',
+                                           'locked': True},
+                              True, 42)]),
+                           ('hosts_add_labels', {'hosts': ['host1', 'host0'],
+                                                 'labels': ['label0']},
+                            False, 'ValidationError: label0 is invalid'),
+                           ('host_add_labels', {'id': 'host1',
+                                                'labels': ['label0']},
+                            False, 'ValidationError: label0 is invalid'),
                            ('host_add_labels', {'id': 'host0',
-                                                'labels': ['label0', 'label,1',
-                                                           'label,2']},
+                                                'labels': ['label0']},
                             True, None),
                            ('acl_group_add_hosts',
-                            {'id': 'acl0', 'hosts': ['host1', 'host0']},
+                            {'id': 'acl0', 'hosts': ['host0']},
                             True, None),
-                           ('modify_host', {'id': 'host1', 'locked': False},
+                           ('modify_hosts',
+                            {'host_filter_data': {'hostname__in': ['host0']},
+                             'update_data': {'locked': False}},
+                            True, None)],
+                     out_words_ok=['host0'],
+                     err_words_ok=['host1', 'label0 is invalid'])
+
+
+    def test_execute_create_second_batch_fails(self):
+        self.god.stub_with(topic_common.atest, 'MAX_BATCH_SIZE', 1)
+        self.run_cmd(argv=['atest', 'host', 'create', '-b', 'label0',
+                           'host0', 'host1', '--ignore_site_file'],
+                     rpcs=[('get_labels', {'name': 'label0'},
+                            True,
+                            [{u'id': 4,
+                              u'platform': 0,
+                              u'name': u'label0',
+                              u'invalid': False,
+                              u'kernel_config': u''}]),
+                           ('batch',
+                            [('add_host', {'hostname': 'host1',
+                                           'status': 'Ready',
+                                           'locked': True},
+                              True, 42)]),
+                           ('batch',
+                            [('add_host', {'hostname': 'host0',
+                                           'status': 'Ready',
+                                           'locked': True},
+                              True, 42)],
+                            proxy.JSONRPCException('Bad batch response')),
+                           ('hosts_add_labels', {'hosts': ['host1'],
+                                                 'labels': ['label0']},
                             True, None),
-                           ('modify_host', {'id': 'host0', 'locked': False},
+                           ('modify_hosts',
+                            {'host_filter_data': {'hostname__in': ['host1']},
+                             'update_data': {'locked': False}},
                             True, None)],
-                     out_words_ok=['host0', 'host1'])
+                     out_words_ok=['Added', 'host1'],
+                     out_words_no=['host0'],
+                     err_words_ok=['Bad batch response', 'host0'])
 
 
 if __name__ == '__main__':
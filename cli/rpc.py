@@ -39,7 +39,7 @@ class rpc_comm(object):
         self.username = username
         self.web_server = get_autotest_server(web_server)
         try:
-            self.proxy = self._connect(rpc_path)
+            self.proxy, self.batch_proxy = self._connect(rpc_path)
         except rpc_client_lib.AuthError, s:
             raise AuthError(s)
 
@@ -50,7 +50,8 @@ class rpc_comm(object):
         headers = rpc_client_lib.authorization_headers(self.username,
                                                        self.web_server)
         rpc_server = self.web_server + rpc_path
-        return rpc_client_lib.get_proxy(rpc_server, headers=headers)
+        return (rpc_client_lib.get_proxy(rpc_server, headers=headers),
+                rpc_client_lib.get_batch_proxy(rpc_server, headers=headers))
 
 
     def run(self, op, *args, **data):
@@ -63,6 +64,22 @@ class rpc_comm(object):
         return result
 
 
+    def run_batch(self, calls):
+        """
+        Run several RPCs in a single request.
+
+        @param calls: A list of (op, data dict) tuples.
+        @returns A list holding, for each call, its result or the
+                JSONRPCException it raised.
+        """
+        if 'AUTOTEST_CLI_DEBUG' in os.environ:
+            print self.web_server, 'batch', calls
+        results = self.batch_proxy.call(calls)
+        if 'AUTOTEST_CLI_DEBUG' in os.environ:
+            print 'results:', results
+        return results
+
+
 class afe_comm(rpc_comm):
     """Handles the AFE setup and communication through RPC"""
     def __init__(self, web_server=None, rpc_path=AFE_RPC_PATH, username=None):
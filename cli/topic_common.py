@@ -244,6 +244,8 @@ class atest(object):
     msg_topic = "[acl|host|job|label|atomicgroup|test|user]"
     usage_action = "[action]"
     msg_items = ''
+    # Maximum number of RPCs sent in a single batch request
+    MAX_BATCH_SIZE = 100
 
     def invalid_arg(self, header, follow_up=''):
         twrap = textwrap.TextWrapper(initial_indent='        ',
@@ -470,10 +472,60 @@ class atest(object):
 
 
     def execute_rpc(self, op, item='', **data):
+        return self._run_with_retries(op, item, data,
+                                      lambda: self.afe.run(op, **data))
+
+
+    def execute_rpc_batch(self, op, items, data_list):
+        """Run op once for each item and its data in a few requests.
+
+        Failures of single calls are reported like those of execute_rpc(),
+        and so are those of every call of a request that failed as a whole.
+        If the server can't handle batches, the calls are made one by one.
+
+        Returns:
+          The list of the items whose call succeeded."""
+        successes = []
+        use_batch = True
+        for start in xrange(0, len(items), self.MAX_BATCH_SIZE):
+            end = start + self.MAX_BATCH_SIZE
+            chunk = zip(items[start:end], data_list[start:end])
+            if use_batch:
+                calls = [(op, data) for item, data in chunk]
+                try:
+                    results = self._run_with_retries(
+                            op, '', calls, lambda: self.afe.run_batch(calls))
+                except proxy.BatchNotSupportedError:
+                    use_batch = False
+                except CliError, err:
+                    for item, data in chunk:
+                        self.failure(err, item=item,
+                                     what_failed='Operation %s failed' % op)
+                    continue
+                else:
+                    for (item, data), result in zip(chunk, results):
+                        if isinstance(result, Exception):
+                            self.failure(result, item=item,
+                                         what_failed='Operation %s failed' % op)
+                        else:
+                            successes.append(item)
+                    continue
+
+            for item, data in chunk:
+                try:
+                    self.execute_rpc(op, item=item, **data)
+                    successes.append(item)
+                except CliError:
+                    # Already logged by execute_rpc()
+                    pass
+        return successes
+
+
+    def _run_with_retries(self, op, item, data, rpc_function):
         retry = 2
         while retry:
             try:
-                return self.afe.run(op, **data)
+                return rpc_function()
             except urllib2.URLError, err:
                 if hasattr(err, 'reason'):
                     if 'timed out' not in err.reason:
@@ -498,7 +550,7 @@ class atest(object):
                                  what_failed=("Timed-out contacting "
                                               "the Autotest server"))
                     raise CliError("Timed-out contacting the Autotest server")
-            except mock.CheckPlaybackError:
+            except (mock.CheckPlaybackError, proxy.BatchNotSupportedError):
                 raise
             except Exception, full_error:
                 # There are various exceptions throwns by JSON,
@@ -142,21 +142,19 @@ def with_backing_lock(method):
 
 # decorator for use with job_state methods
 def with_backing_file(method):
-    """A decorator to perform a lock-read-*-write-unlock cycle.
+    """A decorator to perform a lock-read-*-unlock cycle.
 
     When applied to a method, this decorator will automatically wrap
-    calls to the method in a lock-and-read before the call followed by a
-    write-and-unlock. Any operation that is reading or writing state
-    should be decorated with this method to ensure that backing file
-    state is consistently maintained.
+    calls to the method in a lock-and-read before the call followed by an
+    unlock. Any operation that is reading or writing state should be
+    decorated with this method to ensure that backing file state is
+    consistently maintained; methods changing the state are responsible
+    for journaling their changes with _append_to_backing_file.
     """
     @with_backing_lock
     def wrapped_method(self, *args, **dargs):
         self._read_from_backing_file()
-        try:
-            return method(self, *args, **dargs)
-        finally:
-            self._write_to_backing_file()
+        return method(self, *args, **dargs)
     wrapped_method.__name__ = method.__name__
     wrapped_method.__doc__ = method.__doc__
     return wrapped_method
@@ -172,10 +170,21 @@ class job_state(object):
     as names. Additionally, the namespace 'stateful_property' is used for
     storing the valued associated with properties constructed using the
     property_factory method.
+
+    The backing file is a journal: a header identifying the journal, a
+    pickled snapshot of the state and then one pickled record per change
+    made since the snapshot was written. Changes are appended to it and
+    every JOURNAL_COMPACTION_THRESHOLD records the journal is compacted back
+    into a single snapshot under a new header, which tells the other users
+    of the file to read it from scratch. Readers only load the records
+    appended since their last read, so reading an unchanged state costs a
+    header read and a stat rather than a full load and rewrite.
     """
 
     NO_DEFAULT = object()
     PICKLE_PROTOCOL = 2  # highest protocol available in python 2.4
+    JOURNAL_MAGIC = 'job_state journal'
+    JOURNAL_COMPACTION_THRESHOLD = 100
 
 
     def __init__(self):
@@ -184,6 +193,18 @@ class job_state(object):
         self._backing_file = None
         self._backing_file_initialized = False
         self._backing_file_lock = None
+        self._reset_journal_position()
+
+
+    def _reset_journal_position(self):
+        """Forget how much of the backing file journal was read."""
+        # the id of the journal in the backing file, None if the file is
+        # not a journal; it changes every time the journal is compacted
+        self._journal_id = None
+        # the offset of the end of the last journal record we know of
+        self._journal_offset = 0
+        # the number of journal records following the snapshot
+        self._journal_length = 0
 
 
     def _lock_backing_file(self):
@@ -218,11 +239,14 @@ class job_state(object):
             attempt to control concurrent access to the file at file_path.
         """
 
-        # we can assume that the file exists
-        if os.path.getsize(file_path) == 0:
-            on_disk_state = {}
-        else:
-            on_disk_state = pickle.load(open(file_path))
+        # we can assume that the file exists; getsize raises OSError (and not
+        # the IOError of open) for callers that ignore missing files
+        os.path.getsize(file_path)
+        state_file = open(file_path, 'rb')
+        try:
+            on_disk_state = self._load_state_file(state_file)[1]
+        finally:
+            state_file.close()
 
         if merge:
             # merge the on-disk state with the in-memory state
@@ -266,23 +290,180 @@ class job_state(object):
             outfile.close()
 
 
+    @classmethod
+    def _apply_journal_record(cls, state, record):
+        """Apply a change recorded by _append_to_backing_file to a state.
+
+        @param state: The state dictionary to update.
+        @param record: An (operation, namespace, name, value) tuple.
+        """
+        operation, namespace, name, value = record
+        if operation == 'set':
+            state.setdefault(namespace, {})[name] = value
+        elif operation == 'discard':
+            namespace_dict = state.get(namespace, {})
+            namespace_dict.pop(name, None)
+            if not namespace_dict:
+                state.pop(namespace, None)
+        elif operation == 'discard_namespace':
+            state.pop(namespace, None)
+        else:
+            raise ValueError('Unknown job_state journal operation %r'
+                             % operation)
+
+
+    @classmethod
+    def _load_journal_records(cls, state_file, state):
+        """Apply the journal records from the current position of a file.
+
+        Loading stops at the end of the file or at a record cut short by a
+        crash while it was appended, leaving the file positioned after the
+        last complete record.
+
+        @param state_file: An open file positioned at the start of a record.
+        @param state: The state dictionary to apply the records to.
+
+        @return: The number of records applied.
+        """
+        file_size = os.fstat(state_file.fileno()).st_size
+        count = 0
+        while state_file.tell() < file_size:
+            record_offset = state_file.tell()
+            try:
+                record = pickle.load(state_file)
+            except Exception, e:
+                logging.warning('Ignoring incomplete job_state journal record '
+                                'at offset %d: %s', record_offset, e)
+                state_file.seek(record_offset)
+                break
+            cls._apply_journal_record(state, record)
+            count += 1
+        return count
+
+
+    @classmethod
+    def _load_header(cls, state_file):
+        """Load the first object of a state file.
+
+        @param state_file: An open file positioned at its start.
+
+        @return: A (journal id, object) tuple where the object is None if
+            the file is empty, and None if it is not a journal header.
+        """
+        if os.fstat(state_file.fileno()).st_size == 0:
+            return None, None
+        first_object = pickle.load(state_file)
+        if (isinstance(first_object, tuple) and len(first_object) == 2 and
+            first_object[0] == cls.JOURNAL_MAGIC):
+            return first_object[1], first_object
+        return None, first_object
+
+
+    @classmethod
+    def _load_state_file(cls, state_file):
+        """Load a state file written by write_to_file or a backing file.
+
+        @param state_file: An open file positioned at its start.
+
+        @return: A (journal id, state, journal length) tuple, the journal id
+            being None when the file is not a journal. The file is left
+            positioned after the last complete journal record.
+        """
+        journal_id, first_object = cls._load_header(state_file)
+        if first_object is None:
+            return None, {}, 0
+        if journal_id is None:
+            # a plain snapshot, as written by write_to_file
+            state = first_object
+        else:
+            state = pickle.load(state_file)
+        journal_length = cls._load_journal_records(state_file, state)
+        return journal_id, state, journal_length
+
+
     def _read_from_backing_file(self):
         """Refresh the current state from the backing file.
 
         If the backing file has never been read before (indicated by checking
         self._backing_file_initialized) it will merge the file with the
-        in-memory state, rather than overwriting it.
+        in-memory state, rather than overwriting it. Otherwise only the
+        journal records appended since the last read are loaded, unless the
+        journal was compacted by someone else in the meantime.
         """
-        if self._backing_file:
-            merge_backing_file = not self._backing_file_initialized
-            self.read_from_file(self._backing_file, merge=merge_backing_file)
+        if not self._backing_file:
+            return
+        if not self._backing_file_initialized:
+            # this also compacts the backing file, setting up the journal
+            self.read_from_file(self._backing_file, merge=True)
             self._backing_file_initialized = True
+            return
+
+        backing_file = open(self._backing_file, 'rb')
+        try:
+            journal_id = self._load_header(backing_file)[0]
+            if journal_id is None or journal_id != self._journal_id:
+                backing_file.seek(0)
+                (self._journal_id, self._state,
+                 self._journal_length) = self._load_state_file(backing_file)
+                self._journal_offset = backing_file.tell()
+            elif (os.fstat(backing_file.fileno()).st_size !=
+                  self._journal_offset):
+                backing_file.seek(self._journal_offset)
+                self._journal_length += self._load_journal_records(
+                    backing_file, self._state)
+                self._journal_offset = backing_file.tell()
+        finally:
+            backing_file.close()
 
 
     def _write_to_backing_file(self):
-        """Flush the current state to the backing file."""
-        if self._backing_file:
-            self.write_to_file(self._backing_file)
+        """Flush the current state to the backing file, compacting it."""
+        if not self._backing_file:
+            return
+        journal_id = '%x.%x' % (os.getpid(), int(time.time() * 1000000))
+        if journal_id == self._journal_id:
+            journal_id += '.1'
+        backing_file = open(self._backing_file, 'wb')
+        try:
+            pickle.dump((self.JOURNAL_MAGIC, journal_id), backing_file,
+                        self.PICKLE_PROTOCOL)
+            pickle.dump(self._state, backing_file, self.PICKLE_PROTOCOL)
+            self._journal_offset = backing_file.tell()
+        finally:
+            backing_file.close()
+        self._journal_id = journal_id
+        self._journal_length = 0
+
+
+    def _append_to_backing_file(self, operation, namespace, name=None,
+                                value=None):
+        """Journal a change of the state in the backing file.
+
+        Must be called with the backing file locked and read, right after
+        the change was made in-memory.
+
+        @param operation: One of 'set', 'discard' and 'discard_namespace'.
+        @param namespace: The namespace of the change.
+        @param name: The name of the change, if any.
+        @param value: The new value, for 'set' changes.
+        """
+        if not self._backing_file:
+            return
+        if (self._journal_id is None or
+            self._journal_length >= self.JOURNAL_COMPACTION_THRESHOLD):
+            self._write_to_backing_file()
+            return
+        backing_file = open(self._backing_file, 'r+b')
+        try:
+            # drop whatever a crash left after the last complete record
+            backing_file.seek(self._journal_offset)
+            backing_file.truncate()
+            pickle.dump((operation, namespace, name, value), backing_file,
+                        self.PICKLE_PROTOCOL)
+            self._journal_offset = backing_file.tell()
+        finally:
+            backing_file.close()
+        self._journal_length += 1
 
 
     @with_backing_file
@@ -307,6 +488,7 @@ class job_state(object):
         self._synchronize_backing_file()
         self._backing_file = file_path
         self._backing_file_initialized = False
+        self._reset_journal_position()
         self._synchronize_backing_file()
 
 
@@ -343,6 +525,7 @@ class job_state(object):
         """
         namespace_dict = self._state.setdefault(namespace, {})
         namespace_dict[name] = copy.deepcopy(value)
+        self._append_to_backing_file('set', namespace, name, value)
         logging.debug('Persistent state %s.%s now set to %r', namespace,
                       name, value)
 
@@ -371,6 +554,7 @@ class job_state(object):
             del self._state[namespace][name]
             if len(self._state[namespace]) == 0:
                 del self._state[namespace]
+            self._append_to_backing_file('discard', namespace, name)
             logging.debug('Persistent state %s.%s deleted', namespace, name)
         else:
             logging.debug(
@@ -386,6 +570,7 @@ class job_state(object):
         """
         if namespace in self._state:
             del self._state[namespace]
+            self._append_to_backing_file('discard_namespace', namespace)
         logging.debug('Persistent state %s.* deleted', namespace)
 
 
@@ -1,6 +1,6 @@
 #!/usr/bin/python
 
-import os, stat, tempfile, shutil, logging
+import os, stat, tempfile, shutil, logging, errno
 
 try:
     import autotest.common as common
@@ -51,6 +51,10 @@ class stub_job_state(base_job.job_state):
     def _write_to_backing_file(self):
         pass
 
+    def _append_to_backing_file(self, operation, namespace, name=None,
+                                value=None):
+        pass
+
     def _lock_backing_file(self):
         pass
 
@@ -537,6 +541,16 @@ class test_job_state_read_write_file(unittest.TestCase):
         self.assertEqual(100, state2.get('ns2', 'var10'))
 
 
+    def test_read_missing_file_raises_oserror(self):
+        state = base_job.job_state()
+        try:
+            state.read_from_file('missing_file')
+        except OSError, e:
+            self.assertEqual(errno.ENOENT, e.errno)
+        else:
+            self.fail('reading a missing file did not raise OSError')
+
+
     def test_read_overwrites_in_memory(self):
         state = base_job.job_state()
         state.set('ns', 'myvar', 'hello')
@@ -725,6 +739,77 @@ class test_job_state_set_backing_file(unittest.TestCase):
         self.assertRaises(KeyError, state2.get, 'n7', 'shared5')
 
 
+class test_job_state_backing_file_journal(unittest.TestCase):
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp(suffix='unittest')
+        self.original_wd = os.getcwd()
+        os.chdir(self.testdir)
+        self.state = base_job.job_state()
+        self.state.set_backing_file('journal')
+
+
+    def tearDown(self):
+        os.chdir(self.original_wd)
+        shutil.rmtree(self.testdir, ignore_errors=True)
+
+
+    def read_journal(self):
+        state = base_job.job_state()
+        state.read_from_file('journal')
+        return state
+
+
+    def test_reads_do_not_write(self):
+        self.state.set('ns', 'var', 'value')
+        contents = open('journal').read()
+        self.assertEqual('value', self.state.get('ns', 'var'))
+        self.assertTrue(self.state.has('ns', 'var'))
+        self.assertFalse(self.state.has('ns', 'other'))
+        self.assertEqual(contents, open('journal').read())
+
+
+    def test_changes_are_appended(self):
+        self.state.set('ns', 'var', 'value')
+        contents = open('journal').read()
+        self.state.set('ns', 'var2', 'value2')
+        self.state.discard('ns', 'var')
+        self.assertTrue(open('journal').read().startswith(contents))
+        state = self.read_journal()
+        self.assertFalse(state.has('ns', 'var'))
+        self.assertEqual('value2', state.get('ns', 'var2'))
+
+
+    def test_journal_is_compacted(self):
+        self.state.JOURNAL_COMPACTION_THRESHOLD = 3
+        other_state = base_job.job_state()
+        other_state.set_backing_file('journal')
+        for i in xrange(3):
+            self.state.set('ns', 'var%d' % i, i)
+        self.assertEqual(2, other_state.get('ns', 'var2'))
+        self.assertEqual(3, self.state._journal_length)
+        self.state.set('ns', 'var3', 3)
+        self.assertEqual(0, self.state._journal_length)
+        for i in xrange(4):
+            self.assertEqual(i, other_state.get('ns', 'var%d' % i))
+        other_state.discard_namespace('ns')
+        self.assertFalse(self.state.has('ns', 'var0'))
+        self.assertFalse(self.read_journal().has('ns', 'var0'))
+
+
+    def test_incomplete_record_is_ignored(self):
+        self.state.set('ns', 'var1', 'value1')
+        self.state.set('ns', 'var2', 'value2')
+        backing_file = open('journal', 'r+b')
+        backing_file.truncate(os.path.getsize('journal') - 2)
+        backing_file.close()
+        state = base_job.job_state()
+        state.set_backing_file('journal')
+        self.assertEqual('value1', state.get('ns', 'var1'))
+        self.assertFalse(state.has('ns', 'var2'))
+        state.set('ns', 'var3', 'value3')
+        self.assertEqual('value3', self.read_journal().get('ns', 'var3'))
+
+
 class test_job_state_backing_file_locking(unittest.TestCase):
     def setUp(self):
         self.testdir = tempfile.mkdtemp(suffix='unittest')
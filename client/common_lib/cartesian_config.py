@@ -28,7 +28,8 @@ Cartesian configuration format file parser.
 @copyright: Red Hat 2008-2011
 """
 
-import re, os, optparse, collections, string
+import re, os, optparse, collections, string, hashlib, tempfile, cPickle
+import errno, stat
 
 class ParserError:
     def __init__(self, msg, line=None, filename=None, linenum=None):
@@ -58,6 +59,21 @@ class MissingIncludeError:
 
 num_failed_cases = 5
 
+# bump whenever a change of the parser changes the dicts generated from a
+# config, so that dicts cached by older versions are not used
+CACHE_VERSION = 1
+
+# per user, as cached dicts are only read from directories no one else can
+# write to
+DEFAULT_CACHE_DIR = os.path.join(tempfile.gettempdir(),
+                                 'autotest_cartesian_cache-%d' % os.getuid())
+
+# how many dicts are pickled together in cache files
+_CACHE_CHUNK_SIZE = 100
+
+# how many partially built dicts get_dicts() keeps for reuse
+_PREFIX_CACHE_SIZE = 1000
+
 
 class Node(object):
     def __init__(self):
@@ -197,6 +213,28 @@ class NegativeCondition(OnlyFilter):
         self.content = []
 
 
+def _make_segment(content):
+    """
+    @param content: A list of (filename, linenum, obj) tuples.
+    @return: A (content, ops) segment of content, ops being the tuple of the
+            Op objects in content if it is only made of them, None otherwise.
+    """
+    for filename, linenum, obj in content:
+        if type(obj) is not Op:
+            return content, None
+    return content, tuple([obj for filename, linenum, obj in content])
+
+
+def _segments_contain(segments, t):
+    """
+    @return: Whether the filter t is in the content of one of segments.
+    """
+    for segment_content, ops in segments:
+        if ops is None and t in segment_content:
+            return True
+    return False
+
+
 class Parser(object):
     """
     Parse an input file or string that follows the Cartesian Config File format
@@ -206,15 +244,27 @@ class Parser(object):
     @see: https://github.com/autotest/autotest/wiki/KVMAutotest-CartesianConfigParametersIntro
     """
 
-    def __init__(self, filename=None, debug=False):
+    def __init__(self, filename=None, debug=False, cache_dir=None):
         """
         Initialize the parser and optionally parse a file.
 
         @param filename: Path of the file to parse.
         @param debug: Whether to turn on debugging output.
+        @param cache_dir: Directory where the dicts generated from the parsed
+                code are cached, keyed by the contents of everything parsed,
+                or None to not cache them.  It is created if needed, and not
+                used unless it is owned by the current user and no one else
+                can write to it.
         """
         self.node = Node()
         self.debug = debug
+        self.cache_dir = cache_dir
+        # digests of the contents of everything parsed so far, in order
+        self._source_digests = []
+        # dicts resulting from applying common leading sequences of
+        # assignments, see _apply_ops()
+        self._prefix_ids = {}
+        self._prefix_dicts = []
         if filename:
             self.parse_file(filename)
 
@@ -225,7 +275,8 @@ class Parser(object):
 
         @param filename: Path of the configuration file.
         """
-        self.node = self._parse(FileReader(filename), self.node)
+        self.node = self._parse(self._get_reader(FileReader(filename)),
+                                self.node)
 
 
     def parse_string(self, s):
@@ -234,7 +285,18 @@ class Parser(object):
 
         @param s: String to parse.
         """
-        self.node = self._parse(StrReader(s), self.node)
+        self.node = self._parse(self._get_reader(StrReader(s)), self.node)
+
+
+    def _get_reader(self, cr):
+        """
+        Record the contents of a FileReader/StrReader object about to be
+        parsed, as the dicts generated depend on them.
+
+        @return: cr.
+        """
+        self._source_digests.append(cr.digest)
+        return cr
 
 
     def get_dicts(self, node=None, ctx=[], content=[], shortname=[], dep=[]):
@@ -242,9 +304,136 @@ class Parser(object):
         Generate dictionaries from the code parsed so far.  This should
         be called after parsing something.
 
+        If a cache directory was given, the dicts generated from the whole
+        code are read from the cache when it was generated from the same
+        code before, and are cached otherwise.
+
         @return: A dict generator.
         """
-        def process_content(content, failed_filters):
+        if (node is None and not (ctx or content or shortname or dep) and
+            self.cache_dir and not self.debug and
+            _make_private_dir(self.cache_dir)):
+            return self._get_cached_dicts()
+        segments = []
+        if content:
+            segments.append(_make_segment(content))
+        return self._get_dicts(node or self.node, ctx, segments, shortname,
+                               dep)
+
+
+    def get_variants(self):
+        """
+        Generate the variants of the code parsed so far, without generating
+        their dicts, which are only built by Variant.get_dict().  This
+        should be called after parsing something.
+
+        @return: A Variant generator, in the order of get_dicts().
+        """
+        return self._get_variants(self.node, [], [], [], [])
+
+
+    def get_index(self):
+        """
+        Index the variants of the code parsed so far, without generating
+        their dicts.  This should be called after parsing something.
+
+        @return: A VariantIndex.
+        """
+        return VariantIndex(self.get_variants())
+
+
+    def _get_dicts(self, node, ctx, content, shortname, dep):
+        for variant in self._get_variants(node, ctx, content, shortname, dep):
+            yield variant.get_dict()
+
+
+    def _get_cache_path(self):
+        key = repr((CACHE_VERSION, self._source_digests))
+        return os.path.join(self.cache_dir, hashlib.sha1(key).hexdigest())
+
+
+    def _get_cached_dicts(self):
+        cache_path = self._get_cache_path()
+        if os.path.isfile(cache_path):
+            cache_file = open(cache_path, 'rb')
+            try:
+                chunk = cPickle.load(cache_file)
+                while chunk is not None:
+                    for d in chunk:
+                        yield d
+                    chunk = cPickle.load(cache_file)
+            finally:
+                cache_file.close()
+            return
+
+        cache_writer = _CacheWriter(cache_path)
+        try:
+            for d in self._get_dicts(self.node, [], [], [], []):
+                cache_writer.add(d)
+                # the cached dict must not see changes made by the caller
+                yield dict(d)
+            cache_writer.commit()
+        finally:
+            cache_writer.discard()
+
+
+    def _apply_ops(self, segments, reserved):
+        """
+        Apply the assignments of the content segments of a leaf to a new dict.
+
+        The segments come from the nodes on the path from the leaf to the
+        root, the leaf's first, so the leading segments are shared by the
+        dicts of many leaves.  The dicts resulting from the leading segments
+        are kept and extended (after copying them) rather than recomputed, as
+        long as the assignments do not use the reserved keys, which are
+        specific to every dict.
+
+        @param segments: The content segments of a leaf, see _make_segment().
+        @param reserved: The values of the reserved keys of the new dict.
+        @return: The new dict.
+        """
+        d = {}
+        prefix_id = None
+        applied = 0
+        for segment_content, ops in segments[:-1]:
+            key = (prefix_id, ops)
+            prefix_id = self._prefix_ids.get(key)
+            if prefix_id is None:
+                if (ops is None or
+                    len(self._prefix_dicts) >= _PREFIX_CACHE_SIZE or
+                    [op for op in ops if op.uses_reserved_keys]):
+                    break
+                d = dict(d)
+                for op in ops:
+                    op.apply_to_dict(d)
+                prefix_id = len(self._prefix_dicts)
+                self._prefix_ids[key] = prefix_id
+                self._prefix_dicts.append(d)
+            else:
+                d = self._prefix_dicts[prefix_id]
+            applied += 1
+
+        d = dict(d)
+        d.update(reserved)
+        for segment_content, ops in segments[applied:]:
+            for filename, linenum, op in segment_content:
+                op.apply_to_dict(d)
+        return d
+
+
+    def _get_variants(self, node, ctx, content, shortname, dep):
+        """
+        Generate the variants of a subtree.
+
+        @param node: The root of the subtree.
+        @param ctx: The names of the ancestors of node.
+        @param content: The content inherited from the ancestors of node, as
+                a list of segments, see _make_segment().
+        @param shortname: The short names of the ancestors of node.
+        @param dep: The dependencies inherited from the ancestors of node.
+        @return: A Variant generator.
+        """
+        def process_content(content, new_content, failed_filters):
             # 1. Check that the filters in content are OK with the current
             #    context (ctx).
             # 2. Move the parts of content that are still relevant into
@@ -277,7 +466,7 @@ class Parser(object):
                         # new_internal_filters because we don't expect them to
                         # come from outside this node, even if the Condition
                         # itself was external)
-                        if not process_content(obj.content,
+                        if not process_content(obj.content, new_content,
                                                new_internal_filters):
                             failed_filters.append(t)
                             return False
@@ -295,7 +484,7 @@ class Parser(object):
                        failed_external_filters,
                        failed_internal_filters):
             for t in failed_external_filters:
-                if t not in content:
+                if not _segments_contain(content, t):
                     return True
                 filename, linenum, filter = t
                 if filter.might_pass(failed_ctx, failed_ctx_set, ctx, ctx_set,
@@ -315,7 +504,6 @@ class Parser(object):
             if len(node.failed_cases) > num_failed_cases:
                 node.failed_cases.pop()
 
-        node = node or self.node
         # Update dep
         for d in node.dep:
             dep = dep + [".".join(ctx + [d])]
@@ -334,30 +522,44 @@ class Parser(object):
                 del node.failed_cases[i]
                 node.failed_cases.appendleft(failed_case)
                 return
-        # Check content and unpack it into new_content
-        new_content = []
+        # Check content and unpack it into new segments; the segments only
+        # made of assignments are left as they are
         new_external_filters = []
         new_internal_filters = []
-        if (not process_content(node.content, new_internal_filters) or
-            not process_content(content, new_external_filters)):
+        new_content = []
+        if not process_content(node.content, new_content,
+                               new_internal_filters):
             add_failed_case()
             return
+        new_segments = []
+        if new_content:
+            new_segments.append(_make_segment(new_content))
+        for segment in content:
+            segment_content, ops = segment
+            if ops is not None:
+                new_segments.append(segment)
+                continue
+            new_content = []
+            if not process_content(segment_content, new_content,
+                                   new_external_filters):
+                add_failed_case()
+                return
+            if new_content:
+                new_segments.append(_make_segment(new_content))
         # Update shortname
         if node.append_to_shortname:
             shortname = shortname + node.name
         # Recurse into children
         count = 0
         for n in node.children:
-            for d in self.get_dicts(n, ctx, new_content, shortname, dep):
+            for variant in self._get_variants(n, ctx, new_segments, shortname,
+                                              dep):
                 count += 1
-                yield d
+                yield variant
         # Reached leaf?
         if not node.children:
             self._debug("    reached leaf, returning it")
-            d = {"name": name, "dep": dep, "shortname": ".".join(shortname)}
-            for filename, linenum, op in new_content:
-                op.apply_to_dict(d)
-            yield d
+            yield Variant(self, name, ".".join(shortname), dep, new_segments)
         # If this node did not produce any dicts, remember the failed filters
         # of its descendants
         elif not count:
@@ -372,7 +574,7 @@ class Parser(object):
                     if obj not in new_internal_filters:
                         new_internal_filters.append(obj)
                 for obj in failed_external_filters:
-                    if obj in content:
+                    if _segments_contain(content, obj):
                         if obj not in new_external_filters:
                             new_external_filters.append(obj)
                     else:
@@ -475,7 +677,8 @@ class Parser(object):
                 if not os.path.isfile(filename):
                     raise MissingIncludeError(line, cr.filename, linenum)
                     continue
-                node = self._parse(FileReader(filename), node)
+                node = self._parse(self._get_reader(FileReader(filename)),
+                                   node)
                 continue
 
             # Parse 'only' and 'no' filters
@@ -528,58 +731,119 @@ class Parser(object):
         return node
 
 
+class Variant(object):
+    """
+    A variant of a parsed config, whose dict is built on demand.
+    """
+    def __init__(self, parser, name, shortname, dep, segments):
+        """
+        @param parser: The Parser the variant comes from.
+        @param name: The full name of the variant.
+        @param shortname: The short name of the variant.
+        @param dep: The dependencies of the variant.
+        @param segments: The content segments of the variant's leaf, see
+                _make_segment().
+        """
+        self.name = name
+        self.shortname = shortname
+        self.dep = dep
+        self._parser = parser
+        self._segments = segments
+
+
+    def get_dict(self):
+        """
+        @return: A new dict of the variant, the same get_dicts() generates.
+        """
+        return self._parser._apply_ops(self._segments,
+                                       {"name": self.name, "dep": self.dep,
+                                        "shortname": self.shortname})
+
+
+class VariantIndex(object):
+    """
+    An index of the variants of a parsed config, to count them and look them
+    up by position, name or short name without generating the dicts of the
+    others.
+    """
+    def __init__(self, variants):
+        """
+        @param variants: The Variants to index.
+        """
+        self.variants = list(variants)
+        self._by_name = {}
+        self._by_shortname = {}
+        for variant in self.variants:
+            self._by_name.setdefault(variant.name, variant)
+            self._by_shortname.setdefault(variant.shortname, variant)
+
+
+    def __len__(self):
+        return len(self.variants)
+
+
+    def __getitem__(self, index):
+        return self.variants[index]
+
+
+    def __iter__(self):
+        return iter(self.variants)
+
+
+    def get_by_name(self, name):
+        """
+        @return: The first Variant with the given full name.
+        @raise KeyError: No variant has that name.
+        """
+        return self._by_name[name]
+
+
+    def get_by_shortname(self, shortname):
+        """
+        @return: The first Variant with the given short name.
+        @raise KeyError: No variant has that short name.
+        """
+        return self._by_shortname[shortname]
+
+
 # Assignment operators
 
 _reserved_keys = set(("name", "shortname", "dep"))
 
 
-def _op_set(d, key, value):
-    if key not in _reserved_keys:
-        st = string.Template(value)
-        d[key] = st.safe_substitute(d)
+def _op_set(d, op):
+    if op.key not in _reserved_keys:
+        d[op.key] = op.substitute(d)
 
 
-def _op_append(d, key, value):
-    if key not in _reserved_keys:
-        st = string.Template(value)
-        d[key] = d.get(key, "") + st.safe_substitute(d)
+def _op_append(d, op):
+    if op.key not in _reserved_keys:
+        d[op.key] = d.get(op.key, "") + op.substitute(d)
 
 
-def _op_prepend(d, key, value):
-    if key not in _reserved_keys:
-        st = string.Template(value)
-        d[key] = st.safe_substitute(d) + d.get(key, "")
+def _op_prepend(d, op):
+    if op.key not in _reserved_keys:
+        d[op.key] = op.substitute(d) + d.get(op.key, "")
 
 
-def _op_regex_set(d, exp, value):
-    exp = re.compile("%s$" % exp)
-    st = string.Template(value)
-    for key in d:
-        if key not in _reserved_keys and exp.match(key):
-            d[key] = st.safe_substitute(d)
+def _op_regex_set(d, op):
+    for key in op.get_matching_keys(d):
+        d[key] = op.substitute(d)
 
 
-def _op_regex_append(d, exp, value):
-    exp = re.compile("%s$" % exp)
-    st = string.Template(value)
-    for key in d:
-        if key not in _reserved_keys and exp.match(key):
-            d[key] += st.safe_substitute(d)
+def _op_regex_append(d, op):
+    for key in op.get_matching_keys(d):
+        d[key] += op.substitute(d)
 
 
-def _op_regex_prepend(d, exp, value):
-    exp = re.compile("%s$" % exp)
-    st = string.Template(value)
-    for key in d:
-        if key not in _reserved_keys and exp.match(key):
-            d[key] = st.safe_substitute(d) + d[key]
+def _op_regex_prepend(d, op):
+    for key in op.get_matching_keys(d):
+        d[key] = op.substitute(d) + d[key]
 
 
-def _op_regex_del(d, empty, exp):
-    exp = re.compile("%s$" % exp)
-    for key in d.keys():
-        if key not in _reserved_keys and exp.match(key):
-            del d[key]
+def _op_regex_del(d, op):
+    for key in op.get_matching_keys(d):
+        del d[key]
 
 
 _ops = {"=": (r"\=", _op_set),
@@ -594,6 +858,10 @@ _ops_exp = re.compile("|".join([op[0] for op in _ops.values()]))
 
 
 class Op(object):
+    """
+    An assignment, with its value template and key regex compiled once so
+    they can be applied cheaply to every dict generated.
+    """
     def __init__(self, line, m):
         self.func = _ops[m.group()][1]
         self.key = line[:m.start()].strip()
@@ -603,9 +871,139 @@ class Op(object):
             value = value[1:-1]
         self.value = value
 
+        # values without placeholders are used as they are
+        self.template = None
+        self.uses_reserved_keys = False
+        if "$" in value:
+            self.template = string.Template(value)
+            for match in self.template.pattern.finditer(value):
+                if (match.group("named") in _reserved_keys or
+                    match.group("braced") in _reserved_keys):
+                    self.uses_reserved_keys = True
+
+        self.regex = None
+        if self.func is _op_regex_del:
+            # 'del <regex>': the regex is on the right of the operator
+            self.regex = re.compile("%s$" % value)
+        elif self.func not in (_op_set, _op_append, _op_prepend):
+            self.regex = re.compile("%s$" % self.key)
+        # the keys already checked against the regex, and those matching it
+        self._checked_keys = set()
+        self._matching_keys = set()
+
+
+    def substitute(self, d):
+        """
+        @return: The value of the assignment, with its placeholders replaced
+                by the values in d.
+        """
+        if self.template is None:
+            return self.value
+        return self.template.safe_substitute(d)
+
+
+    def get_matching_keys(self, d):
+        """
+        @return: The set of the non reserved keys of d matched by the regex
+                of this assignment.
+        """
+        keys = set(d)
+        for key in keys - self._checked_keys:
+            self._checked_keys.add(key)
+            if key not in _reserved_keys and self.regex.match(key):
+                self._matching_keys.add(key)
+        return keys & self._matching_keys
+
 
     def apply_to_dict(self, d):
-        self.func(d, self.key, self.value)
+        self.func(d, self)
+
+
+def _make_private_dir(path):
+    """
+    Create the directory path unless it exists, and check that no other user
+    can change its content, so that the pickles in it can be trusted.
+
+    @return: True if path is a private directory, False otherwise.
+    """
+    try:
+        os.makedirs(path, 0700)
+    except OSError, e:
+        if e.errno != errno.EEXIST:
+            return False
+    path_stat = os.lstat(path)
+    return (stat.S_ISDIR(path_stat.st_mode) and
+            path_stat.st_uid == os.getuid() and
+            not path_stat.st_mode & (stat.S_IWGRP | stat.S_IWOTH))
+
+
+class _CacheWriter(object):
+    """
+    Write generated dicts to a cache file, which only appears under its name
+    once all the dicts were written.  Errors writing the file just leave the
+    dicts uncached.
+    """
+    def __init__(self, cache_path):
+        self.cache_path = cache_path
+        self._chunk = []
+        self._file = None
+        cache_dir = os.path.dirname(cache_path)
+        try:
+            fd, self._temp_path = tempfile.mkstemp(dir=cache_dir)
+            self._file = os.fdopen(fd, 'wb')
+        except (IOError, OSError):
+            pass
+
+
+    def _dump(self, obj):
+        try:
+            cPickle.dump(obj, self._file, cPickle.HIGHEST_PROTOCOL)
+        except (IOError, OSError):
+            self.discard()
+
+
+    def add(self, d):
+        """
+        Add a dict to the cache file.
+        """
+        if not self._file:
+            return
+        self._chunk.append(d)
+        if len(self._chunk) >= _CACHE_CHUNK_SIZE:
+            self._dump(self._chunk)
+            self._chunk = []
+
+
+    def commit(self):
+        """
+        Finish the cache file, after all the dicts were added.
+        """
+        if self._file and self._chunk:
+            self._dump(self._chunk)
+        if self._file:
+            # marks the end of the dicts
+            self._dump(None)
+        if self._file:
+            try:
+                self._file.close()
+                os.rename(self._temp_path, self.cache_path)
+                self._file = None
+            except (IOError, OSError):
+                self.discard()
+
+
+    def discard(self):
+        """
+        Remove the cache file if it was not committed.
+        """
+        if not self._file:
+            return
+        self._file.close()
+        self._file = None
+        try:
+            os.remove(self._temp_path)
+        except OSError:
+            pass
 
 
 # StrReader and FileReader
@@ -621,6 +1019,7 @@ class StrReader(object):
         @param s: The string to parse.
         """
         self.filename = "<string>"
+        self.digest = hashlib.sha1(s).hexdigest()
         self._lines = []
         self._line_index = 0
         self._stored_line = None
@@ -700,12 +1099,13 @@ if __name__ == "__main__":
     for s in args[1:]:
         c.parse_string(s)
 
-    for i, d in enumerate(c.get_dicts()):
+    for i, variant in enumerate(c.get_variants()):
         if options.fullname:
-            print "dict %4d:  %s" % (i + 1, d["name"])
+            print "dict %4d:  %s" % (i + 1, variant.name)
         else:
-            print "dict %4d:  %s" % (i + 1, d["shortname"])
+            print "dict %4d:  %s" % (i + 1, variant.shortname)
         if options.contents:
+            d = variant.get_dict()
             keys = d.keys()
             keys.sort()
             for key in keys:
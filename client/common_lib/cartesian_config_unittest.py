@@ -0,0 +1,158 @@
+#!/usr/bin/python
+
+import unittest, os, shutil, tempfile
+try:
+    import autotest.common as common
+except ImportError:
+    import common
+from autotest_lib.client.common_lib import cartesian_config
+
+
+CONFIG = """
+image_name = image
+nic_model = rtl8139
+variants:
+    - qcow2:
+        image_format = qcow2
+    - raw:
+        image_format = raw
+        no boot
+variants:
+    - @Linux:
+        variants:
+            - Fedora:
+                image_name += -fedora
+            - RHEL:
+                image_name += -rhel
+    - Windows:
+        image_name += -win
+        nic_model = e1000
+variants:
+    - boot:
+        nic_.* ?<= "virtio-"
+        RHEL:
+            image_name <= "$image_format/"
+    - migrate: boot
+        del nic_model
+        test_name = "$shortname"
+"""
+
+
+class parser_test(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp(suffix='unittest')
+
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+
+    def get_dicts(self, config, cache_dir=None):
+        parser = cartesian_config.Parser(cache_dir=cache_dir)
+        parser.parse_string(config)
+        return list(parser.get_dicts())
+
+
+    def test_get_dicts(self):
+        dicts = dict((d['shortname'], d) for d in self.get_dicts(CONFIG))
+        self.assertEqual(['boot.Fedora.qcow2', 'boot.RHEL.qcow2',
+                          'boot.Windows.qcow2', 'migrate.Fedora.qcow2',
+                          'migrate.Fedora.raw', 'migrate.RHEL.qcow2',
+                          'migrate.RHEL.raw', 'migrate.Windows.qcow2',
+                          'migrate.Windows.raw'], sorted(dicts))
+
+        d = dicts['boot.RHEL.qcow2']
+        self.assertEqual('boot.Linux.RHEL.qcow2', d['name'])
+        self.assertEqual('qcow2/image-rhel', d['image_name'])
+        self.assertEqual('virtio-rtl8139', d['nic_model'])
+        self.assertEqual('image-fedora',
+                         dicts['boot.Fedora.qcow2']['image_name'])
+        self.assertEqual('virtio-e1000',
+                         dicts['boot.Windows.qcow2']['nic_model'])
+
+        d = dicts['migrate.Windows.raw']
+        self.assertEqual('raw', d['image_format'])
+        self.assertFalse('nic_model' in d)
+        self.assertEqual(['boot'], d['dep'])
+        self.assertEqual('migrate.Windows.raw', d['test_name'])
+
+
+    def test_shared_dicts_are_not_changed(self):
+        parser = cartesian_config.Parser()
+        parser.parse_string(CONFIG)
+        for d in parser.get_dicts():
+            d['image_name'] = 'changed'
+        for d in parser.get_dicts():
+            self.assertNotEqual('changed', d['image_name'])
+
+
+    def test_get_variants(self):
+        parser = cartesian_config.Parser()
+        parser.parse_string(CONFIG)
+        dicts = list(parser.get_dicts())
+        variants = list(parser.get_variants())
+        self.assertEqual([d['name'] for d in dicts],
+                         [variant.name for variant in variants])
+        self.assertEqual([d['shortname'] for d in dicts],
+                         [variant.shortname for variant in variants])
+        self.assertEqual(dicts, [variant.get_dict() for variant in variants])
+
+
+    def test_index(self):
+        parser = cartesian_config.Parser()
+        parser.parse_string(CONFIG)
+        dicts = list(parser.get_dicts())
+        index = parser.get_index()
+        self.assertEqual(len(dicts), len(index))
+        self.assertEqual(dicts[3], index[3].get_dict())
+        self.assertEqual(dicts[-1], index[-1].get_dict())
+        self.assertEqual(dicts[2],
+                         index.get_by_name(dicts[2]['name']).get_dict())
+        self.assertEqual(dicts[5], index.get_by_shortname(
+                dicts[5]['shortname']).get_dict())
+        self.assertRaises(KeyError, index.get_by_name, 'boot.Solaris')
+        self.assertRaises(KeyError, index.get_by_shortname, 'boot.Solaris')
+
+
+    def test_cache(self):
+        dicts = self.get_dicts(CONFIG)
+        self.assertEqual(dicts, self.get_dicts(CONFIG, self.cache_dir))
+        self.assertEqual(1, len(os.listdir(self.cache_dir)))
+        self.assertEqual(dicts, self.get_dicts(CONFIG, self.cache_dir))
+        self.assertEqual(1, len(os.listdir(self.cache_dir)))
+
+        config = CONFIG + "only Fedora\n"
+        dicts = self.get_dicts(config, self.cache_dir)
+        self.assertEqual(3, len(dicts))
+        self.assertEqual(dicts, self.get_dicts(config, self.cache_dir))
+        self.assertEqual(2, len(os.listdir(self.cache_dir)))
+
+
+    def test_cache_not_written_by_partial_generation(self):
+        parser = cartesian_config.Parser(cache_dir=self.cache_dir)
+        parser.parse_string(CONFIG)
+        dicts = parser.get_dicts()
+        dicts.next()
+        dicts.close()
+        self.assertEqual([], os.listdir(self.cache_dir))
+
+
+    def test_cache_dir_must_be_private(self):
+        self.assertTrue(cartesian_config.DEFAULT_CACHE_DIR.endswith(
+                '-%d' % os.getuid()))
+        cache_dir = os.path.join(self.cache_dir, 'cache')
+        self.get_dicts(CONFIG, cache_dir)
+        self.assertEqual(0700, os.stat(cache_dir).st_mode & 0777)
+        self.assertEqual(1, len(os.listdir(cache_dir)))
+
+        # a directory others can write to is not used
+        shutil.rmtree(cache_dir)
+        os.mkdir(cache_dir)
+        os.chmod(cache_dir, 0777)
+        self.assertEqual(self.get_dicts(CONFIG),
+                         self.get_dicts(CONFIG, cache_dir))
+        self.assertEqual([], os.listdir(cache_dir))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -106,6 +106,26 @@ class Host(object):
         raise NotImplementedError('Run not implemented!')
 
 
+    def run_many(self, commands, timeout=3600, ignore_status=False):
+        """
+        Run several independent commands on this host.  Hosts able to run
+        commands concurrently override this; by default they are run one
+        after the other.
+
+        @param commands: a list of command line strings
+        @param timeout: time limit in seconds for each command
+        @param ignore_status: do not raise an exception, no matter
+                what the exit codes of the commands are.
+
+        @return a list of utils.CmdResult objects, in the order of commands
+
+        @raises AutotestHostRunError: the exit code of a command execution
+                was not 0 and ignore_status was not enabled
+        """
+        return [self.run(command, timeout=timeout, ignore_status=ignore_status)
+                for command in commands]
+
+
     def run_output(self, command, *args, **dargs):
         return self.run(command, *args, **dargs).stdout.rstrip()
 
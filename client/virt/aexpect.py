@@ -5,7 +5,7 @@ A class and functions used for running and controlling child processes.
 @copyright: 2008-2009 Red Hat Inc.
 """
 
-import os, sys, pty, select, termios, fcntl
+import os, sys, pty, select, termios, fcntl, signal, errno, collections
 
 
 # The following helper functions are shared by the server and the client.
@@ -55,10 +55,103 @@ def _get_reader_filename(base_dir, id, reader):
 
 # The following is the server part of the module.
 
+def _set_nonblocking(fd):
+    flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+    fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+
+class _ReaderBuffer(object):
+    """
+    Output of the child process waiting to be written to a reader pipe, kept
+    as a queue of chunks so that writes never copy more than one chunk.
+
+    A buffer without max_size keeps all the data.  Otherwise, unless the
+    buffer applies backpressure, the oldest data is dropped to keep at most
+    max_size bytes, and the reader gets a note of how much was dropped in
+    its place.  With backpressure the buffer grows past max_size, and the
+    server stops reading from the child process while it is full.
+    """
+    def __init__(self, fd, max_size, backpressure):
+        """
+        @param fd: The non-blocking file descriptor of the reader pipe.
+        @param max_size: The number of buffered bytes above which the buffer
+                is full, or 0 for no limit.
+        @param backpressure: Whether to keep the data of a full buffer.
+        """
+        self.fd = fd
+        self.max_size = max_size
+        self.backpressure = backpressure
+        self.chunks = collections.deque()
+        self.size = 0
+        self.dropped = 0
+
+
+    def is_full(self):
+        return (self.backpressure and self.max_size > 0 and
+                self.size >= self.max_size)
+
+
+    def append(self, data):
+        if not data:
+            return
+        self.chunks.append(data)
+        self.size += len(data)
+        if self.backpressure or not self.max_size:
+            return
+        while self.size > self.max_size:
+            excess = self.size - self.max_size
+            chunk = self.chunks[0]
+            if len(chunk) > excess:
+                self.chunks[0] = chunk[excess:]
+                self.size -= excess
+                self.dropped += excess
+            else:
+                self.chunks.popleft()
+                self.size -= len(chunk)
+                self.dropped += len(chunk)
+
+
+    def flush(self):
+        """
+        Write as much of the buffered data as the pipe takes without blocking.
+
+        @return: True if the buffer is empty.
+        """
+        if self.dropped:
+            # The note is shorter than PIPE_BUF, so it is written entirely
+            # or not at all
+            note = "\n[aexpect: %d bytes of output dropped]\n" % self.dropped
+            try:
+                os.write(self.fd, note)
+            except OSError, e:
+                if e.errno == errno.EAGAIN:
+                    return False
+                raise
+            self.dropped = 0
+        while self.chunks:
+            chunk = self.chunks[0]
+            try:
+                bytes_written = os.write(self.fd, chunk)
+            except OSError, e:
+                if e.errno == errno.EAGAIN:
+                    return False
+                raise
+            self.size -= bytes_written
+            if bytes_written < len(chunk):
+                self.chunks[0] = chunk[bytes_written:]
+                return False
+            self.chunks.popleft()
+        return True
+
+
 if __name__ == "__main__":
     id = sys.stdin.readline().strip()
     echo = sys.stdin.readline().strip() == "True"
     readers = sys.stdin.readline().strip().split(",")
+    reader_buffer_sizes = [int(size or 0) for size in
+                           sys.stdin.readline().strip().split(",")]
+    reader_backpressure = [backpressure == "True" for backpressure in
+                           sys.stdin.readline().strip().split(",")]
     command = sys.stdin.readline().strip() + " && echo %s > /dev/null" % id
 
     # Define filenames to be used for communication
@@ -77,6 +170,21 @@ if __name__ == "__main__":
     # Set $TERM = dumb
     os.putenv("TERM", "dumb")
 
+    # SIGCHLD writes to this pipe to wake up the event loop below, so the
+    # server notices the child's termination without polling for it
+    sigchld_r, sigchld_w = os.pipe()
+    for fd in sigchld_r, sigchld_w:
+        _set_nonblocking(fd)
+        fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.FD_CLOEXEC)
+
+    def sigchld_handler(signum, frame):
+        try:
+            os.write(sigchld_w, "x")
+        except OSError:
+            pass
+
+    signal.signal(signal.SIGCHLD, sigchld_handler)
+
     (shell_pid, shell_fd) = pty.fork()
     if shell_pid == 0:
         # Child process: run the command in a subshell
@@ -118,45 +226,110 @@ if __name__ == "__main__":
         sys.stdout.flush()
 
         # Initialize buffers
-        buffers = ["" for reader in readers]
+        for fd in reader_fds:
+            _set_nonblocking(fd)
+        buffers = [_ReaderBuffer(fd, size, backpressure)
+                   for fd, size, backpressure in zip(reader_fds,
+                                                     reader_buffer_sizes,
+                                                     reader_backpressure)]
+        buffers_by_fd = dict((buffer.fd, buffer) for buffer in buffers)
+
+        epoll = select.epoll()
+        epoll.register(shell_fd, select.EPOLLIN)
+        epoll.register(inpipe_fd, select.EPOLLIN)
+        epoll.register(sigchld_r, select.EPOLLIN)
+        reading_shell = True
+        shell_eof = False
+
+        def handle_output(data):
+            # Remove carriage returns from the data -- they often cause
+            # trouble and are normally not needed
+            data = data.replace("\r", "")
+            output_file.write(data)
+            output_file.flush()
+            for buffer in buffers:
+                was_empty = not buffer.chunks
+                buffer.append(data)
+                if not buffer.flush() and was_empty:
+                    epoll.register(buffer.fd, select.EPOLLOUT)
 
         # Read from child and write to files/pipes
         while True:
             check_termination = False
-            # Make a list of reader pipes whose buffers are not empty
-            fds = [fd for (i, fd) in enumerate(reader_fds) if buffers[i]]
             # Wait until there's something to do
-            r, w, x = select.select([shell_fd, inpipe_fd], fds, [], 0.5)
-            # If a reader pipe is ready for writing --
-            for (i, fd) in enumerate(reader_fds):
-                if fd in w:
-                    bytes_written = os.write(fd, buffers[i])
-                    buffers[i] = buffers[i][bytes_written:]
-            # If there's data to read from the child process --
-            if shell_fd in r:
-                try:
-                    data = os.read(shell_fd, 16384)
-                except OSError:
-                    data = ""
-                if not data:
+            try:
+                events = epoll.poll()
+            except IOError, e:
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+            for fd, event in events:
+                # If the child process may have terminated --
+                if fd == sigchld_r:
+                    try:
+                        while os.read(sigchld_r, 1024):
+                            pass
+                    except OSError:
+                        pass
                     check_termination = True
-                # Remove carriage returns from the data -- they often cause
-                # trouble and are normally not needed
-                data = data.replace("\r", "")
-                output_file.write(data)
-                output_file.flush()
-                for i in range(len(readers)):
-                    buffers[i] += data
-            # If os.read() raised an exception or there was nothing to read --
-            if check_termination or shell_fd not in r:
+                # If there's data to read from the child process --
+                elif fd == shell_fd:
+                    try:
+                        data = os.read(shell_fd, 16384)
+                    except OSError:
+                        data = ""
+                    if not data:
+                        # Wait for SIGCHLD instead of reporting the same
+                        # condition over and over
+                        epoll.unregister(shell_fd)
+                        reading_shell = False
+                        shell_eof = True
+                        check_termination = True
+                        continue
+                    handle_output(data)
+                # If there's data to read from the client --
+                elif fd == inpipe_fd:
+                    data = os.read(inpipe_fd, 1024)
+                    os.write(shell_fd, data)
+                # If a reader pipe is ready for writing --
+                elif fd in buffers_by_fd:
+                    if buffers_by_fd[fd].flush():
+                        epoll.unregister(fd)
+            # Stop reading from the child process while a reader applying
+            # backpressure is behind
+            any_full = [buffer for buffer in buffers if buffer.is_full()]
+            if reading_shell and any_full:
+                epoll.unregister(shell_fd)
+                reading_shell = False
+            elif not reading_shell and not shell_eof and not any_full:
+                epoll.register(shell_fd, select.EPOLLIN)
+                reading_shell = True
+            # If the child process terminated or closed the terminal --
+            if check_termination:
                 pid, status = os.waitpid(shell_pid, os.WNOHANG)
                 if pid:
                     status = os.WEXITSTATUS(status)
                     break
-            # If there's data to read from the client --
-            if inpipe_fd in r:
-                data = os.read(inpipe_fd, 1024)
-                os.write(shell_fd, data)
+
+        # Keep the output the child process left in the terminal, within
+        # a limit (processes it started may still write)
+        if not shell_eof:
+            _set_nonblocking(shell_fd)
+            bytes_left = 1024 * 1024
+            while bytes_left > 0:
+                try:
+                    data = os.read(shell_fd, 16384)
+                except OSError:
+                    break
+                if not data:
+                    break
+                handle_output(data)
+                bytes_left -= len(data)
+
+        # Hand the readers what their pipes still take
+        for buffer in buffers:
+            buffer.flush()
+        epoll.close()
 
         # Write the exit status to a file
         file = open(status_filename, "w")
@@ -192,6 +365,63 @@ try:
 except ImportError:
     import common
 
+
+# The size of the reads from the "expect" pipe
+_READ_CHUNK_SIZE = 65536
+
+# Compiled regular expressions, by pattern
+_regex_cache = {}
+_REGEX_CACHE_SIZE = 1000
+
+
+def _compile_patterns(patterns):
+    """
+    Return (index, compiled regular expression) pairs for a list of patterns,
+    skipping None and empty strings.  Patterns are only compiled once.
+    """
+    regexes = []
+    for i, pattern in enumerate(patterns):
+        if not pattern:
+            continue
+        regex = _regex_cache.get(pattern)
+        if regex is None:
+            if len(_regex_cache) >= _REGEX_CACHE_SIZE:
+                _regex_cache.clear()
+            regex = _regex_cache[pattern] = re.compile(pattern)
+        regexes.append((i, regex))
+    return regexes
+
+
+def _get_last_word(str):
+    """
+    Return the last whitespace separated word of str, only looking at the end
+    of str.
+    """
+    end = len(str)
+    while end and str[end - 1].isspace():
+        end -= 1
+    start = end
+    while start and not str[start - 1].isspace():
+        start -= 1
+    return str[start:end]
+
+
+def _get_last_nonempty_line(str):
+    """
+    Return the last line of str that isn't only made of whitespace, only
+    looking at the end of str.
+    """
+    end = len(str)
+    while end and str[end - 1].isspace():
+        end -= 1
+    if not end:
+        return ""
+    start = max(str.rfind("\n", 0, end), str.rfind("\r", 0, end)) + 1
+    line_ends = [i for i in (str.find("\n", end), str.find("\r", end))
+                 if i != -1]
+    return str[start:min(line_ends or [len(str)])]
+
+
 class ExpectError(Exception):
     def __init__(self, patterns, output):
         Exception.__init__(self, patterns, output)
@@ -371,6 +601,19 @@ class Spawn:
     resumes _tail() if needed.
     """
 
+    # The number of bytes of output the server buffers for a reader on top
+    # of what its pipe holds, by reader name; the readers not listed get all
+    # the output they have not read yet.  A reader further behind loses the
+    # oldest output and reads a note of how much it lost instead
+    # (get_output() still has all of it), unless it is listed in
+    # backpressure_readers: then the server stops reading from the child
+    # process until the reader catches up.  The "tail" reader is never read
+    # by a Tail without output_func or termination_func, so it drops output;
+    # the "expect" reader keeps it all, so a session nobody reads from is
+    # stopped instead of growing the server (see ConsoleSession).
+    reader_buffer_sizes = {"tail": 1024 * 1024, "expect": 1024 * 1024}
+    backpressure_readers = ["expect"]
+
     def __init__(self, command=None, id=None, auto_close=False, echo=False,
                  linesep="\n"):
         """
@@ -436,6 +679,12 @@ class Spawn:
             sub.stdin.write("%s\n" % self.id)
             sub.stdin.write("%s\n" % echo)
             sub.stdin.write("%s\n" % ",".join(self.readers))
+            sub.stdin.write("%s\n" % ",".join(
+                    str(self.reader_buffer_sizes.get(reader, 0))
+                    for reader in self.readers))
+            sub.stdin.write("%s\n" % ",".join(
+                    str(reader in self.backpressure_readers)
+                    for reader in self.readers))
             sub.stdin.write("%s\n" % command)
             # Wait for the server to complete its initialization
             while not "Server %s ready" % self.id in sub.stdout.readline():
@@ -857,8 +1106,18 @@ class Expect(Tail):
     services.
 
     It also provides all of Tail's functionality.
+
+    bytes_read counts the bytes read from the child process by the expect
+    functions and match_time the seconds they spent matching the output
+    against patterns, to spot sessions that are slow to handle.
     """
 
+    # The number of characters read before the last read that
+    # read_until_output_matches() searches again for matches, so only
+    # matches spanning at most that many earlier characters are found when
+    # the output isn't filtered
+    match_overlap = 4096
+
     def __init__(self, command=None, id=None, auto_close=True, echo=False,
                  linesep="\n", termination_func=None, termination_params=(),
                  output_func=None, output_params=(), output_prefix=""):
@@ -891,6 +1150,9 @@ class Expect(Tail):
         # Add a reader
         self._add_reader("expect")
 
+        self.bytes_read = 0
+        self.match_time = 0.0
+
         # Init the superclass
         Tail.__init__(self, command, id, auto_close, echo, linesep,
                       termination_func, termination_params,
@@ -911,22 +1173,24 @@ class Expect(Tail):
         if timeout is None:
             timeout = 0.1
         fd = self._get_fd("expect")
-        data = ""
+        data = []
         while True:
             try:
                 r, w, x = select.select([fd], [], [], timeout)
             except Exception:
-                return data
+                break
             if fd in r:
-                new_data = os.read(fd, 1024)
+                new_data = os.read(fd, _READ_CHUNK_SIZE)
                 if not new_data:
-                    return data
-                data += new_data
+                    break
+                self.bytes_read += len(new_data)
+                data.append(new_data)
             else:
-                return data
+                break
+        return "".join(data)
 
 
-    def match_patterns(self, str, patterns):
+    def match_patterns(self, str, patterns, pos=0):
         """
         Match str against a list of patterns.
 
@@ -935,28 +1199,30 @@ class Expect(Tail):
         If no match is found, return None.
 
         @param patterns: List of strings (regular expression patterns).
+        @param pos: The index in str where the search starts ('^' still only
+                matches at the beginning of str and after newlines).
         """
-        for i in range(len(patterns)):
-            if not patterns[i]:
-                continue
-            if re.search(patterns[i], str):
+        for i, regex in _compile_patterns(patterns):
+            if regex.search(str, pos):
                 return i
 
 
-    def read_until_output_matches(self, patterns, filter=lambda x: x,
+    def read_until_output_matches(self, patterns, filter=None,
                                   timeout=60, internal_timeout=None,
                                   print_func=None):
         """
         Read using read_nonblocking until a match is found using match_patterns,
         or until timeout expires. Before attempting to search for a match, the
-        data is filtered using the filter function provided.
+        data is filtered using the filter function provided.  Without a
+        filter, only the new data and the match_overlap characters before it
+        are searched after every read.
 
         @brief: Read from child using read_nonblocking until a pattern
                 matches.
         @param patterns: List of strings (regular expression patterns)
         @param filter: Function to apply to the data read from the child before
                 attempting to match it against the patterns (should take and
-                return a string)
+                return a string), or None to match the data as is
         @param timeout: The duration (in seconds) to wait until a match is
                 found
         @param internal_timeout: The timeout to pass to read_nonblocking
@@ -988,8 +1254,14 @@ class Expect(Tail):
                 for line in data.splitlines():
                     print_func(line)
             # Look for patterns
+            pos = max(0, len(o) - self.match_overlap)
             o += data
-            match = self.match_patterns(filter(o), patterns)
+            start_time = time.time()
+            if filter is None:
+                match = self.match_patterns(o, patterns, pos)
+            else:
+                match = self.match_patterns(filter(o), patterns)
+            self.match_time += time.time() - start_time
             if match is not None:
                 return match, o
 
@@ -1019,13 +1291,7 @@ class Expect(Tail):
                 terminates while waiting for output
         @raise ExpectError: Raised if an unknown error occurs
         """
-        def get_last_word(str):
-            if str:
-                return str.split()[-1]
-            else:
-                return ""
-
-        return self.read_until_output_matches(patterns, get_last_word,
+        return self.read_until_output_matches(patterns, _get_last_word,
                                               timeout, internal_timeout,
                                               print_func)
 
@@ -1053,14 +1319,8 @@ class Expect(Tail):
                 terminates while waiting for output
         @raise ExpectError: Raised if an unknown error occurs
         """
-        def get_last_nonempty_line(str):
-            nonempty_lines = [l for l in str.splitlines() if l.strip()]
-            if nonempty_lines:
-                return nonempty_lines[-1]
-            else:
-                return ""
-
-        return self.read_until_output_matches(patterns, get_last_nonempty_line,
+        return self.read_until_output_matches(patterns,
+                                              _get_last_nonempty_line,
                                               timeout, internal_timeout,
                                               print_func)
 
@@ -1352,3 +1612,13 @@ class ShellSession(Expect):
         Alias for cmd_status() for backward compatibility.
         """
         return self.cmd_status(cmd, timeout, internal_timeout, print_func)
+
+
+class ConsoleSession(ShellSession):
+    """
+    A ShellSession on a console whose output is logged by output_func as it
+    is produced, but only read through the "expect" reader now and then,
+    like the serial console of a VM.  The "expect" reader drops the oldest
+    output it is behind on, rather than stopping the console and its log.
+    """
+    backpressure_readers = []
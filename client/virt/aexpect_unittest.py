@@ -0,0 +1,138 @@
+#!/usr/bin/python
+
+import unittest, time, re
+import common
+from autotest_lib.client.virt import aexpect
+
+
+class SmallBufferExpect(aexpect.Expect):
+    reader_buffer_sizes = {"tail": 4096, "expect": 4096}
+    backpressure_readers = []
+
+
+class SmallTailBufferExpect(aexpect.Expect):
+    reader_buffer_sizes = {"tail": 4096}
+
+
+class BackpressureExpect(SmallTailBufferExpect):
+    backpressure_readers = ["tail"]
+
+
+class aexpect_test(unittest.TestCase):
+    def test_get_last_word(self):
+        self.assertEqual("", aexpect._get_last_word(""))
+        self.assertEqual("", aexpect._get_last_word(" \n\t"))
+        self.assertEqual("login:", aexpect._get_last_word("foo\nlogin: \r\n"))
+        self.assertEqual("~]$", aexpect._get_last_word("ls\n[root@vm ~]$"))
+
+
+    def test_get_last_nonempty_line(self):
+        self.assertEqual("", aexpect._get_last_nonempty_line(""))
+        self.assertEqual("", aexpect._get_last_nonempty_line("\n \n\t\r\n"))
+        self.assertEqual("[root@vm ~]# ", aexpect._get_last_nonempty_line(
+                "ls\r\nfoo bar\r\n[root@vm ~]# "))
+        self.assertEqual("foo bar ", aexpect._get_last_nonempty_line(
+                "ls\nfoo bar \n  \n"))
+
+
+    def test_read_until_output_matches(self):
+        session = aexpect.Expect("seq 1 20000; sleep 0.5; echo 20 records out")
+        try:
+            match, output = session.read_until_output_matches(
+                    ["^nomatch", r"(\d+) records out$", "never"], timeout=30)
+        finally:
+            session.close()
+        self.assertEqual(1, match)
+        self.assertTrue(output.startswith("1\n2\n3\n"))
+        self.assertTrue(output.rstrip().endswith("20000\n20 records out"))
+        self.assertEqual(len(output), session.bytes_read)
+        self.assertTrue(session.match_time > 0)
+
+
+    def test_read_until_last_line_matches(self):
+        session = aexpect.Expect("echo 'login: '; sleep 0.5; echo; echo ok")
+        try:
+            match, output = session.read_until_last_line_matches(
+                    ["^ok$", r"login:\s*$"], timeout=30)
+        finally:
+            session.close()
+        self.assertEqual(1, match)
+        self.assertEqual("login:", output.strip())
+
+
+    def test_expect_reader_keeps_output(self):
+        # only the unread "tail" reader has a limit
+        session = SmallTailBufferExpect("seq 1 100000; sleep 1; echo done")
+        try:
+            time.sleep(0.5)
+            match, output = session.read_until_output_matches(["done"],
+                                                              timeout=30)
+        finally:
+            session.close()
+        self.assertTrue(output.startswith("1\n2\n3\n"))
+        self.assertTrue(output.endswith("99999\n100000\ndone\n"))
+        self.assertTrue("dropped" not in output)
+
+
+    def test_reader_buffer_drops_old_output(self):
+        session = SmallBufferExpect("seq 1 100000; sleep 1; echo done")
+        try:
+            time.sleep(0.5)
+            match, output = session.read_until_output_matches(["done"],
+                                                              timeout=30)
+            full_output = session.get_output()
+        finally:
+            session.close()
+        self.assertTrue(output.endswith("99999\n100000\ndone\n"))
+        # the reader pipe holds 64 KB on top of the buffer
+        self.assertTrue(len(output) < 100000)
+        # the reader is told about the output it lost
+        self.assertTrue(re.search(r"\[aexpect: \d+ bytes of output dropped\]",
+                                  output))
+        self.assertTrue(full_output.startswith("1\n2\n3\n"))
+        self.assertTrue(full_output.endswith("100000\ndone\n"))
+
+
+    def test_reader_backpressure(self):
+        # nothing reads the "tail" reader, so the child process is stopped
+        session = BackpressureExpect("seq 1 1000000")
+        try:
+            time.sleep(1)
+            self.assertTrue(session.is_alive())
+            self.assertTrue(len(session.get_output()) < 1000000)
+        finally:
+            session.close()
+
+
+
+    def test_unread_expect_session_is_bounded(self):
+        session = aexpect.Expect("seq 1 100000000")
+        try:
+            time.sleep(1)
+            self.assertTrue(session.is_alive())
+            # the output stops at the 1 MB the "expect" reader buffers, plus
+            # what the pipes hold
+            self.assertTrue(len(session.get_output()) < 2 * 1024 * 1024)
+            stat_file = open("/proc/%d/stat" % session.get_pid())
+            server_pid = int(stat_file.read().split()[3])
+            stat_file.close()
+            status_file = open("/proc/%d/status" % server_pid)
+            rss = [int(line.split()[1]) for line in status_file
+                   if line.startswith("VmRSS:")][0]
+            status_file.close()
+            self.assertTrue(rss < 32 * 1024)
+        finally:
+            session.close()
+        # everything is still there once read
+        session = aexpect.Expect("seq 1 300000; echo done")
+        try:
+            match, output = session.read_until_output_matches(["done"],
+                                                              timeout=30)
+        finally:
+            session.close()
+        self.assertTrue(output.startswith("1\n2\n3\n"))
+        self.assertTrue(output.endswith("300000\ndone\n"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1151,7 +1151,7 @@ class VM(virt_vm.BaseVM):
 
             # Establish a session with the serial console -- requires a version
             # of netcat that supports -U
-            self.serial_console = aexpect.ShellSession(
+            self.serial_console = aexpect.ConsoleSession(
                 "nc -U %s" % self.get_serial_console_filename(),
                 auto_close=False,
                 output_func=virt_utils.log_line,
@@ -1090,13 +1090,13 @@ class VM(virt_vm.BaseVM):
 
             # Establish a session with the serial console
             if self.only_pty == True:
-                self.serial_console = aexpect.ShellSession(
+                self.serial_console = aexpect.ConsoleSession(
                     "virsh console %s" % self.name,
                     auto_close=False,
                     output_func=virt_utils.log_line,
                     output_params=("serial-%s.log" % name,))
             else:
-                self.serial_console = aexpect.ShellSession(
+                self.serial_console = aexpect.ConsoleSession(
                     "tail -f %s" % self.get_serial_console_filename(),
                     auto_close=False,
                     output_func=virt_utils.log_line,
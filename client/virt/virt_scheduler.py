@@ -1,4 +1,4 @@
-import os, select
+import os, select, tempfile, cPickle
 import virt_utils, virt_vm, aexpect
 
 
@@ -6,6 +6,17 @@ class scheduler:
     """
     A scheduler that manages several parallel test execution pipelines on a
     single host.
+
+    Tests declare the resources they use with the following parameters:
+        used_cpus -- the number of CPUs used by the test (default 1)
+        used_mem -- the amount of memory in MB used by the test (default 128)
+    and the image files of their 'images' are used exclusively, unless all
+    the tests using an image run with image_snapshot = yes.
+
+    A worker keeps the resources of the last test it ran, as the VMs of the
+    test may be reused by its next one, until the scheduler tells it to clean
+    up.  Each worker has an env file of its own; MAC addresses are allocated
+    from the shared pool, which is locked and keyed by VM instance.
     """
 
     def __init__(self, tests, num_workers, total_cpus, total_mem, bindir):
@@ -32,8 +43,11 @@ class scheduler:
         self.w2s_w = [os.fdopen(w, "w", 0) for r, w in self.w2s]
         # "Personal" worker dicts contain modifications that are applied
         # specifically to each worker.  For example, each worker must use a
-        # different environment file and a different MAC address pool.
+        # different environment file.
         self.worker_dicts = [{"env": "env%d" % i} for i in range(num_workers)]
+        # The scheduler process leaves the test statuses here for the
+        # process that forked it, see get_results()
+        self.results_file = tempfile.TemporaryFile()
 
 
     def worker(self, index, run_test_func):
@@ -43,8 +57,8 @@ class scheduler:
         Waits for commands from the scheduler and processes them.
 
         @param index: The index of this worker (in the range 0..num_workers-1).
-        @param run_test_func: A function to be called to run a test
-                (e.g. job.run_test).
+        @param run_test_func: A function to be called with the dict of a test
+                to run it, returning the status of the test.
         """
         r = self.s2w_r[index]
         w = self.w2s_w[index]
@@ -63,10 +77,9 @@ class scheduler:
                 test_index = int(cmd[1])
                 test = self.tests[test_index].copy()
                 test.update(self_dict)
-                test_iterations = int(test.get("iterations", 1))
-                status = run_test_func("kvm", params=test,
-                                       tag=test.get("shortname"),
-                                       iterations=test_iterations)
+                if cmd[2] == "yes":
+                    test["dependency_failed"] = "yes"
+                status = run_test_func(test)
                 w.write("done %s %s\n" % (test_index, status))
                 w.write("ready\n")
 
@@ -75,7 +88,7 @@ class scheduler:
                 env_filename = os.path.join(self.bindir, self_dict["env"])
                 env = virt_utils.Env(env_filename)
                 for obj in env.values():
-                    if isinstance(obj, virt_vm.VM):
+                    if virt_utils.is_vm(obj):
                         obj.destroy()
                     elif isinstance(obj, aexpect.Spawn):
                         obj.close()
@@ -88,6 +101,48 @@ class scheduler:
                 break
 
 
+    def get_test_resources(self, test):
+        """
+        Get the resources a test declares to use.
+
+        @param test: A test dictionary.
+
+        @return: A (used CPUs, used memory, used images) tuple, where used
+                images maps image filenames to True if the image is only
+                used in snapshot mode.
+        """
+        params = virt_utils.Params(test)
+        images = {}
+        for image_name in params.objects("images"):
+            image_params = params.object_params(image_name)
+            filename = virt_vm.get_image_filename(image_params, self.bindir)
+            snapshot = image_params.get("image_snapshot") == "yes"
+            images[filename] = images.get(filename, True) and snapshot
+        return (int(test.get("used_cpus", 1)), int(test.get("used_mem", 128)),
+                images)
+
+
+    def _fits(self, resources, used_resources, workers):
+        """
+        Check whether a test fits into what the given workers leave free.
+        A test always fits if the workers don't use any CPUs or memory.
+        """
+        test_cpus, test_mem, test_images = resources
+        uc = sum(used_resources[i][0] for i in workers)
+        if uc and uc + test_cpus > self.total_cpus:
+            return False
+        um = sum(used_resources[i][1] for i in workers)
+        if um and um + test_mem > self.total_mem:
+            return False
+        for i in workers:
+            used_images = used_resources[i][2]
+            for filename, snapshot in test_images.iteritems():
+                if filename in used_images and not (snapshot and
+                                                    used_images[filename]):
+                    return False
+        return True
+
+
     def scheduler(self):
         """
         The scheduler function.
@@ -97,10 +152,20 @@ class scheduler:
         """
         idle_workers = []
         closing_workers = []
-        test_status = ["waiting"] * len(self.tests)
-        test_worker = [None] * len(self.tests)
-        used_cpus = [0] * self.num_workers
-        used_mem = [0] * self.num_workers
+        no_resources = (0, 0, {})
+        used_resources = [no_resources] * self.num_workers
+
+        dependencies = virt_utils.DependencyGraph()
+        test_nodes = [None] * len(self.tests)
+        test_resources = [None] * len(self.tests)
+        test_status = [None] * len(self.tests)
+        waiting_tests = []
+        for i, test in enumerate(self.tests):
+            if test.get("skip") == "yes":
+                continue
+            test_nodes[i] = dependencies.add(test["name"], test.get("dep", []))
+            test_resources[i] = self.get_test_resources(test)
+            waiting_tests.append(i)
 
         while True:
             # Wait for a message from a worker
@@ -122,101 +187,73 @@ class scheduler:
                 # A worker completed a test
                 elif msg[0] == "done":
                     test_index = int(msg[1])
-                    test = self.tests[test_index]
-                    status = int(eval(msg[2]))
-                    test_status[test_index] = ("fail", "pass")[status]
-                    # If the test failed, mark all dependent tests as "failed" too
-                    if not status:
-                        for i, other_test in enumerate(self.tests):
-                            for dep in other_test.get("dep", []):
-                                if dep in test["name"]:
-                                    test_status[i] = "fail"
+                    test_status[test_index] = msg[2]
+                    dependencies.set_status(test_nodes[test_index], msg[2])
 
                 # A worker is done shutting down its VMs and other processes
                 elif msg[0] == "cleanup_done":
-                    used_cpus[worker_index] = 0
-                    used_mem[worker_index] = 0
+                    used_resources[worker_index] = no_resources
                     closing_workers.remove(worker_index)
 
             if not someone_is_ready:
                 continue
 
             for worker in idle_workers[:]:
-                # Find a test for this worker
+                other_workers = [i for i in range(self.num_workers)
+                                 if i != worker]
+                running_workers = [i for i in other_workers
+                                   if i not in closing_workers]
+                worker_images = used_resources[worker][2]
+                # Find a test for this worker, preferably one using the
+                # images of its last test, whose VMs it may reuse
                 test_found = False
-                for i, test in enumerate(self.tests):
-                    # We only want "waiting" tests
-                    if test_status[i] != "waiting":
-                        continue
-                    # Make sure the test isn't assigned to another worker
-                    if test_worker[i] is not None and test_worker[i] != worker:
-                        continue
-                    # Make sure the test's dependencies are satisfied
-                    dependencies_satisfied = True
-                    for dep in test["dep"]:
-                        dependencies = [j for j, t in enumerate(self.tests)
-                                        if dep in t["name"]]
-                        bad_status_deps = [j for j in dependencies
-                                           if test_status[j] != "pass"]
-                        if bad_status_deps:
-                            dependencies_satisfied = False
-                            break
-                    if not dependencies_satisfied:
+                chosen_test = None
+                for i in waiting_tests:
+                    node = test_nodes[i]
+                    # Make sure the test's dependencies finished
+                    if not dependencies.is_ready(node):
                         continue
-                    # Make sure we have enough resources to run the test
-                    test_used_cpus = int(test.get("used_cpus", 1))
-                    test_used_mem = int(test.get("used_mem", 128))
-                    # First make sure the other workers aren't using too many
-                    # CPUs (not including the workers currently shutting down)
-                    uc = (sum(used_cpus) - used_cpus[worker] -
-                          sum(used_cpus[i] for i in closing_workers))
-                    if uc and uc + test_used_cpus > self.total_cpus:
+                    # Tests whose dependencies failed don't start any VMs
+                    if not dependencies.is_satisfied(node):
+                        chosen_test = i
+                        break
+                    resources = test_resources[i]
+                    # If the workers other than the ones currently shutting
+                    # down leave enough resources, there are, or will soon
+                    # be, enough resources to run the test
+                    if not self._fits(resources, used_resources,
+                                      running_workers):
                         continue
-                    # ... or too much memory
-                    um = (sum(used_mem) - used_mem[worker] -
-                          sum(used_mem[i] for i in closing_workers))
-                    if um and um + test_used_mem > self.total_mem:
-                        continue
-                    # If we reached this point it means there are, or will
-                    # soon be, enough resources to run the test
                     test_found = True
-                    # Now check if the test can be run right now, i.e. if the
-                    # other workers, including the ones currently shutting
-                    # down, aren't using too many CPUs
-                    uc = (sum(used_cpus) - used_cpus[worker])
-                    if uc and uc + test_used_cpus > self.total_cpus:
-                        continue
-                    # ... or too much memory
-                    um = (sum(used_mem) - used_mem[worker])
-                    if um and um + test_used_mem > self.total_mem:
+                    # Now check if the test can be run right now
+                    if not self._fits(resources, used_resources,
+                                      other_workers):
                         continue
-                    # Everything is OK -- run the test
-                    test_status[i] = "running"
-                    test_worker[i] = worker
+                    if chosen_test is None:
+                        chosen_test = i
+                    if not worker_images:
+                        break
+                    if [f for f in resources[2] if f in worker_images]:
+                        chosen_test = i
+                        break
+
+                if chosen_test is not None:
+                    node = test_nodes[chosen_test]
+                    waiting_tests.remove(chosen_test)
+                    test_status[chosen_test] = "running"
                     idle_workers.remove(worker)
-                    # Update used_cpus and used_mem
-                    used_cpus[worker] = test_used_cpus
-                    used_mem[worker] = test_used_mem
-                    # Assign all related tests to this worker
-                    for j, other_test in enumerate(self.tests):
-                        for other_dep in other_test["dep"]:
-                            # All tests that depend on this test
-                            if other_dep in test["name"]:
-                                test_worker[j] = worker
-                                break
-                            # ... and all tests that share a dependency
-                            # with this test
-                            for dep in test["dep"]:
-                                if dep in other_dep or other_dep in dep:
-                                    test_worker[j] = worker
-                                    break
+                    if dependencies.is_satisfied(node):
+                        used_resources[worker] = test_resources[chosen_test]
+                        dependency_failed = "no"
+                    else:
+                        dependency_failed = "yes"
                     # Tell the worker to run the test
-                    self.s2w_w[worker].write("run %s\n" % i)
-                    break
+                    self.s2w_w[worker].write("run %s %s\n" %
+                                             (chosen_test, dependency_failed))
 
                 # If there won't be any tests for this worker to run soon, tell
                 # the worker to free its used resources
-                if not test_found and (used_cpus[worker] or used_mem[worker]):
+                elif not test_found and used_resources[worker] != no_resources:
                     self.s2w_w[worker].write("cleanup\n")
                     idle_workers.remove(worker)
                     closing_workers.append(worker)
@@ -227,3 +264,18 @@ class scheduler:
                 for worker in idle_workers:
                     self.s2w_w[worker].write("terminate\n")
                 break
+
+        cPickle.dump(test_status, self.results_file)
+        self.results_file.flush()
+
+
+    def get_results(self):
+        """
+        Get the statuses of the tests once the scheduler function returned,
+        in any process forked after the scheduler was initialized.
+
+        @return: A list of the statuses of the tests, in the order of the
+                tests, with None for the skipped tests.
+        """
+        self.results_file.seek(0)
+        return cPickle.load(self.results_file)
@@ -0,0 +1,133 @@
+#!/usr/bin/python
+
+import unittest, threading, time, shutil, tempfile
+import common
+from autotest_lib.client.virt import virt_scheduler
+from autotest_lib.client.common_lib import cartesian_config
+
+
+CONFIG = """
+images = image1
+used_mem = 1024
+variants:
+    - install:
+    - boot: install
+        image_snapshot = yes
+    - reboot: install
+        image_snapshot = yes
+    - shutdown: install
+    - skipped:
+        skip = yes
+variants:
+    - Fedora:
+        image_name = fedora
+    - RHEL:
+        image_name = rhel
+    - Windows:
+        image_name = win
+        used_cpus = 3
+"""
+
+
+class scheduler_test(unittest.TestCase):
+    def setUp(self):
+        self.bindir = tempfile.mkdtemp(suffix='unittest')
+        self.lock = threading.Lock()
+        self.running = []
+        self.events = []
+
+
+    def tearDown(self):
+        shutil.rmtree(self.bindir, ignore_errors=True)
+
+
+    def run_test(self, params):
+        self.lock.acquire()
+        self.running.append(params)
+        self.events.append(("start", params["shortname"],
+                            [other["shortname"] for other in self.running]))
+        self.lock.release()
+        time.sleep(0.05)
+        self.lock.acquire()
+        self.running.remove(params)
+        self.events.append(("end", params["shortname"]))
+        self.lock.release()
+        if params.get("dependency_failed") == "yes":
+            return "TEST_NA"
+        if params["shortname"] == "RHEL.install":
+            return "FAIL"
+        return "GOOD"
+
+
+    def run_scheduler(self, config, num_workers, total_cpus, total_mem):
+        parser = cartesian_config.Parser()
+        parser.parse_string(config)
+        tests = list(parser.get_dicts())
+        s = virt_scheduler.scheduler(tests, num_workers, total_cpus,
+                                     total_mem, self.bindir)
+        threads = [threading.Thread(target=s.worker, args=(i, self.run_test))
+                   for i in range(num_workers)]
+        threads.append(threading.Thread(target=s.scheduler))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return dict((test["shortname"], status)
+                    for test, status in zip(tests, s.get_results()))
+
+
+    def test_scheduler(self):
+        results = self.run_scheduler(CONFIG, 8, 6, 8192)
+        self.assertEqual({"Fedora.install": "GOOD", "Fedora.boot": "GOOD",
+                          "Fedora.reboot": "GOOD", "Fedora.shutdown": "GOOD",
+                          "RHEL.install": "FAIL", "RHEL.boot": "TEST_NA",
+                          "RHEL.reboot": "TEST_NA", "RHEL.shutdown": "TEST_NA",
+                          "Windows.install": "GOOD", "Windows.boot": "GOOD",
+                          "Windows.reboot": "GOOD",
+                          "Windows.shutdown": "GOOD",
+                          "Fedora.skipped": None, "RHEL.skipped": None,
+                          "Windows.skipped": None}, results)
+
+        started = [event[1] for event in self.events if event[0] == "start"]
+        ended = [event[1] for event in self.events if event[0] == "end"]
+        concurrent = [event[2] for event in self.events if event[0] == "start"]
+        # tests only start after the tests they depend on
+        for guest in ["Fedora", "RHEL", "Windows"]:
+            install = ended.index("%s.install" % guest)
+            for test in ["boot", "reboot", "shutdown"]:
+                start = started.index("%s.%s" % (guest, test))
+                self.assertTrue(start > install)
+        # boot and reboot share their snapshot images, but no other test
+        # runs along the install or shutdown of the same guest (the RHEL
+        # tests whose dependencies failed don't use their images)
+        self.assertTrue([names for names in concurrent
+                         if "Fedora.boot" in names and
+                         "Fedora.reboot" in names])
+        for names in concurrent:
+            for guest in ["Fedora", "Windows"]:
+                for test in ["install", "shutdown"]:
+                    if "%s.%s" % (guest, test) in names:
+                        self.assertEqual(1, len([name for name in names
+                                                 if name.startswith(guest)]))
+            # Windows tests use 3 of the 6 CPUs, the others 1
+            cpus = sum((1, 3)[name.startswith("Windows")] for name in names
+                       if name == "RHEL.install" or
+                       not name.startswith("RHEL"))
+            self.assertTrue(cpus <= 6)
+        self.assertTrue(max(len(names) for names in concurrent) > 1)
+
+
+    def test_memory(self):
+        # each test uses 1024 MB, so only two run at a time, not counting the
+        # tests of RHEL, whose dependencies failed and which use nothing
+        self.run_scheduler(CONFIG, 4, 16, 2048)
+        self.assertEqual(12, len(self.events) / 2)
+        for event in self.events:
+            if event[0] == "start":
+                names = [name for name in event[2] if name == "RHEL.install"
+                         or not name.startswith("RHEL")]
+                self.assertTrue(len(names) <= 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
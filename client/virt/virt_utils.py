@@ -1191,66 +1191,216 @@ def get_hash_from_file(hash_path, dvd_basename):
             return line.split()[0]
 
 
-def run_tests(parser, job):
+class DependencyGraph(object):
+    """
+    The dependencies between the tests of a run.
+
+    A test depends on all the tests added before it whose names contain one
+    of the strings of its 'dep' list.  Every dependency string is matched
+    against the test names once, when it is first seen, instead of against
+    all the finished tests whenever a test is about to run.
+    """
+    def __init__(self):
+        self._deps = []
+        self._statuses = []
+        # test names, to match dependency strings seen later against them
+        self._names = []
+        # dependency string -> indices of the tests whose names contain it
+        self._matches = {}
+        # dependency string -> number of leading matches known to be finished
+        self._finished = {}
+        # dependency string -> index of the first matching test that failed
+        self._first_failure = {}
+
+
+    def add(self, name, deps):
+        """
+        Add a test after all the tests added so far.
+
+        @param name: The name of the test.
+        @param deps: The dependency strings of the test.
+
+        @return: The index of the test in the graph.
+        """
+        index = len(self._names)
+        self._names.append(name)
+        self._deps.append(tuple(deps))
+        self._statuses.append(None)
+        for dep, matches in self._matches.iteritems():
+            if dep in name:
+                matches.append(index)
+        for dep in deps:
+            if dep not in self._matches:
+                self._matches[dep] = [i for i, other_name
+                                      in enumerate(self._names)
+                                      if dep in other_name]
+                self._finished[dep] = 0
+                for i in self._matches[dep]:
+                    if self._is_failure(self._statuses[i]):
+                        self._first_failure[dep] = i
+                        break
+        return index
+
+
+    @staticmethod
+    def _is_failure(status):
+        # So the only really non-fatal state is WARN,
+        # All the others make it not safe to proceed with dependency
+        # execution
+        return status is not None and status not in ['GOOD', 'WARN']
+
+
+    def set_status(self, index, status):
+        """
+        Record the status a test finished with.
+
+        @param index: The index of the test, as returned by add().
+        @param status: The status of the test (e.g. 'GOOD').
+        """
+        self._statuses[index] = status
+        if not self._is_failure(status):
+            return
+        name = self._names[index]
+        for dep in self._matches:
+            if dep in name and index < self._first_failure.get(dep, index + 1):
+                self._first_failure[dep] = index
+
+
+    def get_status(self, index):
+        """
+        @return: The status of a test, None if it didn't finish yet.
+        """
+        return self._statuses[index]
+
+
+    def is_ready(self, index):
+        """
+        @return: True if all the tests a test depends on finished.
+        """
+        for dep in self._deps[index]:
+            matches = self._matches[dep]
+            finished = self._finished[dep]
+            while (finished < len(matches) and
+                   self._statuses[matches[finished]] is not None):
+                finished += 1
+            self._finished[dep] = finished
+            if finished < len(matches) and matches[finished] < index:
+                return False
+        return True
+
+
+    def is_satisfied(self, index):
+        """
+        @return: False if one of the tests a test depends on failed.
+        """
+        for dep in self._deps[index]:
+            if self._first_failure.get(dep, index) < index:
+                return False
+        return True
+
+
+def _run_test(job, params):
+    """
+    Run the test of a dict, profiled by the profilers it lists.
+
+    @param job: Autotest job object.
+    @param params: The dict of the test.
+
+    @return: The status of the test, as returned by job.run_test_detail().
+    """
+    test_iterations = int(params.get("iterations", 1))
+    test_tag = params.get("shortname")
+
+    if params.get("dependency_failed") == "yes":
+        # The test is forced to fail as TestNA during preprocessing
+        return job.run_test_detail(params.get("vm_type"), params=params,
+                                   tag=test_tag, iterations=test_iterations)
+
+    # Setting up profilers during test execution.
+    profilers = params.get("profilers", "").split()
+    for profiler in profilers:
+        job.profilers.add(profiler)
+    # We need only one execution, profiled, hence we're passing
+    # the profile_only parameter to job.run_test().
+    profile_only = bool(profilers) or None
+    status = job.run_test_detail(params.get("vm_type"), params=params,
+                                 tag=test_tag, iterations=test_iterations,
+                                 profile_only=profile_only)
+    for profiler in profilers:
+        job.profilers.delete(profiler)
+    return status
+
+
+def run_tests(parser, job, num_workers=1):
     """
     Runs the sequence of KVM tests based on the list of dictionaries
     generated by the configuration system, handling dependencies.
 
     @param parser: Config parser object.
     @param job: Autotest job object.
+    @param num_workers: The number of tests to run concurrently.  With more
+            than one worker, the tests are dispatched by a
+            virt_scheduler.scheduler within the CPUs and 3/4 of the memory
+            of the host, see virt_scheduler for the parameters the tests
+            declare their requirements with.
 
     @return: True, if all tests ran passed, False if any of them failed.
     """
-    for i, d in enumerate(parser.get_dicts()):
-        logging.info("Test %4d:  %s" % (i + 1, d["shortname"]))
+    # the variants are only generated once, their dicts when they are run
+    variants = list(parser.get_variants())
+    for i, variant in enumerate(variants):
+        logging.info("Test %4d:  %s" % (i + 1, variant.shortname))
 
-    status_dict = {}
+    if num_workers > 1:
+        return _run_tests_in_parallel(variants, job, num_workers)
+
+    dependencies = DependencyGraph()
     failed = False
 
-    for dict in parser.get_dicts():
+    for variant in variants:
+        dict = variant.get_dict()
         if dict.get("skip") == "yes":
             continue
-        dependencies_satisfied = True
-        for dep in dict.get("dep"):
-            for test_name in status_dict.keys():
-                if not dep in test_name:
-                    continue
-                # So the only really non-fatal state is WARN,
-                # All the others make it not safe to proceed with dependency
-                # execution
-                if status_dict[test_name] not in ['GOOD', 'WARN']:
-                    dependencies_satisfied = False
-                    break
-        test_iterations = int(dict.get("iterations", 1))
-        test_tag = dict.get("shortname")
-
-        if dependencies_satisfied:
-            # Setting up profilers during test execution.
-            profilers = dict.get("profilers", "").split()
-            for profiler in profilers:
-                job.profilers.add(profiler)
-            # We need only one execution, profiled, hence we're passing
-            # the profile_only parameter to job.run_test().
-            profile_only = bool(profilers) or None
-            current_status = job.run_test_detail(dict.get("vm_type"),
-                                                 params=dict,
-                                                 tag=test_tag,
-                                                 iterations=test_iterations,
-                                                 profile_only=profile_only)
-            for profiler in profilers:
-                job.profilers.delete(profiler)
-        else:
-            # We will force the test to fail as TestNA during preprocessing
+        index = dependencies.add(variant.name, variant.dep)
+        if not dependencies.is_satisfied(index):
             dict['dependency_failed'] = 'yes'
-            current_status = job.run_test_detail(dict.get("vm_type"),
-                                                 params=dict,
-                                                 tag=test_tag,
-                                                 iterations=test_iterations)
+        current_status = _run_test(job, dict)
 
         if not current_status:
             failed = True
-        status_dict[dict.get("name")] = current_status
+        dependencies.set_status(index, current_status)
+
+    return not failed
+
+
+def _run_tests_in_parallel(variants, job, num_workers):
+    """
+    Run tests concurrently in num_workers job.parallel() tasks.
 
+    @return: True, if all tests ran passed, False if any of them failed.
+    """
+    # virt_scheduler imports this module
+    import virt_scheduler
+
+    tests = [variant.get_dict() for variant in variants]
+    if not tests:
+        return True
+    # the workers' env files are in the test directory, like virt_test's
+    bindir = os.path.join(job.testdir, tests[0].get("vm_type"))
+    total_cpus = utils.count_cpus()
+    # memtotal() is in kB, tests declare their used_mem in MB
+    total_mem = utils.memtotal() / 1024 * 3 / 4
+
+    s = virt_scheduler.scheduler(tests, num_workers, total_cpus, total_mem,
+                                 bindir)
+    run_test_func = lambda params: _run_test(job, params)
+    job.parallel([s.scheduler],
+                 *[(s.worker, i, run_test_func) for i in range(num_workers)])
+
+    failed = False
+    for test, status in zip(tests, s.get_results()):
+        if test.get("skip") != "yes" and not status:
+            failed = True
     return not failed
 
 
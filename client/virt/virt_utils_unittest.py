@@ -84,6 +84,78 @@ git_repo_foo_commit = bc732ad8b2ed8be52160b893735417b43a1e91a8
         self.assertEqual(h.commit, 'bc732ad8b2ed8be52160b893735417b43a1e91a8')
 
 
+class FakeJob(object):
+    def __init__(self, statuses):
+        self.statuses = statuses
+        self.params = []
+
+
+    def run_test_detail(self, url, params, tag, iterations, **dargs):
+        self.params.append(params)
+        if params.get("dependency_failed") == "yes":
+            return "TEST_NA"
+        return self.statuses.get(params["shortname"], "GOOD")
+
+
+class TestDependencyGraph(unittest.TestCase):
+    def test_dependencies(self):
+        graph = virt_utils.DependencyGraph()
+        install = graph.add("install.Fedora", [])
+        boot = graph.add("boot.Fedora", ["install"])
+        migrate = graph.add("migrate.Fedora", ["boot", "install"])
+        # tests only depend on the tests before them
+        late_install = graph.add("install.RHEL", [])
+        self.assertTrue(graph.is_ready(install))
+        self.assertFalse(graph.is_ready(boot))
+        self.assertFalse(graph.is_ready(migrate))
+
+        graph.set_status(install, "GOOD")
+        self.assertTrue(graph.is_ready(boot))
+        self.assertTrue(graph.is_satisfied(boot))
+        self.assertFalse(graph.is_ready(migrate))
+
+        graph.set_status(late_install, "FAIL")
+        graph.set_status(boot, "WARN")
+        self.assertTrue(graph.is_ready(migrate))
+        self.assertTrue(graph.is_satisfied(migrate))
+        self.assertEqual("WARN", graph.get_status(boot))
+
+
+    def test_failed_dependencies(self):
+        graph = virt_utils.DependencyGraph()
+        install = graph.add("install.Fedora", [])
+        graph.set_status(install, "FAIL")
+        boot = graph.add("boot.Fedora", ["install"])
+        self.assertTrue(graph.is_ready(boot))
+        self.assertFalse(graph.is_satisfied(boot))
+        other = graph.add("other.Fedora", ["boot"])
+        graph.set_status(boot, "TEST_NA")
+        self.assertFalse(graph.is_satisfied(other))
+
+
+    def test_run_tests(self):
+        parser = cartesian_config.Parser()
+        parser.parse_string("variants:\n"
+                            "    - install:\n"
+                            "    - boot: install\n"
+                            "        iterations = 2\n"
+                            "    - skipped: install\n"
+                            "        skip = yes\n"
+                            "    - shutdown: boot\n")
+        job = FakeJob({"install": "FAIL"})
+        self.assertTrue(virt_utils.run_tests(parser, job))
+        self.assertEqual(["install", "boot", "shutdown"],
+                         [params["shortname"] for params in job.params])
+        self.assertEqual([None, "yes", "yes"],
+                         [params.get("dependency_failed")
+                          for params in job.params])
+        job = FakeJob({})
+        self.assertTrue(virt_utils.run_tests(parser, job))
+        self.assertEqual([None, None, None],
+                         [params.get("dependency_failed")
+                          for params in job.params])
+
+
 class FakeCmd(object):
     def __init__(self, cmd):
         self.fake_cmds = [
@@ -24,6 +24,9 @@ import urllib2
 class JSONRPCException(Exception):
     pass
 
+class BatchNotSupportedError(JSONRPCException):
+    pass
+
 class ServiceProxy(object):
     def __init__(self, serviceURL, serviceName=None, headers=None):
         self.__serviceURL = serviceURL
@@ -38,22 +41,74 @@ class ServiceProxy(object):
     def __call__(self, *args, **kwargs):
         # pull in simplejson imports lazily so that the library isn't required
         # unless you actually need to do encoding and decoding
-        from simplejson import decoder, encoder
+        from simplejson import encoder
 
         postdata = encoder.JSONEncoder().encode({"method": self.__serviceName,
                                                 'params': args + (kwargs,),
                                                 'id':'jsonrpc'})
-        request = urllib2.Request(self.__serviceURL, data=postdata,
-                                  headers=self.__headers)
-        respdata = urllib2.urlopen(request).read()
-        try:
-            resp = decoder.JSONDecoder().decode(respdata)
-        except ValueError:
-            raise JSONRPCException('Error decoding JSON reponse:\n' + respdata)
-        if resp['error'] is not None:
-            error_message = (resp['error']['name'] + ': ' +
-                             resp['error']['message'] + '\n' +
-                             resp['error']['traceback'])
-            raise JSONRPCException(error_message)
+        resp = _post(self.__serviceURL, postdata, self.__headers)
+        error = _get_error(resp)
+        if error:
+            raise error
         else:
             return resp['result']
+
+
+class BatchServiceProxy(object):
+    """
+    Calls several methods of a service in a single HTTP request.
+    """
+    def __init__(self, serviceURL, headers=None):
+        self.__serviceURL = serviceURL
+        self.__headers = headers or {}
+
+    def call(self, calls):
+        """
+        @param calls: A list of (method name, keyword args dict) tuples.
+        @returns A list holding, for each call, its result or the
+                JSONRPCException it raised.
+        @raises BatchNotSupportedError if the server can't handle batches.
+        """
+        from simplejson import encoder
+
+        requests = [{'method': name, 'params': (kwargs,), 'id': index}
+                    for index, (name, kwargs) in enumerate(calls)]
+        postdata = encoder.JSONEncoder().encode(requests)
+        try:
+            resps = _post(self.__serviceURL, postdata, self.__headers)
+        except urllib2.HTTPError, err:
+            # older servers fail on the list of requests
+            if err.code != 500:
+                raise
+            raise BatchNotSupportedError('Batch request failed: %s' % err)
+        if isinstance(resps, dict):
+            raise BatchNotSupportedError('Not a batch response: %r' % (resps,))
+        if not isinstance(resps, list) or len(resps) != len(calls):
+            raise JSONRPCException('Bad batch response: %r' % (resps,))
+        results = [None] * len(calls)
+        for resp in resps:
+            results[resp['id']] = _get_error(resp) or resp['result']
+        return results
+
+
+def _post(serviceURL, postdata, headers):
+    from simplejson import decoder
+
+    request = urllib2.Request(serviceURL, data=postdata, headers=headers)
+    respdata = urllib2.urlopen(request).read()
+    try:
+        return decoder.JSONDecoder().decode(respdata)
+    except ValueError:
+        raise JSONRPCException('Error decoding JSON reponse:\n' + respdata)
+
+
+def _get_error(resp):
+    """
+    @returns A JSONRPCException for the error in resp, or None.
+    """
+    if resp['error'] is None:
+        return None
+    error_message = (resp['error']['name'] + ': ' +
+                     resp['error']['message'] + '\n' +
+                     resp['error']['traceback'])
+    return JSONRPCException(error_message)
@@ -516,6 +516,31 @@ class ExtendedManager(dbmodels.Manager):
             getattr(base_object, related_list_name).append(related_object)
 
 
+    def populate_foreign_keys(self, base_objects, field_names):
+        """
+        Fetch the objects referenced by the given foreign key fields of all
+        the base_objects with one query per field, so that accessing those
+        fields afterwards doesn't query the DB once per base object.
+        @param base_objects - list of instances of this model
+        @param field_names - names of foreign key fields of this model
+        """
+        for field_name in field_names:
+            field = self.model._meta.get_field(field_name)
+            related_ids = set(getattr(base_object, field.attname)
+                              for base_object in base_objects)
+            related_ids.discard(None)
+            if not related_ids:
+                continue
+            related_objects_by_id = field.rel.to.objects.in_bulk(
+                    list(related_ids))
+            for base_object in base_objects:
+                related_id = getattr(base_object, field.attname)
+                if related_id in related_objects_by_id:
+                    # prime the cache Django's foreign key descriptor uses
+                    setattr(base_object, field.get_cache_name(),
+                            related_objects_by_id[related_id])
+
+
 class ModelWithInvalidQuerySet(dbmodels.query.QuerySet):
     """
     QuerySet that handles delete() properly for models with an "invalid" bit
@@ -542,6 +567,74 @@ class ValidObjectsManager(ModelWithInvalidManager):
         return queryset.filter(invalid=False)
 
 
+class ChangeCountedModel(object):
+    """
+    Mixin for models whose modifications are counted for the scheduler, see
+    models.ChangeCounter.  The models call record_change() when they are
+    saved or deleted, and use the ChangeCounted managers below so that bulk
+    updates and deletes are counted as well.
+    """
+    @classmethod
+    def record_change(cls):
+        """Record a modification of this table for the scheduler."""
+        # models imports this module
+        from autotest_lib.frontend.afe import models
+        models.ChangeCounter.increment(cls._meta.db_table)
+
+
+class ChangeCountedQuerySet(dbmodels.query.QuerySet):
+    """
+    QuerySet that reports bulk update() and delete() calls to the model's
+    record_change() classmethod, which plain save()-based change tracking
+    would miss.
+    """
+    def update(self, **kwargs):
+        rows = super(ChangeCountedQuerySet, self).update(**kwargs)
+        if rows:
+            self.model.record_change()
+        return rows
+
+
+    def delete(self):
+        super(ChangeCountedQuerySet, self).delete()
+        self.model.record_change()
+
+
+class ChangeCountedManager(ExtendedManager):
+    """
+    Manager for ChangeCountedModel models.
+    """
+    def get_query_set(self):
+        return ChangeCountedQuerySet(self.model)
+
+
+class ChangeCountedInvalidQuerySet(ModelWithInvalidQuerySet,
+                                   ChangeCountedQuerySet):
+    """
+    QuerySet for ChangeCountedModel models with an "invalid" bit.
+    delete() invalidates the objects through save(), which records the
+    changes.
+    """
+
+
+class ChangeCountedInvalidManager(ModelWithInvalidManager):
+    """
+    Manager for ChangeCountedModel models with an "invalid" bit.
+    """
+    def get_query_set(self):
+        return ChangeCountedInvalidQuerySet(self.model)
+
+
+class ChangeCountedValidObjectsManager(ChangeCountedInvalidManager):
+    """
+    ValidObjectsManager for ChangeCountedModel models.
+    """
+    def get_query_set(self):
+        queryset = super(ChangeCountedValidObjectsManager,
+                         self).get_query_set()
+        return queryset.filter(invalid=False)
+
+
 class ModelExtensions(object):
     """\
     Mixin with convenience functions for models, built on top of the
@@ -637,8 +730,9 @@ class ModelExtensions(object):
         data.  This allows the user to pass either an ID value or
         the name of the object as a string.
 
-        If to_human_readable=True, perform the inverse - i.e. convert
-        numeric values to human readable values.
+        If to_human_readable=True, perform the inverse for fields that have
+        choice sets - i.e. convert numeric values to human readable values.
+        Foreign keys are converted to names in bulk by clean_object_dicts().
 
         This method modifies data in-place.
         """
@@ -659,15 +753,9 @@ class ModelExtensions(object):
                         data[field_name] = to_val
                         break
             # convert foreign key values
-            elif field_obj.rel:
-                dest_obj = field_obj.rel.to.smart_get(data[field_name],
-                                                      valid_only=False)
-                if to_human_readable:
-                    if dest_obj.name_field is not None:
-                        data[field_name] = getattr(dest_obj,
-                                                   dest_obj.name_field)
-                else:
-                    data[field_name] = dest_obj
+            elif field_obj.rel and not to_human_readable:
+                data[field_name] = field_obj.rel.to.smart_get(
+                        data[field_name], valid_only=False)
 
 
     @classmethod
@@ -795,7 +883,8 @@ class ModelExtensions(object):
 
     # see query_objects()
     _SPECIAL_FILTER_KEYS = ('query_start', 'query_limit', 'sort_by',
-                            'extra_args', 'extra_where', 'no_distinct')
+                            'extra_args', 'extra_where', 'no_distinct',
+                            'after_id')
 
 
     @classmethod
@@ -822,12 +911,18 @@ class ModelExtensions(object):
         """
         special_params, _ = cls._extract_special_params(filter_data)
         sort_by = special_params.get('sort_by', None)
+        query_start = special_params.get('query_start', None)
+        query_limit = special_params.get('query_limit', None)
+        if special_params.get('after_id') is not None:
+            if sort_by or query_start is not None:
+                raise ValueError('Cannot pass after_id with sort_by or '
+                                 'query_start')
+            # keyset pagination pages through the primary key order
+            sort_by = ['pk']
         if sort_by:
             assert isinstance(sort_by, list) or isinstance(sort_by, tuple)
             query = query.extra(order_by=sort_by)
 
-        query_start = special_params.get('query_start', None)
-        query_limit = special_params.get('query_limit', None)
         if query_start is not None:
             if query_limit is None:
                 raise ValueError('Cannot pass query_start without query_limit')
@@ -851,6 +946,10 @@ class ModelExtensions(object):
          DB layer documentation)
         -extra_where: extra WHERE clause to append
         -no_distinct: if True, a DISTINCT will not be added to the SELECT
+        -after_id: return only objects with a greater primary key, in primary
+         key order.  Together with query_limit, this pages through large
+         results by passing the last ID of each page to get the next one,
+         without the cost of skipping query_start rows.
         """
         special_params, regular_filters = cls._extract_special_params(
                 filter_data)
@@ -862,6 +961,9 @@ class ModelExtensions(object):
                 initial_query = cls.objects
 
         query = initial_query.filter(**regular_filters)
+        after_id = special_params.get('after_id')
+        if after_id is not None:
+            query = query.filter(pk__gt=after_id)
 
         use_distinct = not special_params.get('no_distinct', False)
         if use_distinct:
@@ -890,6 +992,7 @@ class ModelExtensions(object):
         """
         filter_data.pop('query_start', None)
         filter_data.pop('query_limit', None)
+        filter_data.pop('after_id', None)
         query = cls.query_objects(filter_data, initial_query=initial_query)
         return query.count()
 
@@ -904,19 +1007,59 @@ class ModelExtensions(object):
         for field_dict in field_dicts:
             cls.clean_foreign_keys(field_dict)
             cls._convert_booleans(field_dict)
+        cls._convert_foreign_keys_to_names(field_dicts)
+        for field_dict in field_dicts:
             cls.convert_human_readable_values(field_dict,
                                               to_human_readable=True)
 
 
+    @classmethod
+    def _convert_foreign_keys_to_names(cls, field_dicts):
+        """\
+        Replace the IDs in the foreign key fields of field_dicts with the
+        names of the objects they reference, looking up the names with one
+        query per field rather than one per dict.
+        """
+        for field in cls._meta.fields:
+            if not field.rel:
+                continue
+            related_model = field.rel.to
+            if getattr(related_model, 'name_field', None) is None:
+                continue
+            related_ids = set(field_dict.get(field.name)
+                              for field_dict in field_dicts)
+            related_ids.discard(None)
+            if not related_ids:
+                continue
+            names_by_id = dict(related_model.objects.filter(
+                    pk__in=related_ids).values_list(
+                            'pk', related_model.name_field))
+            for field_dict in field_dicts:
+                related_id = field_dict.get(field.name)
+                if related_id is None:
+                    continue
+                if related_id not in names_by_id:
+                    raise related_model.DoesNotExist(
+                            '%s %s does not exist' % (related_model.__name__,
+                                                      related_id))
+                field_dict[field.name] = names_by_id[related_id]
+
+
     @classmethod
     def list_objects(cls, filter_data, initial_query=None):
         """\
         Like query_objects, but return a list of dictionaries.
         """
         query = cls.query_objects(filter_data, initial_query=initial_query)
-        extra_fields = query.query.extra_select.keys()
-        field_dicts = [model_object.get_object_dict(extra_fields=extra_fields)
-                       for model_object in query]
+        if (cls._postprocess_object_dict.im_func
+            is not ModelExtensions._postprocess_object_dict.im_func):
+            extra_fields = query.query.extra_select.keys()
+            return cls.get_object_dicts(list(query), extra_fields=extra_fields)
+
+        # the dicts get_object_dict() would build, without instantiating
+        # model objects or fetching related objects
+        field_dicts = list(query.values())
+        cls.clean_object_dicts(field_dicts)
         return field_dicts
 
 
@@ -962,14 +1105,30 @@ class ModelExtensions(object):
         extra_fields: list of extra attribute names to include, in addition to
         the fields defined on this object.
         """
-        fields = self.get_field_dict().keys()
-        if extra_fields:
-            fields += extra_fields
-        object_dict = dict((field_name, getattr(self, field_name))
-                           for field_name in fields)
-        self.clean_object_dicts([object_dict])
-        self._postprocess_object_dict(object_dict)
-        return object_dict
+        return self.get_object_dicts([self], extra_fields=extra_fields)[0]
+
+
+    @classmethod
+    def get_object_dicts(cls, model_objects, extra_fields=None):
+        """\
+        Like get_object_dict() for a list of instances of this model, with a
+        constant number of queries to look up the names of related objects.
+        """
+        object_dicts = []
+        for model_object in model_objects:
+            # foreign keys are read through their <field>_id attributes,
+            # which clean_foreign_keys() renames, rather than fetching the
+            # related objects
+            object_dict = dict((field.attname,
+                                getattr(model_object, field.attname))
+                               for field in cls._meta.fields)
+            for field_name in extra_fields or ():
+                object_dict[field_name] = getattr(model_object, field_name)
+            object_dicts.append(object_dict)
+        cls.clean_object_dicts(object_dicts)
+        for model_object, object_dict in zip(model_objects, object_dicts):
+            model_object._postprocess_object_dict(object_dict)
+        return object_dicts
 
 
     def _postprocess_object_dict(self, object_dict):
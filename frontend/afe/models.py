@@ -1,6 +1,7 @@
 import logging, os
 from datetime import datetime
-from django.db import models as dbmodels, connection
+from django.db import models as dbmodels, connection, IntegrityError
+from django.db.models import signals as dbsignals
 from xml.sax import saxutils
 try:
     import autotest.common as common
@@ -73,7 +74,8 @@ class AtomicGroup(model_logic.ModelWithInvalid, dbmodels.Model):
         return unicode(self.name)
 
 
-class Label(model_logic.ModelWithInvalid, dbmodels.Model):
+class Label(model_logic.ModelWithInvalid, dbmodels.Model,
+            model_logic.ChangeCountedModel):
     """\
     Required:
       name: label name
@@ -94,11 +96,16 @@ class Label(model_logic.ModelWithInvalid, dbmodels.Model):
     only_if_needed = dbmodels.BooleanField(default=False)
 
     name_field = 'name'
-    objects = model_logic.ModelWithInvalidManager()
-    valid_objects = model_logic.ValidObjectsManager()
+    objects = model_logic.ChangeCountedInvalidManager()
+    valid_objects = model_logic.ChangeCountedValidObjectsManager()
     atomic_group = dbmodels.ForeignKey(AtomicGroup, null=True, blank=True)
 
 
+    def save(self, *args, **kwargs):
+        super(Label, self).save(*args, **kwargs)
+        self.record_change()
+
+
     def clean_object(self):
         self.host_set.clear()
         self.test_set.clear()
@@ -297,7 +304,7 @@ class User(dbmodels.Model, model_logic.ModelExtensions):
 
 
 class Host(model_logic.ModelWithInvalid, dbmodels.Model,
-           model_logic.ModelWithAttributes):
+           model_logic.ModelWithAttributes, model_logic.ChangeCountedModel):
     """\
     Required:
     hostname
@@ -338,8 +345,8 @@ class Host(model_logic.ModelWithInvalid, dbmodels.Model,
     dirty = dbmodels.BooleanField(default=True, editable=settings.FULL_ADMIN)
 
     name_field = 'hostname'
-    objects = model_logic.ModelWithInvalidManager()
-    valid_objects = model_logic.ValidObjectsManager()
+    objects = model_logic.ChangeCountedInvalidManager()
+    valid_objects = model_logic.ChangeCountedValidObjectsManager()
 
 
     def __init__(self, *args, **kwargs):
@@ -399,6 +406,7 @@ class Host(model_logic.ModelWithInvalid, dbmodels.Model,
             everyone = AclGroup.objects.get(name='Everyone')
             everyone.hosts.add(self)
         self._check_for_updated_attributes()
+        self.record_change()
 
 
     def delete(self):
@@ -1117,7 +1125,8 @@ class IneligibleHostQueue(dbmodels.Model, model_logic.ModelExtensions):
         db_table = 'afe_ineligible_host_queues'
 
 
-class HostQueueEntry(dbmodels.Model, model_logic.ModelExtensions):
+class HostQueueEntry(dbmodels.Model, model_logic.ModelExtensions,
+                     model_logic.ChangeCountedModel):
     Status = host_queue_entry_states.Status
     ACTIVE_STATUSES = host_queue_entry_states.ACTIVE_STATUSES
     COMPLETE_STATUSES = host_queue_entry_states.COMPLETE_STATUSES
@@ -1138,7 +1147,7 @@ class HostQueueEntry(dbmodels.Model, model_logic.ModelExtensions):
     aborted = dbmodels.BooleanField(default=False)
     started_on = dbmodels.DateTimeField(null=True, blank=True)
 
-    objects = model_logic.ExtendedManager()
+    objects = model_logic.ChangeCountedManager()
 
 
     def __init__(self, *args, **kwargs):
@@ -1162,6 +1171,12 @@ class HostQueueEntry(dbmodels.Model, model_logic.ModelExtensions):
         self._set_active_and_complete()
         super(HostQueueEntry, self).save(*args, **kwargs)
         self._check_for_updated_attributes()
+        self.record_change()
+
+
+    def delete(self):
+        super(HostQueueEntry, self).delete()
+        self.record_change()
 
 
     def execution_path(self):
@@ -1285,7 +1300,8 @@ class RecurringRun(dbmodels.Model, model_logic.ModelExtensions):
             self.job.id, self.start_date, self.loop_period, self.loop_count)
 
 
-class SpecialTask(dbmodels.Model, model_logic.ModelExtensions):
+class SpecialTask(dbmodels.Model, model_logic.ModelExtensions,
+                  model_logic.ChangeCountedModel):
     """\
     Tasks to run on hosts at the next time they are in the Ready state. Use this
     for high-priority tasks, such as forced repair or forced reinstall.
@@ -1313,7 +1329,7 @@ class SpecialTask(dbmodels.Model, model_logic.ModelExtensions):
     queue_entry = dbmodels.ForeignKey(HostQueueEntry, blank=True, null=True)
     success = dbmodels.BooleanField(default=False, blank=False, null=False)
 
-    objects = model_logic.ExtendedManager()
+    objects = model_logic.ChangeCountedManager()
 
 
     def save(self, **kwargs):
@@ -1321,6 +1337,12 @@ class SpecialTask(dbmodels.Model, model_logic.ModelExtensions):
             self.requested_by = User.objects.get(
                     login=self.queue_entry.job.owner)
         super(SpecialTask, self).save(**kwargs)
+        self.record_change()
+
+
+    def delete(self):
+        super(SpecialTask, self).delete()
+        self.record_change()
 
 
     def execution_path(self):
@@ -1403,3 +1425,67 @@ class SpecialTask(dbmodels.Model, model_logic.ModelExtensions):
             result += u' (active)'
 
         return result
+
+
+class ChangeCounter(dbmodels.Model, model_logic.ModelExtensions):
+    """\
+    A monotonically increasing count of modifications made to a table.  The
+    scheduler compares these counters between ticks to skip re-reading tables
+    that have not changed.
+
+    table_name: name of the counted table
+    counter: number of modifications recorded so far
+    """
+    table_name = dbmodels.CharField(max_length=255, unique=True)
+    counter = dbmodels.IntegerField(default=0)
+
+    objects = model_logic.ExtendedManager()
+
+
+    @classmethod
+    def increment(cls, table_name):
+        """
+        Record one modification of table_name.  Migration 069 creates the
+        rows of the counted tables, so the row only has to be created here
+        for databases set up otherwise.
+        """
+        counters = cls.objects.filter(table_name=table_name)
+        if counters.update(counter=dbmodels.F('counter') + 1):
+            return
+        try:
+            cls.objects.create(table_name=table_name, counter=1)
+        except IntegrityError:
+            # another writer created the row first
+            counters.update(counter=dbmodels.F('counter') + 1)
+
+
+    @classmethod
+    def get_counters(cls):
+        """
+        @returns A dict mapping table names to their modification counts.
+        """
+        return dict(cls.objects.values_list('table_name', 'counter'))
+
+
+    class Meta:
+        db_table = 'afe_change_counters'
+
+
+    def __unicode__(self):
+        return u'%s (%d)' % (self.table_name, self.counter)
+
+
+def _record_membership_change(sender, action, **kwargs):
+    """
+    m2m_changed handler counting changes to the host label and ACL
+    memberships the scheduler indexes.
+    """
+    if action.startswith('post_'):
+        ChangeCounter.increment(sender._meta.db_table)
+
+
+for _through_model in (Host.labels.through, AclGroup.hosts.through,
+                       AclGroup.users.through):
+    dbsignals.m2m_changed.connect(
+            _record_membership_change, sender=_through_model,
+            dispatch_uid='record_change_' + _through_model._meta.db_table)
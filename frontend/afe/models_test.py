@@ -145,6 +145,91 @@ class HostQueueEntryUnittest(unittest.TestCase,
         self.assertEquals(entry.execution_path(), '1-autotest_system/subdir')
 
 
+class ChangeCounterTest(unittest.TestCase,
+                        frontend_test_utils.FrontendTestMixin):
+    def setUp(self):
+        self._frontend_common_setup()
+
+
+    def tearDown(self):
+        self._frontend_common_teardown()
+
+
+    def _get_count(self, table_name):
+        return models.ChangeCounter.get_counters().get(table_name, 0)
+
+
+    def test_save(self):
+        before = self._get_count('afe_host_queue_entries')
+        entry = self._create_job(hosts=[1]).hostqueueentry_set.all()[0]
+        entry.save()
+        self.assertEquals(self._get_count('afe_host_queue_entries'),
+                          before + 2)
+
+
+    def test_bulk_update(self):
+        job = self._create_job(hosts=[1, 2])
+        before = self._get_count('afe_host_queue_entries')
+        job.hostqueueentry_set.update(aborted=True)
+        self.assertEquals(self._get_count('afe_host_queue_entries'),
+                          before + 1)
+
+
+    def test_special_task(self):
+        before = self._get_count('afe_special_tasks')
+        models.SpecialTask.schedule_special_task(
+                self.hosts[0], models.SpecialTask.Task.VERIFY)
+        self.assertEquals(self._get_count('afe_special_tasks'), before + 1)
+
+
+    def test_host_and_label_bulk_update(self):
+        before = self._get_count('afe_hosts')
+        models.Host.objects.filter(id=1).update(locked=True)
+        models.Host.valid_objects.filter(id=2).update(locked=True)
+        self.assertEquals(self._get_count('afe_hosts'), before + 2)
+
+        before = self._get_count('afe_labels')
+        models.Label.objects.filter(id=1).update(only_if_needed=True)
+        self.assertEquals(self._get_count('afe_labels'), before + 1)
+
+
+    def test_delete(self):
+        job = self._create_job(hosts=[1, 2])
+        entries = job.hostqueueentry_set.all()
+        before = self._get_count('afe_host_queue_entries')
+        entries[0].delete()
+        self.assertEquals(self._get_count('afe_host_queue_entries'),
+                          before + 1)
+        job.hostqueueentry_set.all().delete()
+        self.assertEquals(self._get_count('afe_host_queue_entries'),
+                          before + 2)
+
+        task = models.SpecialTask.schedule_special_task(
+                self.hosts[0], models.SpecialTask.Task.VERIFY)
+        before = self._get_count('afe_special_tasks')
+        task.delete()
+        self.assertEquals(self._get_count('afe_special_tasks'), before + 1)
+
+
+    def test_increment_creates_counter(self):
+        models.ChangeCounter.objects.filter(table_name='afe_hosts').delete()
+        models.ChangeCounter.increment('afe_hosts')
+        models.ChangeCounter.increment('afe_hosts')
+        self.assertEquals(2, self._get_count('afe_hosts'))
+
+
+    def test_membership_change(self):
+        before = self._get_count('afe_hosts_labels')
+        self.hosts[0].labels.add(self.label3)
+        self.label3.host_set.remove(self.hosts[0])
+        self.assertEquals(self._get_count('afe_hosts_labels'), before + 2)
+
+        before = self._get_count('afe_acl_groups_hosts')
+        acl_group = models.AclGroup.objects.get(name='my_acl')
+        acl_group.hosts.remove(self.hosts[1])
+        self.assertEquals(self._get_count('afe_acl_groups_hosts'), before + 1)
+
+
 class ModelWithInvalidTest(unittest.TestCase,
                            frontend_test_utils.FrontendTestMixin):
     def setUp(self):
@@ -306,5 +391,41 @@ class JobTest(unittest.TestCase, frontend_test_utils.FrontendTestMixin):
                           control_file=object(), parameterized_job=None)
 
 
+class ListObjectsTest(unittest.TestCase,
+                      frontend_test_utils.FrontendTestMixin):
+    def setUp(self):
+        self._frontend_common_setup()
+
+
+    def tearDown(self):
+        self._frontend_common_teardown()
+
+
+    def test_matches_object_dicts(self):
+        for model in (models.Host, models.Label, models.AclGroup):
+            expected = [model_object.get_object_dict()
+                        for model_object in model.objects.order_by('id')]
+            self.assertEquals(expected,
+                              model.list_objects({'sort_by': ['id']}))
+
+
+    def test_keyset_pagination(self):
+        all_ids = [host.id for host in models.Host.objects.all()]
+        ids = []
+        after_id = 0
+        while True:
+            page = models.Host.list_objects({'after_id': after_id,
+                                             'query_limit': 4})
+            if not page:
+                break
+            ids.extend(host['id'] for host in page)
+            after_id = page[-1]['id']
+        self.assertEquals(sorted(all_ids), ids)
+        self.assertEquals(len(all_ids), models.Host.query_count(
+                {'after_id': all_ids[0], 'query_limit': 4}))
+        self.assertRaises(ValueError, models.Host.list_objects,
+                          {'after_id': 0, 'sort_by': ['hostname']})
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -6,6 +6,8 @@ defined in rpc_interface.py.
 __author__ = 'showard@google.com (Steve Howard)'
 
 import traceback, pydoc, re, urllib, logging, logging.handlers, inspect
+import threading, time
+import simplejson
 from autotest_lib.frontend.afe.json_rpc import serviceHandler
 from autotest_lib.frontend.afe import models, rpc_utils
 from autotest_lib.client.common_lib import global_config
@@ -28,10 +30,140 @@ class RpcMethodHolder(object):
     'Dummy class to hold RPC interface methods as attributes.'
 
 
+class RpcResultCache(object):
+    """\
+    In-memory cache of read-only RPC results, keyed on the method, its
+    parameters and the calling user.  Results expire after the TTL of their
+    method and are dropped early when an RPC that may change them is called.
+    Every server process has its own cache, so changes made through other
+    processes or by the scheduler only show up once the TTL expires.
+    """
+    _MAX_ENTRIES = 1000
+    # seconds between reports of the hit and miss counts
+    _STATS_INTERVAL = 3600
+
+    def __init__(self, clock=time.time):
+        self._clock = clock
+        self._lock = threading.Lock()
+        # method name -> ttl
+        self._ttls = {}
+        # RPC name -> set of the cached methods it invalidates
+        self._invalidations = {}
+        # (method, user, encoded params) -> (expiration time, result)
+        self._entries = {}
+        self.hits = {}
+        self.misses = {}
+        self._next_stats_time = None
+
+
+    def add_method(self, name, ttl, invalidated_by):
+        self._ttls[name] = ttl
+        for rpc_name in invalidated_by:
+            self._invalidations.setdefault(rpc_name, set()).add(name)
+        self.hits[name] = self.misses[name] = 0
+
+
+    def caches(self, name):
+        return name in self._ttls
+
+
+    @staticmethod
+    def _make_key(name, params, user_login):
+        return name, user_login, simplejson.dumps(params, sort_keys=True)
+
+
+    def get(self, name, params, user_login):
+        """\
+        @returns A (found, result) tuple.
+        """
+        key = self._make_key(name, params, user_login)
+        self._lock.acquire()
+        try:
+            entry = self._entries.get(key)
+            if entry and entry[0] > self._clock():
+                self.hits[name] += 1
+                return True, entry[1]
+            self.misses[name] += 1
+            return False, None
+        finally:
+            self._lock.release()
+
+
+    def put(self, name, params, user_login, result):
+        key = self._make_key(name, params, user_login)
+        ttl = self._ttls[name]
+        self._lock.acquire()
+        try:
+            if len(self._entries) >= self._MAX_ENTRIES:
+                self._remove_entries(lambda key, expiration: expiration
+                                     <= self._clock())
+            if len(self._entries) >= self._MAX_ENTRIES:
+                self._entries.clear()
+            self._entries[key] = (self._clock() + ttl, result)
+        finally:
+            self._lock.release()
+
+
+    def _remove_entries(self, predicate):
+        for key, (expiration, _) in self._entries.items():
+            if predicate(key, expiration):
+                del self._entries[key]
+
+
+    def invalidate_for(self, name):
+        """\
+        Drop the cached results that may be changed by the RPC name, i.e.
+        those of the methods listing it as invalidating them.
+        """
+        stale_methods = self._invalidations.get(name)
+        if not stale_methods:
+            return
+        self._lock.acquire()
+        try:
+            self._remove_entries(lambda key, expiration:
+                                 key[0] in stale_methods)
+        finally:
+            self._lock.release()
+
+
+    def get_stats(self):
+        """\
+        @returns A dict mapping each cached method to its hit and miss counts.
+        """
+        return dict((name, {'hits': self.hits[name],
+                            'misses': self.misses[name]})
+                    for name in self._ttls)
+
+
+    def stats_due(self):
+        """\
+        @returns True once every _STATS_INTERVAL seconds, when the statistics
+                should be reported again.
+        """
+        self._lock.acquire()
+        try:
+            now = self._clock()
+            if self._next_stats_time is None:
+                self._next_stats_time = now + self._STATS_INTERVAL
+            if now < self._next_stats_time:
+                return False
+            self._next_stats_time = now + self._STATS_INTERVAL
+            return True
+        finally:
+            self._lock.release()
+
+
 class RpcHandler(object):
+    # list results with at least this many rows are streamed
+    MIN_STREAMED_ROWS = 1000
+
     def __init__(self, rpc_interface_modules, document_module=None):
         self._rpc_methods = RpcMethodHolder()
         self._dispatcher = serviceHandler.ServiceHandler(self._rpc_methods)
+        self.result_cache = None
+        if global_config.global_config.get_config_value(
+                'AUTOTEST_WEB', 'rpc_result_cache', type=bool, default=False):
+            self.result_cache = RpcResultCache()
 
         # store all methods from interface modules
         for module in rpc_interface_modules:
@@ -55,7 +187,8 @@ class RpcHandler(object):
 
 
     def execute_request(self, json_request):
-        return self._dispatcher.handleRequest(json_request)
+        decoded_request = self.decode_request(json_request)
+        return self.encode_result(self.dispatch_request(decoded_request))
 
 
     def decode_request(self, json_request):
@@ -63,7 +196,41 @@ class RpcHandler(object):
 
 
     def dispatch_request(self, decoded_request):
-        return self._dispatcher.dispatchRequest(decoded_request)
+        method = None
+        if isinstance(decoded_request, dict):
+            method = decoded_request.get('method')
+        if self.result_cache is None or not isinstance(method, basestring):
+            return self._dispatcher.dispatchRequest(decoded_request)
+
+        if not self.result_cache.caches(method):
+            self.result_cache.invalidate_for(method)
+            return self._dispatcher.dispatchRequest(decoded_request)
+
+        user_login = models.User.current_user().login
+        params = decoded_request.get('params')
+        found, result = self.result_cache.get(method, params, user_login)
+        if rpcserver_logging.LOGGING_ENABLED and self.result_cache.stats_due():
+            self._log_cache_stats()
+        if found:
+            decoded_result = self._dispatcher.blank_result_dict()
+            decoded_result['id'] = decoded_request.get('id')
+            decoded_result['result'] = result
+            return decoded_result
+
+        decoded_result = self._dispatcher.dispatchRequest(decoded_request)
+        if decoded_result['err'] is None:
+            self.result_cache.put(method, params, user_login,
+                                  decoded_result['result'])
+        return decoded_result
+
+
+    def _log_cache_stats(self):
+        stats = self.result_cache.get_stats()
+        rpcserver_logging.rpc_logger.info(
+                'RPC result cache: %s', ', '.join(
+                        '%s %d hits %d misses' % (name, counts['hits'],
+                                                  counts['misses'])
+                        for name, counts in sorted(stats.iteritems())))
 
 
     def log_request(self, user, decoded_request, decoded_result,
@@ -82,15 +249,58 @@ class RpcHandler(object):
         return self._dispatcher.translateResult(results)
 
 
+    def _should_stream(self, decoded_result):
+        result = decoded_result['result']
+        return (decoded_result['err'] is None and isinstance(result, list)
+                and len(result) >= self.MIN_STREAMED_ROWS)
+
+
+    def encode_result_chunks(self, decoded_result):
+        """\
+        Like encode_result(), but for list results only, encoding one row at
+        a time while the response is sent, so that the JSON of the whole
+        result is never built as a single string.  The rows themselves are
+        all in memory already.
+        """
+        encoder = serviceHandler.json_encoder
+        yield '{"id": %s, "error": null, "result": [' % encoder.encode(
+                decoded_result['id'])
+        separator = ''
+        for row in decoded_result['result']:
+            yield separator + encoder.encode(row)
+            separator = ', '
+        yield ']}'
+
+
+    def _handle_decoded_request(self, user, decoded_request):
+        decoded_result = self.dispatch_request(decoded_request)
+        result = self.encode_result(decoded_result)
+        if rpcserver_logging.LOGGING_ENABLED:
+            self.log_request(user, decoded_request, decoded_result)
+        return result
+
+
     def handle_rpc_request(self, request):
+        """\
+        Handle a JSON-RPC request.  The request may also be a batch, i.e. a
+        list of requests, which are executed in order and answered with the
+        list of their results.
+        """
         user = models.User.current_user()
         json_request = self.raw_request_data(request)
         decoded_request = self.decode_request(json_request)
+        if isinstance(decoded_request, list):
+            results = [self._handle_decoded_request(user, single_request)
+                       for single_request in decoded_request]
+            return rpc_utils.raw_http_response('[%s]' % ', '.join(results))
+
         decoded_result = self.dispatch_request(decoded_request)
-        result = self.encode_result(decoded_result)
         if rpcserver_logging.LOGGING_ENABLED:
             self.log_request(user, decoded_request, decoded_result)
-        return rpc_utils.raw_http_response(result)
+        if self._should_stream(decoded_result):
+            return rpc_utils.streaming_http_response(
+                    self.encode_result_chunks(decoded_result))
+        return rpc_utils.raw_http_response(self.encode_result(decoded_result))
 
 
     def handle_jsonp_rpc_request(self, request):
@@ -131,3 +341,8 @@ class RpcHandler(object):
                 continue
             decorated_function = RpcHandler._allow_keyword_args(attribute)
             setattr(self._rpc_methods, name, decorated_function)
+            if (self.result_cache is not None
+                and hasattr(attribute, 'rpc_cache_ttl')):
+                self.result_cache.add_method(
+                        name, attribute.rpc_cache_ttl,
+                        attribute.rpc_cache_invalidated_by)
@@ -0,0 +1,157 @@
+#!/usr/bin/python
+
+import types, unittest
+import simplejson
+try:
+    import autotest.common as common
+except ImportError:
+    import common
+from autotest_lib.frontend import setup_django_environment
+from autotest_lib.frontend import setup_test_environment
+from autotest_lib.client.common_lib import global_config
+from autotest_lib.client.common_lib.test_utils import mock
+from autotest_lib.frontend.afe import models, rpc_handler, rpc_utils
+from autotest_lib.frontend.afe import rpcserver_logging
+
+
+class FakeUser(object):
+    def __init__(self, login):
+        self.login = login
+
+
+class FakeLogger(object):
+    def __init__(self):
+        self.messages = []
+
+
+    def info(self, msg, *args):
+        self.messages.append(msg % args)
+
+
+class FakeRequest(object):
+    method = 'POST'
+
+    def __init__(self, raw_post_data):
+        self.raw_post_data = raw_post_data
+
+
+class RpcResultCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.god = mock.mock_god()
+        self.user = FakeUser('user1')
+        self.god.stub_with(models.User, 'current_user',
+                           staticmethod(lambda: self.user))
+        self.now = 1000
+        self.calls = []
+
+        module = types.ModuleType('fake_rpc_interface')
+        @rpc_utils.cached_rpc(ttl=10,
+                              invalidated_by=('add_label',
+                                              'host_remove_labels'))
+        def get_labels(**filter_data):
+            self.calls.append(('get_labels', filter_data))
+            return ['label%d' % len(self.calls)]
+        def add_label(name):
+            self.calls.append(('add_label', name))
+        def host_remove_labels(id, labels):
+            self.calls.append(('host_remove_labels', id))
+        def add_host(hostname):
+            self.calls.append(('add_host', hostname))
+        for function in (get_labels, add_label, host_remove_labels, add_host):
+            setattr(module, function.func_name, function)
+
+        global_config.global_config.override_config_value(
+                'AUTOTEST_WEB', 'rpc_result_cache', 'True')
+        self.handler = rpc_handler.RpcHandler([module])
+        self.handler.result_cache._clock = lambda: self.now
+
+
+    def tearDown(self):
+        global_config.global_config.reset_config_values()
+        self.god.unstub_all()
+
+
+    def _call(self, method, *params):
+        request = {'method': method, 'params': list(params), 'id': 1}
+        result = self.handler.dispatch_request(request)
+        self.assertEquals(None, result['err'])
+        return result['result']
+
+
+    def _get_labels(self, **filter_data):
+        return self._call('get_labels', filter_data)
+
+
+    def test_hits_and_misses(self):
+        first = self._get_labels(name='a', platform=True)
+        self.assertEquals(first, self._get_labels(platform=True, name='a'))
+        self.assertNotEquals(first, self._get_labels(name='b'))
+        self.user = FakeUser('user2')
+        self.assertNotEquals(first, self._get_labels(name='a', platform=True))
+        self.assertEquals({'get_labels': {'hits': 1, 'misses': 3}},
+                          self.handler.result_cache.get_stats())
+
+
+    def test_stats_logging(self):
+        logger = FakeLogger()
+        self.god.stub_with(rpcserver_logging, 'LOGGING_ENABLED', True)
+        self.god.stub_with(rpcserver_logging, 'rpc_logger', logger)
+        self._get_labels()
+        self._get_labels()
+        self.assertEquals([], logger.messages)
+        self.now += 3600
+        self._get_labels()
+        self.assertEquals(['RPC result cache: get_labels 1 hits 2 misses'],
+                          logger.messages)
+        self._get_labels()
+        self.assertEquals(1, len(logger.messages))
+
+
+    def test_expiration(self):
+        first = self._get_labels()
+        self.now += 9
+        self.assertEquals(first, self._get_labels())
+        self.now += 1
+        self.assertNotEquals(first, self._get_labels())
+
+
+    def test_invalidation(self):
+        first = self._get_labels()
+        self._call('add_host', {'hostname': 'host1'})
+        self.assertEquals(first, self._get_labels())
+        self._call('host_remove_labels', {'id': 1, 'labels': ['x']})
+        second = self._get_labels()
+        self.assertNotEquals(first, second)
+        self._call('add_label', {'name': 'y'})
+        self.assertNotEquals(second, self._get_labels())
+
+
+    def test_batch_request(self):
+        requests = [{'method': 'add_label', 'params': [{'name': 'x'}],
+                     'id': 0},
+                    {'method': 'add_label', 'params': [{}], 'id': 1},
+                    {'method': 'get_labels', 'params': [{}], 'id': 2}]
+        response = self.handler.handle_rpc_request(
+                FakeRequest(simplejson.dumps(requests)))
+        results = simplejson.loads(response.content)
+
+        self.assertEquals([0, 1, 2], [result['id'] for result in results])
+        self.assertEquals(None, results[0]['error'])
+        self.assertEquals('TypeError', results[1]['error']['name'])
+        self.assertEquals(['label2'], results[2]['result'])
+        self.assertEquals([('add_label', 'x'), ('get_labels', {})],
+                          self.calls)
+
+
+    def test_streamed_result(self):
+        self.god.stub_with(rpc_handler.RpcHandler, 'MIN_STREAMED_ROWS', 1)
+        request = {'method': 'get_labels', 'params': [{}], 'id': 3}
+        response = self.handler.handle_rpc_request(
+                FakeRequest(simplejson.dumps(request)))
+        self.assertFalse(response.has_header('Content-length'))
+        self.assertEquals({'id': 3, 'error': None, 'result': ['label1']},
+                          simplejson.loads(response.content))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -30,6 +30,7 @@ See doctests/001_rpc_test.txt for (lots) more examples.
 __author__ = 'showard@google.com (Steve Howard)'
 
 import datetime
+from django.db import transaction
 try:
     import autotest.common as common
 except ImportError:
@@ -39,6 +40,27 @@ from autotest_lib.frontend.afe import control_file, rpc_utils
 from autotest_lib.client.common_lib import global_config
 
 
+# RPCs changing the objects the results of the cached RPCs are built from
+
+_LABEL_CHANGES = ('add_label', 'modify_label', 'delete_label',
+                  'label_add_hosts', 'label_remove_hosts')
+_ATOMIC_GROUP_CHANGES = ('add_atomic_group', 'modify_atomic_group',
+                         'delete_atomic_group', 'atomic_group_add_labels',
+                         'atomic_group_remove_labels')
+_HOST_LABEL_CHANGES = ('host_add_labels', 'host_remove_labels',
+                       'hosts_add_labels', 'hosts_remove_labels')
+_HOST_CHANGES = ('add_host', 'modify_host', 'modify_hosts', 'delete_host',
+                 'set_host_attribute', 'reverify_hosts')
+_ACL_CHANGES = ('add_acl_group', 'modify_acl_group', 'delete_acl_group',
+                'acl_group_add_users', 'acl_group_remove_users',
+                'acl_group_add_hosts', 'acl_group_remove_hosts')
+_STATIC_DATA_CHANGES = ('add_user', 'modify_user', 'delete_user', 'add_test',
+                        'modify_test', 'delete_test', 'add_profiler',
+                        'modify_profiler', 'delete_profiler')
+_JOB_CHANGES = ('create_job', 'create_parameterized_job',
+                'abort_host_queue_entries')
+
+
 # labels
 
 def add_label(name, kernel_config=None, platform=None, only_if_needed=None):
@@ -68,6 +90,9 @@ def label_remove_hosts(id, hosts):
     models.Label.smart_get(id).host_set.remove(*host_objs)
 
 
+@rpc_utils.cached_rpc(ttl=60, invalidated_by=(
+        _LABEL_CHANGES + _ATOMIC_GROUP_CHANGES + _HOST_LABEL_CHANGES +
+        ('delete_host',)))
 def get_labels(**filter_data):
     """\
     @returns A sequence of nested dictionaries of label information.
@@ -122,8 +147,11 @@ def modify_host(id, **data):
     host.update_object(data)
 
 
+@transaction.commit_on_success
 def modify_hosts(host_filter_data, update_data):
     """
+    Modify all the matching hosts in a single transaction.
+
     @param host_filter_data: Filters out which hosts to modify.
     @param update_data: A dictionary with the changes to make to the hosts.
     """
@@ -133,17 +161,20 @@ def modify_hosts(host_filter_data, update_data):
         host.update_object(update_data)
 
 
-def host_add_labels(id, labels):
-    labels = models.Label.smart_get_bulk(labels)
-    host = models.Host.smart_get(id)
-
-    platforms = [label.name for label in labels if label.platform]
+def _check_add_labels(host_objs, label_objs):
+    platforms = [label.name for label in label_objs if label.platform]
     if len(platforms) > 1:
         raise model_logic.ValidationError(
             {'labels': 'Adding more than one platform label: %s' %
                        ', '.join(platforms)})
     if len(platforms) == 1:
-        models.Host.check_no_platform([host])
+        models.Host.check_no_platform(host_objs)
+
+
+def host_add_labels(id, labels):
+    labels = models.Label.smart_get_bulk(labels)
+    host = models.Host.smart_get(id)
+    _check_add_labels([host], labels)
     host.labels.add(*labels)
 
 
@@ -152,6 +183,34 @@ def host_remove_labels(id, labels):
     models.Host.smart_get(id).labels.remove(*labels)
 
 
+@transaction.commit_on_success
+def hosts_add_labels(hosts, labels):
+    """
+    Add the same labels to several hosts in a single transaction.
+
+    @param hosts: A list of host IDs or hostnames.
+    @param labels: A list of label IDs or names.
+    """
+    host_objs = models.Host.smart_get_bulk(hosts)
+    label_objs = models.Label.smart_get_bulk(labels)
+    _check_add_labels(host_objs, label_objs)
+    for label in label_objs:
+        label.host_set.add(*host_objs)
+
+
+@transaction.commit_on_success
+def hosts_remove_labels(hosts, labels):
+    """
+    Remove the same labels from several hosts in a single transaction.
+
+    @param hosts: A list of host IDs or hostnames.
+    @param labels: A list of label IDs or names.
+    """
+    host_objs = models.Host.smart_get_bulk(hosts)
+    for label in models.Label.smart_get_bulk(labels):
+        label.host_set.remove(*host_objs)
+
+
 def set_host_attribute(attribute, value, **host_filter_data):
     """
     @param attribute string name of attribute
@@ -171,6 +230,9 @@ def delete_host(id):
     models.Host.smart_get(id).delete()
 
 
+@rpc_utils.cached_rpc(ttl=10, invalidated_by=(
+        _HOST_CHANGES + _HOST_LABEL_CHANGES + _LABEL_CHANGES +
+        _ATOMIC_GROUP_CHANGES + _ACL_CHANGES))
 def get_hosts(multiple_labels=(), exclude_only_if_needed_labels=False,
               exclude_atomic_group_hosts=False, valid_only=True, **filter_data):
     """
@@ -188,20 +250,22 @@ def get_hosts(multiple_labels=(), exclude_only_if_needed_labels=False,
     hosts = list(hosts)
     models.Host.objects.populate_relationships(hosts, models.Label,
                                                'label_list')
+    # find_platform_and_atomic_group() looks at the labels' atomic groups
+    models.Label.objects.populate_foreign_keys(
+            [label for host in hosts for label in host.label_list],
+            ('atomic_group',))
     models.Host.objects.populate_relationships(hosts, models.AclGroup,
                                                'acl_list')
     models.Host.objects.populate_relationships(hosts, models.HostAttribute,
                                                'attribute_list')
-    host_dicts = []
-    for host_obj in hosts:
-        host_dict = host_obj.get_object_dict()
+    host_dicts = models.Host.get_object_dicts(hosts)
+    for host_obj, host_dict in zip(hosts, host_dicts):
         host_dict['labels'] = [label.name for label in host_obj.label_list]
         host_dict['platform'], host_dict['atomic_group'] = (rpc_utils.
                 find_platform_and_atomic_group(host_obj))
         host_dict['acls'] = [acl.name for acl in host_obj.acl_list]
         host_dict['attributes'] = dict((attribute.attribute, attribute.value)
                                        for attribute in host_obj.attribute_list)
-        host_dicts.append(host_dict)
     return rpc_utils.prepare_for_serialization(host_dicts)
 
 
@@ -530,9 +594,10 @@ def create_job(name, priority, control_file, control_type,
             **rpc_utils.get_create_job_common_args(locals()))
 
 
+@transaction.commit_on_success
 def abort_host_queue_entries(**filter_data):
     """\
-    Abort a set of host queue entries.
+    Abort a set of host queue entries in a single transaction.
     """
     query = models.HostQueueEntry.query_objects(filter_data)
     query = query.filter(complete=False)
@@ -597,6 +662,7 @@ def get_num_jobs(not_yet_run=False, running=False, finished=False,
     return models.Job.query_count(filter_data)
 
 
+@rpc_utils.cached_rpc(ttl=10, invalidated_by=_JOB_CHANGES)
 def get_jobs_summary(**filter_data):
     """\
     Like get_jobs(), but adds a 'status_counts' field, which is a dictionary
@@ -621,9 +687,15 @@ def get_info_for_clone(id, preserve_metahosts, queue_entry_filter_data=None):
                                       queue_entry_filter_data)
 
     host_dicts = []
+    host_dicts_by_id = {}
+    if job_info['hosts']:
+        host_ids = [host.id for host in job_info['hosts']]
+        host_dicts_by_id = dict(
+                (host_dict['id'], host_dict)
+                for host_dict in get_hosts(id__in=host_ids))
     for host in job_info['hosts']:
-        host_dict = get_hosts(id=host.id)[0]
-        other_labels = host_dict['labels']
+        host_dict = dict(host_dicts_by_id[host.id])
+        other_labels = list(host_dict['labels'])
         if host_dict['platform']:
             other_labels.remove(host_dict['platform'])
         host_dict['other_labels'] = ', '.join(other_labels)
@@ -770,6 +842,9 @@ def get_motd():
     return rpc_utils.get_motd()
 
 
+@rpc_utils.cached_rpc(ttl=60, invalidated_by=(
+        _STATIC_DATA_CHANGES + _LABEL_CHANGES + _ATOMIC_GROUP_CHANGES +
+        _ACL_CHANGES))
 def get_static_data():
     """\
     Returns a dictionary containing a bunch of data that shouldn't change
@@ -46,6 +46,9 @@ class RpcInterfaceTest(unittest.TestCase,
                           ['host1', 'host2'])
         self.assertRaises(model_logic.ValidationError,
                           rpc_interface.host_add_labels, 'host1', ['platform2'])
+        self.assertRaises(model_logic.ValidationError,
+                          rpc_interface.hosts_add_labels, ['host1', 'host2'],
+                          ['label1', 'platform2'])
         # make sure the platform didn't get added
         platforms = rpc_interface.get_labels(
             host__hostname__in=['host1', 'host2'], platform=True)
@@ -53,6 +56,19 @@ class RpcInterfaceTest(unittest.TestCase,
         self.assertEquals(platforms[0]['name'], 'myplatform')
 
 
+    def test_hosts_add_and_remove_labels(self):
+        rpc_interface.hosts_add_labels(['host1', 'host3'],
+                                       ['label1', 'label2'])
+        self._check_hostnames(rpc_interface.get_hosts(
+                multiple_labels=['label1', 'label2']), ['host1', 'host3'])
+
+        rpc_interface.hosts_remove_labels(['host1', 'host2', 'host3'],
+                                          ['label2'])
+        self.assertEquals([], rpc_interface.get_hosts(labels__name='label2'))
+        self._check_hostnames(rpc_interface.get_hosts(labels__name='label1'),
+                              ['host1', 'host3'])
+
+
     def _check_hostnames(self, hosts, expected_hostnames):
         self.assertEquals(set(host['hostname'] for host in hosts),
                           set(expected_hostnames))
@@ -200,6 +216,48 @@ class RpcInterfaceTest(unittest.TestCase,
         self.assertEquals(queue_entries[0].atomic_group, None)
 
 
+    def _count_queries(self, function, *args, **dargs):
+        connection.use_debug_cursor = True
+        try:
+            connection.queries = []
+            function(*args, **dargs)
+            return len(connection.queries)
+        finally:
+            connection.use_debug_cursor = None
+
+
+    def test_query_count_independent_of_hosts(self):
+        small_job = self._create_job(hosts=[1, 5], metahosts=[self.label6.id])
+        large_job = self._create_job(hosts=range(1, 10),
+                                     metahosts=[self.label6.id,
+                                                self.label7.id])
+
+        for function, args in (
+                (rpc_interface.get_info_for_clone, (False,)),
+                (rpc_interface.get_info_for_clone, (True,))):
+            self.assertEquals(
+                    self._count_queries(function, small_job.id, *args),
+                    self._count_queries(function, large_job.id, *args))
+        self.assertEquals(
+                self._count_queries(rpc_interface.get_host_queue_entries,
+                                    job=small_job.id),
+                self._count_queries(rpc_interface.get_host_queue_entries,
+                                    job=large_job.id))
+        self.assertEquals(
+                self._count_queries(rpc_interface.get_hosts,
+                                    hostname__in=['host1', 'host5']),
+                self._count_queries(rpc_interface.get_hosts))
+
+        info = rpc_interface.get_info_for_clone(large_job.id, False)
+        self.assertEquals(['host%d' % i for i in xrange(1, 10)],
+                          [host['hostname'] for host in info['hosts']])
+        self.assertEquals('label1', info['hosts'][0]['other_labels'])
+        entries = rpc_interface.get_host_queue_entries(job=large_job.id)
+        self.assertEquals(11, len(entries))
+        self.assertEquals('host9', entries[8]['host']['hostname'])
+        self.assertEquals('label7', entries[10]['meta_host'])
+
+
     def _setup_special_tasks(self):
         host = self.hosts[0]
 
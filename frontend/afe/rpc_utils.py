@@ -22,6 +22,21 @@ def prepare_for_serialization(objects):
     return _prepare_data(objects)
 
 
+def cached_rpc(ttl, invalidated_by):
+    """
+    Decorator marking a read-only RPC whose results RpcHandler may cache.
+
+    @param ttl: Number of seconds a cached result stays valid.
+    @param invalidated_by: Names of the RPCs that may change the result.
+            Calling any of them drops the cached results.
+    """
+    def decorator(function):
+        function.rpc_cache_ttl = ttl
+        function.rpc_cache_invalidated_by = tuple(invalidated_by)
+        return function
+    return decorator
+
+
 def prepare_rows_as_nested_dicts(query, nested_dict_column_names):
     """
     Prepare a Django query to be returned via RPC as a sequence of nested
@@ -34,13 +49,27 @@ def prepare_rows_as_nested_dicts(query, nested_dict_column_names):
 
     @returns An list suitable to returned in an RPC.
     """
-    all_dicts = []
-    for row in query.select_related():
-        row_dict = row.get_object_dict()
-        for column in nested_dict_column_names:
+    rows = list(query)
+    if not rows:
+        return []
+    # a constant number of queries per nested column instead of some per row
+    model = query.model
+    model.objects.populate_foreign_keys(rows, nested_dict_column_names)
+    all_dicts = model.get_object_dicts(rows)
+    for column in nested_dict_column_names:
+        related_objects = {}
+        for row in rows:
+            related_object = getattr(row, column)
+            if related_object is not None:
+                related_objects[related_object.id] = related_object
+        related_model = model._meta.get_field(column).rel.to
+        related_dicts = related_model.get_object_dicts(
+                related_objects.values())
+        dicts_by_id = dict((related_dict['id'], related_dict)
+                           for related_dict in related_dicts)
+        for row, row_dict in zip(rows, all_dicts):
             if row_dict[column] is not None:
-                row_dict[column] = getattr(row, column).get_object_dict()
-        all_dicts.append(row_dict)
+                row_dict[column] = dicts_by_id[getattr(row, column).id]
     return prepare_for_serialization(all_dicts)
 
 
@@ -73,6 +102,14 @@ def raw_http_response(response_data, content_type=None):
     return response
 
 
+def streaming_http_response(response_chunks, content_type=None):
+    """
+    Like raw_http_response(), but the content is an iterator of strings that
+    is only consumed while the response is sent.
+    """
+    return django.http.HttpResponse(response_chunks, mimetype=content_type)
+
+
 def gather_unique_dicts(dict_iterable):
     """\
     Pick out unique objects (by ID) from an iterable of object dicts.
@@ -403,6 +440,9 @@ def get_job_info(job, preserve_metahosts=False, queue_entry_filter_data=None):
     if queue_entry_filter_data:
         queue_entries = models.HostQueueEntry.query_objects(
             queue_entry_filter_data, initial_query=queue_entries)
+    queue_entries = list(queue_entries)
+    models.HostQueueEntry.objects.populate_foreign_keys(
+            queue_entries, ('host', 'meta_host', 'atomic_group'))
 
     for queue_entry in queue_entries:
         if (queue_entry.host and (preserve_metahosts or
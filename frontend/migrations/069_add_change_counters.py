@@ -0,0 +1,20 @@
+UP_SQL = """
+CREATE TABLE afe_change_counters (
+  id INT PRIMARY KEY AUTO_INCREMENT,
+  table_name VARCHAR(255) NOT NULL,
+  counter INT NOT NULL DEFAULT 0
+) ENGINE = InnoDB;
+
+ALTER TABLE afe_change_counters
+ADD CONSTRAINT afe_change_counters_unique
+UNIQUE KEY (table_name);
+
+INSERT INTO afe_change_counters (table_name) VALUES
+  ('afe_hosts'), ('afe_labels'), ('afe_host_queue_entries'),
+  ('afe_special_tasks'), ('afe_hosts_labels'), ('afe_acl_groups_hosts'),
+  ('afe_acl_groups_users');
+"""
+
+DOWN_SQL = """
+DROP TABLE IF EXISTS afe_change_counters;
+"""
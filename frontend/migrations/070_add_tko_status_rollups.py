@@ -0,0 +1,49 @@
+UP_SQL = """
+CREATE TABLE tko_status_rollups (
+  id INT PRIMARY KEY AUTO_INCREMENT,
+  group_hash CHAR(32) NOT NULL,
+  test_name VARCHAR(300) DEFAULT NULL,
+  status VARCHAR(30) DEFAULT NULL,
+  kernel VARCHAR(300) DEFAULT NULL,
+  hostname VARCHAR(255) DEFAULT NULL,
+  platform VARCHAR(240) DEFAULT NULL,
+  job_owner VARCHAR(240) DEFAULT NULL,
+  job_queued_day DATE DEFAULT NULL,
+  test_finished_day DATE DEFAULT NULL,
+  test_count INT NOT NULL DEFAULT 0,
+  latest_test_idx INT DEFAULT NULL
+) ENGINE = InnoDB;
+
+ALTER TABLE tko_status_rollups
+ADD CONSTRAINT tko_status_rollups_unique
+UNIQUE KEY (group_hash);
+
+CREATE INDEX tko_status_rollups_test_name
+ON tko_status_rollups (test_name);
+
+CREATE INDEX tko_status_rollups_hostname
+ON tko_status_rollups (hostname);
+
+CREATE INDEX tko_status_rollups_job_queued_day
+ON tko_status_rollups (job_queued_day);
+
+INSERT INTO tko_status_rollups (group_hash, test_name, status, kernel,
+                                hostname, platform, job_owner, job_queued_day,
+                                test_finished_day, test_count,
+                                latest_test_idx)
+SELECT MD5(CONCAT_WS(CHAR(9), IFNULL(test_name, CHAR(1)),
+                     IFNULL(status, CHAR(1)), IFNULL(kernel, CHAR(1)),
+                     IFNULL(hostname, CHAR(1)), IFNULL(platform, CHAR(1)),
+                     IFNULL(job_owner, CHAR(1)),
+                     IFNULL(DATE(job_queued_time), CHAR(1)),
+                     IFNULL(DATE(test_finished_time), CHAR(1)))),
+       MIN(test_name), MIN(status), MIN(kernel), MIN(hostname),
+       MIN(platform), MIN(job_owner), MIN(DATE(job_queued_time)),
+       MIN(DATE(test_finished_time)), COUNT(*), MAX(test_idx)
+FROM tko_test_view_2
+GROUP BY 1;
+"""
+
+DOWN_SQL = """
+DROP TABLE IF EXISTS tko_status_rollups;
+"""
@@ -1,3 +1,4 @@
+import re
 from django.db import models as dbmodels, connection
 from django.utils import datastructures
 from autotest_lib.frontend.afe import model_logic, readonly_connection
@@ -284,6 +285,125 @@ class EmbeddedGraphingQuery(dbmodels.Model, model_logic.ModelExtensions):
         db_table = 'tko_embedded_graphing_queries'
 
 
+class StatusRollupManager(TempManager):
+    def get_query_set(self):
+        query = super(StatusRollupManager, self).get_query_set()
+
+        # select the day columns under the names TestView uses for them
+        return query.extra(select=self.model.day_fields)
+
+
+    def get_query_set_with_joins(self, filter_data):
+        """
+        Counterpart of TestViewManager.get_query_set_with_joins().  Rollups
+        have nothing to join, so this only drops the (empty) join parameters.
+        """
+        for key in self.model.join_keys:
+            filter_data.pop(key, None)
+        return self.get_query_set()
+
+
+    def get_count_sql(self, query):
+        return (self._GROUP_COUNT_NAME,
+                'CAST(SUM(%s) AS SIGNED)' % self.get_key_on_this_table(
+                        'test_count'))
+
+
+    def get_latest_test_sql(self):
+        return 'MAX(%s)' % self.get_key_on_this_table('latest_test_idx')
+
+
+class StatusRollup(dbmodels.Model, model_logic.ModelExtensions):
+    """
+    Number of tests and latest test_idx for each combination of the
+    TestView fields below.  Maintained by the TKO parser (see tko/db.py), so
+    it can answer grouped counts over TestView without scanning it.
+    """
+    # TestView fields available under the same name
+    view_fields = ['test_name', 'status', 'kernel', 'hostname', 'platform',
+                   'job_owner']
+    # TestView day fields, mapped to the columns holding them
+    day_fields = {'DATE(job_queued_time)': 'job_queued_day',
+                  'DATE(test_finished_time)': 'test_finished_day'}
+
+    group_hash = dbmodels.CharField(max_length=32, unique=True)
+    test_name = dbmodels.CharField(null=True, blank=True, max_length=300)
+    status = dbmodels.CharField(null=True, blank=True, max_length=30)
+    kernel = dbmodels.CharField(null=True, blank=True, max_length=300)
+    hostname = dbmodels.CharField(null=True, blank=True, max_length=255)
+    platform = dbmodels.CharField(null=True, blank=True, max_length=240)
+    job_owner = dbmodels.CharField(null=True, blank=True, max_length=240)
+    job_queued_day = dbmodels.DateField(null=True, blank=True)
+    test_finished_day = dbmodels.DateField(null=True, blank=True)
+    test_count = dbmodels.IntegerField(default=0)
+    latest_test_idx = dbmodels.IntegerField(null=True, blank=True)
+
+    objects = StatusRollupManager()
+
+    # filter_data keys which add joins to TestView queries
+    join_keys = ('test_attribute_fields', 'test_label_fields',
+                 'machine_label_fields', 'iteration_result_fields',
+                 'job_keyval_fields', 'iteration_attribute_fields',
+                 'include_labels', 'exclude_labels',
+                 'include_attributes_where', 'exclude_attributes_where')
+    _FILTER_LOOKUPS = ('exact', 'iexact', 'in', 'contains', 'icontains',
+                       'startswith', 'istartswith', 'endswith', 'iendswith',
+                       'isnull')
+    _SQL_KEYWORDS = ('and', 'or', 'not', 'in', 'like', 'is', 'null',
+                     'between', 'regexp')
+    _QUOTED_SQL_RE = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"")
+    _SQL_IDENTIFIER_RE = re.compile(r'[A-Za-z_][A-Za-z0-9_.]*')
+
+    @classmethod
+    def _where_is_covered(cls, extra_where):
+        unquoted = cls._QUOTED_SQL_RE.sub('', extra_where)
+        for identifier in cls._SQL_IDENTIFIER_RE.findall(unquoted):
+            if (identifier not in cls.view_fields
+                and identifier.lower() not in cls._SQL_KEYWORDS):
+                return False
+        return True
+
+
+    @classmethod
+    def _filter_is_covered(cls, key):
+        parts = key.split('__')
+        if parts[0] not in cls.view_fields or len(parts) > 2:
+            return False
+        return len(parts) == 1 or parts[1] in cls._FILTER_LOOKUPS
+
+
+    @classmethod
+    def covers(cls, group_fields, filter_data):
+        """
+        Check whether a grouped TestView query can be answered from the
+        rollups instead.
+
+        @param group_fields: The TestView fields the query groups by.
+        @param filter_data: The TestView filter_data of the query.
+        """
+        for field in group_fields:
+            if field not in cls.view_fields and field not in cls.day_fields:
+                return False
+        special_params, regular_filters = cls._extract_special_params(
+                filter_data)
+        for key, value in regular_filters.iteritems():
+            if key in cls.join_keys:
+                if value:
+                    return False
+            elif not cls._filter_is_covered(key):
+                return False
+        if special_params.get('extra_args'):
+            return False
+        for field in special_params.get('sort_by', []):
+            if field.lstrip('-') not in cls.view_fields:
+                return False
+        return cls._where_is_covered(special_params.get('extra_where') or '')
+
+
+    class Meta:
+        db_table = 'tko_status_rollups'
+
+
 # views
 
 class TestViewManager(TempManager):
@@ -296,6 +416,10 @@ class TestViewManager(TempManager):
         return query.extra(select=extra_select)
 
 
+    def get_latest_test_sql(self):
+        return 'MAX(%s)' % self.get_key_on_this_table('test_idx')
+
+
     def _get_include_exclude_suffix(self, exclude):
         if exclude:
             return '_exclude'
@@ -4,6 +4,12 @@ from autotest_lib.frontend.afe import rpc_utils, model_logic
 from autotest_lib.frontend.afe import models as afe_models, readonly_connection
 from autotest_lib.frontend.tko import models, tko_rpc_utils, graphing_utils
 from autotest_lib.frontend.tko import preconfigs
+from autotest_lib.client.common_lib import global_config
+
+# RPCs changing the test labels the results of the cached RPCs depend on
+_TEST_LABEL_CHANGES = ('add_test_label', 'modify_test_label',
+                       'delete_test_label', 'test_label_add_tests',
+                       'test_label_remove_tests')
 
 # table/spreadsheet view support
 
@@ -16,6 +22,27 @@ def get_num_test_views(**filter_data):
     return models.TestView.query_count(filter_data)
 
 
+def _use_status_rollups():
+    return global_config.global_config.get_config_value(
+            'AUTOTEST_WEB', 'use_tko_status_rollups', type=bool,
+            default=False)
+
+
+def _get_group_model(group_by, filter_data, extra_select_fields=None):
+    """
+    Pick the model to answer a grouped query from: models.StatusRollup if
+    it is enabled and covers the grouping, filters and extra selects, else
+    models.TestView.  Must be called before filter_data is consumed.
+    """
+    if (extra_select_fields in (None, tko_rpc_utils.STATUS_FIELDS)
+        and _use_status_rollups()
+        and models.StatusRollup.covers(group_by, filter_data)):
+        return models.StatusRollup
+    return models.TestView
+
+
+@rpc_utils.cached_rpc(ttl=30, invalidated_by=(_TEST_LABEL_CHANGES +
+                                              ('set_test_attribute',)))
 def get_group_counts(group_by, header_groups=None, fixed_headers=None,
                      extra_select_fields=None, **filter_data):
     """
@@ -41,15 +68,18 @@ def get_group_counts(group_by, header_groups=None, fixed_headers=None,
       The keys for the extra_select_fields are determined by the "AS" alias of
       the field.
     """
-    query = models.TestView.objects.get_query_set_with_joins(filter_data)
+    model = _get_group_model(group_by, filter_data, extra_select_fields)
+    if model is models.StatusRollup and extra_select_fields:
+        extra_select_fields = tko_rpc_utils.ROLLUP_STATUS_FIELDS
+    query = model.objects.get_query_set_with_joins(filter_data)
     # don't apply presentation yet, since we have extra selects to apply
-    query = models.TestView.query_objects(filter_data, initial_query=query,
-                                          apply_presentation=False)
-    count_alias, count_sql = models.TestView.objects.get_count_sql(query)
+    query = model.query_objects(filter_data, initial_query=query,
+                                apply_presentation=False)
+    count_alias, count_sql = model.objects.get_count_sql(query)
     query = query.extra(select={count_alias: count_sql})
     if extra_select_fields:
         query = query.extra(select=extra_select_fields)
-    query = models.TestView.apply_presentation(query, filter_data)
+    query = model.apply_presentation(query, filter_data)
 
     group_processor = tko_rpc_utils.GroupDataProcessor(query, group_by,
                                                        header_groups or [],
@@ -58,15 +88,20 @@ def get_group_counts(group_by, header_groups=None, fixed_headers=None,
     return rpc_utils.prepare_for_serialization(group_processor.get_info_dict())
 
 
+@rpc_utils.cached_rpc(ttl=30, invalidated_by=(_TEST_LABEL_CHANGES +
+                                              ('set_test_attribute',)))
 def get_num_groups(group_by, **filter_data):
     """
     Gets the count of unique groups with the given grouping fields.
     """
-    query = models.TestView.objects.get_query_set_with_joins(filter_data)
-    query = models.TestView.query_objects(filter_data, initial_query=query)
-    return models.TestView.objects.get_num_groups(query, group_by)
+    model = _get_group_model(group_by, filter_data)
+    query = model.objects.get_query_set_with_joins(filter_data)
+    query = model.query_objects(filter_data, initial_query=query)
+    return model.objects.get_num_groups(query, group_by)
 
 
+@rpc_utils.cached_rpc(ttl=30, invalidated_by=(_TEST_LABEL_CHANGES +
+                                              ('set_test_attribute',)))
 def get_status_counts(group_by, header_groups=[], fixed_headers={},
                       **filter_data):
     """
@@ -80,6 +115,8 @@ def get_status_counts(group_by, header_groups=[], fixed_headers={},
                             **filter_data)
 
 
+@rpc_utils.cached_rpc(ttl=30, invalidated_by=(_TEST_LABEL_CHANGES +
+                                              ('set_test_attribute',)))
 def get_latest_tests(group_by, header_groups=[], fixed_headers={},
                      extra_info=[], **filter_data):
     """
@@ -92,16 +129,14 @@ def get_latest_tests(group_by, header_groups=[], fixed_headers={},
                       field of the return dictionary.
     """
     # find latest test per group
-    initial_query = models.TestView.objects.get_query_set_with_joins(
-            filter_data)
-    query = models.TestView.query_objects(filter_data,
-                                          initial_query=initial_query,
-                                          apply_presentation=False)
+    model = _get_group_model(group_by, filter_data)
+    initial_query = model.objects.get_query_set_with_joins(filter_data)
+    query = model.query_objects(filter_data, initial_query=initial_query,
+                                apply_presentation=False)
     query = query.exclude(status__in=tko_rpc_utils._INVALID_STATUSES)
     query = query.extra(
-            select={'latest_test_idx' : 'MAX(%s)' %
-                    models.TestView.objects.get_key_on_this_table('test_idx')})
-    query = models.TestView.apply_presentation(query, filter_data)
+            select={'max_test_idx' : model.objects.get_latest_test_sql()})
+    query = model.apply_presentation(query, filter_data)
 
     group_processor = tko_rpc_utils.GroupDataProcessor(query, group_by,
                                                        header_groups,
@@ -110,11 +145,14 @@ def get_latest_tests(group_by, header_groups=[], fixed_headers={},
     info = group_processor.get_info_dict()
 
     # fetch full info for these tests so we can access their statuses
-    all_test_ids = [group['latest_test_idx'] for group in info['groups']]
-    test_views = initial_query.in_bulk(all_test_ids)
+    all_test_ids = [group['max_test_idx'] for group in info['groups']]
+    if model is models.TestView:
+        test_views = initial_query.in_bulk(all_test_ids)
+    else:
+        test_views = models.TestView.objects.in_bulk(all_test_ids)
 
     for group_dict in info['groups']:
-        test_idx = group_dict.pop('latest_test_idx')
+        test_idx = group_dict.pop('max_test_idx')
         group_dict['test_idx'] = test_idx
         test_view = test_views[test_idx]
 
@@ -378,6 +416,7 @@ def get_motd():
     return rpc_utils.get_motd()
 
 
+@rpc_utils.cached_rpc(ttl=60, invalidated_by=_TEST_LABEL_CHANGES)
 def get_static_data():
     result = {}
     group_fields = []
@@ -609,5 +609,69 @@ class RpcInterfaceTest(unittest.TestCase, TkoTestMixin):
                 iteration_result_fields=['hyphen-result'])
 
 
+    def _create_status_rollups(self):
+        # mirror the groups the parser maintains for the initial data
+        for test in models.TestView.objects.all():
+            group = dict((field, getattr(test, field))
+                         for field in models.StatusRollup.view_fields)
+            rollup, _ = models.StatusRollup.objects.get_or_create(
+                    group_hash=str(sorted(group.items())), **group)
+            rollup.test_count += 1
+            rollup.latest_test_idx = max(rollup.latest_test_idx,
+                                         test.test_idx)
+            rollup.save()
+        self.god.stub_with(rpc_interface, '_use_status_rollups', lambda: True)
+
+
+    _GROUP_RESULT_KEYS = ('id', 'group_count', 'pass_count', 'complete_count',
+                          'incomplete_count', 'header_indices', 'extra_info')
+
+
+    def _strip_group_results(self, result):
+        # group dicts also carry whatever other columns the model selects
+        if not isinstance(result, dict):
+            return result
+        groups = [dict((key, group[key]) for key in self._GROUP_RESULT_KEYS
+                       if key in group)
+                  for group in result['groups']]
+        return result['header_values'], groups
+
+
+    def _get_status_rollup_results(self, function, *args, **dargs):
+        view_result = function(*args, **dargs)
+        self._create_status_rollups()
+        # the rollups must be used whenever they cover the query
+        self.god.stub_with(models.TestView.objects, 'get_query_set_with_joins',
+                           None)
+        rollup_result = function(*args, **dargs)
+        self.assertEquals(self._strip_group_results(view_result),
+                          self._strip_group_results(rollup_result))
+        return rollup_result
+
+
+    def test_status_rollups(self):
+        counts = self._get_status_rollup_results(
+                rpc_interface.get_status_counts, ['test_name', 'hostname'],
+                header_groups=[('test_name',)], status='GOOD',
+                extra_where="hostname = 'myhost'")
+        self.assertEquals([1, 1], [group['pass_count']
+                                   for group in counts['groups']])
+        self.assertEquals(2, self._get_status_rollup_results(
+                rpc_interface.get_num_groups,
+                ['kernel', 'DATE(job_queued_time)']))
+        latest = self._get_status_rollup_results(
+                rpc_interface.get_latest_tests, ['kernel'],
+                extra_info=['job_tag'])
+        self.assertEquals([2, 3], [group['test_idx']
+                                   for group in latest['groups']])
+
+
+    def test_status_rollups_fallback(self):
+        self._create_status_rollups()
+        counts = rpc_interface.get_group_counts(['job_name'])
+        self.assertEquals([2, 1], [group['group_count']
+                                   for group in counts['groups']])
+
+
 if __name__ == '__main__':
     unittest.main()
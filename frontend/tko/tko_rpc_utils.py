@@ -57,6 +57,15 @@ _INCOMPLETE_COUNT_SQL = 'COUNT(IF(status="RUNNING", 1, NULL))'
 STATUS_FIELDS = {_PASS_COUNT_NAME : _PASS_COUNT_SQL,
                  _COMPLETE_COUNT_NAME : _COMPLETE_COUNT_SQL,
                  _INCOMPLETE_COUNT_NAME : _INCOMPLETE_COUNT_SQL}
+# the same counts computed over models.StatusRollup groups
+ROLLUP_STATUS_FIELDS = {
+        _PASS_COUNT_NAME :
+                'CAST(SUM(IF(status="GOOD", test_count, 0)) AS SIGNED)',
+        _COMPLETE_COUNT_NAME :
+                'CAST(SUM(IF(status NOT IN ("TEST_NA", "RUNNING", '
+                '"NOSTATUS"), test_count, 0)) AS SIGNED)',
+        _INCOMPLETE_COUNT_NAME :
+                'CAST(SUM(IF(status="RUNNING", test_count, 0)) AS SIGNED)'}
 _INVALID_STATUSES = ('TEST_NA', 'NOSTATUS')
 
 
@@ -123,7 +132,7 @@ class GroupDataProcessor(object):
 
     def _fetch_data(self):
         self._restrict_header_values()
-        self._group_dicts = models.TestView.objects.execute_group_query(
+        self._group_dicts = self._query.model.objects.execute_group_query(
             self._query, self._group_by)
 
 
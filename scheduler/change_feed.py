@@ -0,0 +1,94 @@
+"""
+Change feed used by the Dispatcher to avoid re-reading unchanged tables.
+
+The frontend models bump a per-table counter in afe_change_counters whenever
+they modify a table the scheduler polls, and scheduler_models counts the
+modifications the scheduler makes itself.  A poller that found nothing to do
+last time only needs to query again once one of the tables it reads has
+changed.  Every resync_interval_secs all pollers run regardless, as a safety
+net for writers that bypass both mechanisms (e.g. manual SQL).
+"""
+
+import time
+try:
+    import autotest.common as common
+except ImportError:
+    import common
+from autotest_lib.frontend.afe import models
+from autotest_lib.scheduler import scheduler_models
+
+
+class ChangeFeed(object):
+    def __init__(self, resync_interval_secs, now_func=time.time):
+        """
+        @param resync_interval_secs: Seconds between ticks on which every
+                poller runs regardless of changes.  0 disables the feed.
+        @param now_func: A time.time like function.  Used for testing.
+        """
+        self._resync_interval_secs = resync_interval_secs
+        self._now_func = now_func
+        self._next_resync_time = 0
+        # Until the first refresh() we know nothing about the tables.
+        self._full_resync = True
+        self._db_counts = {}
+        # poller name -> (found_rows, {table: count}) as of its last poll
+        self._last_polls = {}
+        # poller name -> {table: count} as of its in-progress poll
+        self._pending_polls = {}
+
+
+    def refresh(self):
+        """
+        Read the current counters.  Called once at the start of every tick.
+        """
+        now = self._now_func()
+        self._full_resync = (not self._resync_interval_secs
+                             or now >= self._next_resync_time)
+        if self._full_resync:
+            self._next_resync_time = now + self._resync_interval_secs
+        self._db_counts = self._read_db_counts()
+
+
+    def _read_db_counts(self):
+        return models.ChangeCounter.get_counters()
+
+
+    def _read_local_counts(self):
+        return scheduler_models.get_local_change_counts()
+
+
+    def _current_counts(self, tables):
+        local_counts = self._read_local_counts()
+        return dict((table, (self._db_counts.get(table, 0),
+                             local_counts.get(table, 0)))
+                    for table in tables)
+
+
+    def needs_poll(self, poller, tables):
+        """
+        Decide whether a poller has to query its tables this tick.  If so, the
+        caller must report the outcome with finish_poll().
+
+        @param poller: A name identifying the polling query.
+        @param tables: The names of the tables the query depends on.
+        @returns True if the query may return rows.
+        """
+        counts = self._current_counts(tables)
+        last_poll = self._last_polls.get(poller)
+        if not self._full_resync and last_poll:
+            last_found_rows, last_counts = last_poll
+            if not last_found_rows and last_counts == counts:
+                return False
+        self._pending_polls[poller] = counts
+        return True
+
+
+    def finish_poll(self, poller, found_rows):
+        """
+        Record the outcome of a poll allowed by needs_poll().
+
+        @param poller: The name passed to needs_poll().
+        @param found_rows: True if the query returned any rows.
+        """
+        counts = self._pending_polls.pop(poller)
+        self._last_polls[poller] = (found_rows, counts)
@@ -0,0 +1,116 @@
+#!/usr/bin/python
+
+"""Tests for autotest_lib.scheduler.change_feed."""
+
+import common
+from autotest_lib.frontend import setup_django_environment
+from autotest_lib.frontend import setup_test_environment
+from autotest_lib.client.common_lib.test_utils import unittest
+from autotest_lib.scheduler import change_feed
+
+
+class MockChangeFeed(change_feed.ChangeFeed):
+    def __init__(self, *args, **kwargs):
+        super(MockChangeFeed, self).__init__(*args, **kwargs)
+        self.db_counts = {}
+        self.local_counts = {}
+
+
+    def _read_db_counts(self):
+        return dict(self.db_counts)
+
+
+    def _read_local_counts(self):
+        return dict(self.local_counts)
+
+
+class ChangeFeedTest(unittest.TestCase):
+    _TABLES = ('table1', 'table2')
+
+    def setUp(self):
+        self.now = 1000
+        self.feed = MockChangeFeed(60, now_func=lambda: self.now)
+
+
+    def _poll(self, found_rows=False):
+        if not self.feed.needs_poll('poller', self._TABLES):
+            return False
+        self.feed.finish_poll('poller', found_rows)
+        return True
+
+
+    def _tick(self, seconds=1):
+        self.now += seconds
+        self.feed.refresh()
+
+
+    def test_polls_before_first_refresh(self):
+        self.assertTrue(self._poll())
+        self.assertTrue(self._poll())
+
+
+    def test_skips_unchanged_empty_poll(self):
+        self._tick()
+        self.assertTrue(self._poll())
+        self._tick()
+        self.assertFalse(self._poll())
+
+
+    def test_keeps_polling_while_rows_are_found(self):
+        self._tick()
+        self.assertTrue(self._poll(found_rows=True))
+        self._tick()
+        self.assertTrue(self._poll())
+        self._tick()
+        self.assertFalse(self._poll())
+
+
+    def test_db_change(self):
+        self._tick()
+        self._poll()
+        self.feed.db_counts['table2'] = 1
+        self._tick()
+        self.assertTrue(self._poll())
+        self._tick()
+        self.assertFalse(self._poll())
+
+
+    def test_untracked_table_change(self):
+        self._tick()
+        self._poll()
+        self.feed.db_counts['other_table'] = 1
+        self.feed.local_counts['other_table'] = 1
+        self._tick()
+        self.assertFalse(self._poll())
+
+
+    def test_local_change_within_tick(self):
+        self._tick()
+        self._poll()
+        self._tick()
+        self.feed.local_counts['table1'] = 1
+        self.assertTrue(self._poll())
+        self.assertFalse(self._poll())
+
+
+    def test_periodic_resync(self):
+        self._tick()
+        self._poll()
+        self._tick(30)
+        self.assertFalse(self._poll())
+        self._tick(30)
+        self.assertTrue(self._poll())
+        self._tick()
+        self.assertFalse(self._poll())
+
+
+    def test_disabled(self):
+        self.feed = MockChangeFeed(0, now_func=lambda: self.now)
+        self._tick()
+        self._poll()
+        self._tick()
+        self.assertTrue(self._poll())
+
+
+if __name__ == '__main__':
+    unittest.main()
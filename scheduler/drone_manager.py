@@ -1,4 +1,5 @@
 import os, re, shutil, signal, subprocess, errno, time, heapq, traceback
+import sys, threading
 try:
     import autotest.common as common
 except ImportError:
@@ -128,6 +129,49 @@ class _DroneHeapWrapper(object):
         return cmp(self.drone.used_capacity(), other.drone.used_capacity())
 
 
+class _AsyncDroneCall(object):
+    """
+    Runs function(drone) in a daemon thread so that calls to several drones
+    can proceed concurrently.
+    """
+    def __init__(self, drone, function):
+        self.drone = drone
+        self._function = function
+        self._result = None
+        self._exc_info = None
+        self._thread = threading.Thread(target=self._run,
+                                        name='drone %s' % drone.hostname)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+
+    def _run(self):
+        try:
+            self._result = self._function(self.drone)
+        except Exception:
+            # re-raised in the calling thread by get_result()
+            self._exc_info = sys.exc_info()
+
+
+    def wait(self, timeout):
+        self._thread.join(timeout)
+
+
+    def is_running(self):
+        return self._thread.isAlive()
+
+
+    def get_result(self):
+        """
+        @returns The return value of the call.
+        @raises Whatever exception the call raised.
+        """
+        assert not self.is_running()
+        if self._exc_info:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+
 class DroneManager(object):
     """
     This class acts as an interface from the scheduler to drones, whether it be
@@ -156,6 +200,14 @@ class DroneManager(object):
         self._attached_files = {}
         # heapq of _DroneHeapWrappers
         self._drone_queue = []
+        # maps Drone to the _AsyncDroneCall it has been stuck in since it
+        # timed out
+        self._degraded_drones = {}
+        # maps Drone to the results of its last completed refresh
+        self._last_refresh_results = {}
+        # maps Drone to the refresh_id of its last completed incremental
+        # refresh, against which its next refresh reports pidfile changes
+        self._last_refresh_ids = {}
 
 
     def initialize(self, base_results_dir, drone_hostnames,
@@ -214,7 +266,10 @@ class DroneManager(object):
 
 
     def _remove_drone(self, hostname):
-        self._drones.pop(hostname, None)
+        drone = self._drones.pop(hostname, None)
+        self._degraded_drones.pop(drone, None)
+        self._last_refresh_results.pop(drone, None)
+        self._last_refresh_ids.pop(drone, None)
 
 
     def refresh_drone_configs(self):
@@ -273,13 +328,115 @@ class DroneManager(object):
         self._drone_queue = []
 
 
+    def _get_drone_call_timeout(self):
+        """
+        @returns: Seconds a drone may take to finish its calls in one cycle
+                before it is considered degraded.
+        """
+        return global_config.global_config.get_config_value(
+                scheduler_config.CONFIG_SECTION, 'drone_call_timeout_secs',
+                type=int, default=300)
+
+
+    def _is_degraded(self, drone):
+        stuck_call = self._degraded_drones.get(drone)
+        if stuck_call is None:
+            return False
+        if stuck_call.is_running():
+            return True
+
+        del self._degraded_drones[drone]
+        logging.warning('Drone %s finished its timed out call, no longer '
+                        'degraded', drone.hostname)
+        try:
+            stuck_call.get_result()
+        except Exception:
+            logging.exception('Timed out call on drone %s failed',
+                              drone.hostname)
+        return False
+
+
+    def _mark_degraded(self, drone_call):
+        drone = drone_call.drone
+        self._degraded_drones[drone] = drone_call
+        subject = 'Drone %s degraded' % drone.hostname
+        message = ('Drone %s did not finish its calls within %d seconds. It '
+                   'will be skipped until they complete.' %
+                   (drone.hostname, self._get_drone_call_timeout()))
+        logging.error(message)
+        email_manager.manager.enqueue_notify_email(subject, message)
+
+
+    def _call_drones_in_parallel(self, drones, function):
+        """
+        Call function(drone) for all the given drones concurrently.
+
+        Drones still stuck in a call that timed out on an earlier cycle are
+        skipped.  Drones whose call does not finish within the drone call
+        timeout are marked degraded and left out of the results.
+
+        @returns A dict mapping each drone whose call finished to its
+                _AsyncDroneCall.
+        """
+        drone_calls = [_AsyncDroneCall(drone, function) for drone in drones
+                       if not self._is_degraded(drone)]
+        deadline = time.time() + self._get_drone_call_timeout()
+        finished_calls = {}
+        for drone_call in drone_calls:
+            drone_call.wait(max(deadline - time.time(), 0))
+            if drone_call.is_running():
+                self._mark_degraded(drone_call)
+            else:
+                finished_calls[drone_call.drone] = drone_call
+        return finished_calls
+
+
     def _call_all_drones(self, method, *args, **kwargs):
+        def call_drone(drone):
+            return drone.call(method, *args, **kwargs)
+        drone_calls = self._call_drones_in_parallel(self.get_drones(),
+                                                    call_drone)
         all_results = {}
-        for drone in self.get_drones():
-            all_results[drone] = drone.call(method, *args, **kwargs)
+        for drone, drone_call in drone_calls.iteritems():
+            all_results[drone] = drone_call.get_result()
         return all_results
 
 
+    def _apply_refresh_changes(self, drone, results):
+        """
+        Turn the results of an incremental refresh back into full ones, using
+        the pidfiles from the drone's last refresh.
+
+        @param drone: The drone the results came from.
+        @param results: The dict returned by DroneUtility.refresh().
+        @returns The results with complete pidfiles and pidfiles_second_read.
+        """
+        if 'refresh_id' not in results:
+            # full results
+            self._last_refresh_ids.pop(drone, None)
+            return results
+
+        last_results = self._last_refresh_results.get(drone)
+        base_refresh_id = results['base_refresh_id']
+        if (base_refresh_id is not None and last_results
+                and base_refresh_id == self._last_refresh_ids.get(drone)):
+            last_pidfiles = last_results[0]['pidfiles']
+        else:
+            last_pidfiles = {}
+        pidfiles = drone_utility.apply_pidfile_changes(
+                last_pidfiles, results['pidfiles'],
+                results['pidfiles_removed'])
+        pidfiles_second_read = drone_utility.apply_pidfile_changes(
+                pidfiles, results['pidfiles_second_read'],
+                results['pidfiles_second_read_removed'])
+        self._last_refresh_ids[drone] = results['refresh_id']
+
+        results = dict(results)
+        results['pidfiles'] = pidfiles
+        results['pidfiles_second_read'] = pidfiles_second_read
+        return results
+
+
     def _parse_pidfile(self, drone, raw_contents):
         contents = PidfileContents()
         if not raw_contents:
@@ -353,9 +510,22 @@ class DroneManager(object):
         self._drop_old_pidfiles()
         pidfile_paths = [pidfile_id.path
                          for pidfile_id in self._registered_pidfile_info]
-        all_results = self._call_all_drones('refresh', pidfile_paths)
+        def refresh_drone(drone):
+            return drone.call('refresh', pidfile_paths, incremental=True,
+                              last_refresh_id=self._last_refresh_ids.get(drone))
+        drone_calls = self._call_drones_in_parallel(self.get_drones(),
+                                                    refresh_drone)
+        for drone, drone_call in drone_calls.iteritems():
+            results = drone_call.get_result()[0]
+            self._last_refresh_results[drone] = [
+                    self._apply_refresh_changes(drone, results)]
 
-        for drone, results_list in all_results.iteritems():
+        for drone in self.get_drones():
+            # degraded drones keep their last known state, so their processes
+            # are not mistaken for lost ones
+            results_list = self._last_refresh_results.get(drone)
+            if results_list is None:
+                continue
             results = results_list[0]
 
             for process_info in results['autoserv_processes']:
@@ -368,20 +538,31 @@ class DroneManager(object):
                                    self._pidfiles_second_read)
 
             self._compute_active_processes(drone)
-            if drone.enabled:
+            if drone.enabled and drone not in self._degraded_drones:
                 self._enqueue_drone(drone)
 
 
     def execute_actions(self):
         """
         Called at the end of a scheduler cycle to execute all queued actions
-        on drones.
+        on drones.  The drones run their calls concurrently, and the results
+        repository runs its calls once they all finished, as those copy the
+        results the drones produced.  Calls queued for a degraded drone are
+        kept until it recovers.
         """
-        for drone in self._drones.values():
+        def execute_drone_calls(drone):
             drone.execute_queued_calls()
-
+        drone_calls = self._call_drones_in_parallel(self._drones.values(),
+                                                    execute_drone_calls)
+        for drone_call in drone_calls.itervalues():
+            drone_call.get_result()
+
+        results_drone_calls = self._call_drones_in_parallel(
+                [self._results_drone], execute_drone_calls)
+        if self._results_drone not in results_drone_calls:
+            return
         try:
-            self._results_drone.execute_queued_calls()
+            results_drone_calls[self._results_drone].get_result()
         except error.AutoservError:
             warning = ('Results repository failed to execute calls:\n' +
                        traceback.format_exc())
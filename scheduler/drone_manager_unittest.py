@@ -1,6 +1,6 @@
 #!/usr/bin/python
 
-import os, unittest
+import os, threading, unittest
 try:
     import autotest.common as common
 except ImportError:
@@ -8,7 +8,7 @@ except ImportError:
 from autotest_lib.client.common_lib import global_config
 from autotest_lib.client.common_lib.test_utils import mock
 from autotest_lib.scheduler import drone_manager, drone_utility, drones
-from autotest_lib.scheduler import scheduler_config
+from autotest_lib.scheduler import email_manager, scheduler_config
 
 class MockDrone(drones._AbstractDrone):
     def __init__(self, name, active_processes=0, max_processes=10,
@@ -60,6 +60,35 @@ class MockDrone(drones._AbstractDrone):
                                               destination_path))
 
 
+class HangingDrone(MockDrone):
+    """A drone whose calls block until release() is called."""
+    def __init__(self, name, call_result=None):
+        super(HangingDrone, self).__init__(name)
+        self._call_result = call_result
+        self.execute_count = 0
+        self._released = threading.Event()
+        self._released.set()
+
+
+    def call(self, method, *args, **kwargs):
+        self._released.wait()
+        return self._call_result
+
+
+    def execute_queued_calls(self):
+        self.execute_count += 1
+        self._released.wait()
+        super(HangingDrone, self).execute_queued_calls()
+
+
+    def hang(self):
+        self._released.clear()
+
+
+    def release(self):
+        self._released.set()
+
+
 class DroneManager(unittest.TestCase):
     _DRONE_INSTALL_DIR = '/drone/install/dir'
     _DRONE_RESULTS_DIR = os.path.join(_DRONE_INSTALL_DIR, 'results')
@@ -333,5 +362,106 @@ class DroneManager(unittest.TestCase):
         self.assertFalse(self.manager._registered_pidfile_info)
 
 
+    def _wait_for_degraded_drone(self, drone):
+        self.manager._degraded_drones[drone].wait(timeout=None)
+
+
+    def test_refresh_degraded_drone(self):
+        self.god.stub_with(self.manager, '_get_drone_call_timeout', lambda: 0.1)
+        self.god.stub_with(email_manager.manager, 'enqueue_notify_email',
+                           lambda subject, message: None)
+        process_info = {'pid': '5', 'pgid': '5', 'ppid': '1',
+                        'comm': 'autoserv', 'args': ''}
+        drone = HangingDrone('hanging_drone',
+                             [{'pidfiles': {}, 'pidfiles_second_read': {},
+                               'autoserv_processes': [process_info],
+                               'parse_processes': []}])
+        self.manager._drones = {drone.hostname: drone}
+        process = drone_manager.Process(drone.hostname, 5)
+
+        self.manager.refresh()
+        self.assert_(self.manager.is_process_running(process))
+        self.assertEquals(1, len(self.manager._drone_queue))
+
+        drone.hang()
+        self.manager.refresh()
+        self.assert_(self.manager._is_degraded(drone))
+        # the last known state is kept, but no new work goes to the drone
+        self.assert_(self.manager.is_process_running(process))
+        self.assertEquals(0, len(self.manager._drone_queue))
+
+        drone.release()
+        self._wait_for_degraded_drone(drone)
+        self.manager.refresh()
+        self.assertFalse(self.manager._is_degraded(drone))
+        self.assertEquals(1, len(self.manager._drone_queue))
+
+
+    def test_refresh_incremental_pidfiles(self):
+        drone = MockDrone('mock_drone')
+        self.manager._drones = {drone.hostname: drone}
+        utility = drone_utility.DroneUtility()
+        self.god.stub_with(utility, '_read_pidfiles', lambda paths: pidfiles)
+        self.god.stub_with(utility, '_scan_processes',
+                           lambda *args, **dargs: {'autoserv': [],
+                                                   'parse': []})
+        refresh_calls = []
+        def call(method, *args, **kwargs):
+            refresh_calls.append(kwargs)
+            return [utility.refresh(*args, **kwargs)]
+        drone.call = call
+        pidfile_id1 = self.manager.get_pidfile_id_from('tag1', 'name')
+        pidfile_id2 = self.manager.get_pidfile_id_from('tag2', 'name')
+        self.manager.register_pidfile(pidfile_id1)
+        self.manager.register_pidfile(pidfile_id2)
+
+        pidfiles = {pidfile_id1.path: '100\n', pidfile_id2.path: '200\n'}
+        self.manager.refresh()
+        pidfiles = {pidfile_id1.path: '100\n0\n0\n'}
+        self.manager.refresh()
+
+        self.assertEqual(None, refresh_calls[0]['last_refresh_id'])
+        self.assert_(refresh_calls[1]['last_refresh_id'])
+        self.assertEqual(0, self.manager.get_pidfile_contents(
+                pidfile_id1).exit_status)
+        self.assertEqual(None, self.manager.get_pidfile_contents(
+                pidfile_id2).process)
+
+
+    def test_execute_actions_degraded_drone(self):
+        self.god.stub_with(self.manager, '_get_drone_call_timeout', lambda: 0.1)
+        self.god.stub_with(email_manager.manager, 'enqueue_notify_email',
+                           lambda subject, message: None)
+        drone = HangingDrone('hanging_drone')
+        self.manager._drones = {drone.hostname: drone}
+
+        drone.hang()
+        self.manager.execute_actions()
+        self.assert_(self.manager._is_degraded(drone))
+        # no new calls are started while the drone is stuck
+        self.manager.execute_actions()
+        self.assertEquals(1, drone.execute_count)
+
+        drone.release()
+        self._wait_for_degraded_drone(drone)
+        self.manager.execute_actions()
+        self.assertFalse(self.manager._is_degraded(drone))
+        self.assertEquals(2, drone.execute_count)
+
+
+    def test_execute_actions_results_drone_last(self):
+        executed = []
+        class RecordingDrone(MockDrone):
+            def execute_queued_calls(self):
+                executed.append(self.name)
+        drone1, drone2 = RecordingDrone('drone1'), RecordingDrone('drone2')
+        self.manager._drones = {'drone1': drone1, 'drone2': drone2}
+        self.manager._results_drone = RecordingDrone('results_drone')
+
+        self.manager.execute_actions()
+        self.assertEquals(['drone1', 'drone2'], sorted(executed[:2]))
+        self.assertEquals(['results_drone'], executed[2:])
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -57,6 +57,15 @@ class DroneUtility(object):
 
         self.warnings = []
         self._subcommands = []
+        # maps (pid, start_time) to the result of _check_pid_for_dark_mark()
+        self._dark_mark_cache = {}
+        # maps pidfile path to (stat signature, contents) as of its last read
+        self._pidfile_cache = {}
+        # identifies the pidfiles returned by the last incremental refresh()
+        self._instance_id = '%d.%f' % (os.getpid(), time.time())
+        self._refresh_count = 0
+        self._last_refresh_id = None
+        self._last_pidfiles = {}
 
 
     def initialize(self, results_dir):
@@ -87,59 +96,160 @@ class DroneUtility(object):
 
 
     _PS_ARGS = ('pid', 'pgid', 'ppid', 'comm', 'args')
+    _PROC_DIR = '/proc'
 
 
     @classmethod
-    def _get_process_info(cls):
+    def _read_proc_file(cls, pid, name):
+        file_object = open(os.path.join(cls._PROC_DIR, pid, name))
+        try:
+            return file_object.read()
+        finally:
+            file_object.close()
+
+
+    @classmethod
+    def _get_process_info(cls, command_names=None):
         """
-        @returns A generator of dicts with cls._PS_ARGS as keys and
-                string values each representing a running process.
+        Scan /proc for the processes owned by our user, like "ps x" does.
+
+        @param command_names: If not None, processes whose comm is not in
+                this collection are skipped as soon as their stat is read.
+        @returns A generator of dicts with cls._PS_ARGS and 'start_time' (in
+                clock ticks after boot) as keys and string values each
+                representing a running process.
         """
-        ps_proc = subprocess.Popen(
-            ['/bin/ps', 'x', '-o', ','.join(cls._PS_ARGS)],
-            stdout=subprocess.PIPE)
-        ps_output = ps_proc.communicate()[0]
+        uid = os.geteuid()
+        for pid in os.listdir(cls._PROC_DIR):
+            if not pid.isdigit():
+                continue
+            try:
+                stat = cls._read_proc_file(pid, 'stat')
+                # comm is in parentheses and may itself contain spaces
+                comm_start = stat.index('(') + 1
+                comm_end = stat.rindex(')')
+                comm = stat[comm_start:comm_end]
+                if command_names is not None and comm not in command_names:
+                    continue
+                if os.stat(os.path.join(cls._PROC_DIR, pid)).st_uid != uid:
+                    continue
+                cmdline = cls._read_proc_file(pid, 'cmdline')
+            except EnvironmentError:
+                # the process exited while we were looking at it
+                continue
+            # fields start at "state", the third field listed in proc(5)
+            fields = stat[comm_end + 2:].split()
+            args = cmdline.replace('\0', ' ').strip() or '[%s]' % comm
+            yield {'pid': pid, 'pgid': fields[2], 'ppid': fields[1],
+                   'comm': comm, 'args': args, 'start_time': fields[19]}
 
-        # split each line into the columns output by ps
-        split_lines = [line.split(None, 4) for line in ps_output.splitlines()]
-        return (dict(itertools.izip(cls._PS_ARGS, line_components))
-                for line_components in split_lines)
 
+    def _has_dark_mark(self, info, open):
+        start_time = info.get('start_time')
+        if start_time is None:
+            return self._check_pid_for_dark_mark(info['pid'], open=open)
+        key = (info['pid'], start_time)
+        if key not in self._dark_mark_cache:
+            self._dark_mark_cache[key] = self._check_pid_for_dark_mark(
+                    info['pid'], open=open)
+        return self._dark_mark_cache[key]
 
-    def _refresh_processes(self, command_name, open=open,
-                           site_check_parse=None):
-        # The open argument is used for test injection.
+
+    def _scan_processes(self, command_names, open=open, site_checks=None):
+        """
+        Find our processes running any of the given commands in a single
+        pass over the process table.
+
+        @param command_names: List of command names (as in ps comm) to find.
+        @param open: Used for test injection.
+        @param site_checks: Dict mapping command names to functions taking
+                a process info dict, for site specific detection of processes
+                that should be reported under that command name.
+        @returns A dict mapping each command name to a list of process info
+                dicts.
+        """
+        if site_checks is None:
+            site_checks = {}
         check_mark = global_config.global_config.get_config_value(
             'SCHEDULER', 'check_processes_for_dark_mark', bool, False)
-        processes = []
-        for info in self._get_process_info():
-            is_parse = (site_check_parse and site_check_parse(info))
-            if info['comm'] == command_name or is_parse:
-                if (check_mark and not
-                        self._check_pid_for_dark_mark(info['pid'], open=open)):
+        processes = dict((command_name, []) for command_name in command_names)
+        if site_checks:
+            # site checks need to see every process
+            process_info = self._get_process_info()
+        else:
+            process_info = self._get_process_info(command_names)
+
+        marked_processes = set()
+        for info in process_info:
+            for command_name in command_names:
+                site_check = site_checks.get(command_name)
+                if (info['comm'] == command_name or
+                        (site_check and site_check(info))):
+                    break
+            else:
+                continue
+
+            if check_mark:
+                marked_processes.add((info['pid'], info.get('start_time')))
+                if not self._has_dark_mark(info, open):
                     self._warn('%(comm)s process pid %(pid)s has no '
                                'dark mark; ignoring.' % info)
                     continue
-                processes.append(info)
+            processes[command_name].append(info)
 
+        # forget processes that have exited
+        for key in self._dark_mark_cache.keys():
+            if key not in marked_processes:
+                del self._dark_mark_cache[key]
         return processes
 
 
+    def _read_pidfile(self, pidfile_path):
+        """
+        @returns The contents of the pidfile, or None if it does not exist.
+                The file is only read if its stat signature changed since the
+                last call.
+        """
+        try:
+            stat = os.stat(pidfile_path)
+        except OSError:
+            self._pidfile_cache.pop(pidfile_path, None)
+            return None
+        signature = (stat.st_ino, stat.st_size, stat.st_mtime, stat.st_ctime)
+        cached = self._pidfile_cache.get(pidfile_path)
+        if cached and cached[0] == signature:
+            return cached[1]
+        try:
+            file_object = open(pidfile_path, 'r')
+            try:
+                contents = file_object.read()
+            finally:
+                file_object.close()
+        except IOError:
+            self._pidfile_cache.pop(pidfile_path, None)
+            return None
+        self._pidfile_cache[pidfile_path] = (signature, contents)
+        return contents
+
+
     def _read_pidfiles(self, pidfile_paths):
         pidfiles = {}
         for pidfile_path in pidfile_paths:
-            if not os.path.exists(pidfile_path):
-                continue
-            try:
-                file_object = open(pidfile_path, 'r')
-                pidfiles[pidfile_path] = file_object.read()
-                file_object.close()
-            except IOError:
-                continue
+            contents = self._read_pidfile(pidfile_path)
+            if contents is not None:
+                pidfiles[pidfile_path] = contents
         return pidfiles
 
 
-    def refresh(self, pidfile_paths):
+    def _forget_pidfiles(self, pidfile_paths):
+        """Drop cached pidfiles that are no longer being refreshed."""
+        pidfile_paths = set(pidfile_paths)
+        for pidfile_path in self._pidfile_cache.keys():
+            if pidfile_path not in pidfile_paths:
+                del self._pidfile_cache[pidfile_path]
+
+
+    def refresh(self, pidfile_paths, incremental=False, last_refresh_id=None):
         """
         pidfile_paths should be a list of paths to check for pidfiles.
 
@@ -148,21 +258,60 @@ class DroneUtility(object):
         that exist.
         * autoserv_processes: list of dicts corresponding to running autoserv
         processes.  each dict contain pid, pgid, ppid, comm, and args (see
-        "man ps" for details).
+        "man ps" for details), and start_time (see "man proc").
         * parse_processes: likewise, for parse processes.
         * pidfiles_second_read: same info as pidfiles, but gathered after the
         processes are scanned.
+
+        If incremental is True, the pidfile information is returned as
+        changes instead (see apply_pidfile_changes()):
+        * refresh_id: identifies this result for the next refresh.
+        * base_refresh_id: last_refresh_id if it identifies our last refresh,
+        otherwise None.
+        * pidfiles: pidfiles changed since the refresh identified by
+        base_refresh_id, or all of them if it is None.
+        * pidfiles_removed: paths of pidfiles that no longer exist.
+        * pidfiles_second_read, pidfiles_second_read_removed: likewise,
+        relative to pidfiles.
         """
         site_check_parse = utils.import_site_function(
                 __file__, 'autotest_lib.scheduler.site_drone_utility',
-                'check_parse', lambda x: False)
+                'check_parse', None)
+        site_checks = {}
+        if site_check_parse:
+            site_checks['parse'] = site_check_parse
+        self._forget_pidfiles(pidfile_paths)
+        pidfiles = self._read_pidfiles(pidfile_paths)
+        processes = self._scan_processes(['autoserv', 'parse'],
+                                         site_checks=site_checks)
+        pidfiles_second_read = self._read_pidfiles(pidfile_paths)
         results = {
-            'pidfiles' : self._read_pidfiles(pidfile_paths),
-            'autoserv_processes' : self._refresh_processes('autoserv'),
-            'parse_processes' : self._refresh_processes(
-                    'parse', site_check_parse=site_check_parse),
-            'pidfiles_second_read' : self._read_pidfiles(pidfile_paths),
+            'pidfiles' : pidfiles,
+            'autoserv_processes' : processes['autoserv'],
+            'parse_processes' : processes['parse'],
+            'pidfiles_second_read' : pidfiles_second_read,
         }
+        if not incremental:
+            return results
+
+        if last_refresh_id is not None and (
+                last_refresh_id == self._last_refresh_id):
+            results['base_refresh_id'] = last_refresh_id
+            previous_pidfiles = self._last_pidfiles
+        else:
+            results['base_refresh_id'] = None
+            previous_pidfiles = {}
+        self._refresh_count += 1
+        self._last_refresh_id = '%s.%d' % (self._instance_id,
+                                           self._refresh_count)
+        self._last_pidfiles = pidfiles
+
+        results['refresh_id'] = self._last_refresh_id
+        results['pidfiles'], results['pidfiles_removed'] = (
+                get_pidfile_changes(previous_pidfiles, pidfiles))
+        (results['pidfiles_second_read'],
+         results['pidfiles_second_read_removed']) = (
+                get_pidfile_changes(pidfiles, pidfiles_second_read))
         return results
 
 
@@ -396,6 +545,32 @@ class DroneUtility(object):
         return dict(results=results, warnings=warnings)
 
 
+def get_pidfile_changes(old_pidfiles, new_pidfiles):
+    """
+    @returns A tuple (changed, removed) where changed is a dict of the entries
+            of new_pidfiles that differ from old_pidfiles and removed is a
+            list of the paths only in old_pidfiles.
+    """
+    changed = dict((path, contents)
+                   for path, contents in new_pidfiles.iteritems()
+                   if old_pidfiles.get(path) != contents)
+    removed = [path for path in old_pidfiles if path not in new_pidfiles]
+    return changed, removed
+
+
+def apply_pidfile_changes(old_pidfiles, changed, removed):
+    """
+    Inverse of get_pidfile_changes().
+
+    @returns The new dict of pidfiles.
+    """
+    new_pidfiles = dict(old_pidfiles)
+    for path in removed:
+        del new_pidfiles[path]
+    new_pidfiles.update(changed)
+    return new_pidfiles
+
+
 def create_host(hostname):
     username = global_config.global_config.get_config_value(
         'SCHEDULER', hostname + '_username', default=getpass.getuser())
@@ -426,7 +601,68 @@ def return_data(data):
     print pickle.dumps(data)
 
 
+def write_frame(output_file, data):
+    """
+    Write one message of the persistent agent protocol: the length of the
+    pickled data on a line of its own, followed by the pickled data.
+    """
+    pickled_data = pickle.dumps(data, pickle.HIGHEST_PROTOCOL)
+    output_file.write('%d\n' % len(pickled_data))
+    output_file.write(pickled_data)
+    output_file.flush()
+
+
+def read_frame(input_file):
+    """
+    Read one message written by write_frame().
+
+    @returns The unpickled data, or None if input_file is at EOF.
+    @raises EOFError if input_file ends in the middle of a message.
+    """
+    header = input_file.readline()
+    if not header:
+        return None
+    length = int(header)
+    pickled_data = input_file.read(length)
+    if len(pickled_data) != length:
+        raise EOFError('Truncated message (%d of %d bytes)' %
+                       (len(pickled_data), length))
+    return pickle.loads(pickled_data)
+
+
+def serve(input_file, output_file):
+    """
+    Run as a persistent drone agent.
+
+    Executes batches of calls read from input_file with a single DroneUtility
+    and writes back one result per batch, in order, until input_file is
+    closed.  Callers may send several batches before reading any results.
+    """
+    drone_utility = DroneUtility()
+    while True:
+        calls = read_frame(input_file)
+        if calls is None:
+            return
+        write_frame(output_file, drone_utility.execute_calls(calls))
+
+
+def _protect_stdout():
+    """
+    Keep stray output of this process and its children off the protocol
+    stream by pointing fd 1 at stderr.
+
+    @returns A file object writing to the original stdout.
+    """
+    sys.stdout.flush()
+    protocol_output = os.fdopen(os.dup(sys.stdout.fileno()), 'wb')
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    return protocol_output
+
+
 def main():
+    if '--persistent' in sys.argv[1:]:
+        serve(sys.stdin, _protect_stdout())
+        return
     calls = parse_input()
     drone_utility = DroneUtility()
     return_value = drone_utility.execute_calls(calls)
@@ -2,7 +2,7 @@
 
 """Tests for drone_utility."""
 
-import os, sys, unittest
+import os, shutil, sys, tempfile, unittest
 from cStringIO import StringIO
 
 try:
@@ -35,13 +35,18 @@ class TestDroneUtility(unittest.TestCase):
                 'SCHEDULER', 'check_processes_for_dark_mark', repr(value))
 
 
-    def test_refresh_processes_ignore_dark_mark(self):
+    def _scan_fake_command(self, open):
+        return self.drone_utility._scan_processes(
+                [self._fake_command], open=open)[self._fake_command]
+
+
+    def test_scan_processes_ignore_dark_mark(self):
         self._set_check_dark_mark(False)
-        self.drone_utility._get_process_info.expect_call().and_return(
+        self.drone_utility._get_process_info.expect_call(
+                [self._fake_command]).and_return(
                 [self._fake_proc_info])
         fake_open = lambda path, mode: self.fail('dark mark checked!')
-        processes = self.drone_utility._refresh_processes(self._fake_command,
-                                                          open=fake_open)
+        processes = self._scan_fake_command(fake_open)
         our_pid = self._fake_proc_info['pid']
         for process in processes:
             if our_pid == process['pid']:
@@ -51,32 +56,239 @@ class TestDroneUtility(unittest.TestCase):
         self.god.check_playback()
 
 
-    def test_refresh_processes_check_dark_mark(self):
+    def test_scan_processes_check_dark_mark(self):
         self._set_check_dark_mark(True)
         num_procs = 2
         proc_info_list = num_procs * [self._fake_proc_info]
 
-        self.drone_utility._get_process_info.expect_call().and_return(
+        self.drone_utility._get_process_info.expect_call(
+                [self._fake_command]).and_return(
                 proc_info_list)
         # Test processes that have the mark in their env.
         def _open_mark(path, mode):
             return StringIO('foo=\0%s=\0bar=\0' %
                            drone_utility.DARK_MARK_ENVIRONMENT_VAR)
-        processes = self.drone_utility._refresh_processes(self._fake_command,
-                                                          open=_open_mark)
+        processes = self._scan_fake_command(_open_mark)
         self.assertEqual(num_procs, len(processes))
         self.assertEqual(proc_info_list, processes)
 
-        self.drone_utility._get_process_info.expect_call().and_return(
+        self.drone_utility._get_process_info.expect_call(
+                [self._fake_command]).and_return(
                 proc_info_list)
         # Test processes that do not have the mark in their env
         def _open_nomark(path, mode):
             return StringIO('foo=\0bar=\0')  # No dark mark.
-        processes = self.drone_utility._refresh_processes(self._fake_command,
-                                                          open=_open_nomark)
+        processes = self._scan_fake_command(_open_nomark)
         self.assertEqual([], processes)
         self.god.check_playback()
 
 
+    def _make_fake_proc(self, processes):
+        proc_dir = tempfile.mkdtemp()
+        for pid, comm, ppid, pgid, start_time, cmdline in processes:
+            os.mkdir(os.path.join(proc_dir, pid))
+            stat = ('%s (%s) S %s %s %s 0 -1 4194560 0 0 0 0 0 0 0 0 20 0 1 0 '
+                    '%s 0 0' % (pid, comm, ppid, pgid, pgid, start_time))
+            open(os.path.join(proc_dir, pid, 'stat'), 'w').write(stat)
+            open(os.path.join(proc_dir, pid, 'cmdline'), 'w').write(cmdline)
+        os.mkdir(os.path.join(proc_dir, 'self'))
+        self.god.stub_with(drone_utility.DroneUtility, '_PROC_DIR', proc_dir)
+        return proc_dir
+
+
+    def test_get_process_info(self):
+        self.god.unstub(self.drone_utility, '_get_process_info')
+        proc_dir = self._make_fake_proc([
+                ('10', 'autoserv', '1', '10', '500', 'autoserv\0-p\0'),
+                ('11', 'odd) name', '10', '10', '501', ''),
+                ('12', 'parse', '1', '12', '502', 'parse\0results\0')])
+        try:
+            all_info = sorted(self.drone_utility._get_process_info(),
+                              key=lambda info: info['pid'])
+            self.assertEqual(
+                    [{'pid': '10', 'pgid': '10', 'ppid': '1',
+                      'comm': 'autoserv', 'args': 'autoserv -p',
+                      'start_time': '500'},
+                     {'pid': '11', 'pgid': '10', 'ppid': '10',
+                      'comm': 'odd) name', 'args': '[odd) name]',
+                      'start_time': '501'},
+                     {'pid': '12', 'pgid': '12', 'ppid': '1',
+                      'comm': 'parse', 'args': 'parse results',
+                      'start_time': '502'}],
+                    all_info)
+            parse_info = list(self.drone_utility._get_process_info(['parse']))
+            self.assertEqual(['12'], [info['pid'] for info in parse_info])
+        finally:
+            shutil.rmtree(proc_dir)
+
+
+    def test_scan_processes_single_pass(self):
+        autoserv_info = dict(self._fake_proc_info, comm='autoserv')
+        parse_info = dict(self._fake_proc_info, comm='parse')
+        site_parse_info = dict(self._fake_proc_info, args='site parser')
+        self.drone_utility._get_process_info.expect_call().and_return(
+                [autoserv_info, parse_info, site_parse_info])
+        site_checks = {'parse': lambda info: info['args'] == 'site parser'}
+
+        processes = self.drone_utility._scan_processes(
+                ['autoserv', 'parse'], site_checks=site_checks)
+
+        self.assertEqual({'autoserv': [autoserv_info],
+                          'parse': [parse_info, site_parse_info]}, processes)
+        self.god.check_playback()
+
+
+    def test_dark_mark_cached_per_process_start(self):
+        self._set_check_dark_mark(True)
+        info = dict(self._fake_proc_info, start_time='100')
+        opened_paths = []
+        def _open_mark(path, mode):
+            opened_paths.append(path)
+            return StringIO('%s=\0' % drone_utility.DARK_MARK_ENVIRONMENT_VAR)
+
+        for _ in xrange(2):
+            self.drone_utility._get_process_info.expect_call(
+                    [self._fake_command]).and_return([info])
+            self._scan_fake_command(_open_mark)
+        self.assertEqual(1, len(opened_paths))
+
+        # a new process reusing the pid is checked again
+        self.drone_utility._get_process_info.expect_call(
+                [self._fake_command]).and_return(
+                        [dict(info, start_time='200')])
+        self._scan_fake_command(_open_mark)
+        self.assertEqual(2, len(opened_paths))
+        self.god.check_playback()
+
+
+class TestPidfileRefresh(unittest.TestCase):
+    def setUp(self):
+        self.drone_utility = drone_utility.DroneUtility()
+        self.god = mock.mock_god()
+        self.god.stub_with(self.drone_utility, '_scan_processes',
+                           lambda *args, **dargs: {'autoserv': [],
+                                                   'parse': []})
+        self.results_dir = tempfile.mkdtemp()
+
+
+    def tearDown(self):
+        self.god.unstub_all()
+        shutil.rmtree(self.results_dir)
+
+
+    def _write_pidfile(self, name, contents):
+        path = os.path.join(self.results_dir, name)
+        pidfile = open(path, 'w')
+        pidfile.write(contents)
+        pidfile.close()
+        return path
+
+
+    def test_unchanged_pidfile_not_reread(self):
+        path = self._write_pidfile('pidfile', '100\n')
+        opened_paths = []
+        real_open = open
+        def _open(path, mode):
+            opened_paths.append(path)
+            return real_open(path, mode)
+        self.god.stub_with(drone_utility, 'open', _open)
+
+        self.assertEqual({path: '100\n'},
+                         self.drone_utility._read_pidfiles([path]))
+        self.assertEqual({path: '100\n'},
+                         self.drone_utility._read_pidfiles([path]))
+        self.assertEqual([path], opened_paths)
+
+        self._write_pidfile('pidfile', '100\n0\n0\n')
+        self.assertEqual({path: '100\n0\n0\n'},
+                         self.drone_utility._read_pidfiles([path]))
+        self.assertEqual([path, path], opened_paths)
+
+
+    def test_full_refresh(self):
+        path = self._write_pidfile('pidfile', '100\n')
+        results = self.drone_utility.refresh([path])
+        self.assertEqual({path: '100\n'}, results['pidfiles'])
+        self.assertEqual({path: '100\n'}, results['pidfiles_second_read'])
+        self.assertFalse('refresh_id' in results)
+
+
+    def test_incremental_refresh(self):
+        path1 = self._write_pidfile('pidfile1', '100\n')
+        path2 = self._write_pidfile('pidfile2', '200\n')
+        paths = [path1, path2]
+
+        results = self.drone_utility.refresh(paths, incremental=True)
+        self.assertEqual(None, results['base_refresh_id'])
+        self.assertEqual({path1: '100\n', path2: '200\n'},
+                         results['pidfiles'])
+        self.assertEqual({}, results['pidfiles_second_read'])
+        first_id = results['refresh_id']
+
+        self._write_pidfile('pidfile1', '100\n0\n0\n')
+        os.remove(path2)
+        results = self.drone_utility.refresh(paths, incremental=True,
+                                             last_refresh_id=first_id)
+        self.assertEqual(first_id, results['base_refresh_id'])
+        self.assertEqual({path1: '100\n0\n0\n'}, results['pidfiles'])
+        self.assertEqual([path2], results['pidfiles_removed'])
+        self.assertNotEqual(first_id, results['refresh_id'])
+
+        # an unknown refresh id gets everything
+        results = self.drone_utility.refresh(paths, incremental=True,
+                                             last_refresh_id=first_id)
+        self.assertEqual(None, results['base_refresh_id'])
+        self.assertEqual({path1: '100\n0\n0\n'}, results['pidfiles'])
+        self.assertEqual([], results['pidfiles_removed'])
+
+
+    def test_pidfile_changes_round_trip(self):
+        old = {'a': '1\n', 'b': '2\n', 'c': '3\n'}
+        new = {'a': '1\n', 'b': '2\n0\n0\n', 'd': '4\n'}
+        changed, removed = drone_utility.get_pidfile_changes(old, new)
+        self.assertEqual({'b': '2\n0\n0\n', 'd': '4\n'}, changed)
+        self.assertEqual(['c'], removed)
+        self.assertEqual(new, drone_utility.apply_pidfile_changes(
+                old, changed, removed))
+
+
+class TestAgentProtocol(unittest.TestCase):
+    def test_frame_round_trip(self):
+        stream = StringIO()
+        drone_utility.write_frame(stream, {'results': [1, 'two']})
+        drone_utility.write_frame(stream, None)
+        stream.seek(0)
+        self.assertEqual({'results': [1, 'two']},
+                         drone_utility.read_frame(stream))
+        self.assertEqual(None, drone_utility.read_frame(stream))
+
+
+    def test_read_frame_eof(self):
+        self.assertEqual(None, drone_utility.read_frame(StringIO()))
+
+
+    def test_read_frame_truncated(self):
+        stream = StringIO()
+        drone_utility.write_frame(stream, 'some data')
+        truncated = StringIO(stream.getvalue()[:-1])
+        self.assertRaises(EOFError, drone_utility.read_frame, truncated)
+
+
+    def test_serve(self):
+        input_stream = StringIO()
+        drone_utility.write_frame(input_stream, [])
+        drone_utility.write_frame(input_stream, [])
+        input_stream.seek(0)
+        output_stream = StringIO()
+
+        drone_utility.serve(input_stream, output_stream)
+
+        output_stream.seek(0)
+        for _ in xrange(2):
+            self.assertEqual(dict(results=[], warnings=[]),
+                             drone_utility.read_frame(output_stream))
+        self.assertEqual(None, drone_utility.read_frame(output_stream))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,4 +1,4 @@
-import cPickle, os, tempfile, logging
+import cPickle, os, signal, subprocess, tempfile, logging
 try:
     import autotest.common as common
 except ImportError:
@@ -15,6 +15,91 @@ class DroneUnreachable(Exception):
     pass
 
 
+class DroneAgentError(error.AutoservError):
+    """The persistent drone agent failed or sent an invalid response."""
+    pass
+
+
+class _DroneAgent(object):
+    """
+    A long-lived drone_utility process on a remote drone, reached through a
+    single ssh session and speaking the drone_utility.write_frame() protocol.
+
+    Several batches may be sent before their results are received; results
+    come back in the order the batches were sent.
+    """
+    def __init__(self, command):
+        """
+        @param command: Shell command starting drone_utility.py --persistent.
+        """
+        self._command = command
+        self._process = None
+        self._pending_batches = 0
+
+
+    def _start(self):
+        logging.info('Starting drone agent: %s', self._command)
+        self._process = subprocess.Popen(self._command, shell=True,
+                                         stdin=subprocess.PIPE,
+                                         stdout=subprocess.PIPE,
+                                         close_fds=True)
+        self._pending_batches = 0
+
+
+    def is_running(self):
+        return self._process is not None and self._process.poll() is None
+
+
+    def send(self, calls):
+        """
+        Send a batch of calls without waiting for its results.  Restarts the
+        agent first if it has exited with no batches outstanding.
+        """
+        if not self.is_running() and not self._pending_batches:
+            self.stop()
+            self._start()
+        try:
+            drone_utility.write_frame(self._process.stdin, calls)
+        except (IOError, OSError), exc:
+            self.stop()
+            raise DroneAgentError('Failed to send calls to drone agent: %s'
+                                  % exc)
+        self._pending_batches += 1
+
+
+    def receive(self):
+        """
+        @returns The result of the oldest batch not yet received.
+        """
+        assert self._pending_batches, 'no batches outstanding'
+        try:
+            result = drone_utility.read_frame(self._process.stdout)
+        except Exception, exc: # unpickling can throw all kinds of exceptions
+            self.stop()
+            raise DroneAgentError('Invalid response from drone agent: %s'
+                                  % exc)
+        if result is None:
+            self.stop()
+            raise DroneAgentError('Drone agent exited unexpectedly')
+        self._pending_batches -= 1
+        return result
+
+
+    def stop(self):
+        """Close the agent's input and reap it, killing it if necessary."""
+        if self._process is None:
+            return
+        process, self._process = self._process, None
+        self._pending_batches = 0
+        try:
+            process.stdin.close()
+        except IOError:
+            pass
+        if process.poll() is None:
+            os.kill(process.pid, signal.SIGTERM)
+        process.wait()
+
+
 class _AbstractDrone(object):
     """
     Attributes:
@@ -85,8 +170,11 @@ class _AbstractDrone(object):
     def execute_queued_calls(self):
         if not self._calls:
             return
-        self._execute_calls(self._calls)
+        # take the queue first; calls may be queued for the next cycle while
+        # this one is still executing in another thread
+        calls = self._calls
         self.clear_call_queue()
+        self._execute_calls(calls)
 
 
     def set_autotest_install_dir(self, path):
@@ -123,6 +211,12 @@ class _RemoteDrone(_AbstractDrone):
             logging.error('Drone %s is unpingable, kicking out', hostname)
             raise DroneUnreachable
         self._autotest_install_dir = AUTOTEST_INSTALL_DIR
+        self._agent = None
+        use_agent = global_config.global_config.get_config_value(
+                'SCHEDULER', 'drone_persistent_agent', type=bool,
+                default=False)
+        if use_agent:
+            self._agent = _DroneAgent(self._agent_command())
 
 
     @property
@@ -131,16 +225,31 @@ class _RemoteDrone(_AbstractDrone):
                             'scheduler', 'drone_utility.py')
 
 
+    def _agent_command(self):
+        return '%s "python %s --persistent"' % (
+                self._host.ssh_command(connect_timeout=300),
+                self._drone_utility_path)
+
+
     def set_autotest_install_dir(self, path):
         self._autotest_install_dir = path
+        if self._agent:
+            self._agent.stop()
+            self._agent = _DroneAgent(self._agent_command())
 
 
     def shutdown(self):
         super(_RemoteDrone, self).shutdown()
+        if self._agent:
+            self._agent.stop()
         self._host.close()
 
 
     def _execute_calls_impl(self, calls):
+        if self._agent:
+            self._agent.send(calls)
+            return self._agent.receive()
+
         logging.info("Running drone_utility on %s", self.hostname)
         result = self._host.run('python %s' % self._drone_utility_path,
                                 stdin=cPickle.dumps(calls), stdout_tee=None,
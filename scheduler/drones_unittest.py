@@ -50,5 +50,38 @@ class RemoteDroneTest(unittest.TestCase):
         self.god.check_playback()
 
 
+class DroneAgentTest(unittest.TestCase):
+    def setUp(self):
+        # cat echoes every batch back, which is enough to exercise the framing
+        self.agent = drones._DroneAgent('cat')
+
+
+    def tearDown(self):
+        self.agent.stop()
+
+
+    def test_pipelined_batches(self):
+        self.agent.send(['batch1'])
+        self.agent.send(['batch2'])
+        self.assertEqual(['batch1'], self.agent.receive())
+        self.assertEqual(['batch2'], self.agent.receive())
+
+
+    def test_restart_after_exit(self):
+        self.agent.send(['batch1'])
+        self.agent.receive()
+        self.agent.stop()
+        self.assertFalse(self.agent.is_running())
+        self.agent.send(['batch2'])
+        self.assertEqual(['batch2'], self.agent.receive())
+
+
+    def test_unexpected_exit(self):
+        self.agent = drones._DroneAgent('true')
+        self.agent.send(['batch1'])
+        self.assertRaises(drones.DroneAgentError, self.agent.receive)
+        self.assertFalse(self.agent.is_running())
+
+
 if __name__ == '__main__':
     unittest.main()
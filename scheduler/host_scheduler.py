@@ -16,6 +16,10 @@ get_site_metahost_schedulers = utils.import_site_function(
         'get_metahost_schedulers', lambda : ())
 
 
+# tables the host eligibility index is built from
+_HOST_INDEX_TABLES = ('afe_labels', 'afe_hosts_labels', 'afe_acl_groups_hosts')
+
+
 class SchedulerError(Exception):
     """Raised by HostScheduler when an inconsistent state occurs."""
 
@@ -31,9 +35,21 @@ class BaseHostScheduler(metahost_scheduler.HostSchedulingUtility):
     In the past this was done with one or two very large, complex database
     queries.  It has proven much simpler and faster to build these auxiliary
     data structures and perform the logic in Python.
+
+    Label and ACL membership of all hosts is kept in an index of host id sets
+    that persists across ticks and is only rebuilt when one of the tables it
+    comes from changes.  The hosts eligible for a queue entry are then
+    computed once per job by set operations on the index.
     """
-    def __init__(self, db):
+    def __init__(self, db, change_feed=None):
+        """
+        @param db: The scheduler's database_connection.
+        @param change_feed: A change_feed.ChangeFeed telling when the host
+                index must be rebuilt.  If None, it is rebuilt on every
+                refresh().
+        """
         self._db = db
+        self._change_feed = change_feed
         self._metahost_schedulers = metahost_scheduler.get_metahost_schedulers()
 
         # load site-specific scheduler selected in global_config
@@ -116,27 +132,20 @@ class BaseHostScheduler(metahost_scheduler.HostSchedulingUtility):
         return self._get_many2many_dict(query, job_ids)
 
 
-    def _get_host_acls(self, host_ids):
-        query = """
-        SELECT host_id, aclgroup_id
+    def _get_acl_hosts(self):
+        rows = self._db.execute("""
+        SELECT aclgroup_id, host_id
         FROM afe_acl_groups_hosts
-        WHERE host_id IN (%s)
-        """
-        return self._get_many2many_dict(query, host_ids)
+        """)
+        return self._process_many2many_dict(rows)
 
 
-    def _get_label_hosts(self, host_ids):
-        if not host_ids:
-            return {}, {}
-        query = """
+    def _get_label_hosts(self):
+        rows = self._db.execute("""
         SELECT label_id, host_id
         FROM afe_hosts_labels
-        WHERE host_id IN (%s)
-        """ % self._get_sql_id_list(host_ids)
-        rows = self._db.execute(query)
-        labels_to_hosts = self._process_many2many_dict(rows)
-        hosts_to_labels = self._process_many2many_dict(rows, flip=True)
-        return labels_to_hosts, hosts_to_labels
+        """)
+        return self._process_many2many_dict(rows)
 
 
     def _get_labels(self):
@@ -149,6 +158,40 @@ class BaseHostScheduler(metahost_scheduler.HostSchedulingUtility):
             metahost_scheduler.recovery_on_startup()
 
 
+    def _refresh_host_index(self):
+        """
+        Rebuild the label and ACL index of all hosts if any of the tables it
+        is built from changed since it was last built.
+        """
+        if self._change_feed and not self._change_feed.needs_poll(
+                'host_index', _HOST_INDEX_TABLES):
+            return
+
+        self._labels = self._get_labels()
+        self._label_hosts_index = self._get_label_hosts()
+        self._acl_hosts_index = self._get_acl_hosts()
+
+        self._only_if_needed_labels = set(
+                label_id for label_id, label in self._labels.iteritems()
+                if label.only_if_needed)
+        # maps atomic group id to the hosts with a label in that group
+        self._atomic_group_hosts = {}
+        for label_id, host_ids in self._label_hosts_index.iteritems():
+            atomic_group_id = self._labels[label_id].atomic_group_id
+            if atomic_group_id is not None:
+                self._atomic_group_hosts.setdefault(
+                        atomic_group_id, set()).update(host_ids)
+        self._hosts_in_atomic_groups = set()
+        for host_ids in self._atomic_group_hosts.itervalues():
+            for host_id in self._hosts_in_atomic_groups.intersection(host_ids):
+                logging.error('More than one Atomic Group on host %d',
+                              host_id)
+            self._hosts_in_atomic_groups.update(host_ids)
+
+        if self._change_feed:
+            self._change_feed.finish_poll('host_index', False)
+
+
     def refresh(self, pending_queue_entries):
         self._hosts_available = self._get_ready_hosts()
 
@@ -158,11 +201,11 @@ class BaseHostScheduler(metahost_scheduler.HostSchedulingUtility):
         self._ineligible_hosts = self._get_job_ineligible_hosts(relevant_jobs)
         self._job_dependencies = self._get_job_dependencies(relevant_jobs)
 
-        host_ids = self._hosts_available.keys()
-        self._host_acls = self._get_host_acls(host_ids)
-        self._label_hosts, self._host_labels = self._get_label_hosts(host_ids)
-
-        self._labels = self._get_labels()
+        self._refresh_host_index()
+        # available hosts per label, computed on demand during this tick
+        self._label_hosts = {}
+        # maps (job id, meta_host, atomic group id) to eligible host ids
+        self._eligible_hosts = {}
 
 
     def tick(self):
@@ -170,12 +213,21 @@ class BaseHostScheduler(metahost_scheduler.HostSchedulingUtility):
             metahost_scheduler.tick()
 
 
+    def _get_available_label_hosts(self, label_id):
+        if label_id not in self._label_hosts:
+            self._label_hosts[label_id] = set(
+                    host_id
+                    for host_id in self._label_hosts_index.get(label_id, ())
+                    if host_id in self._hosts_available)
+        return self._label_hosts[label_id]
+
+
     def hosts_in_label(self, label_id):
-        return set(self._label_hosts.get(label_id, ()))
+        return set(self._get_available_label_hosts(label_id))
 
 
     def remove_host_from_label(self, host_id, label_id):
-        self._label_hosts[label_id].remove(host_id)
+        self._get_available_label_hosts(label_id).remove(host_id)
 
 
     def pop_host(self, host_id):
@@ -186,72 +238,48 @@ class BaseHostScheduler(metahost_scheduler.HostSchedulingUtility):
         return set(self._ineligible_hosts.get(queue_entry.job_id, ()))
 
 
-    def _is_acl_accessible(self, host_id, queue_entry):
-        job_acls = self._job_acls.get(queue_entry.job_id, set())
-        host_acls = self._host_acls.get(host_id, set())
-        return len(host_acls.intersection(job_acls)) > 0
-
-
-    def _check_job_dependencies(self, job_dependencies, host_labels):
-        missing = job_dependencies - host_labels
-        return len(missing) == 0
-
-
-    def _check_only_if_needed_labels(self, job_dependencies, host_labels,
-                                     queue_entry):
-        if not queue_entry.meta_host:
-            # bypass only_if_needed labels when a specific host is selected
-            return True
-
-        for label_id in host_labels:
-            label = self._labels[label_id]
-            if not label.only_if_needed:
-                # we don't care about non-only_if_needed labels
-                continue
-            if queue_entry.meta_host == label_id:
-                # if the label was requested in a metahost it's OK
-                continue
-            if label_id not in job_dependencies:
-                return False
-        return True
-
-
-    def _check_atomic_group_labels(self, host_labels, queue_entry):
+    def _get_eligible_hosts(self, queue_entry):
         """
-        Determine if the given HostQueueEntry's atomic group settings are okay
-        to schedule on a host with the given labels.
+        Compute the set of hosts passing the ACL, dependency, only_if_needed
+        and atomic group checks for queue_entry.  The result is shared by all
+        entries of the job with the same meta_host and atomic group, and
+        includes hosts that are not currently available.
 
-        @param host_labels: A list of label ids that the host has.
-        @param queue_entry: The HostQueueEntry being considered for the host.
+        @param queue_entry: The HostQueueEntry to find hosts for.
 
-        @returns True if atomic group settings are okay, False otherwise.
+        @returns A set of host ids.
         """
-        return (self._get_host_atomic_group_id(host_labels, queue_entry) ==
-                queue_entry.atomic_group_id)
-
-
-    def _get_host_atomic_group_id(self, host_labels, queue_entry=None):
-        """
-        Return the atomic group label id for a host with the given set of
-        labels if any, or None otherwise.  Raises an exception if more than
-        one atomic group are found in the set of labels.
-
-        @param host_labels: A list of label ids that the host has.
-        @param queue_entry: The HostQueueEntry we're testing.  Only used for
-                extra info in a potential logged error message.
-
-        @returns The id of the atomic group found on a label in host_labels
-                or None if no atomic group label is found.
-        """
-        atomic_labels = [self._labels[label_id] for label_id in host_labels
-                         if self._labels[label_id].atomic_group_id is not None]
-        atomic_ids = set(label.atomic_group_id for label in atomic_labels)
-        if not atomic_ids:
-            return None
-        if len(atomic_ids) > 1:
-            logging.error('More than one Atomic Group on HQE "%s" via: %r',
-                          queue_entry, atomic_labels)
-        return atomic_ids.pop()
+        key = (queue_entry.job_id, queue_entry.meta_host,
+               queue_entry.atomic_group_id)
+        if key in self._eligible_hosts:
+            return self._eligible_hosts[key]
+
+        eligible_hosts = set()
+        for acl_id in self._job_acls.get(queue_entry.job_id, ()):
+            eligible_hosts.update(self._acl_hosts_index.get(acl_id, ()))
+
+        job_dependencies = self._job_dependencies.get(queue_entry.job_id, ())
+        for label_id in job_dependencies:
+            eligible_hosts.intersection_update(
+                    self._label_hosts_index.get(label_id, ()))
+
+        # only_if_needed labels are bypassed when a specific host is selected,
+        # and are OK if requested as the metahost or as a dependency
+        if queue_entry.meta_host:
+            for label_id in self._only_if_needed_labels:
+                if (label_id != queue_entry.meta_host
+                        and label_id not in job_dependencies):
+                    eligible_hosts.difference_update(
+                            self._label_hosts_index.get(label_id, ()))
+
+        if queue_entry.atomic_group_id is None:
+            eligible_hosts -= self._hosts_in_atomic_groups
+        else:
+            eligible_hosts.intersection_update(self._atomic_group_hosts.get(
+                    queue_entry.atomic_group_id, ()))
+
+        self._eligible_hosts[key] = eligible_hosts
+        return eligible_hosts
 
 
     def _get_atomic_group_labels(self, atomic_group_id):
@@ -277,9 +305,10 @@ class BaseHostScheduler(metahost_scheduler.HostSchedulingUtility):
         @returns A subset of group_hosts Host ids that are eligible for the
                 supplied queue_entry.
         """
+        eligible_hosts = self._get_eligible_hosts(queue_entry)
         return set(host_id for host_id in group_hosts
-                   if self.is_host_usable(host_id)
-                   and self.is_host_eligible_for_job(host_id, queue_entry))
+                   if host_id in eligible_hosts
+                   and self.is_host_usable(host_id))
 
 
     def is_host_eligible_for_job(self, host_id, queue_entry):
@@ -290,14 +319,15 @@ class BaseHostScheduler(metahost_scheduler.HostSchedulingUtility):
             # relationships cleared.
             return True
 
-        job_dependencies = self._job_dependencies.get(queue_entry.job_id, set())
-        host_labels = self._host_labels.get(host_id, set())
+        return host_id in self._get_eligible_hosts(queue_entry)
+
 
-        return (self._is_acl_accessible(host_id, queue_entry) and
-                self._check_job_dependencies(job_dependencies, host_labels) and
-                self._check_only_if_needed_labels(
-                    job_dependencies, host_labels, queue_entry) and
-                self._check_atomic_group_labels(host_labels, queue_entry))
+    def eligible_hosts_in_label(self, label_id, queue_entry):
+        hosts = self._get_available_label_hosts(label_id).intersection(
+                self._get_eligible_hosts(queue_entry))
+        hosts -= self.ineligible_hosts_for_entry(queue_entry)
+        return set(host_id for host_id in hosts
+                   if self.is_host_usable(host_id))
 
 
     def _is_host_invalid(self, host_id):
@@ -41,6 +41,46 @@ class LabelMetahostSchedulerTest(unittest.TestCase):
         entry.meta_host = 1
         host = object()
 
+        (self.scheduling_utility.eligible_hosts_in_label.expect_call(1, entry)
+         .and_return([5, 6]))
+        self.scheduling_utility.remove_host_from_label.expect_call(5, 1)
+        self.scheduling_utility.pop_host.expect_call(5).and_return(host)
+        entry.set_host.expect_call(host)
+
+        self.metahost_scheduler.schedule_metahost(entry,
+                                                  self.scheduling_utility)
+        self.god.check_playback()
+
+
+    def test_no_hosts(self):
+        entry = self.entry()
+        entry.meta_host = 1
+
+        (self.scheduling_utility.eligible_hosts_in_label.expect_call(1, entry)
+         .and_return(()))
+
+        self.metahost_scheduler.schedule_metahost(entry,
+                                                  self.scheduling_utility)
+        self.god.check_playback()
+
+
+class HostSchedulingUtilityTest(unittest.TestCase):
+    def setUp(self):
+        self.god = mock.mock_god()
+        self.scheduling_utility = metahost_scheduler.HostSchedulingUtility()
+        for name in ('hosts_in_label', 'ineligible_hosts_for_entry',
+                     'is_host_usable', 'remove_host_from_label',
+                     'is_host_eligible_for_job'):
+            self.god.stub_function(self.scheduling_utility, name)
+
+
+    def tearDown(self):
+        self.god.unstub_all()
+
+
+    def test_eligible_hosts_in_label(self):
+        entry = object()
+
         self.scheduling_utility.hosts_in_label.expect_call(1).and_return(
                 [2, 3, 4, 5])
         # 2 is in ineligible_hosts
@@ -58,25 +98,22 @@ class LabelMetahostSchedulerTest(unittest.TestCase):
         self.scheduling_utility.is_host_usable.expect_call(5).and_return(True)
         (self.scheduling_utility.is_host_eligible_for_job.expect_call(5, entry)
          .and_return(True))
-        self.scheduling_utility.remove_host_from_label.expect_call(5, 1)
-        self.scheduling_utility.pop_host.expect_call(5).and_return(host)
-        entry.set_host.expect_call(host)
 
-        self.metahost_scheduler.schedule_metahost(entry,
-                                                  self.scheduling_utility)
+        eligible_hosts = self.scheduling_utility.eligible_hosts_in_label(
+                1, entry)
+        self.assertEquals(5, eligible_hosts.next())
         self.god.check_playback()
 
 
     def test_no_hosts(self):
-        entry = self.entry()
-        entry.meta_host = 1
+        entry = object()
 
         self.scheduling_utility.hosts_in_label.expect_call(1).and_return(())
         (self.scheduling_utility.ineligible_hosts_for_entry.expect_call(entry)
          .and_return(()))
 
-        self.metahost_scheduler.schedule_metahost(entry,
-                                                  self.scheduling_utility)
+        self.assertEquals([], list(
+                self.scheduling_utility.eligible_hosts_in_label(1, entry)))
         self.god.check_playback()
 
 
@@ -18,9 +18,11 @@ from autotest_lib.client.common_lib import host_protections, utils
 from autotest_lib.database import database_connection
 from autotest_lib.frontend.afe import models, rpc_utils, readonly_connection
 from autotest_lib.frontend.afe import model_attributes
-from autotest_lib.scheduler import drone_manager, drones, email_manager
+from autotest_lib.scheduler import change_feed, drone_manager, drones
+from autotest_lib.scheduler import email_manager
 from autotest_lib.scheduler import gc_stats, host_scheduler, monitor_db_cleanup
 from autotest_lib.scheduler import status_server, scheduler_config
+from autotest_lib.scheduler import tick_stats
 from autotest_lib.scheduler import scheduler_models
 
 WATCHER_PID_FILE_PREFIX = 'autotest-scheduler-watcher'
@@ -52,6 +54,11 @@ _autoserv_path = os.path.join(drones.AUTOTEST_INSTALL_DIR, 'server', 'autoserv')
 _testing_mode = False
 _drone_manager = None
 
+# tables read by the polling queries the Dispatcher runs every tick
+_HQE_TABLES = ('afe_host_queue_entries',)
+_SPECIAL_TASK_TABLES = ('afe_special_tasks', 'afe_hosts',
+                        'afe_host_queue_entries')
+
 
 def _parser_path_default(install_dir):
     return os.path.join(install_dir, 'tko', 'parse')
@@ -138,6 +145,14 @@ def initialize():
             DB_CONFIG_SECTION, 'database', 'stresstest_autotest_web')
 
     os.environ['PATH'] = AUTOTEST_SERVER_DIR + ':' + os.environ['PATH']
+    # record queries on the Django connection so tick_stats can count them;
+    # must be set before the scheduler's connections create their cursors
+    if global_config.global_config.get_config_value(
+            scheduler_config.CONFIG_SECTION, 'tick_stats_count_queries',
+            type=bool, default=True):
+        django.db.connection.use_debug_cursor = True
+        tick_stats.instance().set_query_count_func(_get_query_count)
+
     global _db
     _db = database_connection.DatabaseConnection(DB_CONFIG_SECTION)
     _db.connect(db_type='django')
@@ -163,6 +178,10 @@ def initialize():
     logging.info("Connected! Running...")
 
 
+def _get_query_count():
+    return len(django.db.connection.queries)
+
+
 def initialize_globals():
     global _drone_manager
     _drone_manager = drone_manager.instance()
@@ -253,7 +272,6 @@ class Dispatcher(object):
     def __init__(self):
         self._agents = []
         self._last_clean_time = time.time()
-        self._host_scheduler = host_scheduler.HostScheduler(_db)
         user_cleanup_time = scheduler_config.config.clean_interval
         self._periodic_cleanup = monitor_db_cleanup.UserCleanup(
             _db, user_cleanup_time)
@@ -266,6 +284,12 @@ class Dispatcher(object):
                 global_config.global_config.get_config_value(
                         scheduler_config.CONFIG_SECTION,
                         'gc_stats_interval_mins', type=int, default=6*60))
+        self._change_feed = change_feed.ChangeFeed(
+                global_config.global_config.get_config_value(
+                        scheduler_config.CONFIG_SECTION,
+                        'change_feed_resync_secs', type=int, default=60))
+        self._host_scheduler = host_scheduler.HostScheduler(
+                _db, change_feed=self._change_feed)
 
 
     def initialize(self, recover_hosts=True):
@@ -282,19 +306,25 @@ class Dispatcher(object):
 
 
     def tick(self):
-        self._garbage_collection()
-        _drone_manager.refresh()
-        self._run_cleanup()
-        self._find_aborting()
-        self._process_recurring_runs()
-        self._schedule_delay_tasks()
-        self._schedule_running_host_queue_entries()
-        self._schedule_special_tasks()
-        self._schedule_new_jobs()
-        self._handle_agents()
-        self._host_scheduler.tick()
-        _drone_manager.execute_actions()
-        email_manager.manager.send_queued_emails()
+        stats = tick_stats.instance()
+        stats.start_tick()
+        stats.run_phase('garbage_collection', self._garbage_collection)
+        stats.run_phase('drone_refresh', _drone_manager.refresh)
+        stats.run_phase('change_feed', self._change_feed.refresh)
+        stats.run_phase('cleanup', self._run_cleanup)
+        stats.run_phase('find_aborting', self._find_aborting)
+        stats.run_phase('recurring_runs', self._process_recurring_runs)
+        stats.run_phase('delay_tasks', self._schedule_delay_tasks)
+        stats.run_phase('running_queue_entries',
+                        self._schedule_running_host_queue_entries)
+        stats.run_phase('special_tasks', self._schedule_special_tasks)
+        stats.run_phase('new_jobs', self._schedule_new_jobs)
+        stats.run_phase('handle_agents', self._handle_agents)
+        stats.run_phase('host_scheduler', self._host_scheduler.tick)
+        stats.run_phase('execute_actions', _drone_manager.execute_actions)
+        stats.run_phase('send_email',
+                        email_manager.manager.send_queued_emails)
+        stats.end_tick()
         django.db.reset_queries()
         self._tick_count += 1
 
@@ -558,6 +588,9 @@ class Dispatcher(object):
         Returns all queued SpecialTasks prioritized for repair first, then
         cleanup, then verify.
         """
+        if not self._change_feed.needs_poll('special_tasks',
+                                            _SPECIAL_TASK_TABLES):
+            return []
         queued_tasks = models.SpecialTask.objects.filter(is_active=False,
                                                          is_complete=False,
                                                          host__locked=False)
@@ -578,7 +611,9 @@ class Dispatcher(object):
                                models.SpecialTask.Task.VERIFY]
         def task_priority_key(task):
             return task_priority_order.index(task.task)
-        return sorted(queued_tasks, key=task_priority_key)
+        queued_tasks = sorted(queued_tasks, key=task_priority_key)
+        self._change_feed.finish_poll('special_tasks', bool(queued_tasks))
+        return queued_tasks
 
 
     def _schedule_special_tasks(self):
@@ -627,11 +662,17 @@ class Dispatcher(object):
 
 
     def _get_pending_queue_entries(self):
+        if not self._change_feed.needs_poll('pending_queue_entries',
+                                            _HQE_TABLES):
+            return []
         # prioritize by job priority, then non-metahost over metahost, then FIFO
-        return list(scheduler_models.HostQueueEntry.fetch(
+        queue_entries = list(scheduler_models.HostQueueEntry.fetch(
             joins='INNER JOIN afe_jobs ON (job_id=afe_jobs.id)',
             where='NOT complete AND NOT active AND status="Queued"',
             order_by='afe_jobs.priority DESC, meta_host, job_id'))
+        self._change_feed.finish_poll('pending_queue_entries',
+                                      bool(queue_entries))
+        return queue_entries
 
 
     def _refresh_pending_queue_entries(self):
@@ -714,8 +755,12 @@ class Dispatcher(object):
 
 
     def _schedule_delay_tasks(self):
-        for entry in scheduler_models.HostQueueEntry.fetch(
-                where='status = "%s"' % models.HostQueueEntry.Status.WAITING):
+        if not self._change_feed.needs_poll('delay_tasks', _HQE_TABLES):
+            return
+        waiting_entries = scheduler_models.HostQueueEntry.fetch(
+                where='status = "%s"' % models.HostQueueEntry.Status.WAITING)
+        self._change_feed.finish_poll('delay_tasks', bool(waiting_entries))
+        for entry in waiting_entries:
             task = entry.job.schedule_delayed_callback_task(entry)
             if task:
                 self.add_agent_task(task)
@@ -726,9 +771,13 @@ class Dispatcher(object):
 
 
     def _find_aborting(self):
+        if not self._change_feed.needs_poll('aborting', _HQE_TABLES):
+            return
+        aborting_entries = scheduler_models.HostQueueEntry.fetch(
+                where='aborted and not complete')
+        self._change_feed.finish_poll('aborting', bool(aborting_entries))
         jobs_to_stop = set()
-        for entry in scheduler_models.HostQueueEntry.fetch(
-                where='aborted and not complete'):
+        for entry in aborting_entries:
             logging.info('Aborting %s', entry)
             for agent in self.get_agents_for_entry(entry):
                 agent.abort()
@@ -1191,13 +1240,15 @@ class AgentTask(object):
 
 
     def _parse_results(self, queue_entries):
-        for queue_entry in queue_entries:
-            queue_entry.set_status(models.HostQueueEntry.Status.PARSING)
+        with scheduler_models.write_batch():
+            for queue_entry in queue_entries:
+                queue_entry.set_status(models.HostQueueEntry.Status.PARSING)
 
 
     def _archive_results(self, queue_entries):
-        for queue_entry in queue_entries:
-            queue_entry.set_status(models.HostQueueEntry.Status.ARCHIVING)
+        with scheduler_models.write_batch():
+            for queue_entry in queue_entries:
+                queue_entry.set_status(models.HostQueueEntry.Status.ARCHIVING)
 
 
     def _command_line(self):
@@ -1753,9 +1804,10 @@ class AbstractQueueTask(AgentTask, TaskWithJobKeyvals):
         if group_name:
             keyval_dict['host_group_name'] = group_name
         self._write_keyvals_before_job(keyval_dict)
-        for queue_entry in self.queue_entries:
-            queue_entry.set_status(models.HostQueueEntry.Status.RUNNING)
-            queue_entry.set_started_on_now()
+        with scheduler_models.write_batch():
+            for queue_entry in self.queue_entries:
+                queue_entry.set_status(models.HostQueueEntry.Status.RUNNING)
+                queue_entry.set_started_on_now()
 
 
     def _write_lost_process_error_file(self):
@@ -1854,9 +1906,10 @@ class QueueTask(AbstractQueueTask):
     def _finish_task(self):
         super(QueueTask, self)._finish_task()
 
-        for queue_entry in self.queue_entries:
-            queue_entry.set_status(models.HostQueueEntry.Status.GATHERING)
-            queue_entry.host.set_status(models.Host.Status.RUNNING)
+        with scheduler_models.write_batch():
+            for queue_entry in self.queue_entries:
+                queue_entry.set_status(models.HostQueueEntry.Status.GATHERING)
+                queue_entry.host.set_status(models.Host.Status.RUNNING)
 
 
 class HostlessQueueTask(AbstractQueueTask):
@@ -1939,8 +1992,9 @@ class PostJobTask(AgentTask):
 
 
     def _set_all_statuses(self, status):
-        for queue_entry in self.queue_entries:
-            queue_entry.set_status(status)
+        with scheduler_models.write_batch():
+            for queue_entry in self.queue_entries:
+                queue_entry.set_status(status)
 
 
     def abort(self):
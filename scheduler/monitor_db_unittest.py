@@ -1,6 +1,6 @@
 #!/usr/bin/python
 
-import gc, logging, time
+import gc, time
 try:
     import autotest.common as common
 except ImportError:
@@ -398,67 +398,35 @@ class DispatcherSchedulingTest(BaseSchedulerTest):
     # TODO(gps): These should probably live in their own TestCase class
     # specific to testing HostScheduler methods directly.  It was convenient
     # to put it here for now to share existing test environment setup code.
-    def test_HostScheduler_check_atomic_group_labels(self):
-        normal_job = self._create_job(metahosts=[0])
-        atomic_job = self._create_job(atomic_group=1)
-        # Indirectly initialize the internal state of the host scheduler.
-        self._dispatcher._refresh_pending_queue_entries()
-
-        atomic_hqe = scheduler_models.HostQueueEntry.fetch(where='job_id=%d' %
-                                                     atomic_job.id)[0]
-        normal_hqe = scheduler_models.HostQueueEntry.fetch(where='job_id=%d' %
-                                                     normal_job.id)[0]
-
-        host_scheduler = self._dispatcher._host_scheduler
-        self.assertTrue(host_scheduler._check_atomic_group_labels(
-                [self.label4.id], atomic_hqe))
-        self.assertFalse(host_scheduler._check_atomic_group_labels(
-                [self.label4.id], normal_hqe))
-        self.assertFalse(host_scheduler._check_atomic_group_labels(
-                [self.label5.id, self.label6.id, self.label7.id], normal_hqe))
-        self.assertTrue(host_scheduler._check_atomic_group_labels(
-                [self.label4.id, self.label6.id], atomic_hqe))
-        self.assertTrue(host_scheduler._check_atomic_group_labels(
-                        [self.label4.id, self.label5.id],
-                        atomic_hqe))
-
-
-    def test_HostScheduler_get_host_atomic_group_id(self):
-        job = self._create_job(metahosts=[self.label6.id])
+    def test_HostScheduler_host_index_refresh(self):
+        job = self._create_job(metahosts=[self.labels[0].id])
+        job.dependency_labels.add(self.labels[0])
         queue_entry = scheduler_models.HostQueueEntry.fetch(
                 where='job_id=%d' % job.id)[0]
-        # Indirectly initialize the internal state of the host scheduler.
-        self._dispatcher._refresh_pending_queue_entries()
-
-        # Test the host scheduler
         host_scheduler = self._dispatcher._host_scheduler
-
-        # Two labels each in a different atomic group.  This should log an
-        # error and continue.
-        orig_logging_error = logging.error
-        def mock_logging_error(message, *args):
-            mock_logging_error._num_calls += 1
-            # Test the logging call itself, we just wrapped it to count it.
-            orig_logging_error(message, *args)
-        mock_logging_error._num_calls = 0
-        self.god.stub_with(logging, 'error', mock_logging_error)
-        self.assertNotEquals(None, host_scheduler._get_host_atomic_group_id(
-                [self.label4.id, self.label8.id], queue_entry))
-        self.assertTrue(mock_logging_error._num_calls > 0)
-        self.god.unstub(logging, 'error')
-
-        # Two labels both in the same atomic group, this should not raise an
-        # error, it will merely cause the job to schedule on the intersection.
-        self.assertEquals(1, host_scheduler._get_host_atomic_group_id(
-                [self.label4.id, self.label5.id]))
-
-        self.assertEquals(None, host_scheduler._get_host_atomic_group_id([]))
-        self.assertEquals(None, host_scheduler._get_host_atomic_group_id(
-                [self.label3.id, self.label7.id, self.label6.id]))
-        self.assertEquals(1, host_scheduler._get_host_atomic_group_id(
-                [self.label4.id, self.label7.id, self.label6.id]))
-        self.assertEquals(1, host_scheduler._get_host_atomic_group_id(
-                [self.label7.id, self.label5.id]))
+        index_builds = []
+        original_get_labels = host_scheduler._get_labels
+        def counting_get_labels():
+            index_builds.append(True)
+            return original_get_labels()
+        self.god.stub_with(host_scheduler, '_get_labels', counting_get_labels)
+        def refresh():
+            self._dispatcher._change_feed.refresh()
+            self._dispatcher._refresh_pending_queue_entries()
+
+        refresh()
+        refresh()
+        self.assertEquals(1, len(index_builds))
+        self.assertFalse(host_scheduler.is_host_eligible_for_job(
+                self.hosts[2].id, queue_entry))
+
+        self.hosts[2].labels.add(self.labels[0])
+        refresh()
+        self.assertEquals(2, len(index_builds))
+        self.assertTrue(host_scheduler.is_host_eligible_for_job(
+                self.hosts[2].id, queue_entry))
+        self.assertTrue(self.hosts[2].id in host_scheduler.hosts_in_label(
+                self.labels[0].id))
 
 
     def test_atomic_group_hosts_blocked_from_non_atomic_jobs(self):
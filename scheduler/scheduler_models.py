@@ -14,10 +14,13 @@ _notify_email_statuses: list of HQE statuses.  each time a single HQE reaches
 _base_url: URL to the local AFE server, used to construct URLs for emails.
 _db: DatabaseConnection for this module.
 _drone_manager: reference to global DroneManager instance.
+_local_change_counts: dict mapping table names to the number of modifications
+        made to them through DBObject by this process.
+_write_batch: the open _WriteBatch, or None.  See write_batch().
 """
 
-import datetime, itertools, logging, os, re, sys, time, weakref
-from django.db import connection
+import contextlib, datetime, itertools, logging, os, re, sys, time, weakref
+from django.db import connection, transaction
 from autotest_lib.client.common_lib import global_config, host_protections
 from autotest_lib.client.common_lib import global_config, utils
 from autotest_lib.frontend.afe import models, model_attributes
@@ -30,6 +33,8 @@ _base_url = None
 
 _db = None
 _drone_manager = None
+_local_change_counts = {}
+_write_batch = None
 
 def initialize():
     global _db
@@ -69,6 +74,114 @@ def initialize_globals():
     _drone_manager = drone_manager.instance()
 
 
+def _record_local_change(table_name):
+    _local_change_counts[table_name] = (
+            _local_change_counts.get(table_name, 0) + 1)
+
+
+def get_local_change_counts():
+    """
+    @returns A copy of _local_change_counts.
+    """
+    return dict(_local_change_counts)
+
+
+class _WriteBatch(object):
+    """
+    Field updates made through DBObject.update_field() while write_batch() is
+    active.  Updates to the same row are merged, and rows receiving the same
+    values are written with a single UPDATE.
+    """
+    def __init__(self):
+        self.depth = 0
+        # maps (table, id) to a dict mapping field names to new values
+        self._row_updates = {}
+        # (table, id) keys in the order they were first updated
+        self._rows = []
+
+
+    def add_update(self, table, row_id, field, value):
+        key = (table, row_id)
+        if key not in self._row_updates:
+            self._row_updates[key] = {}
+            self._rows.append(key)
+        self._row_updates[key][field] = value
+
+
+    def pop_statements(self):
+        """
+        Empty the batch.
+
+        @returns A list of (query, parameters) tuples applying its updates.
+        """
+        # maps (table, sorted field/value pairs) to the ids to update
+        groups = {}
+        group_order = []
+        for table, row_id in self._rows:
+            fields = self._row_updates[(table, row_id)]
+            group = (table, tuple(sorted(fields.iteritems())))
+            if group not in groups:
+                groups[group] = []
+                group_order.append(group)
+            groups[group].append(row_id)
+        self._row_updates = {}
+        self._rows = []
+
+        statements = []
+        for table, fields in group_order:
+            ids = groups[(table, fields)]
+            query = 'UPDATE %s SET %s WHERE id IN (%s)' % (
+                    table, ', '.join('%s = %%s' % field for field, _ in fields),
+                    ','.join(str(int(row_id)) for row_id in ids))
+            statements.append((query, [value for _, value in fields]))
+        return statements
+
+
+@transaction.commit_on_success
+def _execute_in_transaction(statements):
+    for query, parameters in statements:
+        _db.execute(query, parameters)
+
+
+def flush_writes():
+    """
+    Write out the updates pending in the current write batch, if any, in one
+    transaction.
+    """
+    if not _write_batch:
+        return
+    statements = _write_batch.pop_statements()
+    if len(statements) == 1:
+        _db.execute(*statements[0])
+    elif statements:
+        _execute_in_transaction(statements)
+
+
+@contextlib.contextmanager
+def write_batch():
+    """
+    Context manager deferring DBObject.update_field() writes until the
+    outermost write_batch() block exits.  Instances are updated in memory
+    immediately, and the writes are flushed early before any DBObject read,
+    insert or delete.  Code in the block must not read the updated rows by
+    other means (e.g. through the Django models) without calling
+    flush_writes() first.
+    """
+    global _write_batch
+    if not _write_batch:
+        _write_batch = _WriteBatch()
+    _write_batch.depth += 1
+    try:
+        yield
+    finally:
+        _write_batch.depth -= 1
+        if not _write_batch.depth:
+            try:
+                flush_writes()
+            finally:
+                _write_batch = None
+
+
 class DelayedCallTask(object):
     """
     A task object like AgentTask for an Agent to run that waits for the
@@ -192,6 +305,7 @@ class DBObject(object):
 
 
     def _fetch_row_from_db(self, row_id):
+        flush_writes()
         sql = 'SELECT * FROM %s WHERE ID=%%s' % self.__table
         rows = _db.execute(sql, (row_id,))
         if not rows:
@@ -259,6 +373,7 @@ class DBObject(object):
         if not table:
             table = self.__table
 
+        flush_writes()
         rows = _db.execute("""
                 SELECT count(*) FROM %s
                 WHERE %s
@@ -275,14 +390,20 @@ class DBObject(object):
         if getattr(self, field) == value:
             return
 
-        query = "UPDATE %s SET %s = %%s WHERE id = %%s" % (self.__table, field)
-        _db.execute(query, (value, self.id))
+        if _write_batch:
+            _write_batch.add_update(self.__table, self.id, field, value)
+        else:
+            query = "UPDATE %s SET %s = %%s WHERE id = %%s" % (self.__table,
+                                                              field)
+            _db.execute(query, (value, self.id))
+        _record_local_change(self.__table)
 
         setattr(self, field, value)
 
 
     def save(self):
         if self.__new_record:
+            flush_writes()
             keys = self._fields[1:] # avoid id
             columns = ','.join([str(key) for key in keys])
             values = []
@@ -298,14 +419,17 @@ class DBObject(object):
             _db.execute(query)
             # Update our id to the one the database just assigned to us.
             self.id = _db.execute('SELECT LAST_INSERT_ID()')[0][0]
+            _record_local_change(self.__table)
 
 
     def delete(self):
         self._instances_by_type_and_id.pop((type(self), id), None)
         self._initialized = False
         self._valid_fields.clear()
+        flush_writes()
         query = 'DELETE FROM %s WHERE id=%%s' % self.__table
         _db.execute(query, (self.id,))
+        _record_local_change(self.__table)
 
 
     @staticmethod
@@ -329,6 +453,7 @@ class DBObject(object):
                                              'joins' : joins,
                                              'where' : where,
                                              'order_by' : order_by})
+        flush_writes()
         rows = _db.execute(query, params)
         return [cls(id=row[0], row=row) for row in rows]
 
@@ -560,16 +685,18 @@ class HostQueueEntry(DBObject):
     def set_status(self, status):
         logging.info("%s -> %s", self, status)
 
-        self.update_field('status', status)
-
         active = (status in models.HostQueueEntry.ACTIVE_STATUSES)
         complete = (status in models.HostQueueEntry.COMPLETE_STATUSES)
         assert not (active and complete)
 
-        self.update_field('active', active)
-        self.update_field('complete', complete)
+        with write_batch():
+            self.update_field('status', status)
+            self.update_field('active', active)
+            self.update_field('complete', complete)
 
         if complete:
+            # completion handling reads job state through the Django models
+            flush_writes()
             self._on_complete(status)
             self._email_on_job_complete()
 
@@ -1169,8 +1296,9 @@ class Job(DBObject):
                 self.id, [entry.host.hostname for entry in queue_entries],
                 group_subdir_name)
 
-        for queue_entry in queue_entries:
-            queue_entry.set_execution_subdir(group_subdir_name)
+        with write_batch():
+            for queue_entry in queue_entries:
+                queue_entry.set_execution_subdir(group_subdir_name)
 
 
     def _choose_group_to_run(self, include_queue_entry):
@@ -1301,8 +1429,9 @@ class Job(DBObject):
 
 
     def _finish_run(self, queue_entries):
-        for queue_entry in queue_entries:
-            queue_entry.set_status(models.HostQueueEntry.Status.STARTING)
+        with write_batch():
+            for queue_entry in queue_entries:
+                queue_entry.set_status(models.HostQueueEntry.Status.STARTING)
         self.abort_delay_ready_task()
 
 
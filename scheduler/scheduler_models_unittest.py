@@ -177,6 +177,50 @@ class DBObjectTest(BaseSchedulerModelsTest):
         self.assertEqual(hqe.started_on, None)
 
 
+    def _count_updates(self):
+        queries = []
+        original_execute = self._database.execute
+        def execute(query, parameters=None, **kwargs):
+            if query.startswith('UPDATE'):
+                queries.append(query)
+            return original_execute(query, parameters, **kwargs)
+        self.god.stub_with(self._database, 'execute', execute)
+        return queries
+
+
+    def test_write_batch(self):
+        hosts = [scheduler_models.Host(id=host_id) for host_id in (1, 2, 3)]
+        updates = self._count_updates()
+
+        with scheduler_models.write_batch():
+            for host in hosts:
+                host.update_field('status', 'Running')
+                host.update_field('dirty', 1)
+            hosts[2].update_field('locked', 1)
+            with scheduler_models.write_batch():
+                hosts[0].update_field('protection', 1)
+            # the instances are updated right away, the database is not
+            self.assertEqual('Running', hosts[1].status)
+            self.assertEqual([], updates)
+
+        self.assertEqual(3, len(updates))
+        scheduler_models.DBObject._clear_instance_cache()
+        for host_id in (1, 2, 3):
+            host = scheduler_models.Host(id=host_id)
+            self.assertEqual('Running', host.status)
+            self.assertEqual(1, host.dirty)
+        self.assertEqual(1, scheduler_models.Host(id=3).locked)
+        self.assertEqual(1, scheduler_models.Host(id=1).protection)
+
+
+    def test_write_batch_flushes_before_read(self):
+        host = scheduler_models.Host(id=1)
+        with scheduler_models.write_batch():
+            host.update_field('status', 'Running')
+            fetched = scheduler_models.Host.fetch(where='status="Running"')
+            self.assertEqual([host], fetched)
+
+
 class HostTest(BaseSchedulerModelsTest):
     def test_cmp_for_sort(self):
         expected_order = [
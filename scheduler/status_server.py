@@ -1,9 +1,11 @@
 import os, BaseHTTPServer, cgi, threading, urllib, fcntl, logging
+import simplejson
 try:
     import autotest.common as common
 except ImportError:
     import common
 from autotest_lib.scheduler import drone_manager, scheduler_config
+from autotest_lib.scheduler import tick_stats
 
 _PORT = 13467
 
@@ -14,6 +16,7 @@ _HEADER = """
 Actions:<br>
 <a href="?reparse_config=1">Reparse global config values</a><br>
 <a href="?restart_scheduler=1">Restart the scheduler</a><br>
+<a href="tick_stats">Tick statistics (JSON)</a><br>
 <br>
 """
 
@@ -22,10 +25,13 @@ _FOOTER = """
 </html>
 """
 
+_TICK_STATS_PATH = '/tick_stats'
+
+
 class StatusServerRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
-    def _send_headers(self):
+    def _send_headers(self, content_type='text/html'):
         self.send_response(200, 'OK')
-        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Type', content_type)
         self.end_headers()
 
 
@@ -73,6 +79,23 @@ class StatusServerRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
         self._write_line()
 
 
+    def _write_tick_stats(self, summary):
+        self._write_line('Tick phases (seconds over the last %s ticks, '
+                         'SQL queries per tick):'
+                         % summary['phases'].get(tick_stats.TICK, {}).get(
+                                 'recent', {}).get('count', 0))
+        for phase in summary['phase_order']:
+            recent = summary['phases'][phase]['recent']
+            if not recent['count']:
+                continue
+            self._write_line(
+                    '%s: last=%.3f p50=%.3f p90=%.3f max=%.3f queries=%.1f'
+                    % (phase, recent['last_secs'], recent['p50_secs'],
+                       recent['p90_secs'], recent['max_secs'],
+                       float(recent['queries']) / recent['count']))
+        self._write_line()
+
+
     def _execute_actions(self, arguments):
         if 'reparse_config' in arguments:
             scheduler_config.config.read_config()
@@ -85,6 +108,12 @@ class StatusServerRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
 
 
     def do_GET(self):
+        summary = self.server._tick_stats.get_summary()
+        if self.path.split('?', 1)[0] == _TICK_STATS_PATH:
+            self._send_headers(content_type='application/json')
+            self.wfile.write(simplejson.dumps(summary))
+            return
+
         self._send_headers()
         self.wfile.write(_HEADER)
 
@@ -92,6 +121,7 @@ class StatusServerRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
         self._execute_actions(arguments)
         self._write_all_fields()
         self._write_drone_list()
+        self._write_tick_stats(summary)
 
         self.wfile.write(_FOOTER)
 
@@ -104,6 +134,7 @@ class StatusServer(BaseHTTPServer.HTTPServer):
                                            StatusServerRequestHandler)
         self._shutting_down = False
         self._drone_manager = drone_manager.instance()
+        self._tick_stats = tick_stats.instance()
         self._shutdown_scheduler = False
 
         # ensure the listening socket is not inherited by child processes
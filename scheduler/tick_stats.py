@@ -0,0 +1,185 @@
+"""
+Timing statistics for the phases of the scheduler's Dispatcher.tick().
+
+Each phase records its duration and the number of SQL queries it ran.  For
+every phase the totals since startup and the durations of the last
+window_size ticks are kept; the latter are summarized as a histogram and
+percentiles by get_summary().  The status server exports the summary.
+"""
+
+import collections, math, threading, time
+try:
+    import autotest.common as common
+except ImportError:
+    import common
+from autotest_lib.client.common_lib import global_config
+from autotest_lib.scheduler import scheduler_config
+
+# upper bounds in seconds of the histogram buckets; the last is unbounded
+HISTOGRAM_BUCKETS = (0.001, 0.01, 0.1, 1, 10, 60)
+
+# name of the pseudo-phase covering a whole tick
+TICK = 'tick'
+
+
+class _PhaseStats(object):
+    def __init__(self, window_size):
+        self.count = 0
+        self.total_secs = 0.0
+        self.max_secs = 0.0
+        self.total_queries = 0
+        # (duration, queries) of the most recent runs
+        self.recent = collections.deque(maxlen=window_size)
+
+
+    def add(self, duration, queries):
+        self.count += 1
+        self.total_secs += duration
+        self.max_secs = max(self.max_secs, duration)
+        self.total_queries += queries
+        self.recent.append((duration, queries))
+
+
+    def get_summary(self):
+        durations = sorted(duration for duration, _ in self.recent)
+        histogram = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+        for duration in durations:
+            bucket = 0
+            while (bucket < len(HISTOGRAM_BUCKETS)
+                   and duration > HISTOGRAM_BUCKETS[bucket]):
+                bucket += 1
+            histogram[bucket] += 1
+
+        summary = {
+            'count': self.count,
+            'total_secs': self.total_secs,
+            'max_secs': self.max_secs,
+            'total_queries': self.total_queries,
+            'recent': {
+                'count': len(durations),
+                'histogram': histogram,
+                'queries': sum(queries for _, queries in self.recent),
+            },
+        }
+        if durations:
+            summary['recent'].update(
+                    last_secs=self.recent[-1][0],
+                    p50_secs=_percentile(durations, 50),
+                    p90_secs=_percentile(durations, 90),
+                    max_secs=durations[-1])
+        return summary
+
+
+def _percentile(sorted_values, percent):
+    """Nearest-rank percentile of a non-empty sorted list."""
+    rank = int(math.ceil(len(sorted_values) * percent / 100.0))
+    return sorted_values[max(rank, 1) - 1]
+
+
+class TickStats(object):
+    """
+    Collects per-phase statistics for Dispatcher.tick().  Phases are run
+    through run_phase() between start_tick() and end_tick().
+    """
+    def __init__(self, window_size=None, query_count_func=None,
+                 now_func=time.time):
+        """
+        @param window_size: Number of recent ticks summarized in histograms.
+                Defaults to the tick_stats_window config value.
+        @param query_count_func: A function returning the number of SQL
+                queries run so far, or None to not count queries.
+        @param now_func: A time.time like function.  Used for testing.
+        """
+        if window_size is None:
+            window_size = global_config.global_config.get_config_value(
+                    scheduler_config.CONFIG_SECTION, 'tick_stats_window',
+                    type=int, default=100)
+        self._window_size = window_size
+        self._query_count_func = query_count_func
+        self._now_func = now_func
+        self._lock = threading.Lock()
+        # maps phase name to _PhaseStats, in the order phases first ran
+        self._phases = {}
+        self._phase_order = []
+        self._tick_start = None
+
+
+    def set_query_count_func(self, query_count_func):
+        """
+        @param query_count_func: See __init__().
+        """
+        self._query_count_func = query_count_func
+
+
+    def _get_query_count(self):
+        if self._query_count_func:
+            return self._query_count_func()
+        return 0
+
+
+    def _record(self, phase, duration, queries):
+        self._lock.acquire()
+        try:
+            if phase not in self._phases:
+                self._phases[phase] = _PhaseStats(self._window_size)
+                self._phase_order.append(phase)
+            self._phases[phase].add(duration, queries)
+        finally:
+            self._lock.release()
+
+
+    def start_tick(self):
+        self._tick_start = (self._now_func(), self._get_query_count())
+
+
+    def end_tick(self):
+        start_time, start_queries = self._tick_start
+        self._record(TICK, self._now_func() - start_time,
+                     self._get_query_count() - start_queries)
+        self._tick_start = None
+
+
+    def run_phase(self, phase, function, *args, **dargs):
+        """
+        Call function(*args, **dargs), recording its statistics under phase.
+
+        @returns The function's return value.
+        """
+        start_time = self._now_func()
+        start_queries = self._get_query_count()
+        try:
+            return function(*args, **dargs)
+        finally:
+            self._record(phase, self._now_func() - start_time,
+                         self._get_query_count() - start_queries)
+
+
+    def get_summary(self):
+        """
+        @returns A dict with the list of phase names in the order they ran,
+                the histogram bucket bounds and a dict mapping each phase to
+                its statistics.
+        """
+        self._lock.acquire()
+        try:
+            phases = dict((phase, stats.get_summary())
+                          for phase, stats in self._phases.iteritems())
+            phase_order = list(self._phase_order)
+        finally:
+            self._lock.release()
+        return {'phase_order': phase_order,
+                'histogram_buckets': list(HISTOGRAM_BUCKETS),
+                'phases': phases}
+
+
+_the_instance = None
+
+def instance():
+    if _the_instance is None:
+        _set_instance(TickStats())
+    return _the_instance
+
+
+def _set_instance(instance): # usable for testing
+    global _the_instance
+    _the_instance = instance
@@ -0,0 +1,76 @@
+#!/usr/bin/python
+
+try:
+    import autotest.common as common
+except ImportError:
+    import common
+from autotest_lib.client.common_lib.test_utils import unittest
+from autotest_lib.scheduler import tick_stats
+
+
+class TickStatsTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 0
+        self.queries = 0
+        self.stats = tick_stats.TickStats(
+                window_size=3, query_count_func=lambda: self.queries,
+                now_func=lambda: self.now)
+
+
+    def _phase(self, seconds, queries):
+        self.now += seconds
+        self.queries += queries
+        return 'result'
+
+
+    def _tick(self, seconds, queries):
+        self.stats.start_tick()
+        self.assertEqual('result', self.stats.run_phase(
+                'phase1', self._phase, seconds, queries=queries))
+        self.stats.run_phase('phase2', self._phase, 0.0001, 0)
+        self.stats.end_tick()
+
+
+    def test_summary(self):
+        self._tick(0.5, 3)
+        self._tick(2, 5)
+        summary = self.stats.get_summary()
+
+        self.assertEqual(['phase1', 'phase2', tick_stats.TICK],
+                         summary['phase_order'])
+        phase1 = summary['phases']['phase1']
+        self.assertEqual(2, phase1['count'])
+        self.assertAlmostEqual(2.5, phase1['total_secs'])
+        self.assertAlmostEqual(2, phase1['max_secs'])
+        self.assertEqual(8, phase1['total_queries'])
+        self.assertEqual([0, 0, 0, 1, 1, 0, 0], phase1['recent']['histogram'])
+        self.assertAlmostEqual(2, phase1['recent']['last_secs'])
+        self.assertAlmostEqual(0.5, phase1['recent']['p50_secs'])
+
+        self.assertEqual([2, 0, 0, 0, 0, 0, 0],
+                         summary['phases']['phase2']['recent']['histogram'])
+        self.assertEqual(8, summary['phases'][tick_stats.TICK]['total_queries'])
+
+
+    def test_rolling_window(self):
+        for seconds in (100, 1, 1, 1):
+            self._tick(seconds, 1)
+        phase1 = self.stats.get_summary()['phases']['phase1']
+        self.assertEqual(4, phase1['count'])
+        self.assertAlmostEqual(100, phase1['max_secs'])
+        self.assertEqual(3, phase1['recent']['count'])
+        self.assertAlmostEqual(1, phase1['recent']['max_secs'])
+        self.assertEqual(3, phase1['recent']['queries'])
+
+
+    def test_phase_exception(self):
+        def fail():
+            self.now += 1
+            raise ValueError
+        self.assertRaises(ValueError, self.stats.run_phase, 'failing', fail)
+        self.assertEqual(
+                1, self.stats.get_summary()['phases']['failing']['max_secs'])
+
+
+if __name__ == '__main__':
+    unittest.main()
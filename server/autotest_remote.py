@@ -1,8 +1,9 @@
 # Copyright 2007 Google Inc. Released under the GPL v2
 
 import re, os, sys, traceback, subprocess, time, pickle, glob, tempfile
-import logging, getpass
+import fcntl, logging, getpass
 from autotest_lib.server import installable_object, prebuild, utils
+from autotest_lib.server import client_manifest
 from autotest_lib.client.common_lib import base_job, log, error, autotemp
 from autotest_lib.client.common_lib import global_config, packages
 from autotest_lib.client.common_lib import utils as client_utils
@@ -11,6 +12,17 @@ from autotest_lib.client.common_lib import utils as client_utils
 get_value = global_config.global_config.get_config_value
 autoserv_prebuild = get_value('AUTOSERV', 'enable_server_prebuild',
                               type=bool, default=False)
+enable_delta_install = get_value('AUTOSERV', 'enable_client_delta_install',
+                                 type=bool, default=False)
+enable_compressed_collection = get_value(
+        'AUTOSERV', 'enable_compressed_result_collection', type=bool,
+        default=False)
+max_concurrent_collections = get_value(
+        'AUTOSERV', 'max_concurrent_result_collections', type=int, default=10)
+
+# client directories served by autoserv packaging rather than installed
+_AUTOSERV_PACKAGED_DIRS = frozenset(['tests', 'site_tests', 'deps',
+                                     'profilers'])
 
 
 class AutodirNotFoundError(Exception):
@@ -66,16 +78,33 @@ class BaseAutotest(installable_object.InstallableObject):
             logging.debug('Using existing host autodir: %s', autodir)
             return autodir
 
-        for path in Autotest.get_client_autodir_paths(host):
-            try:
-                autotest_binary = os.path.join(path, 'bin', 'autotest')
-                host.run('test -x %s' % utils.sh_escape(autotest_binary))
-                host.run('test -w %s' % utils.sh_escape(path))
+        paths = Autotest.get_client_autodir_paths(host)
+        if not hasattr(host, 'run_many'):
+            # hosts that only provide run() probe the paths one by one
+            for path in paths:
+                try:
+                    autotest_binary = os.path.join(path, 'bin', 'autotest')
+                    host.run('test -x %s' % utils.sh_escape(autotest_binary))
+                    host.run('test -w %s' % utils.sh_escape(path))
+                    logging.debug('Found existing autodir at %s', path)
+                    return path
+                except error.AutoservRunError:
+                    logging.debug('%s does not exist on %s', autotest_binary,
+                                  host.hostname)
+            raise AutodirNotFoundError
+
+        # probe all the paths at once, but prefer them in order
+        commands = ['test -x %s && test -w %s'
+                    % (utils.sh_escape(os.path.join(path, 'bin', 'autotest')),
+                       utils.sh_escape(path))
+                    for path in paths]
+        results = host.run_many(commands, ignore_status=True)
+        for path, result in zip(paths, results):
+            if result.exit_status == 0:
                 logging.debug('Found existing autodir at %s', path)
                 return path
-            except error.AutoservRunError:
-                logging.debug('%s does not exist on %s', autotest_binary,
-                              host.hostname)
+            logging.debug('%s does not exist on %s',
+                          os.path.join(path, 'bin', 'autotest'), host.hostname)
         raise AutodirNotFoundError
 
 
@@ -157,20 +186,69 @@ class BaseAutotest(installable_object.InstallableObject):
 
 
     def _install_using_send_file(self, host, autodir):
-        dirs_to_exclude = set(["tests", "site_tests", "deps", "profilers"])
         light_files = [os.path.join(self.source_material, f)
                        for f in os.listdir(self.source_material)
-                       if f not in dirs_to_exclude]
+                       if f not in _AUTOSERV_PACKAGED_DIRS]
         host.send_file(light_files, autodir, delete_dest=True)
+        self._create_excluded_dirs(host, autodir, _AUTOSERV_PACKAGED_DIRS)
+
+
+    def _install_using_delta(self, host, autodir, dirs_to_exclude):
+        """
+        Bring the client installed in autodir up to date with the client
+        tree in self.source_material, sending only the files the host
+        doesn't have already and deleting the ones it shouldn't have.
 
-        # create empty dirs for all the stuff we excluded
+        @param dirs_to_exclude: Top level directories of the client tree
+                not to install.  Their content on the host is left alone.
+        """
+        manifest = client_manifest.get_manifest(self.source_material,
+                                                dirs_to_exclude)
+        preserved_dirs = set(dirs_to_exclude) | set(['packages'])
+        result = host.run(client_manifest.get_remote_hashes_command(
+                autodir, preserved_dirs))
+        remote_hashes = client_manifest.parse_remote_hashes(result.stdout)
+        to_send, to_delete = client_manifest.get_changes(manifest,
+                                                         remote_hashes)
+        logging.info('Sending %d of %d client files, deleting %d stale ones',
+                     len(to_send), len(manifest), len(to_delete))
+
+        if to_delete:
+            host.run('cd %s && xargs -0 rm -f' % utils.sh_escape(autodir),
+                     stdin='\0'.join(to_delete))
+        if to_send:
+            fd, tarball = tempfile.mkstemp(suffix='.tar.gz')
+            os.close(fd)
+            remote_tarball = os.path.join(autodir, '.client_delta.tar.gz')
+            try:
+                client_manifest.make_tarball(self.source_material, to_send,
+                                             tarball)
+                host.send_file(tarball, remote_tarball)
+            finally:
+                os.remove(tarball)
+            host.run('tar -xzf %s -C %s && rm -f %s'
+                     % (utils.sh_escape(remote_tarball),
+                        utils.sh_escape(autodir),
+                        utils.sh_escape(remote_tarball)))
+        self._create_excluded_dirs(host, autodir, dirs_to_exclude)
+
+
+    def _create_excluded_dirs(self, host, autodir, dirs_to_exclude):
+        """Create empty dirs for all the stuff we excluded."""
         commands = []
         for path in dirs_to_exclude:
             abs_path = os.path.join(autodir, path)
             abs_path = utils.sh_escape(abs_path)
             commands.append("mkdir -p '%s'" % abs_path)
             commands.append("touch '%s'/__init__.py" % abs_path)
-        host.run(';'.join(commands))
+        if commands:
+            host.run(';'.join(commands))
+
+
+    def _supports_autoserv_packaging(self):
+        c = global_config.global_config
+        return c.get_config_value("PACKAGES", "serve_packages_from_autoserv",
+                                  type=bool)
 
 
     def _install(self, host=None, autodir=None, use_autoserv=True,
@@ -209,6 +287,22 @@ class BaseAutotest(installable_object.InstallableObject):
         host.run('rm -rf %s/*' % utils.sh_escape(results_path),
                  ignore_status=True)
 
+        # Only send what changed since the last install on this host
+        if enable_delta_install and self.source_material:
+            if self._supports_autoserv_packaging() and use_autoserv:
+                dirs_to_exclude = _AUTOSERV_PACKAGED_DIRS
+            else:
+                dirs_to_exclude = ()
+            try:
+                self._install_using_delta(host, autodir, dirs_to_exclude)
+                logging.info("Installation of autotest completed")
+                self.installed = True
+                return
+            except (error.AutoservRunError, error.AutoservSSHTimeout,
+                    IOError, OSError), e:
+                logging.info("Could not install autotest by sending the "
+                             "changed files: %s. Trying other methods", e)
+
         # Fetch the autotest client from the nearest repository
         if use_packaging:
             try:
@@ -221,11 +315,8 @@ class BaseAutotest(installable_object.InstallableObject):
 
         # try to install from file or directory
         if self.source_material:
-            c = global_config.global_config
-            supports_autoserv_packaging = c.get_config_value(
-                "PACKAGES", "serve_packages_from_autoserv", type=bool)
             # Copy autotest recursively
-            if supports_autoserv_packaging and use_autoserv:
+            if self._supports_autoserv_packaging() and use_autoserv:
                 self._install_using_send_file(host, autodir)
             else:
                 host.send_file(self.source_material, autodir, delete_dest=True)
@@ -450,8 +541,8 @@ class _BaseRun(object):
         if not self.parallel_flag:
             tmpdir = os.path.join(self.autodir, 'tmp')
             download = os.path.join(self.autodir, 'tests/download')
-            self.host.run('umount %s' % tmpdir, ignore_status=True)
-            self.host.run('umount %s' % download, ignore_status=True)
+            self.host.run_many(['umount %s' % tmpdir, 'umount %s' % download],
+                               ignore_status=True)
 
 
     def get_base_cmd_args(self, section):
@@ -780,7 +871,53 @@ class _BaseRun(object):
         raise error.AutotestTimeoutError()
 
 
+class _collection_slot(object):
+    """
+    One of a limited number of slots for result collections, shared by all
+    the autoserv processes of this user on this machine through file locks
+    so that the processes of a parallel_simple() don't all collect at once.
+    The lock files live in a private directory; if it can't be used, the
+    collections are not limited.
+    """
+    slots_dir = os.path.join(tempfile.gettempdir(),
+                             'autotest_collection_slots-%d' % os.getuid())
+    poll_interval = 1
+
+    def __init__(self, max_slots):
+        self.max_slots = max_slots
+        self._lock_fd = None
+
+
+    def acquire(self):
+        if self.max_slots <= 0 or not utils.make_private_dir(self.slots_dir):
+            return
+        while True:
+            for slot in xrange(self.max_slots):
+                lock_fd = os.open(os.path.join(self.slots_dir,
+                                               'slot.%d' % slot),
+                                  os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW,
+                                  0600)
+                try:
+                    fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except IOError:
+                    os.close(lock_fd)
+                    continue
+                self._lock_fd = lock_fd
+                return
+            time.sleep(self.poll_interval)
+
+
+    def release(self):
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+
 class log_collector(object):
+    # attempts of a compressed collection, each resuming where the last
+    # one was interrupted
+    compressed_collection_attempts = 3
+
     def __init__(self, host, client_tag, results_dir):
         self.host = host
         if not client_tag:
@@ -788,6 +925,8 @@ class log_collector(object):
         self.client_results_dir = os.path.join(host.get_autodir(), "results",
                                                client_tag)
         self.server_results_dir = results_dir
+        self.collected_bytes = 0
+        self.collection_duration = 0
 
 
     def collect_client_job_results(self):
@@ -806,6 +945,15 @@ class log_collector(object):
 
         # Copy all dirs in default to results_dir
         try:
+            if (enable_compressed_collection and
+                hasattr(self.host, 'make_run_command')):
+                try:
+                    self._collect_compressed()
+                    return
+                except (error.AutoservError, IOError, OSError), e:
+                    logging.warning('Compressed collection of results from '
+                                    '%s failed (%s), copying them instead',
+                                    self.host.hostname, e)
             self.host.get_file(self.client_results_dir + '/',
                                self.server_results_dir, preserve_symlinks=True)
         except Exception:
@@ -815,6 +963,84 @@ class log_collector(object):
             traceback.print_exc(file=sys.stdout)
 
 
+    def _collect_compressed(self):
+        """
+        Stream the client results as a compressed tarball, created on the
+        fly by the host, into a partial archive in the server results dir
+        and extract it there.  An interrupted transfer is resumed at the
+        byte where it stopped, which works as long as the results don't
+        change, since gzip -n archives of the same files are identical.
+
+        @raises AutoservError: if the results couldn't be collected.
+        """
+        if not os.path.isdir(self.server_results_dir):
+            os.makedirs(self.server_results_dir)
+        archive_path = os.path.join(self.server_results_dir,
+                                    '.client_results.tar.gz.part')
+        if os.path.exists(archive_path):
+            os.remove(archive_path)
+
+        try:
+            self._stream_results(archive_path)
+            try:
+                utils.run('tar -xzf %s -C %s'
+                          % (utils.sh_escape(archive_path),
+                             utils.sh_escape(self.server_results_dir)))
+            except error.CmdError, e:
+                raise error.AutoservError('Corrupt results archive from %s: %s'
+                                          % (self.host.hostname, e))
+        finally:
+            if os.path.exists(archive_path):
+                os.remove(archive_path)
+
+        throughput = self.collected_bytes / max(self.collection_duration,
+                                                0.001)
+        logging.info('Collected %d bytes of compressed results from %s in '
+                     '%.1fs (%.1f KB/s)', self.collected_bytes,
+                     self.host.hostname, self.collection_duration,
+                     throughput / 1024)
+
+
+    def _stream_results(self, archive_path):
+        """
+        Stream the compressed results into archive_path, holding a
+        collection slot while doing so.
+
+        @raises AutoservError: if every attempt was interrupted.
+        """
+        slot = _collection_slot(max_concurrent_collections)
+        slot.acquire()
+        try:
+            start_time = time.time()
+            for attempt in xrange(self.compressed_collection_attempts):
+                offset = 0
+                if os.path.exists(archive_path):
+                    offset = os.path.getsize(archive_path)
+                command = ('cd %s && tar -cf - . | gzip -n -c | tail -c +%d'
+                           % (utils.sh_escape(self.client_results_dir),
+                              offset + 1))
+                archive = open(archive_path, 'ab')
+                try:
+                    sp = subprocess.Popen(self.host.make_run_command(command),
+                                          shell=True, stdout=archive)
+                    exit_status = sp.wait()
+                finally:
+                    archive.close()
+                if exit_status == 0:
+                    break
+                logging.info('Collection of results from %s interrupted '
+                             'after %d bytes (exit status %d)',
+                             self.host.hostname,
+                             os.path.getsize(archive_path), exit_status)
+            else:
+                raise error.AutoservError(
+                        'Unable to stream results from %s' % self.host.hostname)
+            self.collected_bytes = os.path.getsize(archive_path)
+            self.collection_duration = time.time() - start_time
+        finally:
+            slot.release()
+
+
     def remove_redundant_client_logs(self):
         """Remove client.*.log files in favour of client.*.DEBUG files."""
         debug_dir = os.path.join(self.server_results_dir, 'debug')
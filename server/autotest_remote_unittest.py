@@ -2,10 +2,11 @@
 
 __author__ = "raphtee@google.com (Travis Miller)"
 
-import unittest, os, tempfile, logging
+import errno, unittest, os, shutil, tempfile, time, logging
 
 import common
 from autotest_lib.server import autotest_remote, utils, hosts, server_job, profilers
+from autotest_lib.server import client_manifest
 from autotest_lib.client.bin import sysinfo
 from autotest_lib.client.common_lib import utils as client_utils, packages
 from autotest_lib.client.common_lib import error
@@ -146,6 +147,77 @@ class TestBaseAutotest(unittest.TestCase):
         self.god.check_playback()
 
 
+    def test_delta_install(self):
+        self.record_install_prologue()
+        self.god.stub_with(autotest_remote, 'enable_delta_install', True)
+        self.god.stub_function(self.base_autotest, '_install_using_delta')
+
+        c = autotest_remote.global_config.global_config
+        c.get_config_value.expect_call('PACKAGES',
+                                       'serve_packages_from_autoserv',
+                                       type=bool).and_return(True)
+        self.base_autotest._install_using_delta.expect_call(
+                self.host, 'autodir', autotest_remote._AUTOSERV_PACKAGED_DIRS)
+
+        # run and check
+        self.base_autotest.install()
+        self.god.check_playback()
+
+
+    def test_delta_install_falls_back(self):
+        self.record_install_prologue()
+        self.god.stub_with(autotest_remote, 'enable_delta_install', True)
+        self.god.stub_function(self.base_autotest, '_install_using_delta')
+
+        c = autotest_remote.global_config.global_config
+        c.get_config_value.expect_call('PACKAGES',
+                                       'serve_packages_from_autoserv',
+                                       type=bool).and_return(False)
+        self.base_autotest._install_using_delta.expect_call(
+                self.host, 'autodir', ()).and_raises(
+                OSError(errno.ENOSPC, 'No space left on device'))
+        c.get_config_value.expect_call('PACKAGES',
+                                       'serve_packages_from_autoserv',
+                                       type=bool).and_return(False)
+        self.host.send_file.expect_call('source_material', 'autodir',
+                                        delete_dest=True)
+
+        # run and check
+        self.base_autotest.install_full_client()
+        self.god.check_playback()
+
+
+    def test_install_using_delta(self):
+        self.construct()
+        self.base_autotest.source_material = 'source_material'
+        self.god.stub_function(client_manifest, 'get_manifest')
+        self.god.stub_function(client_manifest, 'make_tarball')
+
+        client_manifest.get_manifest.expect_call('source_material', ()
+                ).and_return({'bin/autotest': 'hash1', 'bin/job.py': 'hash2'})
+        self.host.run.expect_call(client_manifest.get_remote_hashes_command(
+                'autodir', ['packages'])).and_return(client_utils.CmdResult(
+                        stdout='hash1  ./bin/autotest\nold  ./bin/job.py\n'
+                               'old  ./bin/gone.py\n'))
+        self.host.run.expect_call('cd autodir && xargs -0 rm -f',
+                                  stdin='bin/gone.py')
+        tempfile.mkstemp.expect_call(suffix='.tar.gz').and_return(
+                (3, '/tmp/delta'))
+        self.god.stub_function(os, 'close')
+        os.close.expect_call(3)
+        client_manifest.make_tarball.expect_call('source_material',
+                                                 ['bin/job.py'], '/tmp/delta')
+        self.host.send_file.expect_call('/tmp/delta',
+                                        'autodir/.client_delta.tar.gz')
+        os.remove.expect_call('/tmp/delta')
+        self.host.run.expect_call(
+                'tar -xzf autodir/.client_delta.tar.gz -C autodir && '
+                'rm -f autodir/.client_delta.tar.gz')
+
+        self.base_autotest._install_using_delta(self.host, 'autodir', ())
+        self.god.check_playback()
+
+
     def test_packaging_install(self):
         self.record_install_prologue()
 
@@ -251,12 +323,20 @@ class TestBaseAutotest(unittest.TestCase):
          .and_raises(error.AutoservRunError('dummy', object())))
 
 
+    def _expect_autodir_probes(self, *exit_statuses):
+        commands = ['test -x /some/path/bin/autotest && test -w /some/path',
+                    'test -x /another/path/bin/autotest && '
+                    'test -w /another/path']
+        results = [client_utils.CmdResult(command, exit_status=exit_status)
+                   for command, exit_status in zip(commands, exit_statuses)]
+        self.host.run_many.expect_call(
+                commands, ignore_status=True).and_return(results)
+
+
     def test_get_installed_autodir(self):
         self._stub_get_client_autodir_paths()
         self.host.get_autodir.expect_call().and_return(None)
-        self._expect_failed_run('test -x /some/path/bin/autotest')
-        self.host.run.expect_call('test -x /another/path/bin/autotest')
-        self.host.run.expect_call('test -w /another/path')
+        self._expect_autodir_probes(1, 0)
 
         autodir = autotest_remote.Autotest.get_installed_autodir(self.host)
         self.assertEquals(autodir, '/another/path')
@@ -265,8 +345,7 @@ class TestBaseAutotest(unittest.TestCase):
     def test_get_install_dir(self):
         self._stub_get_client_autodir_paths()
         self.host.get_autodir.expect_call().and_return(None)
-        self._expect_failed_run('test -x /some/path/bin/autotest')
-        self._expect_failed_run('test -x /another/path/bin/autotest')
+        self._expect_autodir_probes(1, 1)
         self._expect_failed_run('mkdir -p /some/path')
         self.host.run.expect_call('mkdir -p /another/path')
         self.host.run.expect_call('test -w /another/path')
@@ -354,5 +433,123 @@ class test_autotest_mixin(unittest.TestCase):
         self.assertEqual(self.mixin, self.host)
 
 
+class FakeSSHHost(object):
+    """Runs the "remote" commands locally instead of through ssh."""
+    hostname = 'fakehost'
+
+    def __init__(self, autodir, interrupt_after=None):
+        self.autodir = autodir
+        self.interrupt_after = interrupt_after
+        self.commands = []
+
+
+    def get_autodir(self):
+        return self.autodir
+
+
+    def wait_up(self, timeout):
+        pass
+
+
+    def make_run_command(self, command):
+        self.commands.append(command)
+        if self.interrupt_after is not None:
+            # fail the first transfer half way through, like a dropped ssh
+            interrupt_after, self.interrupt_after = self.interrupt_after, None
+            return '(%s) | head -c %d; exit 255' % (command, interrupt_after)
+        return command
+
+
+class test_log_collector(unittest.TestCase):
+    def setUp(self):
+        self.god = mock.mock_god()
+        self.tempdir = tempfile.mkdtemp()
+        self.client_dir = os.path.join(self.tempdir, 'client', 'results',
+                                       'default')
+        self.server_dir = os.path.join(self.tempdir, 'server')
+        os.makedirs(os.path.join(self.client_dir, 'sysinfo'))
+        for name in ('status.log', 'sysinfo/dmesg'):
+            output = open(os.path.join(self.client_dir, name), 'w')
+            output.write(os.urandom(20000).encode('hex'))
+            output.close()
+        self.god.stub_with(autotest_remote, 'enable_compressed_collection',
+                           True)
+        self.god.stub_with(autotest_remote._collection_slot, 'slots_dir',
+                           os.path.join(self.tempdir, 'slots'))
+
+
+    def tearDown(self):
+        self.god.unstub_all()
+        shutil.rmtree(self.tempdir)
+
+
+    def _collect(self, host):
+        collector = autotest_remote.log_collector(host, '', self.server_dir)
+        collector.collect_client_job_results()
+        for name in ('status.log', 'sysinfo/dmesg'):
+            self.assertEquals(
+                    open(os.path.join(self.client_dir, name)).read(),
+                    open(os.path.join(self.server_dir, name)).read())
+        self.assertEquals(['status.log', 'sysinfo'],
+                          sorted(os.listdir(self.server_dir)))
+        return collector
+
+
+    def test_compressed_collection(self):
+        host = FakeSSHHost(os.path.join(self.tempdir, 'client'))
+        collector = self._collect(host)
+        self.assertEquals(1, len(host.commands))
+        self.assertTrue(0 < collector.collected_bytes < 80000)
+
+
+    def test_resumed_collection(self):
+        host = FakeSSHHost(os.path.join(self.tempdir, 'client'),
+                           interrupt_after=10000)
+        self._collect(host)
+        self.assertEquals(2, len(host.commands))
+        self.assertTrue(host.commands[1].endswith('tail -c +10001'))
+
+
+    def test_failed_collection_removes_archive(self):
+        class FailingHost(FakeSSHHost):
+            def make_run_command(self, command):
+                self.commands.append(command)
+                return '(%s) | head -c 100; exit 255' % command
+        host = FailingHost(os.path.join(self.tempdir, 'client'))
+        collector = autotest_remote.log_collector(host, '', self.server_dir)
+        self.assertRaises(error.AutoservError, collector._collect_compressed)
+        self.assertEquals(collector.compressed_collection_attempts,
+                          len(host.commands))
+        self.assertEquals([], os.listdir(self.server_dir))
+
+
+    def test_collection_slots(self):
+        slot = autotest_remote._collection_slot(1)
+        slot.acquire()
+        waits = []
+        def release_slot(seconds):
+            waits.append(seconds)
+            slot.release()
+        self.god.stub_with(time, 'sleep', release_slot)
+
+        # the only slot is taken until the first wait releases it
+        other_slot = autotest_remote._collection_slot(1)
+        other_slot.acquire()
+        other_slot.release()
+        self.assertEquals([other_slot.poll_interval], waits)
+        self.assertEquals(0700, os.stat(slot.slots_dir).st_mode & 0777)
+
+
+    def test_collection_slots_need_private_dir(self):
+        os.makedirs(autotest_remote._collection_slot.slots_dir)
+        os.chmod(autotest_remote._collection_slot.slots_dir, 0777)
+        slot = autotest_remote._collection_slot(1)
+        slot.acquire()
+        # collections are not limited rather than locked in a shared dir
+        other_slot = autotest_remote._collection_slot(1)
+        other_slot.acquire()
+        self.assertEquals([], os.listdir(slot.slots_dir))
+
+
 if __name__ == "__main__":
     unittest.main()
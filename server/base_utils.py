@@ -8,7 +8,8 @@ DO NOT import this file directly - it is mixed in by server/utils.py,
 import that instead
 """
 
-import atexit, os, re, shutil, textwrap, sys, tempfile, types
+import atexit, errno, logging, os, re, shutil, stat, textwrap, sys, tempfile
+import types
 
 from autotest_lib.client.common_lib import barrier, utils
 from autotest_lib.server import subcommand
@@ -117,6 +118,28 @@ def get_tmp_dir():
     return dir_name
 
 
+def make_private_dir(path):
+    """Create the directory path unless it exists, and check that no other
+    user can change its content, so that files in it can be trusted even
+    when it lives in a shared directory such as /tmp.
+
+    Returns True if path is a private directory, False otherwise.
+    """
+    try:
+        os.makedirs(path, 0700)
+    except OSError, e:
+        if e.errno != errno.EEXIST:
+            logging.warning('Unable to create directory %s: %s', path, e)
+            return False
+    path_stat = os.lstat(path)
+    if (not stat.S_ISDIR(path_stat.st_mode)
+        or path_stat.st_uid != os.getuid()
+        or path_stat.st_mode & (stat.S_IWGRP | stat.S_IWOTH)):
+        logging.warning('%s is not a private directory', path)
+        return False
+    return True
+
+
 def __clean_tmp_dirs():
     """Erase temporary directories that were created by the get_tmp_dir()
     function and that are still present.
@@ -2,7 +2,7 @@
 
 __author__ = 'raphtee@google.com (Travis Miller)'
 
-import unittest
+import os, shutil, tempfile, unittest
 try:
     import autotest.common as common
 except ImportError:
@@ -29,6 +29,23 @@ class UtilsTest(unittest.TestCase):
         self.assertEquals(self.failures, failures)
 
 
+    def test_make_private_dir(self):
+        tempdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tempdir, 'private')
+            self.assertTrue(utils.make_private_dir(path))
+            self.assertEquals(0700, os.stat(path).st_mode & 0777)
+            self.assertTrue(utils.make_private_dir(path))
+
+            os.chmod(path, 0777)
+            self.assertFalse(utils.make_private_dir(path))
+            link = os.path.join(tempdir, 'link')
+            os.symlink(tempdir, link)
+            self.assertFalse(utils.make_private_dir(link))
+        finally:
+            shutil.rmtree(tempdir)
+
+
     # parse_machine() test cases
     def test_parse_machine_good(self):
         '''test that parse_machine() is outputting the correct data'''
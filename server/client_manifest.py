@@ -0,0 +1,203 @@
+"""
+Manifests of autotest client trees, for delta client installs.
+
+A manifest maps the path of every file of a client tree, relative to the
+tree, to the SHA-1 of its content.  Comparing the manifest of the server's
+client tree with the hashes of the files installed on a host tells which
+files have to be sent to the host and which installed files are stale.
+
+Manifests are cached on disk per source tree together with the size and
+mtime of every file, so computing the manifest of an unchanged tree again
+only takes a stat() per file.  The cache is stored as JSON, in a directory
+only the current user can write to.
+"""
+
+import errno, hashlib, json, logging, os, tarfile, tempfile
+
+from autotest_lib.server import utils
+
+
+# bump whenever the format of the cached manifests changes
+CACHE_VERSION = 2
+
+DEFAULT_CACHE_DIR = os.path.join(tempfile.gettempdir(),
+                                 'autotest_client_manifests-%d' % os.getuid())
+
+
+def hash_file(path):
+    """
+    @returns The hex SHA-1 of the content of the file at path.
+    """
+    sha1 = hashlib.sha1()
+    source = open(path, 'rb')
+    try:
+        while True:
+            data = source.read(64 * 1024)
+            if not data:
+                break
+            sha1.update(data)
+    finally:
+        source.close()
+    return sha1.hexdigest()
+
+
+def _is_ignored(name):
+    # bytecode is rebuilt from the sources on the host
+    return name.endswith('.pyc') or name.endswith('.pyo')
+
+
+def _get_cache_path(cache_dir, source_dir, exclude_dirs):
+    key = '\0'.join([os.path.abspath(source_dir)] + sorted(exclude_dirs))
+    return os.path.join(cache_dir, hashlib.sha1(key).hexdigest())
+
+
+def _load_cache(cache_path):
+    try:
+        cache_file = open(cache_path, 'rb')
+        try:
+            cache = json.load(cache_file)
+        finally:
+            cache_file.close()
+        if cache.get('version') != CACHE_VERSION:
+            return {}
+        return dict((path, (tuple(signature), digest))
+                    for path, (signature, digest)
+                    in cache['files'].iteritems())
+    except (IOError, ValueError, TypeError, KeyError, AttributeError), e:
+        if getattr(e, 'errno', None) != errno.ENOENT:
+            logging.debug('Ignoring unreadable manifest cache %s: %s',
+                          cache_path, e)
+        return {}
+
+
+def _save_cache(cache_path, files):
+    cache_dir = os.path.dirname(cache_path)
+    try:
+        fd, temp_path = tempfile.mkstemp(dir=cache_dir)
+        temp_file = os.fdopen(fd, 'wb')
+        try:
+            json.dump({'version': CACHE_VERSION, 'files': files}, temp_file)
+        finally:
+            temp_file.close()
+        os.rename(temp_path, cache_path)
+    except (IOError, OSError, ValueError), e:
+        logging.debug('Unable to write manifest cache %s: %s', cache_path, e)
+
+
+def get_manifest(source_dir, exclude_dirs=(), cache_dir=DEFAULT_CACHE_DIR):
+    """
+    Compute the manifest of a client tree.
+
+    @param source_dir: The root of the client tree.
+    @param exclude_dirs: Names of top level directories to leave out.
+    @param cache_dir: Where to cache manifests, or None to not cache them.
+
+    @returns A dict mapping relative file paths to hex SHA-1 digests.
+    """
+    cache_path = None
+    cached_files = {}
+    if cache_dir and utils.make_private_dir(cache_dir):
+        cache_path = _get_cache_path(cache_dir, source_dir, exclude_dirs)
+        cached_files = _load_cache(cache_path)
+
+    files = {}
+    for dirpath, dirnames, filenames in os.walk(source_dir,
+                                                followlinks=True):
+        relative_dir = os.path.relpath(dirpath, source_dir)
+        if relative_dir == os.curdir:
+            relative_dir = ''
+            dirnames[:] = [name for name in dirnames
+                           if name not in exclude_dirs]
+        for filename in filenames:
+            if _is_ignored(filename):
+                continue
+            path = os.path.join(dirpath, filename)
+            try:
+                file_stat = os.stat(path)
+            except OSError:
+                # dangling symlink
+                continue
+            relative_path = os.path.join(relative_dir, filename)
+            signature = (file_stat.st_size, file_stat.st_mtime)
+            cached = cached_files.get(relative_path)
+            if cached and cached[0] == signature:
+                files[relative_path] = cached
+            else:
+                files[relative_path] = (signature, hash_file(path))
+
+    if cache_path and files != cached_files:
+        _save_cache(cache_path, files)
+    return dict((path, digest) for path, (signature, digest)
+                in files.iteritems())
+
+
+def get_remote_hashes_command(autodir, exclude_dirs=()):
+    """
+    @param autodir: The client install directory on the host.
+    @param exclude_dirs: Names of top level directories whose files must be
+            neither reported nor deleted.
+
+    @returns A shell command listing the hashes of the files installed in
+            autodir, in the format parse_remote_hashes() expects.
+    """
+    prune = ' -o '.join('-path "%s"' % utils.sh_escape('./' + name)
+                        for name in sorted(exclude_dirs))
+    if prune:
+        prune = '\\( %s \\) -prune -o ' % prune
+    return ('cd %s && find . %s-type f -print0 | xargs -0 -r sha1sum'
+            % (utils.sh_escape(autodir), prune))
+
+
+def parse_remote_hashes(output):
+    """
+    @param output: The output of the get_remote_hashes_command() command.
+
+    @returns A dict mapping relative file paths to hex SHA-1 digests.
+    """
+    hashes = {}
+    for line in output.splitlines():
+        if not line:
+            continue
+        digest, path = line.split('  ', 1)
+        hashes[os.path.normpath(path)] = digest
+    return hashes
+
+
+def get_changes(manifest, remote_hashes):
+    """
+    Compare the manifest of a client tree with what is installed on a host.
+
+    @param manifest: The manifest of the client tree.
+    @param remote_hashes: The hashes of the files installed on the host.
+
+    @returns A (paths to send, paths to delete) tuple of sorted lists.
+    """
+    to_send = sorted(path for path, digest in manifest.iteritems()
+                     if remote_hashes.get(path) != digest)
+    to_delete = []
+    for path in remote_hashes:
+        if path in manifest:
+            continue
+        if _is_ignored(path) and path[:-1] in manifest:
+            # keep the bytecode of sources still installed
+            continue
+        to_delete.append(path)
+    return to_send, sorted(to_delete)
+
+
+def make_tarball(source_dir, paths, tarball_path):
+    """
+    Create a gzipped tarball of some of the files of a client tree.
+
+    @param source_dir: The root of the client tree.
+    @param paths: The paths of the files to add, relative to source_dir.
+    @param tarball_path: The path of the tarball to create.
+    """
+    # symlinks are archived as the files they point to, as they are hashed
+    tarball = tarfile.open(tarball_path, 'w:gz', dereference=True)
+    try:
+        for path in paths:
+            tarball.add(os.path.join(source_dir, path), arcname=path,
+                        recursive=False)
+    finally:
+        tarball.close()
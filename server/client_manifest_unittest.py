@@ -0,0 +1,124 @@
+#!/usr/bin/python
+
+import os, shutil, tarfile, tempfile, unittest
+try:
+    import autotest.common as common
+except ImportError:
+    import common
+from autotest_lib.client.common_lib import utils
+from autotest_lib.client.common_lib.test_utils import mock
+from autotest_lib.server import client_manifest
+
+
+class client_manifest_test(unittest.TestCase):
+    def setUp(self):
+        self.god = mock.mock_god()
+        self.tempdir = tempfile.mkdtemp()
+        self.source_dir = os.path.join(self.tempdir, 'client')
+        self.cache_dir = os.path.join(self.tempdir, 'cache')
+        self._write_files(self.source_dir, {'bin/autotest': 'main',
+                                            'bin/job.py': 'job',
+                                            'bin/job.pyc': 'bytecode',
+                                            'tests/sleeptest/control': 'x'})
+
+
+    def tearDown(self):
+        self.god.unstub_all()
+        shutil.rmtree(self.tempdir)
+
+
+    def _write_files(self, root, files):
+        for path, content in files.iteritems():
+            path = os.path.join(root, path)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            output = open(path, 'w')
+            output.write(content)
+            output.close()
+
+
+    def _get_manifest(self):
+        return client_manifest.get_manifest(self.source_dir, ['tests'],
+                                            self.cache_dir)
+
+
+    def test_manifest(self):
+        manifest = self._get_manifest()
+        self.assertEquals(['bin/autotest', 'bin/job.py'], sorted(manifest))
+        self.assertEquals(client_manifest.hash_file(
+                os.path.join(self.source_dir, 'bin/job.py')),
+                manifest['bin/job.py'])
+
+
+    def test_manifest_cache(self):
+        manifest = self._get_manifest()
+        hashed = []
+        def counting_hash_file(path, hash_file=client_manifest.hash_file):
+            hashed.append(os.path.relpath(path, self.source_dir))
+            return hash_file(path)
+        self.god.stub_with(client_manifest, 'hash_file', counting_hash_file)
+
+        self.assertEquals(manifest, self._get_manifest())
+        self.assertEquals([], hashed)
+
+        self._write_files(self.source_dir, {'bin/job.py': 'new job'})
+        self.assertNotEquals(manifest, self._get_manifest())
+        self.assertEquals(['bin/job.py'], hashed)
+
+
+    def test_manifest_cache_dir_is_private(self):
+        self._get_manifest()
+        self.assertEquals(0700, os.stat(self.cache_dir).st_mode & 0777)
+
+        # a cache dir others can write to is not used
+        os.chmod(self.cache_dir, 0777)
+        def unexpected_cache_load(cache_path):
+            self.fail('loaded %s' % cache_path)
+        self.god.stub_with(client_manifest, '_load_cache',
+                           unexpected_cache_load)
+        self.assertEquals(['bin/autotest', 'bin/job.py'],
+                          sorted(self._get_manifest()))
+
+
+    def test_unreadable_manifest_cache(self):
+        manifest = self._get_manifest()
+        for name in os.listdir(self.cache_dir):
+            cache_file = open(os.path.join(self.cache_dir, name), 'w')
+            cache_file.write('{"version": 2, "files": [')
+            cache_file.close()
+        self.assertEquals(manifest, self._get_manifest())
+
+
+    def test_changes_against_install(self):
+        install_dir = os.path.join(self.tempdir, 'install')
+        self._write_files(install_dir, {'bin/autotest': 'main',
+                                        'bin/job.py': 'old job',
+                                        'bin/job.pyc': 'bytecode',
+                                        'bin/gone.py': 'stale',
+                                        'bin/gone.pyc': 'stale bytecode',
+                                        'tests/mine/control': 'kept',
+                                        'packages/client.tar.bz2': 'kept'})
+        output = utils.run(client_manifest.get_remote_hashes_command(
+                install_dir, ['packages', 'tests'])).stdout
+        remote_hashes = client_manifest.parse_remote_hashes(output)
+
+        to_send, to_delete = client_manifest.get_changes(self._get_manifest(),
+                                                         remote_hashes)
+        self.assertEquals(['bin/job.py'], to_send)
+        self.assertEquals(['bin/gone.py', 'bin/gone.pyc'], to_delete)
+
+
+    def test_make_tarball(self):
+        tarball_path = os.path.join(self.tempdir, 'delta.tar.gz')
+        client_manifest.make_tarball(self.source_dir, ['bin/job.py'],
+                                     tarball_path)
+        tarball = tarfile.open(tarball_path)
+        try:
+            self.assertEquals(['bin/job.py'], tarball.getnames())
+            self.assertEquals('job', tarball.extractfile('bin/job.py').read())
+        finally:
+            tarball.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -13,7 +13,7 @@ You should import the "hosts" package instead of importing each type of host.
 import sys, re, traceback, logging, subprocess, os
 from autotest_lib.client.common_lib import error, pxssh
 from autotest_lib.server import utils
-from autotest_lib.server.hosts import abstract_ssh
+from autotest_lib.server.hosts import abstract_ssh, ssh_pool
 
 
 class SSHHost(abstract_ssh.AbstractSSHHost):
@@ -62,21 +62,43 @@ class SSHHost(abstract_ssh.AbstractSSHHost):
         return "%s %s" % (base_cmd, self.hostname)
 
 
-    def _run(self, command, timeout, ignore_status, stdout, stderr,
-             connect_timeout, env, options, stdin, args):
-        """Helper function for run()."""
+    def make_run_command(self, command, connect_timeout=30, options='',
+                         args=()):
+        """
+        Construct the local command line running command on this host.
+
+        @see run() for the parameters.
+        """
         ssh_cmd = self.ssh_command(connect_timeout, options)
+        env = " ".join("=".join(pair) for pair in self.env.iteritems())
         if not env.strip():
             env = ""
         else:
             env = "export %s;" % env
         for arg in args:
             command += ' "%s"' % utils.sh_escape(arg)
-        full_cmd = '%s "%s %s"' % (ssh_cmd, env, utils.sh_escape(command))
+        return '%s "%s %s"' % (ssh_cmd, env, utils.sh_escape(command))
+
+
+    def _run(self, command, timeout, ignore_status, stdout, stderr,
+             connect_timeout, options, stdin, args):
+        """Helper function for run()."""
+        full_cmd = self.make_run_command(command, connect_timeout, options,
+                                         args)
         result = utils.run(full_cmd, timeout, True, stdout, stderr,
                            verbose=False, stdin=stdin,
                            stderr_is_expected=ignore_status)
+        self._check_run_result(result, ignore_status)
+        return result
+
 
+    def _check_run_result(self, result, ignore_status):
+        """
+        @raises AutoservSSHTimeout: ssh connection has timed out
+        @raises AutoservSshPermissionDeniedError: ssh authentication failed
+        @raises AutoservRunError: the command failed and ignore_status is
+                False
+        """
         # The error messages will show up in band (indistinguishable
         # from stuff sent through the SSH connection), so we have the
         # remote computer echo the message "Connected." before running
@@ -93,8 +115,6 @@ class SSHHost(abstract_ssh.AbstractSSHHost):
         if not ignore_status and result.exit_status > 0:
             raise error.AutoservRunError("command execution error", result)
 
-        return result
-
 
     def run(self, command, timeout=3600, ignore_status=False,
             stdout_tee=utils.TEE_TO_LOGS, stderr_tee=utils.TEE_TO_LOGS,
@@ -116,10 +136,9 @@ class SSHHost(abstract_ssh.AbstractSSHHost):
         # Start a master SSH connection if necessary.
         self.start_master_ssh()
 
-        env = " ".join("=".join(pair) for pair in self.env.iteritems())
         try:
             return self._run(command, timeout, ignore_status, stdout_tee,
-                             stderr_tee, connect_timeout, env, options,
+                             stderr_tee, connect_timeout, options,
                              stdin, args)
         except error.CmdError, cmderr:
             # We get a CmdError here only if there is timeout of that command.
@@ -127,6 +146,27 @@ class SSHHost(abstract_ssh.AbstractSSHHost):
             raise error.AutoservRunError(cmderr.args[0], cmderr.args[1])
 
 
+    def run_many(self, commands, timeout=3600, ignore_status=False,
+                 max_concurrency=None):
+        """
+        Run independent commands on the remote host concurrently, through
+        the process wide ssh_pool.SSHPool.
+        @see common_lib.hosts.host.run_many()
+
+        @param max_concurrency: the maximum number of commands to run at
+                once, or None for the pool's default.
+
+        @raises AutoservRunError: if a command failed
+        @raises AutoservSSHTimeout: ssh connection has timed out
+        """
+        results = ssh_pool.run_many([(self, command) for command in commands],
+                                    timeout=timeout, ignore_status=True,
+                                    max_concurrency=max_concurrency)
+        for result in results:
+            self._check_run_result(result, ignore_status)
+        return results
+
+
     def run_short(self, command, **kwargs):
         """
         Calls the run() command with a short default timeout.
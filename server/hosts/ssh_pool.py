@@ -0,0 +1,281 @@
+"""
+Pooled, concurrent execution of commands on SSH hosts.
+
+Every command still runs in its own ssh client, but the clients running
+commands on the same host are multiplexed over a persistent master
+connection, so they skip the TCP and SSH handshakes, and a pool keeps at
+most max_concurrency clients running from a single select() loop.  Hosts
+with master SSH enabled (see AbstractSSHHost.start_master_ssh) share their
+own master connection; for the others the pool starts a master connection
+of its own, which only its commands use.  Commands started before a master
+connection accepts clients use ordinary ssh connections, and hosts not
+using the ssh command line at all run their commands with run().
+
+A pool owns child processes, so it must not be shared across fork();
+get_pool() returns a pool per process, which makes run_many() safe to use
+from functions run by server_job.parallel_simple().
+"""
+
+import atexit, logging, os, select, StringIO, time
+from autotest_lib.client.common_lib import autotemp, error
+from autotest_lib.client.common_lib.global_config import global_config
+from autotest_lib.server import utils
+
+
+DEFAULT_MAX_CONCURRENCY = global_config.get_config_value(
+        'AUTOSERV', 'ssh_pool_max_concurrency', type=int, default=16)
+
+# seconds between checks for exited or timed out commands
+_SELECT_TIMEOUT = 1
+
+
+class PooledCommand(object):
+    """
+    A command submitted to an SSHPool.  result is the utils.CmdResult of the
+    command once it finished, None until then; its timed_out attribute is
+    True if the command was killed for running past its timeout.
+    """
+    def __init__(self, host, command, timeout):
+        self.host = host
+        self.command = command
+        self.timeout = timeout
+        self.result = None
+        self.bg_job = None
+        self.start_time = None
+
+
+    def done(self):
+        return self.result is not None
+
+
+class SSHPool(object):
+    """
+    Runs commands on hosts, at most max_concurrency of them at a time.
+    """
+    def __init__(self, max_concurrency=None):
+        if max_concurrency is None:
+            max_concurrency = DEFAULT_MAX_CONCURRENCY
+        assert max_concurrency > 0
+        self.max_concurrency = max_concurrency
+        self._queued = []
+        self._running = []
+        # (user, hostname, port) -> (master BgJob, control socket path)
+        self._masters = {}
+        self._control_dir = None
+        self._pid = os.getpid()
+
+
+    def submit(self, host, command, timeout=3600):
+        """
+        Queue a command, starting it right away unless max_concurrency
+        commands are running already.
+
+        @param host: the host to run command on.
+        @param command: the command line string.
+        @param timeout: seconds after which the command is killed.
+
+        @returns A PooledCommand, finished once wait() returned for it.
+        """
+        pooled_command = PooledCommand(host, command, timeout)
+        self._queued.append(pooled_command)
+        self._start_queued()
+        return pooled_command
+
+
+    def wait(self, pooled_commands=None):
+        """
+        Run the pool until the given commands finished.
+
+        @param pooled_commands: a list of PooledCommands returned by
+                submit(), or None to wait for all the submitted commands.
+        """
+        if pooled_commands is None:
+            pooled_commands = self._queued + self._running
+        while not all(pooled_command.done()
+                      for pooled_command in pooled_commands):
+            self._poll()
+
+
+    def close(self):
+        """
+        Kill the master connections started by the pool.  Only the process
+        that created the pool does so, forked children leave them alone.
+        """
+        if os.getpid() != self._pid:
+            return
+        for master_job, socket_path in self._masters.itervalues():
+            utils.nuke_subprocess(master_job.sp)
+        self._masters.clear()
+        if self._control_dir is not None:
+            self._control_dir.clean()
+            self._control_dir = None
+
+
+    def _get_control_option(self, host):
+        """
+        Get the ssh option that multiplexes a command over a master
+        connection to host, starting one if needed.  Never waits for a
+        new master connection to come up.
+
+        @returns A ControlPath option, or '' if the host's own master
+                connection is used or no master connection is up yet.
+        """
+        host.start_master_ssh()
+        if host.master_ssh_option:
+            return ''
+
+        key = (host.user, host.hostname, host.port)
+        if key in self._masters:
+            master_job, socket_path = self._masters[key]
+            if master_job.sp.poll() is not None:
+                logging.info("Pooled master ssh connection to %s is down.",
+                             host.hostname)
+                del self._masters[key]
+                if os.path.exists(socket_path):
+                    os.remove(socket_path)
+        if key not in self._masters:
+            if self._control_dir is None:
+                self._control_dir = autotemp.tempdir(unique_id='ssh-pool')
+            socket_path = os.path.join(self._control_dir.name,
+                                       'socket-%s-%s' % (host.hostname,
+                                                         host.port))
+            master_cmd = host.ssh_command(
+                    options="-N -o ControlMaster=yes -o ControlPath=%s"
+                    % socket_path)
+            logging.info("Starting pooled master ssh connection '%s'",
+                         master_cmd)
+            self._masters[key] = (utils.BgJob(master_cmd, verbose=False),
+                                  socket_path)
+
+        socket_path = self._masters[key][1]
+        if os.path.exists(socket_path):
+            return '-o ControlPath=%s' % socket_path
+        return ''
+
+
+    def _start_queued(self):
+        while self._queued and len(self._running) < self.max_concurrency:
+            pooled_command = self._queued.pop(0)
+            host = pooled_command.host
+            if not hasattr(host, 'make_run_command'):
+                pooled_command.result = host.run(
+                        pooled_command.command, timeout=pooled_command.timeout,
+                        ignore_status=True)
+                # run() raises on timeouts
+                pooled_command.result.timed_out = False
+                continue
+
+            options = self._get_control_option(host)
+            logging.debug("Running (pooled ssh) '%s' on %s",
+                          pooled_command.command, host.hostname)
+            bg_job = utils.BgJob(host.make_run_command(pooled_command.command,
+                                                       options=options),
+                                 verbose=False)
+            bg_job.output_prepare(StringIO.StringIO(), StringIO.StringIO())
+            pooled_command.bg_job = bg_job
+            pooled_command.start_time = time.time()
+            self._running.append(pooled_command)
+
+
+    def _poll(self):
+        """
+        Process the output of the running commands, finish the ones that
+        exited or timed out and start queued ones in their place.
+        """
+        pipes = {}
+        for pooled_command in self._running:
+            sp = pooled_command.bg_job.sp
+            pipes[sp.stdout] = (pooled_command.bg_job, True)
+            pipes[sp.stderr] = (pooled_command.bg_job, False)
+        if pipes:
+            read_ready = select.select(pipes.keys(), [], [],
+                                       _SELECT_TIMEOUT)[0]
+            for pipe in read_ready:
+                bg_job, is_stdout = pipes[pipe]
+                bg_job.process_output(is_stdout)
+
+        now = time.time()
+        for pooled_command in list(self._running):
+            bg_job = pooled_command.bg_job
+            exit_status = bg_job.sp.poll()
+            timed_out = False
+            if exit_status is None:
+                if now - pooled_command.start_time < pooled_command.timeout:
+                    continue
+                logging.warn('run process timeout (%s) fired on: %s',
+                             pooled_command.timeout, bg_job.command)
+                utils.nuke_subprocess(bg_job.sp)
+                exit_status = bg_job.sp.poll()
+                timed_out = True
+            self._finish(pooled_command, exit_status, timed_out)
+        self._start_queued()
+
+
+    def _finish(self, pooled_command, exit_status, timed_out):
+        bg_job = pooled_command.bg_job
+        bg_job.process_output(stdout=True, final_read=True)
+        bg_job.process_output(stdout=False, final_read=True)
+        bg_job.cleanup()
+        bg_job.result.exit_status = exit_status
+        bg_job.result.timed_out = timed_out
+        bg_job.result.duration = time.time() - pooled_command.start_time
+        pooled_command.result = bg_job.result
+        self._running.remove(pooled_command)
+
+
+_pools = {}
+
+def get_pool():
+    """
+    @returns The SSHPool of the current process.
+    """
+    pid = os.getpid()
+    if pid not in _pools:
+        # pools inherited from a parent process are not ours to run
+        _pools.clear()
+        _pools[pid] = SSHPool()
+        atexit.register(_pools[pid].close)
+    return _pools[pid]
+
+
+def run_many(host_commands, timeout=3600, ignore_status=False,
+             max_concurrency=None):
+    """
+    Run commands concurrently on any number of hosts.
+
+    @param host_commands: a list of (host, command line string) pairs.
+    @param timeout: time limit in seconds for each command.
+    @param ignore_status: do not raise an exception, no matter what the exit
+            codes of the commands are.
+    @param max_concurrency: the maximum number of commands to run at once,
+            or None to share the process wide pool.
+
+    @returns A list of utils.CmdResult objects, in the order of host_commands.
+
+    @raises AutoservSSHTimeout: a command was killed for running longer than
+            timeout, whatever ignore_status is.
+    @raises AutoservRunError: a command failed and ignore_status is False.
+    """
+    if max_concurrency is None:
+        pool = get_pool()
+    else:
+        pool = SSHPool(max_concurrency)
+    try:
+        pooled_commands = [pool.submit(host, command, timeout)
+                           for host, command in host_commands]
+        pool.wait(pooled_commands)
+    finally:
+        if max_concurrency is not None:
+            pool.close()
+
+    results = [pooled_command.result for pooled_command in pooled_commands]
+    for result in results:
+        if result.timed_out:
+            raise error.AutoservSSHTimeout(
+                    "command did not complete within %s seconds" % timeout,
+                    result)
+    if not ignore_status:
+        for result in results:
+            if result.exit_status != 0:
+                raise error.AutoservRunError("command execution error", result)
+    return results
@@ -0,0 +1,153 @@
+#!/usr/bin/python
+
+import os, time, unittest
+try:
+    import autotest.common as common
+except ImportError:
+    import common
+from autotest_lib.client.common_lib import error, utils
+from autotest_lib.server.hosts import ssh_pool
+
+
+class FakeSSHHost(object):
+    """Runs the "remote" commands locally instead of through ssh."""
+    user = 'root'
+    port = 22
+
+    def __init__(self, hostname, master_ssh_option=''):
+        self.hostname = hostname
+        self.master_ssh_option = master_ssh_option
+        self.master_commands = []
+        self.options = []
+
+
+    def start_master_ssh(self):
+        pass
+
+
+    def ssh_command(self, options=''):
+        # a master connection that never creates its control socket
+        self.master_commands.append(options)
+        return 'sleep 60'
+
+
+    def make_run_command(self, command, options=''):
+        self.options.append(options)
+        return command
+
+
+class FakeHost(object):
+    hostname = 'serial'
+
+    def run(self, command, timeout, ignore_status):
+        return utils.CmdResult(command, stdout='ran ' + command,
+                               exit_status=0)
+
+
+class ssh_pool_test(unittest.TestCase):
+    def test_results_in_order(self):
+        hosts = [FakeSSHHost('order1'), FakeSSHHost('order2')]
+        host_commands = [(host, 'echo %s-%d' % (host.hostname, i))
+                         for i in xrange(3) for host in hosts]
+        results = ssh_pool.run_many(host_commands)
+
+        self.assertEquals(['%s-%d\n' % (host.hostname, i)
+                           for i in xrange(3) for host in hosts],
+                          [result.stdout for result in results])
+        self.assertEquals([1, 1], [len(host.master_commands)
+                                   for host in hosts])
+        for host in hosts:
+            self.assertEquals('', host.master_ssh_option)
+            # commands don't wait for the master connection to come up
+            self.assertEquals([''] * 3, host.options)
+
+
+    def test_pooled_master(self):
+        host = FakeSSHHost('host1')
+        pool = ssh_pool.SSHPool()
+        pool.submit(host, 'true')
+        master_job, socket_path = pool._masters[('root', 'host1', 22)]
+        self.assertTrue(host.master_commands[0].endswith(
+                '-o ControlMaster=yes -o ControlPath=%s' % socket_path))
+        # once the socket exists, commands are multiplexed over the master
+        open(socket_path, 'w').close()
+        pool.submit(host, 'true')
+        self.assertEquals(['', '-o ControlPath=%s' % socket_path],
+                          host.options)
+        pool.wait()
+
+        # a dead master connection is restarted
+        utils.nuke_subprocess(master_job.sp)
+        pool.submit(host, 'true')
+        self.assertEquals(2, len(host.master_commands))
+        self.assertFalse(os.path.exists(socket_path))
+        pool.wait()
+
+        pool.close()
+        self.assertEquals({}, pool._masters)
+        self.assertEquals(None, pool._control_dir)
+
+
+    def test_host_master(self):
+        host = FakeSSHHost('host1', master_ssh_option='-o ControlPath=foo')
+        ssh_pool.run_many([(host, 'true')], max_concurrency=1)
+        self.assertEquals([], host.master_commands)
+        self.assertEquals([''], host.options)
+
+
+    def test_concurrency_cap(self):
+        host = FakeSSHHost('host1')
+        pool = ssh_pool.SSHPool(max_concurrency=2)
+        pooled_commands = [pool.submit(host, 'sleep 0.1; echo %d >&2' % i)
+                           for i in xrange(5)]
+        self.assertEquals(2, len(pool._running))
+        self.assertEquals(3, len(pool._queued))
+
+        pool.wait()
+        self.assertEquals(['%d\n' % i for i in xrange(5)],
+                          [pooled_command.result.stderr
+                           for pooled_command in pooled_commands])
+        self.assertEquals([], pool._running)
+        pool.close()
+
+
+    def test_failures(self):
+        host = FakeSSHHost('host1')
+        results = ssh_pool.run_many([(host, 'true'), (host, 'exit 3')],
+                                    ignore_status=True)
+        self.assertEquals([0, 3], [result.exit_status for result in results])
+        self.assertRaises(error.AutoservRunError, ssh_pool.run_many,
+                          [(host, 'exit 3')])
+
+
+    def test_timeout(self):
+        start_time = time.time()
+        pool = ssh_pool.SSHPool()
+        slow = pool.submit(FakeSSHHost('host1'), 'sleep 30', timeout=0.5)
+        fast = pool.submit(FakeSSHHost('host1'), 'exit 3', timeout=0.5)
+        pool.wait()
+        pool.close()
+        self.assertTrue(slow.result.timed_out)
+        self.assertFalse(fast.result.timed_out)
+        self.assertTrue(time.time() - start_time < 10)
+
+        # a timeout is not an ordinary failure, even with ignore_status
+        try:
+            ssh_pool.run_many([(FakeSSHHost('host1'), 'sleep 30')],
+                              timeout=0.5, ignore_status=True,
+                              max_concurrency=1)
+        except error.AutoservSSHTimeout, e:
+            self.assertEquals('sleep 30', e.args[1].command)
+        else:
+            self.fail('AutoservSSHTimeout not raised')
+
+
+    def test_fallback_to_run(self):
+        results = ssh_pool.run_many([(FakeHost(), 'uptime'),
+                                     (FakeSSHHost('host1'), 'echo ssh')])
+        self.assertEquals(['ran uptime', 'ssh\n'],
+                          [result.stdout for result in results])
+
+
+if __name__ == '__main__':
+    unittest.main()
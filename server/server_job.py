@@ -15,6 +15,7 @@ from autotest_lib.client.common_lib import logging_manager
 from autotest_lib.server import test, subcommand, profilers
 from autotest_lib.server.hosts import abstract_ssh
 from autotest_lib.tko import db as tko_db, status_lib, utils as tko_utils
+from autotest_lib.tko import status_checkpoint
 
 
 def _control_segment_path(name):
@@ -133,6 +134,8 @@ class base_server_job(base_job.base_job):
     """
 
     _STATUS_VERSION = 1
+    # minimum seconds between checkpoints of the continuous parser
+    _PARSE_CHECKPOINT_INTERVAL = 60
 
     def __init__(self, control, args, resultdir, label, user, machines,
                  client=False, parse_job='',
@@ -297,9 +300,15 @@ class base_server_job(base_job.base_job):
         tko_utils.redirect_parser_debugging(parse_log)
         # create a job model object and set up the db
         self.results_db = tko_db.db(autocommit=True)
-        self.parser = status_lib.parser(self._STATUS_VERSION)
-        self.job_model = self.parser.make_job(self.resultdir)
-        self.parser.start(self.job_model)
+        status_log = os.path.join(self.resultdir, 'status.log')
+        self.parser = status_checkpoint.checkpointed_parser(
+                self._STATUS_VERSION, self.resultdir, status_log)
+        self.job_model = self.parser.job
+        self.parser.start(resume=False)
+        # the parser is fed the lines as they are appended to status.log,
+        # which only yields valid checkpoints if it starts out empty
+        if os.path.exists(status_log) and os.path.getsize(status_log):
+            self.parser.disable_checkpoints()
         # check if a job already exists in the db and insert it if
         # it does not
         job_idx = self.results_db.find_job(self._parse_job)
@@ -319,7 +328,7 @@ class base_server_job(base_job.base_job):
         """
         if not self._using_parser:
             return
-        final_tests = self.parser.end()
+        final_tests = self.parser.end([])
         for test in final_tests:
             self.__insert_test(test)
         self._using_parser = False
@@ -1021,9 +1030,10 @@ class base_server_job(base_job.base_job):
     def _parse_status(self, new_line):
         if not self._using_parser:
             return
-        new_tests = self.parser.process_lines([new_line])
+        new_tests = self.parser.process_lines([new_line + '\n'])
         for test in new_tests:
             self.__insert_test(test)
+        self.parser.save(min_interval=self._PARSE_CHECKPOINT_INTERVAL)
 
 
     def __insert_test(self, test):
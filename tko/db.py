@@ -5,9 +5,30 @@ try:
 except ImportError:
     import common
 from autotest_lib.client.common_lib import global_config
+from autotest_lib.client.common_lib import utils as common_utils
 from autotest_lib.tko import utils
 
 
+# tko_status_rollups holds the number of tests and the latest test_idx for
+# every combination of the grouping columns below, as they appear in
+# tko_test_view_2.  It is kept up to date as tests are inserted, updated and
+# deleted so that the TKO RPCs can count tests without scanning the view.
+_ROLLUP_TABLE = 'tko_status_rollups'
+
+# (rollup column, SQL over tko_test_view_2, column width)
+_ROLLUP_COLUMNS = (('test_name', 'test_name', 300),
+                   ('status', 'status', 30),
+                   ('kernel', 'kernel', 300),
+                   ('hostname', 'hostname', 255),
+                   ('platform', 'platform', 240),
+                   ('job_owner', 'job_owner', 240),
+                   ('job_queued_day', 'DATE(job_queued_time)', None),
+                   ('test_finished_day', 'DATE(test_finished_time)', None))
+
+# stands for NULL when hashing the grouping columns
+_ROLLUP_NULL = '\x01'
+
+
 class MySQLTooManyRows(Exception):
     pass
 
@@ -37,6 +58,7 @@ class db_sql(object):
         else:
             self.machine_map = None
         self.machine_group = {}
+        self._row_cache = {}
 
 
     def _load_config(self, host, database, user, password):
@@ -243,20 +265,31 @@ class db_sql(object):
             return exec_sql()
 
 
-    def _exec_sql_with_commit(self, sql, values, commit):
+    def _exec_sql_with_commit(self, sql, values, commit, many=False):
+        if many:
+            execute = self.cur.executemany
+        else:
+            execute = self.cur.execute
         if self.autocommit:
             # re-run the query until it succeeds
             def exec_sql():
-                self.cur.execute(sql, values)
+                execute(sql, values)
                 self.con.commit()
             self.run_with_retry(exec_sql)
         else:
             # take one shot at running the query
-            self.cur.execute(sql, values)
+            execute(sql, values)
             if commit:
                 self.con.commit()
 
 
+    def _insert_sql(self, table, fields):
+        refs = ['%s' for field in fields]
+        return ('insert into %s (%s) values (%s)' %
+                (table, ','.join(self._quote(field) for field in fields),
+                 ','.join(refs)))
+
+
     def insert(self, table, data, commit=None):
         """\
                 'insert into table (keys) values (%s ... %s)', values
@@ -265,16 +298,33 @@ class db_sql(object):
                         dictionary of fields and data
         """
         fields = data.keys()
-        refs = ['%s' for field in fields]
         values = [data[field] for field in fields]
-        cmd = ('insert into %s (%s) values (%s)' %
-               (table, ','.join(self._quote(field) for field in fields),
-                ','.join(refs)))
+        cmd = self._insert_sql(table, fields)
         self.dprint('%s %s' % (cmd, values))
 
         self._exec_sql_with_commit(cmd, values, commit)
 
 
+    def insert_many(self, table, rows, commit=None):
+        """\
+                'insert into table (keys) values (%s ... %s)' for many
+                rows with a single executemany() call, which the MySQL
+                driver sends as multi-row INSERT statements.
+
+                rows:
+                        list of dictionaries of fields and data, all
+                        with the same keys
+        """
+        if not rows:
+            return
+        fields = rows[0].keys()
+        values = [[row[field] for field in fields] for row in rows]
+        cmd = self._insert_sql(table, fields)
+        self.dprint('%s (%d rows)' % (cmd, len(values)))
+
+        self._exec_sql_with_commit(cmd, values, commit, many=True)
+
+
     def delete(self, table, where, commit = None):
         cmd = ['delete from', table]
         if commit is None:
@@ -311,8 +361,180 @@ class db_sql(object):
         self._exec_sql_with_commit(cmd, values, commit)
 
 
+    def _rollup_group(self, values):
+        """\
+                Return a (group_hash, values) rollup group for a tuple of
+                values of the _ROLLUP_COLUMNS, as they are stored.
+        """
+        stored_values = []
+        for (column, sql, width), value in zip(_ROLLUP_COLUMNS, values):
+            if value is None:
+                stored_values.append(None)
+                continue
+            if hasattr(value, 'date'):
+                value = value.date()
+            if hasattr(value, 'isoformat'):
+                value = value.isoformat()
+            if isinstance(value, unicode):
+                value = value.encode('utf-8')
+            stored_values.append(str(value)[:width])
+        hash_input = '\t'.join(_ROLLUP_NULL if value is None else value
+                                for value in stored_values)
+        group_hash = common_utils.hash('md5', hash_input).hexdigest()
+        return group_hash, tuple(stored_values)
+
+
+    def _rollup_hash_sql(self):
+        """\
+                SQL computing the group_hash of a tko_test_view_2 row, the
+                same way as _rollup_group().
+        """
+        parts = ["IFNULL(%s, CHAR(1))" % sql
+                 for column, sql, width in _ROLLUP_COLUMNS]
+        return 'MD5(CONCAT_WS(CHAR(9), %s))' % ', '.join(parts)
+
+
+    def _get_rollup_groups(self, where):
+        """\
+                Return a dictionary mapping the test_idx of the tests
+                matching where in tko_test_view_2 to their rollup group.
+        """
+        fields = ['test_idx'] + [sql for column, sql, width in _ROLLUP_COLUMNS]
+        rows = self.select(', '.join(fields), 'tko_test_view_2', where)
+        return dict((row[0], self._rollup_group(row[1:])) for row in rows)
+
+
+    def _get_test_rollup_group(self, job, test, kernel_idx):
+        hostname, platform = self._get_cached_row(
+                'hostname, machine_group', 'tko_machines',
+                {'machine_idx': job.machine_idx})
+        kernel, = self._get_cached_row('printable', 'tko_kernels',
+                                       {'kernel_idx': kernel_idx})
+        return self._rollup_group((test.testname, test.status, kernel,
+                                   hostname, platform, job.user,
+                                   job.queued_time, test.finished_time))
+
+
+    def _get_cached_row(self, fields, table, where):
+        key = (fields, table, tuple(sorted(where.items())))
+        if key not in self._row_cache:
+            self._row_cache[key] = self.select(fields, table, where)[0]
+        return self._row_cache[key]
+
+
+    def _update_rollups(self, old_groups, new_groups, commit):
+        """\
+                Move tests between rollup groups.
+
+                old_groups, new_groups:
+                        dictionaries mapping test_idx to the rollup group
+                        of the test before and after the change; tests
+                        missing from new_groups were deleted
+        """
+        # group hash -> [values, count delta, highest added test_idx]
+        deltas = {}
+        removed_tests = {}
+        for test_idx, (group_hash, values) in old_groups.iteritems():
+            if new_groups.get(test_idx, (None,))[0] != group_hash:
+                deltas.setdefault(group_hash, [values, 0, None])[1] -= 1
+                removed_tests.setdefault(group_hash, set()).add(test_idx)
+        for test_idx, (group_hash, values) in new_groups.iteritems():
+            if old_groups.get(test_idx, (None,))[0] != group_hash:
+                delta = deltas.setdefault(group_hash, [values, 0, None])
+                delta[1] += 1
+                delta[2] = max(delta[2], test_idx)
+        if not deltas:
+            return
+
+        upserts, decrements = [], []
+        for group_hash, (values, count, latest_test_idx) in deltas.iteritems():
+            if latest_test_idx is None:
+                decrements.append((count, group_hash))
+            else:
+                upserts.append((group_hash,) + values +
+                               (count, latest_test_idx))
+        if upserts:
+            columns = (['group_hash'] +
+                       [column for column, sql, width in _ROLLUP_COLUMNS] +
+                       ['test_count', 'latest_test_idx'])
+            sql = self._insert_sql(_ROLLUP_TABLE, columns)
+            sql += (' ON DUPLICATE KEY UPDATE '
+                    'test_count = test_count + VALUES(test_count), '
+                    'latest_test_idx = GREATEST(latest_test_idx, '
+                    'VALUES(latest_test_idx))')
+            self.dprint('%s (%d rows)' % (sql, len(upserts)))
+            self._exec_sql_with_commit(sql, upserts, commit, many=True)
+        if decrements:
+            sql = ('UPDATE %s SET test_count = test_count + %%s '
+                   'WHERE group_hash = %%s' % _ROLLUP_TABLE)
+            self.dprint('%s (%d rows)' % (sql, len(decrements)))
+            self._exec_sql_with_commit(sql, decrements, commit, many=True)
+        if not removed_tests:
+            return
+
+        # drop emptied groups and find a new latest test for the groups
+        # that lost theirs
+        hashes = removed_tests.keys()
+        hash_refs = ','.join(['%s'] * len(hashes))
+        self.delete(_ROLLUP_TABLE,
+                    ('group_hash IN (%s) AND test_count <= 0' % hash_refs,
+                     hashes), commit=commit)
+        rows = self.select('group_hash, latest_test_idx', _ROLLUP_TABLE,
+                           ('group_hash IN (%s)' % hash_refs, hashes))
+        for group_hash, latest_test_idx in rows:
+            if latest_test_idx not in removed_tests[group_hash]:
+                continue
+            values = deltas[group_hash][0]
+            conditions = ['%s <=> %%s' % sql
+                          for column, sql, width in _ROLLUP_COLUMNS]
+            latest_sql = ('(SELECT MAX(test_idx) FROM tko_test_view_2 '
+                          'WHERE %s)' % ' AND '.join(conditions))
+            sql = ('UPDATE %s SET latest_test_idx = %s WHERE group_hash = %%s'
+                   % (_ROLLUP_TABLE, latest_sql))
+            self.dprint(sql)
+            self._exec_sql_with_commit(sql, list(values) + [group_hash],
+                                       commit)
+
+
+    def rebuild_status_rollups(self, hostname=None, commit=None):
+        """\
+                Recompute tko_status_rollups from tko_test_view_2, for
+                all tests or only those run on hostname.
+        """
+        if hostname is None:
+            where, where_sql, values = None, '', []
+        else:
+            where = {'hostname': hostname}
+            where_sql, values = ' WHERE hostname = %s', [hostname]
+        self.delete(_ROLLUP_TABLE, where, commit=commit)
+        columns = [column for column, sql, width in _ROLLUP_COLUMNS]
+        selects = ['MIN(%s)' % sql for column, sql, width in _ROLLUP_COLUMNS]
+        sql = ('INSERT INTO %s (group_hash, %s, test_count, latest_test_idx) '
+               'SELECT %s, %s, COUNT(*), MAX(test_idx) FROM tko_test_view_2%s '
+               'GROUP BY 1' % (_ROLLUP_TABLE, ', '.join(columns),
+                               self._rollup_hash_sql(), ', '.join(selects),
+                               where_sql))
+        self.dprint('%s %s' % (sql, values))
+        self._exec_sql_with_commit(sql, values, commit)
+
+
+    def delete_test(self, test_idx, commit = None):
+        """\
+                Delete a test and all of its results.
+        """
+        old_groups = self._get_rollup_groups({'test_idx': test_idx})
+        where = {'test_idx' : test_idx}
+        self.delete('tko_iteration_result', where)
+        self.delete('tko_iteration_attributes', where)
+        self.delete('tko_test_attributes', where)
+        self.delete('tko_test_labels_tests', {'test_id': test_idx})
+        self.delete('tko_tests', where)
+        self._update_rollups(old_groups, {}, commit)
+
+
     def delete_job(self, tag, commit = None):
         job_idx = self.find_job(tag)
+        old_groups = self._get_rollup_groups({'job_idx': job_idx})
         for test_idx in self.find_tests(job_idx):
             where = {'test_idx' : test_idx}
             self.delete('tko_iteration_result', where)
@@ -322,9 +544,50 @@ class db_sql(object):
         where = {'job_idx' : job_idx}
         self.delete('tko_tests', where)
         self.delete('tko_jobs', where)
+        self._update_rollups(old_groups, {}, commit)
 
 
     def insert_job(self, tag, job, commit = None):
+        """\
+                Write a parsed job and all of its tests.  The rows of the
+                per-test tables are collected across all the tests and
+                written with one insert_many() per table.  In autocommit
+                mode the whole job is written in a single transaction
+                which is retried as a unit.
+        """
+        if self.autocommit:
+            self.run_with_retry(self._insert_job_in_transaction, tag, job)
+        else:
+            self._insert_job(tag, job, commit)
+
+
+    def _insert_job_in_transaction(self, tag, job):
+        had_index = hasattr(job, 'index')
+        new_tests = [test for test in job.tests
+                     if not hasattr(test, 'test_idx')]
+        self.autocommit = False
+        try:
+            try:
+                self._insert_job(tag, job, commit=False)
+                self.con.commit()
+            except:
+                # run_with_retry reconnects, dropping the transaction, so
+                # a retry has to insert the job and its tests again
+                if not had_index and hasattr(job, 'index'):
+                    del job.index
+                for test in new_tests:
+                    if hasattr(test, 'test_idx'):
+                        del test.test_idx
+                # don't leave the rows inserted so far in an open
+                # transaction on a connection that is kept
+                self.con.rollback()
+                raise
+        finally:
+            self.autocommit = True
+
+
+    def _insert_job(self, tag, job, commit):
+        self._row_cache = {}
         job.machine_idx = self.lookup_machine(job.machine)
         if not job.machine_idx:
             job.machine_idx = self.insert_machine(job, commit=commit)
@@ -343,28 +606,77 @@ class db_sql(object):
                 'afe_job_id': afe_job_id}
         is_update = hasattr(job, 'index')
         if is_update:
+            old_groups = self._get_rollup_groups({'job_idx': job.index})
             self.update('tko_jobs', data, {'job_idx': job.index}, commit=commit)
         else:
+            old_groups = {}
             self.insert('tko_jobs', data, commit=commit)
             job.index = self.get_last_autonumber_value()
         self.update_job_keyvals(job, commit=commit)
+        pending_rows = {}
+        new_groups = {}
         for test in job.tests:
-            self.insert_test(job, test, commit=commit)
+            self._insert_test(job, test, pending_rows, new_groups, commit)
+        self._insert_pending_rows(pending_rows, commit)
+        # tests of the job that were not part of this parse keep their group
+        for test_idx, group in old_groups.iteritems():
+            new_groups.setdefault(test_idx, group)
+        self._update_rollups(old_groups, new_groups, commit)
 
 
     def update_job_keyvals(self, job, commit=None):
+        """\
+                Upsert the job's keyvals: existing keys whose value
+                changed are updated and all new keys are inserted with a
+                single insert_many().  tko_job_keyvals has no unique key
+                on (job_id, key), so this cannot use ON DUPLICATE KEY.
+        """
+        if not job.keyval_dict:
+            return
+        existing = dict(self.select('`key`, `value`', 'tko_job_keyvals',
+                                    {'job_id': job.index}))
+        new_rows = []
         for key, value in job.keyval_dict.iteritems():
-            where = {'job_id': job.index, 'key': key}
-            data = dict(where, value=value)
-            exists = self.select('id', 'tko_job_keyvals', where=where)
+            if key not in existing:
+                new_rows.append({'job_id': job.index, 'key': key,
+                                 'value': value})
+            elif existing[key] != value:
+                self.update('tko_job_keyvals', {'value': value},
+                            where={'job_id': job.index, 'key': key},
+                            commit=commit)
+        self.insert_many('tko_job_keyvals', new_rows, commit=commit)
 
-            if exists:
-                self.update('tko_job_keyvals', data, where=where, commit=commit)
-            else:
-                self.insert('tko_job_keyvals', data, commit=commit)
 
+    # per-test tables, in the order their pending rows are inserted
+    _TEST_CHILD_TABLES = ('tko_iteration_attributes', 'tko_iteration_result',
+                          'tko_test_attributes', 'tko_test_labels_tests')
 
     def insert_test(self, job, test, commit = None):
+        self._row_cache = {}
+        if hasattr(test, 'test_idx'):
+            old_groups = self._get_rollup_groups({'test_idx': test.test_idx})
+        else:
+            old_groups = {}
+        pending_rows = {}
+        new_groups = {}
+        self._insert_test(job, test, pending_rows, new_groups, commit)
+        self._insert_pending_rows(pending_rows, commit)
+        self._update_rollups(old_groups, new_groups, commit)
+
+
+    def _insert_pending_rows(self, pending_rows, commit):
+        for table in self._TEST_CHILD_TABLES:
+            self.insert_many(table, pending_rows.get(table), commit=commit)
+
+
+    def _insert_test(self, job, test, pending_rows, new_groups, commit):
+        """\
+                Insert or update the tko_tests row of a test.  The rows
+                for its iterations, attributes and labels are appended
+                to pending_rows, a dictionary of table name to a list of
+                rows, for the caller to insert.  The rollup group of the
+                test is added to new_groups, see _update_rollups().
+        """
         kver = self.insert_kernel(test.kernel, commit=commit)
         data = {'job_idx':job.index, 'test':test.testname,
                 'subdir':test.subdir, 'kernel_idx':kver,
@@ -385,30 +697,29 @@ class db_sql(object):
         else:
             self.insert('tko_tests', data, commit=commit)
             test_idx = test.test_idx = self.get_last_autonumber_value()
-        data = {'test_idx': test_idx}
+        new_groups[test_idx] = self._get_test_rollup_group(job, test, kver)
+
+        def add_row(table, row):
+            pending_rows.setdefault(table, []).append(row)
 
         for i in test.iterations:
-            data['iteration'] = i.index
             for key, value in i.attr_keyval.iteritems():
-                data['attribute'] = key
-                data['value'] = value
-                self.insert('tko_iteration_attributes', data,
-                            commit=commit)
+                add_row('tko_iteration_attributes',
+                        {'test_idx': test_idx, 'iteration': i.index,
+                         'attribute': key, 'value': value})
             for key, value in i.perf_keyval.iteritems():
-                data['attribute'] = key
-                data['value'] = value
-                self.insert('tko_iteration_result', data,
-                            commit=commit)
+                add_row('tko_iteration_result',
+                        {'test_idx': test_idx, 'iteration': i.index,
+                         'attribute': key, 'value': value})
 
         for key, value in test.attributes.iteritems():
-            data = {'test_idx': test_idx, 'attribute': key,
-                    'value': value}
-            self.insert('tko_test_attributes', data, commit=commit)
+            add_row('tko_test_attributes',
+                    {'test_idx': test_idx, 'attribute': key, 'value': value})
 
         if not is_update:
             for label_index in test.labels:
-                data = {'test_id': test_idx, 'testlabel_id': label_index}
-                self.insert('tko_test_labels_tests', data, commit=commit)
+                add_row('tko_test_labels_tests',
+                        {'test_id': test_idx, 'testlabel_id': label_index})
 
 
     def read_machine_map(self):
@@ -441,9 +752,13 @@ class db_sql(object):
 
     def update_machine_information(self, job, commit = None):
         machine_info = self.machine_info_dict(job)
-        self.update('tko_machines', machine_info,
-                    where={'hostname': machine_info['hostname']},
-                    commit=commit)
+        where = {'hostname': machine_info['hostname']}
+        old_groups = self.select('machine_group', 'tko_machines', where)
+        self.update('tko_machines', machine_info, where=where, commit=commit)
+        # the platform of all the tests run on the machine changed
+        if old_groups and old_groups[0][0] != machine_info['machine_group']:
+            self.rebuild_status_rollups(machine_info['hostname'],
+                                        commit=commit)
 
 
     def lookup_machine(self, hostname):
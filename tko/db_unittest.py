@@ -0,0 +1,222 @@
+#!/usr/bin/python
+
+import unittest
+
+try:
+    import autotest.common as common
+except ImportError:
+    import common
+from autotest_lib.tko import db, models
+
+
+class FakeCursor(object):
+    def __init__(self, select_results):
+        self.select_results = select_results
+        self.statements = []
+        self._result = []
+        self._last_id = 0
+
+
+    def execute(self, sql, values):
+        self.statements.append(('execute', sql, values))
+        self._result = []
+        if sql.startswith('SELECT LAST_INSERT_ID()'):
+            self._last_id += 1
+            self._result = [(self._last_id,)]
+        elif sql.startswith('select'):
+            # select results are looked up by table and selected fields
+            fields, rest = sql[len('select '):].split(' from ')
+            self._result = self.select_results.get(
+                    (rest.split()[0], fields), [])
+
+
+    def executemany(self, sql, values):
+        self.statements.append(('executemany', sql, values))
+
+
+    def fetchall(self):
+        return self._result
+
+
+class FakeConnection(object):
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self.commits = 0
+        self.rollbacks = 0
+
+
+    def cursor(self):
+        return self._cursor
+
+
+    def commit(self):
+        self.commits += 1
+
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+class FakeDb(db.db_sql):
+    def __init__(self, select_results, **dargs):
+        self.fake_cursor = FakeCursor(select_results)
+        super(FakeDb, self).__init__(host='host', database='db', user='user',
+                                     password='', **dargs)
+
+
+    def connect(self, host, database, user, password):
+        self.fake_connection = FakeConnection(self.fake_cursor)
+        return self.fake_connection
+
+
+    def run_with_retry(self, function, *args, **dargs):
+        # the fake connection never raises operational errors
+        return function(*args, **dargs)
+
+
+class BulkInsertTest(unittest.TestCase):
+    def _make_db(self, select_results={}, autocommit=False):
+        results = {('tko_status', 'status_idx, word'): [(6, 'GOOD')],
+                   ('tko_machines', 'machine_idx'): [(1,)],
+                   ('tko_machines', 'hostname, machine_group'):
+                           [('machine', 'group')],
+                   ('tko_machines', 'machine_group'): [('group',)],
+                   ('tko_kernels', 'kernel_idx'): [(2,)],
+                   ('tko_kernels', 'printable'): [('2.6.18',)]}
+        results.update(select_results)
+        self.db = FakeDb(results, autocommit=autocommit)
+        self.statements = self.db.fake_cursor.statements
+        del self.statements[:]
+
+
+    def _make_job(self, num_tests, num_iterations):
+        kernel = models.kernel('2.6.18', [], 'kernel_hash')
+        tests = []
+        for test_index in xrange(num_tests):
+            iterations = [models.iteration(i, {'attr': 'x'},
+                                           {'perf1': i, 'perf2': i})
+                          for i in xrange(num_iterations)]
+            tests.append(models.test('sub%d' % test_index, 'test', 'GOOD',
+                                     '', kernel, 'machine', None, None,
+                                     iterations, {'test_attr': 'y'}, [1]))
+        job = models.job('dir', 'user', 'label', 'machine', None, None, None,
+                         None, None, None, None, {'k1': 'v1', 'k2': 'v2'})
+        job.tests = tests
+        return job
+
+
+    def _get_statements(self, kind, table):
+        prefix = 'insert into %s ' % table
+        return [values for statement_kind, sql, values in self.statements
+                if statement_kind == kind and sql.startswith(prefix)]
+
+
+    def test_insert_job(self):
+        self._make_db()
+        self.db.insert_job('1-user/host', self._make_job(3, 4))
+
+        for table, row_count in (('tko_iteration_attributes', 12),
+                                 ('tko_iteration_result', 24),
+                                 ('tko_test_attributes', 3),
+                                 ('tko_test_labels_tests', 3),
+                                 ('tko_job_keyvals', 2)):
+            self.assertEqual([], self._get_statements('execute', table))
+            batches = self._get_statements('executemany', table)
+            self.assertEqual(1, len(batches))
+            self.assertEqual(row_count, len(batches[0]))
+        self.assertEqual(3, len(self._get_statements('execute', 'tko_tests')))
+
+
+    def test_update_job_keyvals(self):
+        self._make_db({('tko_job_keyvals', '`key`, `value`'):
+                               [('k1', 'v1'), ('k2', 'old')]})
+        job = self._make_job(0, 0)
+        job.index = 5
+        job.keyval_dict.update(k2='v2', k3='v3')
+        self.db.update_job_keyvals(job)
+
+        updates = [values for kind, sql, values in self.statements
+                   if sql.startswith('update tko_job_keyvals')]
+        self.assertEqual(1, len(updates))
+        self.assertEqual('v2', updates[0][0])
+        batches = self._get_statements('executemany', 'tko_job_keyvals')
+        self.assertEqual(1, len(batches))
+        self.assertEqual(1, len(batches[0]))
+        self.assert_(5 in batches[0][0] and 'k3' in batches[0][0])
+
+
+    def _get_rollup_statements(self, prefix):
+        return [(kind, values) for kind, sql, values in self.statements
+                if sql.startswith(prefix)]
+
+
+    def test_rollups_on_insert(self):
+        self._make_db()
+        self.db.insert_job('1-user/host', self._make_job(3, 0))
+
+        upserts = self._get_rollup_statements('insert into tko_status_rollups')
+        self.assertEqual(1, len(upserts))
+        kind, rows = upserts[0]
+        self.assertEqual('executemany', kind)
+        self.assertEqual(1, len(rows))
+        # three tests in one group, the latest being the last inserted
+        self.assertEqual(('test', 'GOOD', '2.6.18', 'machine', 'group',
+                          'user', None, None, 3, 4), rows[0][1:])
+
+
+    def test_rollups_on_update(self):
+        view_fields = ', '.join(['test_idx'] + [sql for column, sql, width
+                                                 in db._ROLLUP_COLUMNS])
+        running_values = ('test', 'RUNNING', '2.6.18', 'machine', 'group',
+                          'user', None, None)
+        self._make_db({('tko_test_view_2', view_fields):
+                               [(7,) + running_values]})
+        running_hash, _ = self.db._rollup_group(running_values)
+        self.db.fake_cursor.select_results[
+                ('tko_status_rollups', 'group_hash, latest_test_idx')] = [
+                (running_hash, 7)]
+
+        job = self._make_job(1, 0)
+        job.index, job.machine_idx = 1, 1
+        job.tests[0].test_idx = 7
+        self.db.insert_test(job, job.tests[0])
+
+        upserts = self._get_rollup_statements('insert into tko_status_rollups')
+        self.assertEqual([(1, 7)], [row[-2:] for row in upserts[0][1]])
+        self.assertEqual('GOOD', upserts[0][1][0][2])
+        decrements = self._get_rollup_statements('UPDATE tko_status_rollups '
+                                                 'SET test_count')
+        self.assertEqual([[(-1, running_hash)]],
+                         [values for kind, values in decrements])
+        # the test was the latest of its old group
+        recomputes = self._get_rollup_statements('UPDATE tko_status_rollups '
+                                                 'SET latest_test_idx')
+        self.assertEqual(1, len(recomputes))
+        self.assertEqual(list(running_values) + [running_hash],
+                         recomputes[0][1])
+
+
+    def test_autocommit_job_is_one_transaction(self):
+        self._make_db(autocommit=True)
+        connection = self.db.fake_connection
+        commits = connection.commits
+        self.db.insert_job('1-user/host', self._make_job(2, 2))
+        self.assertEqual(commits + 1, connection.commits)
+        self.assertTrue(self.db.autocommit)
+
+
+    def test_failed_autocommit_job_is_rolled_back(self):
+        self._make_db(autocommit=True)
+        connection = self.db.fake_connection
+        job = self._make_job(2, 0)
+        def fail(*args, **dargs):
+            raise ValueError('insert failed')
+        self.db._insert_test = fail
+        self.assertRaises(ValueError, self.db.insert_job, '1-user/host', job)
+        self.assertEqual(1, connection.rollbacks)
+        self.assertFalse(hasattr(job, 'index'))
+        self.assertTrue(self.db.autocommit)
+
+
+if __name__ == '__main__':
+    unittest.main()
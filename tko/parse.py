@@ -1,13 +1,14 @@
 #!/usr/bin/python -u
 
-import os, sys, optparse, fcntl, errno, traceback, socket
+import os, sys, optparse, fcntl, errno, traceback, socket, time
 
 try:
     import autotest.common as common
 except ImportError:
     import common
 from autotest_lib.client.common_lib import mail, pidfile
-from autotest_lib.tko import db as tko_db, utils as tko_utils, status_lib, models
+from autotest_lib.tko import db as tko_db, utils as tko_utils, models
+from autotest_lib.tko import status_checkpoint
 from autotest_lib.client.common_lib import utils
 
 
@@ -37,6 +38,13 @@ def parse_args():
                       help="write pidfile (.parser_execute)",
                       dest="write_pidfile", action="store_true",
                       default=False)
+    parser.add_option("--ignore-checkpoint",
+                      help=("Parse the whole status log even if a checkpoint "
+                            "of an earlier parse exists"),
+                      dest="resume", action="store_false", default=True)
+    parser.add_option("--jobs", help=("Number of job directories to parse "
+                                      "in parallel"),
+                      type="int", dest="jobs", default=1)
     options, args = parser.parse_args()
 
     # we need a results directory
@@ -72,9 +80,12 @@ def mailfailure(jobname, job, message):
     mail.send("", job.user, "", subject, message_header + message)
 
 
-def parse_one(db, jobname, path, reparse, mail_on_failure):
+def parse_one(db, jobname, path, reparse, mail_on_failure, resume=True):
     """
     Parse a single job. Optionally send email on failure.
+
+    The status log is parsed from the last checkpoint in the job directory,
+    unless resume is False.
     """
     tko_utils.dprint("\nScanning %s (%s)" % (jobname, path))
     old_job_idx = db.find_job(jobname)
@@ -95,9 +106,6 @@ def parse_one(db, jobname, path, reparse, mail_on_failure):
     job_keyval = models.job.read_keyval(path)
     status_version = job_keyval.get("status_version", 0)
 
-    # parse out the job
-    parser = status_lib.parser(status_version)
-    job = parser.make_job(path)
     status_log = os.path.join(path, "status.log")
     if not os.path.exists(status_log):
         status_log = os.path.join(path, "status")
@@ -105,11 +113,14 @@ def parse_one(db, jobname, path, reparse, mail_on_failure):
         tko_utils.dprint("! Unable to parse job, no status file")
         return
 
-    # parse the status logs
+    # parse the status logs, starting from the last checkpoint
     tko_utils.dprint("+ Parsing dir=%s, jobname=%s" % (path, jobname))
-    status_lines = open(status_log).readlines()
-    parser.start(job)
-    tests = parser.end(status_lines)
+    parser = status_checkpoint.checkpointed_parser(status_version, path,
+                                                   status_log)
+    job = parser.job
+    parser.start(resume)
+    parser.end()
+    tests = parser.tests
 
     # parser.end can return the same object multiple times, so filter out dups
     job.tests = []
@@ -132,12 +143,7 @@ def parse_one(db, jobname, path, reparse, mail_on_failure):
                                  "testname=%r subdir=%r" %
                                  (test.testname, test.subdir))
         for test_idx in old_tests.itervalues():
-            where = {'test_idx' : test_idx}
-            db.delete('tko_iteration_result', where)
-            db.delete('tko_iteration_attributes', where)
-            db.delete('tko_test_attributes', where)
-            db.delete('tko_test_labels_tests', {'test_id': test_idx})
-            db.delete('tko_tests', where)
+            db.delete_test(test_idx)
 
     # check for failures
     message_lines = [""]
@@ -204,6 +210,7 @@ def _get_job_subdirs(path):
     # if this dir contains ONLY subdirectories, return them
     contents = set(os.listdir(path))
     contents.discard(".parse.lock")
+    contents.discard(status_checkpoint.CHECKPOINT_FILENAME)
     subdirs = set(sub for sub in contents if
                   os.path.isdir(os.path.join(path, sub)))
     if len(contents) == len(subdirs) != 0:
@@ -213,31 +220,141 @@ def _get_job_subdirs(path):
     return None
 
 
-def parse_leaf_path(db, path, level, reparse, mail_on_failure):
+def parse_leaf_path(db, path, level, reparse, mail_on_failure, resume=True):
+    """
+    Parse a single job, printing any error.
+
+    @returns True if the job was parsed without errors.
+    """
     job_elements = path.split("/")[-level:]
     jobname = "/".join(job_elements)
     try:
         db.run_with_retry(parse_one, db, jobname, path, reparse,
-                          mail_on_failure)
+                          mail_on_failure, resume)
     except Exception:
         traceback.print_exc()
+        return False
+    return True
 
 
-def parse_path(db, path, level, reparse, mail_on_failure):
+def parse_path(db, path, level, reparse, mail_on_failure, resume=True):
+    """
+    Parse a job directory and, for multi-machine jobs, its subdirectories.
+
+    @returns The number of jobs that failed to parse.
+    """
+    failures = 0
     job_subdirs = _get_job_subdirs(path)
     if job_subdirs is not None:
         # parse status.log in current directory, if it exists. multi-machine
         # synchronous server side tests record output in this directory. without
         # this check, we do not parse these results.
         if os.path.exists(os.path.join(path, 'status.log')):
-            parse_leaf_path(db, path, level, reparse, mail_on_failure)
+            if not parse_leaf_path(db, path, level, reparse, mail_on_failure,
+                                   resume):
+                failures += 1
         # multi-machine job
         for subdir in job_subdirs:
             jobpath = os.path.join(path, subdir)
-            parse_path(db, jobpath, level + 1, reparse, mail_on_failure)
+            failures += parse_path(db, jobpath, level + 1, reparse,
+                                   mail_on_failure, resume)
     else:
         # single machine job
-        parse_leaf_path(db, path, level, reparse, mail_on_failure)
+        if not parse_leaf_path(db, path, level, reparse, mail_on_failure,
+                               resume):
+            failures += 1
+    return failures
+
+
+# outcomes of parse_job_dir()
+PARSED = 'parsed'
+FAILED = 'failed'
+LOCKED = 'locked'
+
+
+def open_db(options):
+    return tko_db.db(autocommit=False, host=options.db_host,
+                     user=options.db_user, password=options.db_pass,
+                     database=options.db_name)
+
+
+def parse_job_dir(db, path, options):
+    """
+    Parse a top level job directory while holding its .parse.lock.
+
+    @returns PARSED, FAILED if any job under path failed to parse, or
+            LOCKED if the lock was held and non-blocking mode was requested.
+    """
+    lockfile = open(os.path.join(path, ".parse.lock"), "w")
+    flags = fcntl.LOCK_EX
+    if options.noblock:
+        flags |= fcntl.LOCK_NB
+    try:
+        fcntl.flock(lockfile, flags)
+    except IOError, e:
+        # lock is not available and nonblock has been requested
+        if e.errno == errno.EWOULDBLOCK:
+            lockfile.close()
+            return LOCKED
+        else:
+            raise # something unexpected happened
+    try:
+        failures = parse_path(db, path, options.level, options.reparse,
+                              options.mailit, options.resume)
+    finally:
+        fcntl.flock(lockfile, fcntl.LOCK_UN)
+        lockfile.close()
+    if failures:
+        return FAILED
+    return PARSED
+
+
+# per process state of the parallel parsing workers
+_worker_db = None
+_worker_options = None
+
+def _init_worker(options):
+    global _worker_db, _worker_options
+    _worker_options = options
+    _worker_db = open_db(options)
+
+
+def _parse_job_dir_in_worker(path):
+    return path, parse_job_dir(_worker_db, path, _worker_options)
+
+
+def parse_job_dirs(jobs_list, options):
+    """
+    Parse the given top level job directories, options.jobs of them at a
+    time.  Parallel parsing uses a pool of worker processes, each with its
+    own database connection.
+
+    @returns A dict mapping PARSED, FAILED and LOCKED to the number of job
+            directories with that outcome.
+    """
+    results = {PARSED: 0, FAILED: 0, LOCKED: 0}
+    if options.jobs <= 1:
+        db = open_db(options)
+        for path in jobs_list:
+            results[parse_job_dir(db, path, options)] += 1
+        return results
+
+    import multiprocessing
+    pool = multiprocessing.Pool(options.jobs, _init_worker, (options,))
+    try:
+        done = 0
+        for path, result in pool.imap_unordered(_parse_job_dir_in_worker,
+                                                jobs_list):
+            done += 1
+            results[result] += 1
+            tko_utils.dprint("[%d/%d] %s: %s" % (done, len(jobs_list), path,
+                                                 result))
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    pool.join()
+    return results
 
 
 def main():
@@ -258,33 +375,13 @@ def main():
             jobs_list = [os.path.join(results_dir, subdir)
                          for subdir in os.listdir(results_dir)]
 
-        # build up the database
-        db = tko_db.db(autocommit=False, host=options.db_host,
-                       user=options.db_user, password=options.db_pass,
-                       database=options.db_name)
-
-        # parse all the jobs
-        for path in jobs_list:
-            lockfile = open(os.path.join(path, ".parse.lock"), "w")
-            flags = fcntl.LOCK_EX
-            if options.noblock:
-                flags |= fcntl.LOCK_NB
-            try:
-                fcntl.flock(lockfile, flags)
-            except IOError, e:
-                # lock is not available and nonblock has been requested
-                if e.errno == errno.EWOULDBLOCK:
-                    lockfile.close()
-                    continue
-                else:
-                    raise # something unexpected happened
-            try:
-                parse_path(db, path, options.level, options.reparse,
-                           options.mailit)
-
-            finally:
-                fcntl.flock(lockfile, fcntl.LOCK_UN)
-                lockfile.close()
+        start_time = time.time()
+        results = parse_job_dirs(jobs_list, options)
+        tko_utils.dprint("Parsed %d job directories in %.1fs: %d parsed, "
+                         "%d failed, %d skipped (locked)"
+                         % (len(jobs_list), time.time() - start_time,
+                            results[PARSED], results[FAILED],
+                            results[LOCKED]))
 
     except:
         pid_file_manager.close_file(1)
@@ -0,0 +1,64 @@
+#!/usr/bin/python
+
+import fcntl, optparse, os, shutil, tempfile, unittest
+
+try:
+    import autotest.common as common
+except ImportError:
+    import common
+from autotest_lib.client.common_lib.test_utils import mock
+from autotest_lib.tko import parse
+
+
+class parse_job_dirs_test(unittest.TestCase):
+    def setUp(self):
+        self.god = mock.mock_god()
+        self.results_dir = tempfile.mkdtemp()
+        self.jobs_list = []
+        for name in ('1-user', '2-user', 'failing', 'locked'):
+            path = os.path.join(self.results_dir, name)
+            os.mkdir(path)
+            self.jobs_list.append(path)
+        self.god.stub_with(parse, 'open_db', lambda options: None)
+        self.god.stub_with(parse, 'parse_path', self._fake_parse_path)
+
+
+    def tearDown(self):
+        self.god.unstub_all()
+        shutil.rmtree(self.results_dir)
+
+
+    def _fake_parse_path(self, db, path, level, reparse, mail_on_failure,
+                         resume):
+        if path.endswith('failing'):
+            return 1
+        return 0
+
+
+    def _parse(self, jobs):
+        options = optparse.Values({'jobs': jobs, 'noblock': True, 'level': 1,
+                                   'reparse': False, 'mailit': False,
+                                   'resume': True})
+        lockfile = open(os.path.join(self.jobs_list[-1], '.parse.lock'), 'w')
+        fcntl.flock(lockfile, fcntl.LOCK_EX)
+        try:
+            return parse.parse_job_dirs(self.jobs_list, options)
+        finally:
+            lockfile.close()
+
+
+    def _check_results(self, results):
+        self.assertEquals({parse.PARSED: 2, parse.FAILED: 1, parse.LOCKED: 1},
+                          results)
+
+
+    def test_serial(self):
+        self._check_results(self._parse(1))
+
+
+    def test_parallel(self):
+        self._check_results(self._parse(2))
+
+
+if __name__ == '__main__':
+    unittest.main()
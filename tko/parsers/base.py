@@ -9,12 +9,16 @@ class parser(object):
     standard parser interfaction functions. The derived classes must
     implement a state_iterator method for this class to be useful.
     """
-    def start(self, job):
+    def start(self, job, resume_state=None):
         """ Initialize the parser for processing the results of
-        'job'."""
+        'job'. If 'resume_state' is given, continue from a state
+        previously returned by get_state() instead of from the start
+        of the status log."""
         # initialize all the basic parser parameters
         self.job = job
         self.finished = False
+        self.resume_state = resume_state
+        self.saved_state = None
         self.line_buffer = status_lib.line_buffer()
         # create and prime the parser state machine
         self.state = self.state_iterator(self.line_buffer)
@@ -57,6 +61,14 @@ class parser(object):
             return []
 
 
+    def get_state(self):
+        """ Return a picklable snapshot of the state machine after
+        the last process_lines() call, suitable for passing to
+        start() to resume parsing after the lines processed so far,
+        or None if this parser does not support resuming."""
+        return self.saved_state
+
+
     @staticmethod
     def make_job(dir):
         """ Create a new instance of the job model used by the
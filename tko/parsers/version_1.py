@@ -169,6 +169,13 @@ class parser(base.parser):
         line_buffer.put_back(abort)
 
 
+    # the state_iterator variables saved in checkpoints, see get_state()
+    _STATE_VARIABLES = ('line', 'job_count', 'boot_count', 'min_stack_size',
+                        'stack', 'current_kernel', 'current_status',
+                        'current_reason', 'started_time_stack',
+                        'subdir_stack', 'running_test', 'running_reasons',
+                        'running_job', 'running_client')
+
     def state_iterator(self, buffer):
         line = None
         new_tests = []
@@ -182,13 +189,22 @@ class parser(base.parser):
         subdir_stack = [None]
         running_test = None
         running_reasons = set()
+        running_client = None
         yield []   # we're ready to start running
 
-        # create a RUNNING SERVER_JOB entry to represent the entire test
-        running_job = test.parse_partial_test(self.job, "----", "SERVER_JOB",
-                                              "", current_kernel,
-                                              self.job.started_time)
-        new_tests.append(running_job)
+        if self.resume_state:
+            (line, job_count, boot_count, min_stack_size, stack,
+             current_kernel, current_status, current_reason,
+             started_time_stack, subdir_stack, running_test, running_reasons,
+             running_job, running_client) = [
+                    self.resume_state[name] for name in self._STATE_VARIABLES]
+        else:
+            # create a RUNNING SERVER_JOB entry to represent the entire test
+            running_job = test.parse_partial_test(self.job, "----",
+                                                  "SERVER_JOB", "",
+                                                  current_kernel,
+                                                  self.job.started_time)
+            new_tests.append(running_job)
 
         while True:
             # are we finished with parsing?
@@ -218,6 +234,11 @@ class parser(base.parser):
 
             # stop processing once the buffer is empty
             if buffer.size() == 0:
+                self.saved_state = dict(zip(self._STATE_VARIABLES, (
+                        line, job_count, boot_count, min_stack_size, stack,
+                        current_kernel, current_status, current_reason,
+                        started_time_stack, subdir_stack, running_test,
+                        running_reasons, running_job, running_client)))
                 yield new_tests
                 new_tests = []
                 continue
@@ -0,0 +1,236 @@
+"""
+Checkpointed, streaming parsing of job status logs.
+
+A checkpoint, stored as .parse.checkpoint in the job results directory,
+records how many bytes of the status log were processed, the state of the
+status log parser after those bytes and the tests produced so far.  A parse
+that finds a valid checkpoint only processes the part of the log appended
+after it, so the continuous parser of a running job lets the final parse
+and later reparses skip everything it already saw.
+"""
+
+import cPickle, os, tempfile, time
+
+try:
+    import autotest.common as common
+except ImportError:
+    import common
+from autotest_lib.tko import status_lib, utils as tko_utils
+
+
+CHECKPOINT_FILENAME = '.parse.checkpoint'
+
+# bump whenever the format of the checkpoints or of the parser state changes
+CHECKPOINT_VERSION = 1
+
+
+class checkpointed_parser(object):
+    """
+    Wraps a status_lib.parser, keeping track of the status log offset and of
+    all the tests produced so far so that both can be checkpointed.
+    """
+    def __init__(self, status_version, job_dir, status_log):
+        """
+        @param status_version: The status log version of the job.
+        @param job_dir: The job results directory.
+        @param status_log: The path of the status log being parsed.
+        """
+        self.status_version = status_version
+        self.job_dir = job_dir
+        self.status_log = status_log
+        self.checkpoint_path = os.path.join(job_dir, CHECKPOINT_FILENAME)
+        self.parser = status_lib.parser(status_version)
+        self.job = self.parser.make_job(job_dir)
+        self.offset = 0
+        self.tests = []
+        self.checkpoints_enabled = True
+        self._last_line = ''
+        self._seen_tests = set()
+        self._last_save_time = 0
+
+
+    def start(self, resume=True):
+        """
+        Start the parser, resuming from the checkpoint if one is valid.
+
+        @param resume: If False, ignore any existing checkpoint.
+        @returns True if parsing resumes from a checkpoint.
+        """
+        checkpoint = None
+        if resume:
+            checkpoint = self._load()
+        if checkpoint:
+            self.offset = checkpoint['offset']
+            self._last_line = checkpoint['last_line']
+            self._add_tests(checkpoint['tests'])
+            self.parser.start(self.job, resume_state=checkpoint['state'])
+            tko_utils.dprint('Resuming parse of %s at offset %d with %d tests'
+                             % (self.status_log, self.offset,
+                                len(self.tests)))
+        else:
+            self.parser.start(self.job)
+        return checkpoint is not None
+
+
+    def disable_checkpoints(self):
+        """
+        Never write a checkpoint, e.g. because the lines fed to
+        process_lines() don't match the status log.
+        """
+        self.checkpoints_enabled = False
+
+
+    def _add_tests(self, tests):
+        # the parser returns the same test again whenever it changes
+        for test in tests:
+            if test not in self._seen_tests:
+                self._seen_tests.add(test)
+                self.tests.append(test)
+
+
+    def process_lines(self, lines):
+        """
+        Feed complete lines, as appended to the status log, to the parser.
+
+        @param lines: A list of lines, each ending with a newline.
+        @returns The list of new or updated tests.
+        """
+        new_tests = self.parser.process_lines(lines)
+        for line in lines:
+            self.offset += len(line)
+        if lines:
+            self._last_line = lines[-1]
+        self._add_tests(new_tests)
+        return new_tests
+
+
+    def _read_tail(self):
+        """
+        Read the status log from the current offset.
+
+        @returns A (complete lines, trailing partial line) tuple.
+        """
+        status_file = open(self.status_log)
+        try:
+            status_file.seek(self.offset)
+            data = status_file.read()
+        finally:
+            status_file.close()
+        complete, newline, partial = data.rpartition('\n')
+        lines = (complete + newline).splitlines(True)
+        return lines, partial
+
+
+    def end(self, lines=None):
+        """
+        Process the rest of the status log, including an unterminated last
+        line, and end the parser.  A checkpoint is written first so that a
+        later reparse only has to process what is appended from now on.
+        All the tests of the job are in self.tests afterwards.
+
+        @param lines: The complete lines not passed to process_lines() yet,
+                or None to read them from the status log.
+        @returns The list of tests new or updated by this call.
+        """
+        if lines is None:
+            lines, partial = self._read_tail()
+        else:
+            partial = ''
+        new_tests = self.process_lines(lines)
+        self.save()
+        if partial:
+            final_lines = [partial]
+        else:
+            final_lines = []
+        final_tests = self.parser.end(final_lines)
+        self._add_tests(final_tests)
+        return new_tests + final_tests
+
+
+    def save(self, min_interval=0):
+        """
+        Write a checkpoint of the lines processed so far.
+
+        @param min_interval: Skip the checkpoint if the last one was written
+                less than min_interval seconds ago.
+        """
+        state = self.parser.get_state()
+        if not self.checkpoints_enabled or state is None:
+            return
+        now = time.time()
+        if now - self._last_save_time < min_interval:
+            return
+        checkpoint = {'version': CHECKPOINT_VERSION,
+                      'status_version': self.status_version,
+                      'status_log': os.path.basename(self.status_log),
+                      'offset': self.offset,
+                      'last_line': self._last_line,
+                      'state': state,
+                      'tests': self.tests}
+        fd, temp_path = tempfile.mkstemp(dir=self.job_dir,
+                                         prefix=CHECKPOINT_FILENAME)
+        try:
+            temp_file = os.fdopen(fd, 'wb')
+            try:
+                cPickle.dump(checkpoint, temp_file, cPickle.HIGHEST_PROTOCOL)
+            finally:
+                temp_file.close()
+            os.rename(temp_path, self.checkpoint_path)
+        except Exception, e:
+            tko_utils.dprint('Unable to write checkpoint %s: %s'
+                             % (self.checkpoint_path, e))
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return
+        self._last_save_time = now
+
+
+    def _load(self):
+        """
+        @returns The checkpoint, or None if there is no checkpoint or it
+                doesn't match the status log.
+        """
+        if not os.path.exists(self.checkpoint_path):
+            return None
+        try:
+            checkpoint_file = open(self.checkpoint_path, 'rb')
+            try:
+                checkpoint = cPickle.load(checkpoint_file)
+            finally:
+                checkpoint_file.close()
+        except Exception, e:
+            tko_utils.dprint('Ignoring unreadable checkpoint %s: %s'
+                             % (self.checkpoint_path, e))
+            return None
+
+        if (checkpoint.get('version') != CHECKPOINT_VERSION
+            or checkpoint['status_version'] != self.status_version
+            or checkpoint['status_log'] != os.path.basename(self.status_log)
+            or not self._matches_log(checkpoint['offset'],
+                                     checkpoint['last_line'])):
+            tko_utils.dprint('Ignoring stale checkpoint %s'
+                             % self.checkpoint_path)
+            return None
+
+        # test indexes are looked up again by whoever inserts the tests
+        for test in checkpoint['tests']:
+            if hasattr(test, 'test_idx'):
+                del test.test_idx
+        return checkpoint
+
+
+    def _matches_log(self, offset, last_line):
+        """
+        Check that the status log still has last_line right before offset,
+        i.e. that it was only appended to since the checkpoint.
+        """
+        if not os.path.exists(self.status_log):
+            return False
+        if os.path.getsize(self.status_log) < offset:
+            return False
+        status_file = open(self.status_log)
+        try:
+            status_file.seek(offset - len(last_line))
+            return status_file.read(len(last_line)) == last_line
+        finally:
+            status_file.close()
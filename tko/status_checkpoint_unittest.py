@@ -0,0 +1,95 @@
+#!/usr/bin/python
+
+import os, shutil, tempfile, unittest
+
+try:
+    import autotest.common as common
+except ImportError:
+    import common
+from autotest_lib.client.common_lib import utils
+from autotest_lib.tko import status_checkpoint
+
+
+_FIRST_PART = """\
+START\t----\t----\ttimestamp=1000\tlocaltime=Jan 01 00:00:00\t
+\tSTART\ttest1\ttest1\ttimestamp=1001\tlocaltime=Jan 01 00:00:01\t
+\t\tGOOD\ttest1\ttest1\ttimestamp=1002\tlocaltime=Jan 01 00:00:02\tpassed
+\tEND GOOD\ttest1\ttest1\ttimestamp=1003\tlocaltime=Jan 01 00:00:03\t
+\tSTART\ttest2\ttest2\ttimestamp=1004\tlocaltime=Jan 01 00:00:04\t
+"""
+
+_SECOND_PART = """\
+\t\tFAIL\ttest2\ttest2\ttimestamp=1005\tlocaltime=Jan 01 00:00:05\tfailed
+\tEND FAIL\ttest2\ttest2\ttimestamp=1006\tlocaltime=Jan 01 00:00:06\t
+END GOOD\t----\t----\ttimestamp=1007\tlocaltime=Jan 01 00:00:07\t
+"""
+
+
+class checkpointed_parser_test(unittest.TestCase):
+    def setUp(self):
+        self.job_dir = tempfile.mkdtemp()
+        self.status_log = os.path.join(self.job_dir, 'status.log')
+        utils.write_keyval(self.job_dir, {'status_version': 1,
+                                          'hostname': 'host1'})
+
+
+    def tearDown(self):
+        shutil.rmtree(self.job_dir)
+
+
+    def _write_log(self, text, mode='w'):
+        log_file = open(self.status_log, mode)
+        log_file.write(text)
+        log_file.close()
+
+
+    def _parse(self, resume=True):
+        parser = status_checkpoint.checkpointed_parser(1, self.job_dir,
+                                                       self.status_log)
+        resumed = parser.start(resume)
+        parser.end()
+        results = [(test.testname, test.status, test.reason)
+                   for test in parser.tests]
+        return resumed, results
+
+
+    def _stream_first_part(self):
+        parser = status_checkpoint.checkpointed_parser(1, self.job_dir,
+                                                       self.status_log)
+        parser.start(resume=False)
+        for line in _FIRST_PART.splitlines(True):
+            self._write_log(line, 'a')
+            parser.process_lines([line])
+        parser.save()
+
+
+    def test_resume_matches_full_parse(self):
+        self._stream_first_part()
+        self._write_log(_SECOND_PART, 'a')
+
+        resumed, results = self._parse()
+        self.assertTrue(resumed)
+        self.assertEquals((False, results), self._parse(resume=False))
+        # SERVER_JOB is an ABORT since there is no .autoserv_execute
+        self.assertEquals([('CLIENT_JOB.0', 'GOOD'), ('SERVER_JOB', 'ABORT'),
+                           ('test1', 'GOOD'), ('test2', 'FAIL')],
+                          sorted((name, status)
+                                 for name, status, _ in results))
+
+
+    def test_reparse_of_unchanged_log(self):
+        self._write_log(_FIRST_PART + _SECOND_PART)
+        resumed, results = self._parse()
+        self.assertFalse(resumed)
+        self.assertEquals((True, results), self._parse())
+
+
+    def test_rewritten_log_invalidates_checkpoint(self):
+        self._stream_first_part()
+        self._write_log(_FIRST_PART.replace('test', 'other') + _SECOND_PART)
+        resumed, _ = self._parse()
+        self.assertFalse(resumed)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -32,6 +32,7 @@ REQUIRES_DJANGO = set((
         'models_test.py',
         'scheduler_models_unittest.py',
         'metahost_scheduler_unittest.py',
+        'change_feed_unittest.py',
         'site_metahost_scheduler_unittest.py',
         'rpc_utils_unittest.py',
         'site_rpc_utils_unittest.py',